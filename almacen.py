@@ -0,0 +1,217 @@
+"""
+Almacenamiento en disco por bloques para trabajos grandes
+
+Los registros de RENSPA y los polígonos se acumulan en memoria hasta una
+fracción del presupuesto de memoria y luego se vuelcan a archivos Arrow IPC
+(uno por bloque). La lectura también es por bloques, de modo que el pico de
+memoria depende del presupuesto y no del tamaño del trabajo.
+"""
+import glob
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from esquema import tipar_renspa
+from geometria import cuantizar_deltas, empaquetar, reconstruir_deltas
+
+# Presupuesto de memoria del trabajo; cada buffer se vuelca al llegar a una fracción
+PRESUPUESTO_MEMORIA_MB = int(os.environ.get("RENSPA_PRESUPUESTO_MEMORIA_MB", "256"))
+FRACCION_BUFFER = 8
+
+# Directorio donde se crean los almacenes temporales
+DIRECTORIO_TRABAJOS = os.environ.get("RENSPA_TRABAJOS_DIR", os.path.join(".renspa_cache", "trabajos"))
+
+# Estimaciones del tamaño en memoria de los objetos de Python pendientes de volcar
+BYTES_POR_VERTICE = 120  # lista [lon, lat] con dos floats
+BYTES_POR_CAMPO = 100
+
+def _tabla_registros(registros):
+    """Convierte registros (diccionarios) en una tabla Arrow"""
+    try:
+        return pa.Table.from_pylist(registros)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columnas con tipos mezclados: guardarlas como texto
+        df = pd.DataFrame(registros)
+        for columna in df.columns[df.dtypes == object]:
+            df[columna] = df[columna].map(lambda v: None if v is None else str(v))
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+def _filas(ruta):
+    """Cantidad de filas de un bloque (solo lee los metadatos)"""
+    return feather.read_table(ruta, memory_map=True).num_rows
+
+class AlmacenTemporal:
+    """
+    Registros y polígonos de un trabajo, volcados a disco por bloques
+
+    Los polígonos se guardan con sus atributos serializados en JSON (para
+    conservar los tipos originales al exportar) y sus vértices cuantizados
+    como diferencias int32 (geometria.cuantizar_deltas), en una lista plana
+    [lon, lat, lon, lat, ...] por polígono que al leer se convierte
+    directamente en los buffers (vertices, offsets) de geometria.
+    """
+
+    def __init__(self, presupuesto_mb=None, directorio=None, ruta=None):
+        """
+        Args:
+            presupuesto_mb: Presupuesto de memoria en MB (por defecto RENSPA_PRESUPUESTO_MEMORIA_MB)
+            directorio: Directorio padre del almacén (por defecto RENSPA_TRABAJOS_DIR)
+            ruta: Directorio exacto del almacén, en lugar de uno temporal; si ya
+                tiene bloques escritos (por ejemplo, la salida de un shard de
+                un rastreo) se pueden leer
+        """
+        self.presupuesto = (presupuesto_mb or PRESUPUESTO_MEMORIA_MB) * 1024 * 1024
+        if ruta:
+            os.makedirs(ruta, exist_ok=True)
+            self.directorio = ruta
+        else:
+            padre = directorio or DIRECTORIO_TRABAJOS
+            os.makedirs(padre, exist_ok=True)
+            self.directorio = tempfile.mkdtemp(prefix="trabajo_", dir=padre)
+
+        self._registros = []
+        self._bytes_registros = 0
+        self._poligonos = []
+        self._bytes_poligonos = 0
+        self._archivos = {tipo: sorted(glob.glob(os.path.join(self.directorio, f"{tipo}-*.arrow")))
+                          for tipo in ('registros', 'poligonos')}
+        self.total_registros = sum(_filas(archivo) for archivo in self._archivos['registros'])
+        self.total_poligonos = sum(_filas(archivo) for archivo in self._archivos['poligonos'])
+
+    @property
+    def limite_buffer(self):
+        return self.presupuesto // FRACCION_BUFFER
+
+    def ruta(self, nombre):
+        """Ruta de un archivo dentro del almacén (por ejemplo, una exportación)"""
+        return os.path.join(self.directorio, nombre)
+
+    def agregar_registros(self, registros):
+        """Agrega registros de RENSPA (diccionarios); se vuelcan a disco al llenar el buffer"""
+        self._registros.extend(registros)
+        self._bytes_registros += sum(len(r) for r in registros) * BYTES_POR_CAMPO
+        self.total_registros += len(registros)
+        if self._bytes_registros >= self.limite_buffer:
+            self._volcar_registros()
+
+    def agregar_poligonos(self, poligonos):
+        """Agrega polígonos (diccionarios con 'coords'); se vuelcan a disco al llenar el buffer"""
+        self._poligonos.extend(poligonos)
+        self._bytes_poligonos += sum(len(p['coords']) * BYTES_POR_VERTICE + len(p) * BYTES_POR_CAMPO
+                                     for p in poligonos)
+        self.total_poligonos += len(poligonos)
+        if self._bytes_poligonos >= self.limite_buffer:
+            self._volcar_poligonos()
+
+    def cerrar(self):
+        """Vuelca lo pendiente; después se puede leer el almacén"""
+        self._volcar_registros()
+        self._volcar_poligonos()
+
+    def _escribir(self, tipo, tabla):
+        ruta = self.ruta(f"{tipo}-{len(self._archivos[tipo]):05d}.arrow")
+        feather.write_feather(tabla, ruta, compression="lz4")
+        self._archivos[tipo].append(ruta)
+
+    def _volcar_registros(self):
+        if self._registros:
+            self._escribir('registros', _tabla_registros(self._registros))
+        self._registros = []
+        self._bytes_registros = 0
+
+    def _volcar_poligonos(self):
+        if self._poligonos:
+            vertices, offsets = empaquetar([pol['coords'] for pol in self._poligonos])
+            # Diferencias cuantizadas en int32: ocupan la mitad y lz4 las comprime mucho mejor
+            deltas = cuantizar_deltas(vertices, offsets)
+            lista = pa.ListArray.from_arrays(pa.array(offsets * 2, type=pa.int32()),
+                                             pa.array(deltas.ravel(), type=pa.int32()))
+            atributos = [json.dumps({k: v for k, v in pol.items() if k != 'coords'}, ensure_ascii=False)
+                         for pol in self._poligonos]
+            self._escribir('poligonos', pa.table({'atributos': atributos, 'deltas': lista}))
+        self._poligonos = []
+        self._bytes_poligonos = 0
+
+    def incorporar(self, otro):
+        """
+        Agrega los bloques ya escritos de otro almacén, copiándolos sin leerlos
+
+        Args:
+            otro: AlmacenTemporal cerrado
+        """
+        for tipo in ('registros', 'poligonos'):
+            for origen in otro._archivos[tipo]:
+                ruta = self.ruta(f"{tipo}-{len(self._archivos[tipo]):05d}.arrow")
+                shutil.copyfile(origen, ruta)
+                self._archivos[tipo].append(ruta)
+        self.total_registros += otro.total_registros
+        self.total_poligonos += otro.total_poligonos
+
+    def iterar_registros(self, columnas=None):
+        """
+        Lee los registros bloque a bloque
+
+        Args:
+            columnas: Columnas a leer (None para todas); las que falten en un
+                bloque quedan en None
+
+        Yields:
+            Un DataFrame tipado (esquema.ESQUEMA_RENSPA) por bloque
+        """
+        for ruta in self._archivos['registros']:
+            tabla = feather.read_table(ruta, memory_map=True)
+            df = tipar_renspa(tabla.to_pandas())
+            if columnas is not None:
+                df = df.reindex(columns=columnas)
+            yield df
+
+    def columnas_registros(self):
+        """Unión ordenada de las columnas de todos los bloques de registros"""
+        columnas = []
+        for ruta in self._archivos['registros']:
+            for nombre in feather.read_table(ruta, memory_map=True).schema.names:
+                if nombre not in columnas:
+                    columnas.append(nombre)
+        return columnas
+
+    def iterar_buffers_poligonos(self):
+        """
+        Lee los polígonos bloque a bloque como buffers planos
+
+        Yields:
+            Tuplas (atributos, vertices, offsets): atributos es una lista de
+            diccionarios y (vertices, offsets) los buffers de geometria
+        """
+        for ruta in self._archivos['poligonos']:
+            tabla = feather.read_table(ruta, memory_map=True)
+            # Los bloques escritos antes de la cuantización guardan los vértices en float64
+            cuantizado = 'deltas' in tabla.column_names
+            columna = tabla.column('deltas' if cuantizado else 'vertices').combine_chunks()
+            offsets = columna.offsets.to_numpy().astype(np.int64)
+            valores = columna.flatten().to_numpy(zero_copy_only=False).reshape(-1, 2)
+            # Los offsets de Arrow cuentan valores; cada vértice son dos valores
+            offsets = (offsets - offsets[0]) // 2
+            vertices = reconstruir_deltas(valores, offsets) if cuantizado else valores
+            atributos = [json.loads(texto) for texto in tabla.column('atributos').to_pylist()]
+            yield atributos, vertices, offsets
+
+    def iterar_poligonos(self):
+        """
+        Lee los polígonos bloque a bloque
+
+        Yields:
+            Una lista de diccionarios (con 'coords') por bloque
+        """
+        for atributos, vertices, offsets in self.iterar_buffers_poligonos():
+            yield [{**datos, 'coords': vertices[a:b].tolist()}
+                   for datos, a, b in zip(atributos, offsets[:-1], offsets[1:])]
+
+    def eliminar(self):
+        """Borra el almacén del disco"""
+        shutil.rmtree(self.directorio, ignore_errors=True)
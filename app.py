@@ -1,22 +1,28 @@
 import streamlit as st
-import pandas as pd
-import numpy as np
-import time
-import json
-import re
-import requests
-import zipfile
-from io import BytesIO
+import os
 import random
+import tempfile
+from io import BytesIO
+
+from senasa import normalizar_cuit, plazo_consulta
+from ingesta import ingerir_archivo, ingerir_texto
+from estadisticas import estadisticas_cacheadas, calcular_estadisticas_por_bloques, huella_estadisticas
+from exportacion import escribir_paquete, PARTICIONES
+from procesamiento import Procesamiento, exportar
+from precalentamiento import exportar_cuit, iniciar_precalentamiento, precalentado
+from progresivo import VistaProgresiva, MAX_FILAS_ACOTADO, MAX_POLIGONOS_ACOTADO
+from busqueda import indice_cacheado, MAX_FILAS_BUSQUEDA, MAX_POLIGONOS_CONTEXTO
+from mapa import folium_disponible, mostrar_mapa
+from almacen import AlmacenTemporal
+from metricas import iniciar_exportacion
+from perfilado import mostrar_interruptor, perfilar_si_activo
+from earth_engine_integration import crear_boton_analisis_cultivos
+
+# Endpoint/archivo de métricas y precalentamiento de la lista de seguimiento
+# (una sola vez por proceso, si están configurados)
+iniciar_exportacion()
+iniciar_precalentamiento()
 
-# Intentar importar folium y streamlit_folium
-try:
-    import folium
-    from folium.plugins import MeasureControl, MiniMap, MarkerCluster
-    from streamlit_folium import folium_static
-    folium_disponible = True
-except ImportError:
-    folium_disponible = False
 # Configuración de la página
 st.set_page_config(
     page_title="Consulta RENSPA - SENASA",
@@ -24,13 +30,12 @@ st.set_page_config(
     layout="wide"
 )
 
-# Configuraciones globales
-API_BASE_URL = "https://aps.senasa.gob.ar/restapiprod/servicios/renspa"
-TIEMPO_ESPERA = 0.5  # Pausa entre peticiones para no sobrecargar la API
-
 # Título principal
 st.title("Consulta RENSPA desde SENASA")
 
+# Interruptor de perfilado, oculto salvo que se abra la aplicación con ?diagnostico
+mostrar_interruptor()
+
 # Introducción
 st.markdown("""
 Esta herramienta permite:
@@ -40,249 +45,215 @@ Esta herramienta permite:
 3. Descargar los datos en formato KMZ/GeoJSON para su uso en sistemas GIS
 """)
 
-# Función para normalizar CUIT
-def normalizar_cuit(cuit):
-    """Normaliza un CUIT a formato XX-XXXXXXXX-X"""
-    # Eliminar guiones si están presentes
-    cuit_limpio = cuit.replace("-", "")
-    
-    # Validar longitud
-    if len(cuit_limpio) != 11:
-        raise ValueError(f"CUIT inválido: {cuit}. Debe tener 11 dígitos.")
-    
-    # Reformatear con guiones
-    return f"{cuit_limpio[:2]}-{cuit_limpio[2:10]}-{cuit_limpio[10]}"
-
-# Función para obtener RENSPA por CUIT
-def obtener_renspa_por_cuit(cuit):
-    """
-    Obtiene todos los RENSPA asociados a un CUIT, manejando la paginación
+# Función para mostrar estadísticas de RENSPA
+def mostrar_estadisticas(df_renspa, poligonos=None, clave=None):
     """
-    try:
-        # URL base para la consulta
-        url_base = f"{API_BASE_URL}/consultaPorCuit"
-        
-        todos_renspa = []
-        offset = 0
-        limit = 10  # La API usa un límite de 10 por página
-        has_more = True
-        
-        # Realizar consultas sucesivas hasta obtener todos los RENSPA
-        while has_more:
-            # Construir URL con offset para paginación
-            url = f"{url_base}?cuit={cuit}&offset={offset}"
-            
-            try:
-                # Realizar la consulta a la API
-                response = requests.get(url, timeout=15)
-                response.raise_for_status()
-                resultado = response.json()
-                
-                # Verificar si hay resultados
-                if 'items' in resultado and resultado['items']:
-                    # Agregar los RENSPA a la lista total
-                    todos_renspa.extend(resultado['items'])
-                    
-                    # Verificar si hay más páginas
-                    has_more = resultado.get('hasMore', False)
-                    
-                    # Actualizar offset para la siguiente página
-                    offset += limit
-                else:
-                    has_more = False
-            
-            except Exception as e:
-                st.error(f"Error consultando la API: {str(e)}")
-                has_more = False
-                
-            # Pausa breve para no sobrecargar la API
-            time.sleep(TIEMPO_ESPERA)
-        
-        return todos_renspa
-    
-    except Exception as e:
-        st.error(f"Error al obtener RENSPA: {str(e)}")
-        return []
-
-# Función para normalizar RENSPA
-def normalizar_renspa(renspa):
-    """Normaliza un RENSPA al formato ##.###.#.#####/##"""
-    # Eliminar espacios
-    renspa_limpio = renspa.strip()
+    Muestra estadísticas sobre los RENSPA procesados
     
-    # Ya tiene el formato correcto con puntos y barra
-    if re.match(r'^\d{2}\.\d{3}\.\d\.\d{5}/\d{2}$', renspa_limpio):
-        return renspa_limpio
+    Args:
+        df_renspa: DataFrame con los datos de RENSPA
+        poligonos: Lista de diccionarios con los polígonos (opcional)
+        clave: Huella de huella_estadisticas ya calculada (opcional)
+    """
+    st.subheader("Estadísticas de RENSPA")
     
-    # Tiene el formato numérico sin puntos ni barra
-    # Formato esperado: XXYYYZWWWWWDD (XX.YYY.Z.WWWWW/DD)
-    if re.match(r'^\d{13}$', renspa_limpio):
-        return f"{renspa_limpio[0:2]}.{renspa_limpio[2:5]}.{renspa_limpio[5:6]}.{renspa_limpio[6:11]}/{renspa_limpio[11:13]}"
+    if df_renspa.empty:
+        st.warning("No hay datos para mostrar estadísticas.")
+        return
     
-    raise ValueError(f"Formato de RENSPA inválido: {renspa}")
-
-# Función para consultar detalles de un RENSPA
-def consultar_renspa_detalle(renspa):
-    """
-    Consulta los detalles de un RENSPA específico para obtener el polígono
-    """
-    try:
-        url = f"{API_BASE_URL}/consultaPorNumero?numero={renspa}"
-        
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        return data
-    except Exception as e:
-        st.error(f"Error consultando {renspa}: {e}")
-        return None
+    # Todos los agregados salen de una única pasada agrupada (cacheada por huella de los datos)
+    estadisticas = estadisticas_cacheadas(df_renspa, poligonos, clave=clave)
+    mostrar_panel_estadisticas(estadisticas, por_cuit='cuit' in df_renspa.columns, con_poligonos=bool(poligonos))
 
-# Función para extraer coordenadas de un polígono
-def extraer_coordenadas(poligono_str):
+def mostrar_panel_estadisticas(estadisticas, por_cuit=False, con_poligonos=False):
     """
-    Extrae coordenadas de un string de polígono en el formato de SENASA
+    Muestra métricas y desgloses de estadísticas ya calculadas
+    
+    Args:
+        estadisticas: Resultado de calcular_estadisticas
+        por_cuit: Si se incluye el desglose por CUIT
+        con_poligonos: Si se muestran las métricas de superficie calculada
     """
-    if not poligono_str or not isinstance(poligono_str, str):
-        return None
+    resumen = estadisticas['resumen']
     
-    # Extraer pares de coordenadas
-    coord_pattern = r'\(([-\d\.]+),([-\d\.]+)\)'
-    coord_pairs = re.findall(coord_pattern, poligono_str)
+    # Crear columnas para estadísticas básicas
+    col1, col2, col3 = st.columns(3)
     
-    if not coord_pairs:
-        return None
+    with col1:
+        # Contar RENSPA activos e inactivos
+        st.metric("RENSPA activos", resumen['activos'])
+        st.metric("RENSPA inactivos", resumen['inactivos'])
     
-    # Convertir a formato [lon, lat] para GeoJSON
-    coords_geojson = []
-    for lat_str, lon_str in coord_pairs:
-        try:
-            lat = float(lat_str)
-            lon = float(lon_str)
-            coords_geojson.append([lon, lat])  # GeoJSON usa [lon, lat]
-        except ValueError:
-            continue
+    with col2:
+        # Superficie declarada en SENASA
+        st.metric("Superficie declarada (ha)", f"{resumen['superficie_declarada']:,.1f}")
+        st.metric("Superficie declarada activa (ha)", f"{resumen['superficie_declarada_activa']:,.1f}")
     
-    # Verificar que hay al menos 3 puntos y que el polígono está cerrado
-    if len(coords_geojson) >= 3:
-        # Para polígonos válidos, asegurarse de que está cerrado
-        if coords_geojson[0] != coords_geojson[-1]:
-            coords_geojson.append(coords_geojson[0])  # Cerrar el polígono
-        
-        return coords_geojson
+    with col3:
+        # Superficie calculada a partir de los polígonos
+        if con_poligonos:
+            st.metric("RENSPA con polígono", resumen['con_poligono'])
+            st.metric("Superficie calculada (ha)", f"{resumen['superficie_calculada']:,.1f}")
+    
+    # Desgloses por CUIT, localidad y provincia
+    desgloses = [("Por provincia", 'por_provincia', 'provincia'), ("Por localidad", 'por_localidad', 'localidad')]
+    if por_cuit:
+        desgloses.insert(0, ("Por CUIT", 'por_cuit', 'cuit'))
+    columnas_grafico = ['superficie_declarada', 'superficie_calculada'] if con_poligonos else ['superficie_declarada']
     
-    return None
+    for tab_desglose, (_, clave, etiqueta) in zip(st.tabs([titulo for titulo, _, _ in desgloses]), desgloses):
+        with tab_desglose:
+            tabla = estadisticas[clave]
+            # Graficar los 20 grupos con mayor superficie declarada
+            st.bar_chart(tabla.head(20).set_index(etiqueta)[columnas_grafico])
+            st.dataframe(tabla, hide_index=True)
 
-# Función para crear mapa con múltiples mejoras
-def crear_mapa_mejorado(poligonos, center=None, cuit_colors=None):
+# Función para cargar archivos de CUITs/RENSPA (cacheada entre reruns)
+@st.cache_data(show_spinner="Cargando archivo...", max_entries=8)
+def cargar_archivo_identificadores(contenido, nombre, tipo):
+    """Normaliza y valida un archivo subido; el resultado se reutiliza mientras el archivo no cambie"""
+    return ingerir_archivo(BytesIO(contenido), tipo, nombre=nombre)
+
+# Función para mostrar las entradas rechazadas en la carga
+def mostrar_rechazados(rechazados):
+    """Muestra un resumen de las entradas inválidas o duplicadas"""
+    if rechazados.empty:
+        return
+    st.warning(f"Se descartaron {len(rechazados)} entradas inválidas o duplicadas")
+    with st.expander("Ver entradas descartadas"):
+        st.dataframe(rechazados, hide_index=True)
+
+# Función para ofrecer las descargas de un procesamiento
+def mostrar_descargas(archivos, almacen=None):
     """
-    Crea un mapa folium mejorado con los polígonos proporcionados
-    
+    Ofrece para descargar los archivos exportados, uno por columna
+
+    En el modo de memoria acotada los archivos están en el almacén temporal;
+    st.download_button carga el archivo completo en memoria, así que los
+    archivos que superan el presupuesto de memoria se informan por su ruta.
+
     Args:
-        poligonos: Lista de diccionarios con los datos de polígonos
-        center: Coordenadas del centro del mapa (opcional)
-        cuit_colors: Diccionario de colores por CUIT (opcional)
-        
+        archivos: Lista de tuplas (etiqueta, nombre de archivo, tipo MIME, datos) de procesamiento.exportar
+        almacen: AlmacenTemporal donde se escribieron los archivos (opcional)
+
     Returns:
-        Objeto mapa de folium
+        True si todos los archivos se ofrecieron como descarga
     """
-    if not folium_disponible:
-        st.warning("Para visualizar mapas, instala folium y streamlit-folium con: pip install folium streamlit-folium")
-        return None
-    
-    # Determinar centro del mapa
-    if center:
-        # Usar centro proporcionado
-        center_lat, center_lon = center
-    elif poligonos:
-        # Usar el primer polígono como referencia
-        center_lat = poligonos[0]['coords'][0][1]  # Latitud está en la segunda posición
-        center_lon = poligonos[0]['coords'][0][0]  # Longitud está en la primera posición
-    else:
-        # Centro predeterminado (Buenos Aires)
-        center_lat = -34.603722
-        center_lon = -58.381592
-    
-    # Crear mapa base
-    m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
-    
-    # Añadir diferentes capas base
-    folium.TileLayer('https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}', 
-                    name='Google Hybrid', 
-                    attr='Google').add_to(m)
-    folium.TileLayer('https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}', 
-                    name='Google Satellite', 
-                    attr='Google').add_to(m)
-    folium.TileLayer('OpenStreetMap', name='OpenStreetMap').add_to(m)
-    
-    # Añadir herramienta de medición
-    MeasureControl(position='topright', 
-                  primary_length_unit='kilometers', 
-                  secondary_length_unit='miles', 
-                  primary_area_unit='hectares').add_to(m)
-    
-    # Añadir mini mapa para ubicación
-    MiniMap().add_to(m)
-    
-    # Crear grupos de capas para mejor organización
-    fg_poligonos = folium.FeatureGroup(name="Polígonos RENSPA").add_to(m)
-    
-    # Añadir cada polígono al mapa
-    for pol in poligonos:
-        # Determinar color según CUIT si está disponible
-        if cuit_colors and 'cuit' in pol and pol['cuit'] in cuit_colors:
-            color = cuit_colors[pol['cuit']]
-        else:
-            color = 'green'
-        
-        # Formatear popup con información
-        popup_text = f"""
-        <b>RENSPA:</b> {pol['renspa']}<br>
-        <b>Titular:</b> {pol.get('titular', 'No disponible')}<br>
-        <b>Localidad:</b> {pol.get('localidad', 'No disponible')}<br>
-        <b>Superficie:</b> {pol.get('superficie', 0)} ha
-        """
-        if 'cuit' in pol:
-            popup_text += f"<br><b>CUIT:</b> {pol['cuit']}"
-        
-        # Añadir polígono al mapa
-        folium.Polygon(
-            locations=[[coord[1], coord[0]] for coord in pol['coords']],  # Invertir coordenadas para folium
-            color=color,
-            weight=2,
-            fill=True,
-            fill_color=color,
-            fill_opacity=0.3,
-            tooltip=f"RENSPA: {pol['renspa']}",
-            popup=popup_text
-        ).add_to(fg_poligonos)
-    
-    # Añadir control de capas
-    folium.LayerControl(position='topright').add_to(m)
-    
-    return m
+    st.subheader("Descargar resultados")
 
-# Función para mostrar estadísticas de RENSPA
-def mostrar_estadisticas(df_renspa, poligonos=None):
+    todos_descargables = True
+    for columna, (etiqueta, nombre, mime, datos) in zip(st.columns(len(archivos)), archivos):
+        with columna:
+            if almacen is None:
+                st.download_button(label=etiqueta, data=datos, file_name=nombre, mime=mime)
+                continue
+            ruta = almacen.ruta(nombre)
+            if os.path.getsize(ruta) <= almacen.presupuesto:
+                with open(ruta, "rb") as archivo:
+                    st.download_button(label=etiqueta, data=archivo, file_name=nombre, mime=mime)
+            else:
+                todos_descargables = False
+                st.info(f"{nombre} supera el presupuesto de memoria; se guardó en {ruta}")
+    return todos_descargables
+
+# Funciones para volver a mostrar y buscar en los resultados de la última consulta de cada pestaña
+def guardar_resultados(clave, df_renspa, poligonos=None, cuit_colors=None, clave_mapa=None,
+                       clave_estadisticas=None, descargas=None, nota_descargas=None):
     """
-    Muestra estadísticas sobre los RENSPA procesados
-    
+    Guarda en la sesión los resultados de una pestaña, para mostrarlos y
+    buscar en ellos en las siguientes ejecuciones del script (una descarga,
+    otra pestaña o cualquier widget vuelven a ejecutarlo sin volver a consultar)
+
     Args:
-        df_renspa: DataFrame con los datos de RENSPA
-        poligonos: Lista de diccionarios con los polígonos (opcional)
+        clave_mapa: Clave del mapa en mapa.cache_mapas (VistaProgresiva.clave_mapa)
+        clave_estadisticas: Huella de huella_estadisticas con que se calcularon
+            las estadísticas (si falta, se calcula al volver a mostrarlas)
+        descargas: Archivos ofrecidos, como los recibe mostrar_descargas
+        nota_descargas: Texto que acompaña a las descargas (opcional)
     """
-    st.subheader("Estadísticas de RENSPA")
-    
-    if df_renspa.empty:
-        st.warning("No hay datos para mostrar estadísticas.")
+    st.session_state[clave] = {'df': df_renspa, 'poligonos': poligonos or [],
+                               'cuit_colors': cuit_colors, 'indice': None, 'clave_mapa': clave_mapa,
+                               'clave_estadisticas': clave_estadisticas,
+                               'descargas': descargas or [], 'nota_descargas': nota_descargas}
+
+def mostrar_resultados(clave, titulo_tabla):
+    """
+    Vuelve a mostrar la tabla, las estadísticas, el mapa y las descargas
+    guardados con guardar_resultados. Las estadísticas y el mapa salen de
+    sus cachés por las claves guardadas, sin volver a hashear los polígonos.
+    """
+    resultados = st.session_state.get(clave)
+    if resultados is None:
         return
-    
-    # Crear columnas para estadísticas básicas
-    col1, col2, col3 = st.columns(3)
-    
-    with col1:
-        # Contar RENSPA activos e inactivos
-        activos = df_renspa[df_renspa['fecha_baja'].isnull()].shape[0]
-        inactivos = df_renspa[~df_renspa['fecha_baja'].isnull()].shape[0]
+    df_renspa = resultados['df']
+    st.subheader(titulo_tabla)
+    st.dataframe(df_renspa.drop(columns=['coords'], errors='ignore'))
+    if resultados['clave_estadisticas'] is None:
+        resultados['clave_estadisticas'] = huella_estadisticas(df_renspa, resultados['poligonos'])
+    mostrar_estadisticas(df_renspa, resultados['poligonos'], clave=resultados['clave_estadisticas'])
+    if resultados['poligonos'] and folium_disponible:
+        st.subheader("Visualización de polígonos")
+        mostrar_mapa(resultados['poligonos'], cuit_colors=resultados['cuit_colors'], clave=resultados['clave_mapa'])
+    if resultados['descargas']:
+        mostrar_descargas(resultados['descargas'])
+        if resultados['nota_descargas']:
+            st.caption(resultados['nota_descargas'])
+
+def mostrar_analisis_cultivos(clave):
+    """
+    Botón de análisis de cultivos históricos (rasters locales o Earth Engine)
+    sobre los polígonos guardados con guardar_resultados
+    """
+    resultados = st.session_state.get(clave)
+    if resultados is None or not resultados['poligonos']:
+        return
+    st.subheader("Cultivos históricos")
+    crear_boton_analisis_cultivos(resultados['poligonos'], key=f"{clave}_cultivos")
+
+def mostrar_busqueda(clave):
+    """
+    Buscador sobre los resultados guardados con guardar_resultados: filtra la
+    tabla con el índice de busqueda.py y resalta en el mapa los polígonos que
+    coinciden
+    """
+    resultados = st.session_state.get(clave)
+    if resultados is None:
+        return
+    df_renspa = resultados['df']
+    st.subheader("Buscar en los resultados")
+    consulta = st.text_input(
+        "Titular, localidad, RENSPA o CUIT (todas las palabras deben coincidir; "
+        "'localidad:pergamino' busca solo en esa columna):",
+        key=f"{clave}_consulta"
+    )
+    if not consulta.strip():
+        st.caption(f"{len(df_renspa)} RENSPA en la última consulta")
+        return
+
+    # El índice se construye con la primera búsqueda y queda en la sesión
+    if resultados['indice'] is None:
+        resultados['indice'] = indice_cacheado(df_renspa)
+    coincidencias = df_renspa[resultados['indice'].buscar(consulta)]
+    st.caption(f"{len(coincidencias)} de {len(df_renspa)} RENSPA coinciden" +
+               (f"; se muestran los primeros {MAX_FILAS_BUSQUEDA}" if len(coincidencias) > MAX_FILAS_BUSQUEDA else ""))
+    if coincidencias.empty:
+        return
+    st.dataframe(coincidencias.head(MAX_FILAS_BUSQUEDA).drop(columns=['coords'], errors='ignore'), hide_index=True)
+
+    poligonos = resultados['poligonos']
+    if not poligonos or not folium_disponible:
+        return
+    renspa = set(coincidencias['renspa'])
+    if len(poligonos) <= MAX_POLIGONOS_CONTEXTO:
+        mostrar_mapa(poligonos, cuit_colors=resultados['cuit_colors'], resaltados=renspa)
+    else:
+        # Con muchos polígonos, dibujar solo los que coinciden
+        poligonos = [pol for pol in poligonos if pol['renspa'] in renspa]
+        if len(poligonos) > MAX_POLIGONOS_ACOTADO:
+            st.caption(f"El mapa muestra los primeros {MAX_POLIGONOS_ACOTADO} polígonos que coinciden")
+        if poligonos:
+            mostrar_mapa(poligonos[:MAX_POLIGONOS_ACOTADO], cuit_colors=resultados['cuit_colors'])
+
 # Crear tabs para las diferentes funcionalidades
 tab1, tab2, tab3 = st.tabs(["Consulta por CUIT", "Consulta por Lista de RENSPA", "Consulta por Múltiples CUITs"])
 
@@ -297,15 +268,21 @@ with tab1:
         solo_activos = st.checkbox("Solo RENSPA activos", value=True)
     with col2:
         incluir_poligono = st.checkbox("Incluir información de polígonos", value=True)
+    modo_incremental = st.checkbox(
+        "Actualización incremental (solo consulta los RENSPA nuevos o modificados desde la última consulta)",
+        value=False, key="incremental_single"
+    )
 
     # Botón para procesar
     if st.button("Consultar RENSPA", key="btn_cuit"):
+        st.session_state.pop("resultados_cuit", None)
         try:
             # Normalizar CUIT
             cuit_normalizado = normalizar_cuit(cuit_input)
             
             # Mostrar un indicador de procesamiento
-            with st.spinner('Consultando RENSPA desde SENASA...'):
+            with st.spinner('Consultando RENSPA desde SENASA...'), plazo_consulta(1), \
+                    perfilar_si_activo("consulta_cuit"):
                 # Crear barras de progreso
                 progress_bar = st.progress(0)
                 status_text = st.empty()
@@ -314,265 +291,99 @@ with tab1:
                 status_text.text("Obteniendo listado de RENSPA...")
                 progress_bar.progress(20)
                 
-                todos_renspa = obtener_renspa_por_cuit(cuit_normalizado)
-                
-                if not todos_renspa:
-                    st.error(f"No se encontraron RENSPA para el CUIT {cuit_normalizado}")
-                    st.stop()
-                
-                # Crear DataFrame para mejor visualización y manipulación
-                df_renspa = pd.DataFrame(todos_renspa)
-                
-                # Contar RENSPA activos e inactivos
-                activos = df_renspa[df_renspa['fecha_baja'].isnull()].shape[0]
-                inactivos = df_renspa[~df_renspa['fecha_baja'].isnull()].shape[0]
-                
-                st.success(f"Se encontraron {len(todos_renspa)} RENSPA en total ({activos} activos, {inactivos} inactivos)")
+                # Reservar los lugares de avisos y resultados
+                avisos = st.container()
+                vista = VistaProgresiva("Listado de RENSPA", mostrar_mapa=incluir_poligono)
+                
+                def mostrar_listado(listado):
+                    # El listado se muestra de inmediato, antes de buscar los polígonos
+                    if not listado.items:
+                        return
+                    activos = sum(1 for item in listado.items if item.get('fecha_baja') is None)
+                    with avisos:
+                        st.success(f"Se encontraron {len(listado.items)} RENSPA en total "
+                                   f"({activos} activos, {len(listado.items) - activos} inactivos)")
+                        if incluir_poligono:
+                            st.info(f"Se procesarán {len(listado.a_procesar)} RENSPA" +
+                                    (" activos" if solo_activos else ""))
+                    vista.agregar_filas(listado.items, inmediato=True)
+                    
+                    # Paso 2: Procesar los RENSPA para obtener los polígonos
+                    if incluir_poligono:
+                        status_text.text("Obteniendo información de polígonos...")
+                        progress_bar.progress(40)
+                
+                # Los CUITs de la lista de seguimiento pueden estar ya procesados
+                resultado_previo = None
+                if solo_activos and incluir_poligono and not modo_incremental:
+                    resultado_previo = precalentado(cuit_normalizado)
+                
+                if resultado_previo:
+                    procesamiento = resultado_previo.procesamiento
+                else:
+                    procesamiento = Procesamiento(
+                        'cuit', solo_activos=solo_activos, buscar_poligonos=incluir_poligono,
+                        incremental=modo_incremental, incluir_cuit=False, al_listar=mostrar_listado
+                    )
                 
-                # Filtrar según la opción seleccionada
-                if solo_activos:
-                    renspa_a_procesar = df_renspa[df_renspa['fecha_baja'].isnull()].to_dict('records')
-                    st.info(f"Se procesarán {len(renspa_a_procesar)} RENSPA activos")
+                def actualizar_metricas_procesamiento():
+                    total_procesados = sum(procesamiento.estados.values())
+                    vista.actualizar_metricas({
+                        "Total procesados": total_procesados,
+                        "Con polígono": procesamiento.estados['ok'],
+                        "Sin polígono": total_procesados - procesamiento.estados['ok']
+                    }, titulo="Estadísticas de procesamiento")
+                
+                if resultado_previo:
+                    mostrar_listado(resultado_previo.listado)
+                    with avisos:
+                        st.info(f"Resultado precalentado el {resultado_previo.fecha:%d/%m/%Y a las %H:%M}")
+                    vista.agregar_poligonos(procesamiento.poligonos)
                 else:
-                    renspa_a_procesar = todos_renspa
-                    st.info(f"Se procesarán todos los {len(renspa_a_procesar)} RENSPA")
+                    # Mostrar cada resultado a medida que llega
+                    for i, elemento in enumerate(procesamiento.ejecutar([cuit_normalizado])):
+                        total = len(elemento.listado.a_procesar)
+                        progress_bar.progress(40 + ((i + 1) * 40 // total))
+                        status_text.text(f"Procesando RENSPA: {elemento.renspa} ({i+1}/{total})")
+                        if elemento.estado == 'ok':
+                            vista.agregar_poligonos([elemento.poligono])
+                        actualizar_metricas_procesamiento()
+                
+                if not procesamiento.registros:
+                    vista.mostrar_aviso_tabla(f"No se encontraron RENSPA para el CUIT {cuit_normalizado}")
+                    st.stop()
                 
-                # Paso 2: Procesar los RENSPA para obtener los polígonos
                 if incluir_poligono:
-                    status_text.text("Obteniendo información de polígonos...")
-                    progress_bar.progress(40)
-                    
-                    # Listas para almacenar resultados
-                    poligonos_gee = []
-                    fallidos = []
-                    renspa_sin_poligono = []
-                    
-                    # Procesar cada RENSPA
-                    for i, item in enumerate(renspa_a_procesar):
-                        renspa = item['renspa']
-                        # Actualizar progreso
-                        progress_percentage = 40 + (i * 40 // len(renspa_a_procesar))
-                        progress_bar.progress(progress_percentage)
-                        status_text.text(f"Procesando RENSPA: {renspa} ({i+1}/{len(renspa_a_procesar)})")
-                        
-                        # Verificar si ya tiene el polígono en la información básica
-                        if 'poligono' in item and item['poligono']:
-                            poligono_str = item['poligono']
-                            superficie = item.get('superficie', 0)
-                            
-                            # Extraer coordenadas
-                            coordenadas = extraer_coordenadas(poligono_str)
-                            
-                            if coordenadas:
-                                # Crear objeto con datos del polígono
-                                poligono_data = {
-                                    'renspa': renspa,
-                                    'coords': coordenadas,
-                                    'superficie': superficie,
-                                    'titular': item.get('titular', ''),
-                                    'localidad': item.get('localidad', ''),
-                                    'cuit': cuit_normalizado
-                                }
-                                poligonos_gee.append(poligono_data)
-                                continue
-                        
-                        # Si no tenía polígono o no era válido, consultar más detalles
-                        resultado = consultar_renspa_detalle(renspa)
-                        
-                        if resultado and 'items' in resultado and resultado['items'] and 'poligono' in resultado['items'][0]:
-                            item_detalle = resultado['items'][0]
-                            poligono_str = item_detalle.get('poligono')
-                            superficie = item_detalle.get('superficie', 0)
-                            
-                            if poligono_str:
-                                # Extraer coordenadas
-                                coordenadas = extraer_coordenadas(poligono_str)
-                                
-                                if coordenadas:
-                                    # Crear objeto con datos del polígono
-                                    poligono_data = {
-                                        'renspa': renspa,
-                                        'coords': coordenadas,
-                                        'superficie': superficie,
-                                        'titular': item.get('titular', ''),
-                                        'localidad': item.get('localidad', ''),
-                                        'cuit': cuit_normalizado
-                                    }
-                                    poligonos_gee.append(poligono_data)
-                                else:
-                                    fallidos.append(renspa)
-                            else:
-                                renspa_sin_poligono.append(renspa)
-                        else:
-                            renspa_sin_poligono.append(renspa)
-                        
-                        # Pausa breve para no sobrecargar la API
-                        time.sleep(TIEMPO_ESPERA)
-                    
                     # Mostrar estadísticas de procesamiento
-                    total_procesados = len(renspa_a_procesar)
-                    total_exitosos = len(poligonos_gee)
-                    total_fallidos = len(fallidos)
-                    total_sin_poligono = len(renspa_sin_poligono)
-                    
-                    st.subheader("Estadísticas de procesamiento")
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Total procesados", total_procesados)
-                    with col2:
-                        st.metric("Con polígono", total_exitosos)
-                    with col3:
-                        st.metric("Sin polígono", total_sin_poligono + total_fallidos)
-                
-                # Mostrar los datos en formato de tabla
+                    actualizar_metricas_procesamiento()
+                    if modo_incremental:
+                        cambios = procesamiento.cambios
+                        with avisos:
+                            st.info(
+                                f"Actualización incremental: {cambios['nuevos']} nuevos, "
+                                f"{cambios['modificados']} modificados, {cambios['sin_cambios']} sin cambios, "
+                                f"{cambios['eliminados']} ya no figuran en SENASA"
+                            )
+                
+                # Completar la tabla y el mapa con lo pendiente
                 status_text.text("Generando resultados...")
                 progress_bar.progress(80)
-                
-                st.subheader("Listado de RENSPA")
-                st.dataframe(df_renspa)
+                vista.finalizar()
                 
                 # Panel de estadísticas
-                if 'df_renspa' in locals() and not df_renspa.empty:
-                    mostrar_estadisticas(df_renspa, poligonos_gee if incluir_poligono else None)
-                
-                # Si se procesaron polígonos, mostrarlos en el mapa
-                if incluir_poligono and poligonos_gee and folium_disponible:
-                    # Crear mapa para visualización
-                    st.subheader("Visualización de polígonos")
-                    
-                    # Crear mapa mejorado
-                    m = crear_mapa_mejorado(poligonos_gee)
-                    
-                    # Mostrar el mapa
-                    folium_static(m, width=1000, height=600)
-                elif incluir_poligono and not folium_disponible:
-                    st.warning("Para visualizar mapas, instala folium y streamlit-folium con: pip install folium streamlit-folium")
+                df_renspa = procesamiento.dataframe()
+                poligonos = procesamiento.poligonos if incluir_poligono else None
+                clave_estadisticas = huella_estadisticas(df_renspa, poligonos)
+                with vista.estadisticas:
+                    mostrar_estadisticas(df_renspa, poligonos, clave=clave_estadisticas)
                 
-                # Generar archivo KMZ para descarga
-                if incluir_poligono and poligonos_gee:
-                    status_text.text("Preparando archivos para descarga...")
-                    progress_bar.progress(90)
-                    
-                    # Crear archivo KML
-                    kml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-  <name>RENSPA - CUIT {cuit_normalizado}</name>
-  <description>Polígonos de RENSPA para el CUIT {cuit_normalizado}</description>
-  <Style id="greenPoly">
-    <LineStyle>
-      <color>ff009900</color>
-      <width>3</width>
-    </LineStyle>
-    <PolyStyle>
-      <color>7f00ff00</color>
-    </PolyStyle>
-  </Style>
-"""
-                    
-                    # Añadir cada polígono al KML
-                    for pol in poligonos_gee:
-                        kml_content += f"""
-  <Placemark>
-    <name>{pol['renspa']}</name>
-    <description><![CDATA[
-      <b>RENSPA:</b> {pol['renspa']}<br/>
-      <b>Titular:</b> {pol['titular']}<br/>
-      <b>Localidad:</b> {pol['localidad']}<br/>
-      <b>Superficie:</b> {pol['superficie']} ha
-    ]]></description>
-    <styleUrl>#greenPoly</styleUrl>
-    <Polygon>
-      <extrude>1</extrude>
-      <altitudeMode>clampToGround</altitudeMode>
-      <outerBoundaryIs>
-        <LinearRing>
-          <coordinates>
-"""
-                        
-                        # Añadir coordenadas
-                        for coord in pol['coords']:
-                            lon = coord[0]
-                            lat = coord[1]
-                            kml_content += f"{lon},{lat},0\n"
-                        
-                        kml_content += """
-          </coordinates>
-        </LinearRing>
-      </outerBoundaryIs>
-    </Polygon>
-  </Placemark>
-"""
-                    
-                    # Cerrar documento KML
-                    kml_content += """
-</Document>
-</kml>
-"""
-                    
-                    # Crear archivo KMZ (ZIP que contiene el KML)
-                    kmz_buffer = BytesIO()
-                    with zipfile.ZipFile(kmz_buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
-                        kmz.writestr("doc.kml", kml_content)
-                    
-                    kmz_buffer.seek(0)
-                    
-                    # Crear también un GeoJSON
-                    geojson_data = {
-                        "type": "FeatureCollection",
-                        "features": []
-                    }
-                    
-                    for pol in poligonos_gee:
-                        feature = {
-                            "type": "Feature",
-                            "properties": {
-                                "renspa": pol['renspa'],
-                                "titular": pol['titular'],
-                                "localidad": pol['localidad'],
-                                "superficie": pol['superficie'],
-                                "cuit": cuit_normalizado
-                            },
-                            "geometry": {
-                                "type": "Polygon",
-                                "coordinates": [pol['coords']]
-                            }
-                        }
-                        geojson_data["features"].append(feature)
-                    
-                    geojson_str = json.dumps(geojson_data, indent=2)
-                    
-                    # Preparar CSV con todos los datos
-                    csv_data = df_renspa.to_csv(index=False).encode('utf-8')
-                    
-                    # Opciones de descarga
-                    st.subheader("Descargar resultados")
-                    
-                    col1, col2, col3 = st.columns(3)
-                    
-                    with col1:
-                        st.download_button(
-                            label="Descargar KMZ",
-                            data=kmz_buffer,
-                            file_name=f"renspa_{cuit_normalizado.replace('-', '')}.kmz",
-                            mime="application/vnd.google-earth.kmz",
-                        )
-                    
-                    with col2:
-                        st.download_button(
-                            label="Descargar GeoJSON",
-                            data=geojson_str,
-                            file_name=f"renspa_{cuit_normalizado.replace('-', '')}.geojson",
-                            mime="application/json",
-                        )
-                    
-                    with col3:
-                        st.download_button(
-                            label="Descargar CSV",
-                            data=csv_data,
-                            file_name=f"renspa_{cuit_normalizado.replace('-', '')}.csv",
-                            mime="text/csv",
-                        )
+                # Archivos KMZ, GeoJSON y CSV para descarga
+                status_text.text("Preparando archivos para descarga...")
+                progress_bar.progress(90)
+                archivos = resultado_previo.archivos if resultado_previo else exportar_cuit(procesamiento, cuit_normalizado)
+                guardar_resultados("resultados_cuit", df_renspa, poligonos, clave_mapa=vista.clave_mapa,
+                                   clave_estadisticas=clave_estadisticas, descargas=archivos)
+                mostrar_descargas(archivos)
                 
                 # Completar procesamiento
                 status_text.text("Procesamiento completo!")
@@ -580,6 +391,11 @@ with tab1:
         
         except Exception as e:
             st.error(f"Error durante el procesamiento: {str(e)}")
+    else:
+        mostrar_resultados("resultados_cuit", "Listado de RENSPA")
+
+    mostrar_analisis_cultivos("resultados_cuit")
+    mostrar_busqueda("resultados_cuit")
 
 with tab2:
     st.header("Consulta por Lista de RENSPA")
@@ -604,18 +420,22 @@ with tab2:
         )
         
         if renspa_input:
-            renspa_list = [line.strip() for line in renspa_input.split('\n') if line.strip()]
+            renspa_list, rechazados = ingerir_texto(renspa_input, 'renspa')
+            mostrar_rechazados(rechazados)
     else:
         uploaded_file = st.file_uploader(
-            "Suba un archivo TXT con un RENSPA por línea", 
-            type=['txt'],
+            "Suba un archivo TXT, CSV o XLSX con un RENSPA por línea (o una columna 'renspa')", 
+            type=['txt', 'csv', 'xlsx'],
             key="renspa_file_upload"
         )
         
         if uploaded_file:
-            content = uploaded_file.getvalue().decode('utf-8')
-            renspa_list = [line.strip() for line in content.split('\n') if line.strip()]
-            st.success(f"Archivo cargado con {len(renspa_list)} RENSPA")
+            try:
+                renspa_list, rechazados = cargar_archivo_identificadores(uploaded_file.getvalue(), uploaded_file.name, 'renspa')
+                st.success(f"Archivo cargado con {len(renspa_list)} RENSPA")
+                mostrar_rechazados(rechazados)
+            except ValueError as e:
+                st.error(f"No se pudo leer el archivo: {str(e)}")
 
     # Mostrar lista de RENSPA a procesar
     if renspa_list:
@@ -624,235 +444,89 @@ with tab2:
 
     # Botón para procesar
     if st.button("Procesar Lista de RENSPA", key="btn_renspa_list") and renspa_list:
-        with st.spinner('Procesando lista de RENSPA...'):
+        st.session_state.pop("resultados_lista", None)
+        with st.spinner('Procesando lista de RENSPA...'), plazo_consulta(len(renspa_list)), \
+                perfilar_si_activo("lista_renspa"):
             # Crear barras de progreso
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Procesamiento para cada RENSPA
-            poligonos_gee = []
-            fallidos = []
-            detalles_renspa = []
+            # Los RENSPA de un listado consultado recientemente usan su polígono sin consultar el detalle
+            procesamiento = Procesamiento('renspa')
+            
+            # Reservar los lugares de resultados, que se completan a medida que llegan
+            vista = VistaProgresiva("Detalles de RENSPA")
             
-            for i, renspa in enumerate(renspa_list):
+            def actualizar_metricas_procesamiento(procesados):
+                vista.actualizar_metricas({
+                    "RENSPA procesados": procesados,
+                    "RENSPA obtenidos": procesamiento.total_registros,
+                    "RENSPA con polígono": procesamiento.total_poligonos
+                }, titulo="Resultados del procesamiento")
+            
+            for i, elemento in enumerate(procesamiento.ejecutar(renspa_list)):
                 # Actualizar progreso
-                progress_percentage = (i * 70) // len(renspa_list)
+                progress_percentage = ((i + 1) * 70) // len(renspa_list)
                 progress_bar.progress(progress_percentage)
-                status_text.text(f"Procesando RENSPA: {renspa} ({i+1}/{len(renspa_list)})")
-                
-                try:
-                    # Normalizar RENSPA
-                    renspa_normalizado = normalizar_renspa(renspa)
-                    
-                    # Consultar detalles
-                    resultado = consultar_renspa_detalle(renspa_normalizado)
-                    
-                    if resultado and 'items' in resultado and resultado['items']:
-                        item = resultado['items'][0]
-                        
-                        # Extraer datos básicos
-                        datos_renspa = {
-                            'renspa': renspa_normalizado,
-                            'titular': item.get('titular', ''),
-                            'localidad': item.get('localidad', ''),
-                            'superficie': item.get('superficie', 0),
-                            'fecha_baja': item.get('fecha_baja', None)
-                        }
-                        
-                        # Añadir a la lista de detalles
-                        detalles_renspa.append(datos_renspa)
-                        
-                        # Extraer polígono si está disponible
-                        if 'poligono' in item and item['poligono']:
-                            poligono_str = item['poligono']
-                            coordenadas = extraer_coordenadas(poligono_str)
-                            
-                            if coordenadas:
-                                # Añadir coordenadas al diccionario
-                                datos_renspa['coords'] = coordenadas
-                                poligonos_gee.append(datos_renspa)
-                                continue
-                        
-                        # Si llegamos aquí, no se pudo extraer el polígono
-                        fallidos.append(renspa_normalizado)
-                    else:
-                        fallidos.append(renspa)
+                status_text.text(f"Procesando RENSPA: {elemento.renspa} ({i+1}/{len(renspa_list)})")
                 
-                except Exception as e:
-                    st.error(f"Error procesando {renspa}: {str(e)}")
-                    fallidos.append(renspa)
-                
-                # Pausa breve
-                time.sleep(TIEMPO_ESPERA)
+                if elemento.fila:
+                    vista.agregar_filas([elemento.fila])
+                if elemento.estado == 'ok':
+                    vista.agregar_poligonos([elemento.poligono])
+                actualizar_metricas_procesamiento(i + 1)
+            
+            # RENSPA omitidos sin consultar la API
+            for _, error in procesamiento.invalidos:
+                st.error(error)
+            if procesamiento.desconocidos:
+                st.info(f"Se omitieron {len(procesamiento.desconocidos)} RENSPA sin datos en SENASA en consultas recientes")
             
             # Crear DataFrame con todos los detalles
-            df_renspa = pd.DataFrame(detalles_renspa)
+            df_renspa = procesamiento.dataframe()
             
             # Actualizar progreso
             status_text.text("Generando visualizaciones...")
             progress_bar.progress(80)
             
             # Mostrar estadísticas
-            st.subheader("Resultados del procesamiento")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("RENSPA procesados", len(renspa_list))
-            with col2:
-                st.metric("RENSPA obtenidos", len(detalles_renspa))
-            with col3:
-                st.metric("RENSPA con polígono", len(poligonos_gee))
+            actualizar_metricas_procesamiento(sum(procesamiento.estados.values()))
             
-            # Mostrar datos en tabla
-            st.subheader("Detalles de RENSPA")
-            if not df_renspa.empty:
-                st.dataframe(df_renspa)
-            else:
-                st.warning("No se pudo obtener información para ninguno de los RENSPA proporcionados.")
+            # Completar la tabla y el mapa con lo pendiente
+            vista.finalizar()
+            if df_renspa.empty:
+                vista.mostrar_aviso_tabla("No se pudo obtener información para ninguno de los RENSPA proporcionados.")
             
-            # Panel de estadísticas
+            # Panel de estadísticas (la huella se guarda con los resultados para no recalcularla)
+            clave_estadisticas = huella_estadisticas(df_renspa, procesamiento.poligonos)
             if not df_renspa.empty:
-                mostrar_estadisticas(df_renspa, poligonos_gee)
+                with vista.estadisticas:
+                    mostrar_estadisticas(df_renspa, procesamiento.poligonos, clave=clave_estadisticas)
             
-            # Visualizar en mapa
-            if poligonos_gee and folium_disponible:
-                st.subheader("Visualización de polígonos")
-                
-                # Crear mapa mejorado
-                m = crear_mapa_mejorado(poligonos_gee)
-                
-                # Mostrar el mapa
-                folium_static(m, width=1000, height=600)
-                
-                # Preparar archivos para descarga
+            # Preparar archivos para descarga
+            archivos = exportar(
+                procesamiento,
+                "renspa_lista",
+                "RENSPA - Lista personalizada",
+                "Polígonos de RENSPA de la lista personalizada"
+            )
+            if archivos:
                 status_text.text("Preparando archivos para descarga...")
                 progress_bar.progress(90)
-                
-                # Crear archivo KML
-                kml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-  <name>RENSPA - Lista personalizada</name>
-  <description>Polígonos de RENSPA de la lista personalizada</description>
-  <Style id="greenPoly">
-    <LineStyle>
-      <color>ff009900</color>
-      <width>3</width>
-    </LineStyle>
-    <PolyStyle>
-      <color>7f00ff00</color>
-    </PolyStyle>
-  </Style>
-"""
-                
-                # Añadir cada polígono al KML
-                for pol in poligonos_gee:
-                    kml_content += f"""
-  <Placemark>
-    <name>{pol['renspa']}</name>
-    <description><![CDATA[
-      <b>RENSPA:</b> {pol['renspa']}<br/>
-      <b>Titular:</b> {pol['titular']}<br/>
-      <b>Localidad:</b> {pol['localidad']}<br/>
-      <b>Superficie:</b> {pol['superficie']} ha
-    ]]></description>
-    <styleUrl>#greenPoly</styleUrl>
-    <Polygon>
-      <extrude>1</extrude>
-      <altitudeMode>clampToGround</altitudeMode>
-      <outerBoundaryIs>
-        <LinearRing>
-          <coordinates>
-"""
-                    
-                    # Añadir coordenadas
-                    for coord in pol['coords']:
-                        lon = coord[0]
-                        lat = coord[1]
-                        kml_content += f"{lon},{lat},0\n"
-                    
-                    kml_content += """
-          </coordinates>
-        </LinearRing>
-      </outerBoundaryIs>
-    </Polygon>
-  </Placemark>
-"""
-                
-                # Cerrar documento KML
-                kml_content += """
-</Document>
-</kml>
-"""
-                
-                # Crear archivo KMZ (ZIP que contiene el KML)
-                kmz_buffer = BytesIO()
-                with zipfile.ZipFile(kmz_buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
-                    kmz.writestr("doc.kml", kml_content)
-                
-                kmz_buffer.seek(0)
-                
-                # Crear también un GeoJSON
-                geojson_data = {
-                    "type": "FeatureCollection",
-                    "features": []
-                }
-                
-                for pol in poligonos_gee:
-                    feature = {
-                        "type": "Feature",
-                        "properties": {
-                            "renspa": pol['renspa'],
-                            "titular": pol['titular'],
-                            "localidad": pol['localidad'],
-                            "superficie": pol['superficie']
-                        },
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": [pol['coords']]
-                        }
-                    }
-                    geojson_data["features"].append(feature)
-                
-                geojson_str = json.dumps(geojson_data, indent=2)
-                
-                # Preparar CSV con todos los datos
-                if not df_renspa.empty:
-                    csv_data = df_renspa.to_csv(index=False).encode('utf-8')
-                else:
-                    csv_data = "No hay datos disponibles".encode('utf-8')
-                
-                # Opciones de descarga
-                st.subheader("Descargar resultados")
-                
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    st.download_button(
-                        label="Descargar KMZ",
-                        data=kmz_buffer,
-                        file_name="renspa_lista.kmz",
-                        mime="application/vnd.google-earth.kmz",
-                    )
-                
-                with col2:
-                    st.download_button(
-                        label="Descargar GeoJSON",
-                        data=geojson_str,
-                        file_name="renspa_lista.geojson",
-                        mime="application/json",
-                    )
-                
-                with col3:
-                    st.download_button(
-                        label="Descargar CSV",
-                        data=csv_data,
-                        file_name="renspa_lista.csv",
-                        mime="text/csv",
-                    )
+                mostrar_descargas(archivos)
+            if not df_renspa.empty:
+                guardar_resultados("resultados_lista", df_renspa, procesamiento.poligonos,
+                                   clave_mapa=vista.clave_mapa, clave_estadisticas=clave_estadisticas,
+                                   descargas=archivos)
             
             # Completar progreso
             status_text.text("Procesamiento completo!")
             progress_bar.progress(100)
+    else:
+        mostrar_resultados("resultados_lista", "Detalles de RENSPA")
+
+    mostrar_analisis_cultivos("resultados_lista")
+    mostrar_busqueda("resultados_lista")
 
 with tab3:
     st.header("Consulta por Múltiples CUITs")
@@ -871,24 +545,28 @@ with tab3:
         # Área de texto para ingresar múltiples CUITs
         cuits_input = st.text_area(
             "Ingrese los CUITs (uno por línea):", 
-            "30-65425756-2\n30-12345678-9",
+            "30-65425756-2\n20-12345678-6",
             height=150,
             key="cuits_input"
         )
         
         if cuits_input:
-            cuit_list = [line.strip() for line in cuits_input.split('\n') if line.strip()]
+            cuit_list, rechazados = ingerir_texto(cuits_input, 'cuit')
+            mostrar_rechazados(rechazados)
     else:
         cuit_file = st.file_uploader(
-            "Suba un archivo TXT con un CUIT por línea", 
-            type=['txt'], 
+            "Suba un archivo TXT, CSV o XLSX con un CUIT por línea (o una columna 'cuit')", 
+            type=['txt', 'csv', 'xlsx'], 
             key="cuit_file"
         )
         
         if cuit_file:
-            content = cuit_file.getvalue().decode('utf-8')
-            cuit_list = [line.strip() for line in content.split('\n') if line.strip()]
-            st.success(f"Archivo cargado con {len(cuit_list)} CUITs")
+            try:
+                cuit_list, rechazados = cargar_archivo_identificadores(cuit_file.getvalue(), cuit_file.name, 'cuit')
+                st.success(f"Archivo cargado con {len(cuit_list)} CUITs")
+                mostrar_rechazados(rechazados)
+            except ValueError as e:
+                st.error(f"No se pudo leer el archivo: {str(e)}")
 
     # Opciones adicionales
     col1, col2 = st.columns(2)
@@ -896,320 +574,194 @@ with tab3:
         multi_solo_activos = st.checkbox("Solo RENSPA activos", value=True, key="multi_solo_activos")
     with col2:
         multi_cuit_color = st.checkbox("Usar color diferente para cada CUIT", value=True, key="multi_cuit_color")
+    multi_incremental = st.checkbox(
+        "Actualización incremental (solo consulta los RENSPA nuevos o modificados desde la última consulta)",
+        value=False, key="multi_incremental"
+    )
+    multi_disco = st.checkbox(
+        "Modo de memoria acotada (guarda los resultados en disco; para lotes muy grandes)",
+        value=False, key="multi_disco"
+    )
+    opciones_particion = {"Un archivo por formato": None}
+    opciones_particion.update({f"Paquete ZIP con un archivo por {etiqueta.lower()}": particion
+                               for particion, etiqueta in PARTICIONES.items()})
+    multi_particion = opciones_particion[st.selectbox(
+        "Archivos de descarga:", list(opciones_particion), key="multi_particion"
+    )]
+    if multi_particion and multi_disco:
+        st.caption("En el modo de memoria acotada se genera un único archivo por formato.")
 
     # Botón para procesar
     if st.button("Procesar Múltiples CUITs", key="btn_multi_cuit") and cuit_list:
-        with st.spinner('Procesando múltiples CUITs...'):
+        # En el modo de memoria acotada los resultados quedan en disco y no se guardan para volver a mostrarlos ni buscar
+        st.session_state.pop("resultados_multiples", None)
+        with st.spinner('Procesando múltiples CUITs...'), plazo_consulta(len(cuit_list)), \
+                perfilar_si_activo("multiples_cuits"):
             # Crear barras de progreso
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            # Procesamiento para cada CUIT
-            poligonos_gee = []
-            todos_renspa = []
-            cuits_normalizados = []
+            # Colores por CUIT, asignados a medida que llega cada listado
             cuit_colors = {}
             
-            # Normalizar CUITs
-            for cuit in cuit_list:
-                try:
-                    cuit_normalizado = normalizar_cuit(cuit)
-                    cuits_normalizados.append(cuit_normalizado)
-                    
-                    # Asignar un color aleatorio para este CUIT
-                    if multi_cuit_color:
-                        r = random.randint(0, 200)
-                        g = random.randint(0, 200)
-                        b = random.randint(0, 200)
-                        cuit_colors[cuit_normalizado] = f'#{r:02x}{g:02x}{b:02x}'
-                except ValueError as e:
-                    st.error(f"CUIT inválido: {cuit}. {str(e)}")
+            # En modo de memoria acotada, registros y polígonos se vuelcan a disco por bloques
+            almacen = AlmacenTemporal() if multi_disco else None
             
-            # Verificar que haya CUITs válidos
-            if not cuits_normalizados:
-                st.error("No se proporcionaron CUITs válidos.")
-                st.stop()
+            # Reservar los lugares de resultados, que se completan CUIT a CUIT
+            vista = VistaProgresiva(
+                "Detalles de RENSPA",
+                cuit_colors=cuit_colors if multi_cuit_color else None,
+                max_filas=MAX_FILAS_ACOTADO if almacen else None,
+                max_poligonos=MAX_POLIGONOS_ACOTADO if almacen else None
+            )
             
-            # Procesar cada CUIT
-            for i, cuit in enumerate(cuits_normalizados):
+            def actualizar_metricas_procesamiento(procesados):
+                vista.actualizar_metricas({
+                    "CUITs procesados": procesados,
+                    "RENSPA obtenidos": procesamiento.total_registros,
+                    "RENSPA con polígono": procesamiento.total_poligonos
+                }, titulo="Resultados del procesamiento")
+            
+            def registrar_listado(listado):
                 # Actualizar progreso
-                progress_percentage = (i * 70) // len(cuits_normalizados)
+                i = procesamiento.listados - 1
+                progress_percentage = (i * 70) // len(cuit_list)
                 progress_bar.progress(progress_percentage)
-                status_text.text(f"Procesando CUIT: {cuit} ({i+1}/{len(cuits_normalizados)})")
+                status_text.text(f"Procesando CUIT: {listado.cuit} ({i+1}/{len(cuit_list)})")
+                actualizar_metricas_procesamiento(i)
                 
-                # Obtener todos los RENSPA para este CUIT
-                renspa_cuit = obtener_renspa_por_cuit(cuit)
+                # Asignar un color aleatorio para este CUIT
+                if multi_cuit_color:
+                    r = random.randint(0, 200)
+                    g = random.randint(0, 200)
+                    b = random.randint(0, 200)
+                    cuit_colors[listado.cuit] = f'#{r:02x}{g:02x}{b:02x}'
                 
-                if renspa_cuit:
-                    # Añadir el CUIT a cada registro para identificación
-                    for renspa in renspa_cuit:
-                        renspa['cuit'] = cuit
-                    
-                    # Añadir a la lista total
-                    todos_renspa.extend(renspa_cuit)
-                    
-                    # Filtrar por activos si se solicita
-                    if multi_solo_activos:
-                        renspa_a_procesar = [r for r in renspa_cuit if r.get('fecha_baja') is None]
-                    else:
-                        renspa_a_procesar = renspa_cuit
-                    
-                    # Procesar polígonos de este CUIT
-                    for renspa_item in renspa_a_procesar:
-                        renspa = renspa_item['renspa']
-                        
-                        # Verificar si ya tiene el polígono en la información básica
-                        if 'poligono' in renspa_item and renspa_item['poligono']:
-                            poligono_str = renspa_item['poligono']
-                            superficie = renspa_item.get('superficie', 0)
-                            
-                            # Extraer coordenadas
-                            coordenadas = extraer_coordenadas(poligono_str)
-                            
-                            if coordenadas:
-                                # Crear objeto con datos del polígono
-                                poligono_data = {
-                                    'renspa': renspa,
-                                    'coords': coordenadas,
-                                    'superficie': superficie,
-                                    'titular': renspa_item.get('titular', ''),
-                                    'localidad': renspa_item.get('localidad', ''),
-                                    'cuit': cuit
-                                }
-                                poligonos_gee.append(poligono_data)
-                                continue
-                        
-                        # Si no tenía polígono o no era válido, consultar más detalles
-                        resultado = consultar_renspa_detalle(renspa)
-                        
-                        if resultado and 'items' in resultado and resultado['items'] and 'poligono' in resultado['items'][0]:
-                            item_detalle = resultado['items'][0]
-                            poligono_str = item_detalle.get('poligono')
-                            superficie = item_detalle.get('superficie', 0)
-                            
-                            if poligono_str:
-                                # Extraer coordenadas
-                                coordenadas = extraer_coordenadas(poligono_str)
-                                
-                                if coordenadas:
-                                    # Crear objeto con datos del polígono
-                                    poligono_data = {
-                                        'renspa': renspa,
-                                        'coords': coordenadas,
-                                        'superficie': superficie,
-                                        'titular': renspa_item.get('titular', ''),
-                                        'localidad': renspa_item.get('localidad', ''),
-                                        'cuit': cuit
-                                    }
-                                    poligonos_gee.append(poligono_data)
-                        
-                        # Pausa breve para no sobrecargar la API
-                        time.sleep(TIEMPO_ESPERA)
+                # Añadir los RENSPA del CUIT a la tabla
+                vista.agregar_filas(listado.items)
+            
+            procesamiento = Procesamiento(
+                'cuit', solo_activos=multi_solo_activos, incremental=multi_incremental,
+                almacen=almacen, al_listar=registrar_listado
+            )
+            
+            # Procesar cada CUIT
+            for elemento in procesamiento.ejecutar(cuit_list):
+                if elemento.estado == 'ok':
+                    vista.agregar_poligonos([elemento.poligono])
             
-            # Crear DataFrame con todos los RENSPA
-            df_renspa = pd.DataFrame(todos_renspa)
+            # CUITs omitidos sin consultar la API
+            for _, error in procesamiento.invalidos:
+                st.error(error)
+            if procesamiento.desconocidos:
+                st.info(f"Se omitieron {len(procesamiento.desconocidos)} CUITs sin RENSPA en SENASA en consultas recientes")
             
             # Actualizar progreso
             status_text.text("Generando visualizaciones...")
             progress_bar.progress(80)
             
             # Mostrar estadísticas
-            st.subheader("Resultados del procesamiento")
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("CUITs procesados", len(cuits_normalizados))
-            with col2:
-                st.metric("RENSPA obtenidos", len(todos_renspa))
-            with col3:
-                st.metric("RENSPA con polígono", len(poligonos_gee))
-            
-            # Mostrar datos en tabla
-            st.subheader("Detalles de RENSPA")
-            if not df_renspa.empty:
-                st.dataframe(df_renspa)
-            else:
-                st.warning("No se pudo obtener información para ninguno de los CUITs proporcionados.")
+            actualizar_metricas_procesamiento(procesamiento.listados)
+            if multi_incremental:
+                st.info(f"Actualización incremental: {procesamiento.cambios['sin_cambios']} RENSPA sin cambios "
+                        "reutilizados de la consulta anterior")
             
-            # Panel de estadísticas
-            if not df_renspa.empty:
-                mostrar_estadisticas(df_renspa, poligonos_gee)
+            # Completar la tabla y el mapa con lo pendiente
+            vista.finalizar()
             
-            # Visualizar en mapa
-            if poligonos_gee and folium_disponible:
-                st.subheader("Visualización de polígonos")
-                
-                # Crear mapa mejorado con colores por CUIT
-                m = crear_mapa_mejorado(poligonos_gee, cuit_colors=cuit_colors if multi_cuit_color else None)
-                
-                # Mostrar el mapa
-                folium_static(m, width=1000, height=600)
-                
-                # Preparar archivos para descarga
-                status_text.text("Preparando archivos para descarga...")
-                progress_bar.progress(90)
-                
-                # Crear archivo KML
-                kml_content = f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-  <name>RENSPA - Múltiples CUITs</name>
-  <description>Polígonos de RENSPA para múltiples CUITs</description>
-"""
-                
-                # Añadir estilos para cada CUIT
-                if multi_cuit_color:
-                    for cuit, color in cuit_colors.items():
-                        # Convertir color de hex a KML (aabbggrr)
-                        color_hex = color.lstrip('#')
-                        r = color_hex[0:2]
-                        g = color_hex[2:4]
-                        b = color_hex[4:6]
-                        kml_color = f"7f{b}{g}{r}"  # 7f de transparencia
-                        
-                        cuit_clean = cuit.replace('-', '_')
-                        kml_content += f"""
-  <Style id="style_{cuit_clean}">
-    <LineStyle>
-      <color>ff{b}{g}{r}</color>
-      <width>3</width>
-    </LineStyle>
-    <PolyStyle>
-      <color>{kml_color}</color>
-    </PolyStyle>
-  </Style>
-"""
+            if almacen:
+                almacen.cerrar()
+                if not almacen.total_registros:
+                    vista.mostrar_aviso_tabla("No se pudo obtener información para ninguno de los CUITs proporcionados.")
+                    almacen.eliminar()
                 else:
-                    # Estilo único para todos
-                    kml_content += """
-  <Style id="defaultStyle">
-    <LineStyle>
-      <color>ff009900</color>
-      <width>3</width>
-    </LineStyle>
-    <PolyStyle>
-      <color>7f00ff00</color>
-    </PolyStyle>
-  </Style>
-"""
-                
-                # Añadir cada polígono al KML
-                for pol in poligonos_gee:
-                    # Determinar estilo
-                    if multi_cuit_color:
-                        cuit_clean = pol['cuit'].replace('-', '_')
-                        style_url = f"#style_{cuit_clean}"
-                    else:
-                        style_url = "#defaultStyle"
+                    # Estadísticas y exportaciones leyendo el almacén bloque a bloque
+                    with vista.estadisticas:
+                        st.subheader("Estadísticas de RENSPA")
+                        estadisticas = calcular_estadisticas_por_bloques(almacen.iterar_registros(),
+                                                                         almacen.iterar_buffers_poligonos())
+                        mostrar_panel_estadisticas(estadisticas, por_cuit=True,
+                                                   con_poligonos=almacen.total_poligonos > 0)
                     
-                    kml_content += f"""
-  <Placemark>
-    <name>{pol['renspa']}</name>
-    <description><![CDATA[
-      <b>RENSPA:</b> {pol['renspa']}<br/>
-      <b>CUIT:</b> {pol['cuit']}<br/>
-      <b>Titular:</b> {pol['titular']}<br/>
-      <b>Localidad:</b> {pol['localidad']}<br/>
-      <b>Superficie:</b> {pol['superficie']} ha
-    ]]></description>
-    <styleUrl>{style_url}</styleUrl>
-    <Polygon>
-      <extrude>1</extrude>
-      <altitudeMode>clampToGround</altitudeMode>
-      <outerBoundaryIs>
-        <LinearRing>
-          <coordinates>
-"""
+                    status_text.text("Preparando archivos para descarga...")
+                    progress_bar.progress(90)
                     
-                    # Añadir coordenadas
-                    for coord in pol['coords']:
-                        lon = coord[0]
-                        lat = coord[1]
-                        kml_content += f"{lon},{lat},0\n"
+                    archivos = exportar(
+                        procesamiento,
+                        "renspa_multiples_cuits",
+                        "RENSPA - Múltiples CUITs",
+                        "Polígonos de RENSPA para múltiples CUITs",
+                        cuit_colors=cuit_colors if multi_cuit_color else None
+                    )
                     
-                    kml_content += """
-          </coordinates>
-        </LinearRing>
-      </outerBoundaryIs>
-    </Polygon>
-  </Placemark>
-"""
-                
-                # Cerrar documento KML
-                kml_content += """
-</Document>
-</kml>
-"""
-                
-                # Crear archivo KMZ (ZIP que contiene el KML)
-                kmz_buffer = BytesIO()
-                with zipfile.ZipFile(kmz_buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
-                    kmz.writestr("doc.kml", kml_content)
-                
-                kmz_buffer.seek(0)
-                
-                # Crear también un GeoJSON
-                geojson_data = {
-                    "type": "FeatureCollection",
-                    "features": []
-                }
-                
-                for pol in poligonos_gee:
-                    feature = {
-                        "type": "Feature",
-                        "properties": {
-                            "renspa": pol['renspa'],
-                            "cuit": pol['cuit'],
-                            "titular": pol['titular'],
-                            "localidad": pol['localidad'],
-                            "superficie": pol['superficie']
-                        },
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": [pol['coords']]
-                        }
-                    }
-                    geojson_data["features"].append(feature)
-                
-                geojson_str = json.dumps(geojson_data, indent=2)
+                    # Los archivos que no se pudieron ofrecer como descarga quedan en disco
+                    if mostrar_descargas(archivos, almacen):
+                        almacen.eliminar()
+            else:
+                # Crear DataFrame con todos los RENSPA
+                df_renspa = procesamiento.dataframe()
+                if df_renspa.empty:
+                    vista.mostrar_aviso_tabla("No se pudo obtener información para ninguno de los CUITs proporcionados.")
                 
-                # Preparar CSV con todos los datos
+                # Panel de estadísticas (la huella se guarda con los resultados para no recalcularla)
+                clave_estadisticas = huella_estadisticas(df_renspa, procesamiento.poligonos)
                 if not df_renspa.empty:
-                    csv_data = df_renspa.to_csv(index=False).encode('utf-8')
-                else:
-                    csv_data = "No hay datos disponibles".encode('utf-8')
-                
-                # Opciones de descarga
-                st.subheader("Descargar resultados")
+                    with vista.estadisticas:
+                        mostrar_estadisticas(df_renspa, procesamiento.poligonos, clave=clave_estadisticas)
                 
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    st.download_button(
-                        label="Descargar KMZ",
-                        data=kmz_buffer,
-                        file_name="renspa_multiples_cuits.kmz",
-                        mime="application/vnd.google-earth.kmz",
-                    )
-                
-                with col2:
-                    st.download_button(
-                        label="Descargar GeoJSON",
-                        data=geojson_str,
-                        file_name="renspa_multiples_cuits.geojson",
-                        mime="application/json",
+                archivos, nota_descargas = [], None
+                if multi_particion and not df_renspa.empty:
+                    # Paquete con un KMZ, GeoJSON y CSV por partición, generado en disco
+                    status_text.text("Preparando archivos para descarga...")
+                    progress_bar.progress(90)
+                    
+                    with tempfile.TemporaryFile() as archivo_paquete:
+                        manifiesto = escribir_paquete(
+                            archivo_paquete,
+                            df_renspa,
+                            procesamiento.poligonos,
+                            multi_particion,
+                            titulo="RENSPA",
+                            cuit_colors=cuit_colors if multi_cuit_color else None,
+                            incluir_cuit=True
+                        )
+                        archivo_paquete.seek(0)
+                        datos_paquete = archivo_paquete.read()
+                    
+                    archivos = [("Descargar paquete ZIP", f"renspa_por_{multi_particion}.zip",
+                                 "application/zip", datos_paquete)]
+                    nota_descargas = (f"{len(manifiesto['particiones'])} particiones por "
+                                      f"{PARTICIONES[multi_particion].lower()}; el detalle está en manifest.json")
+                    mostrar_descargas(archivos)
+                    st.caption(nota_descargas)
+                elif not df_renspa.empty:
+                    # Preparar archivos para descarga
+                    status_text.text("Preparando archivos para descarga...")
+                    progress_bar.progress(90)
+                    
+                    archivos = exportar(
+                        procesamiento,
+                        "renspa_multiples_cuits",
+                        "RENSPA - Múltiples CUITs",
+                        "Polígonos de RENSPA para múltiples CUITs",
+                        cuit_colors=cuit_colors if multi_cuit_color else None
                     )
+                    mostrar_descargas(archivos)
                 
-                with col3:
-                    st.download_button(
-                        label="Descargar CSV",
-                        data=csv_data,
-                        file_name="renspa_multiples_cuits.csv",
-                        mime="text/csv",
-                    )
+                if not df_renspa.empty:
+                    guardar_resultados("resultados_multiples", df_renspa, procesamiento.poligonos,
+                                       cuit_colors if multi_cuit_color else None, clave_mapa=vista.clave_mapa,
+                                       clave_estadisticas=clave_estadisticas, descargas=archivos,
+                                       nota_descargas=nota_descargas)
             
             # Completar progreso
             status_text.text("Procesamiento completo!")
             progress_bar.progress(100)
+    else:
+        mostrar_resultados("resultados_multiples", "Detalles de RENSPA")
+
+    mostrar_analisis_cultivos("resultados_multiples")
+    mostrar_busqueda("resultados_multiples")
 
 # Información en el pie de página
 st.sidebar.markdown("---")
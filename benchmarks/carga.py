@@ -0,0 +1,326 @@
+"""
+Prueba de carga con sesiones concurrentes de la aplicación RENSPA
+
+Cada sesión es un hilo que repite, durante --duracion segundos, los flujos
+de las tres pestañas de app.py (consulta por CUIT, lista de RENSPA y
+múltiples CUITs) con las mismas llamadas que la interfaz: Procesamiento con
+el plazo de cada trabajo, estadísticas, mapa y archivos de descarga. Como en
+un despliegue de Streamlit, todas las sesiones comparten el proceso, sus
+cachés y el pool de geometría. Cada nivel de concurrencia corre en un
+proceso nuevo, con las cachés vacías, contra el servidor SENASA simulado,
+que corre en el proceso principal para que su CPU no se cuente.
+
+Por nivel se informa el rendimiento (flujos terminados por segundo), los
+percentiles de latencia de cada flujo, las peticiones a SENASA y sus
+respuestas 429, el uso de CPU y la memoria residente del proceso (los
+procesos del pool de geometría no se cuentan).
+
+Uso:
+    python -m benchmarks.carga --sesiones 1,4,16,64 --duracion 60
+    python -m benchmarks.carga --sesiones 8,32 --limite 20 --latencia 0.2 --salida carga.json
+    python -m benchmarks.carga --sesiones 16 --pausa 0 --flujos cuit
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import numpy as np
+
+import senasa
+import validacion
+from estadisticas import estadisticas_cacheadas
+from mapa import mapa_html
+from precalentamiento import exportar_cuit, precalentado
+from procesamiento import Procesamiento, exportar
+from benchmarks.mock_senasa import ServidorSenasaSimulado, ITEMS_POR_PAGINA, generar_cuits, generar_renspa
+
+SESIONES_PREDETERMINADAS = (1, 4, 16, 64)
+FLUJOS = ('cuit', 'lista_renspa', 'multiples_cuits')
+PERCENTILES = (50, 90, 99)
+INTERVALO_MEMORIA = 0.2  # segundos entre muestras de la memoria residente
+
+
+def _memoria_residente():
+    """Memoria residente actual del proceso en bytes (0 si no se puede leer)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _MuestreoMemoria:
+    """Máximo de la memoria residente del proceso, muestreada en un hilo"""
+
+    def __init__(self):
+        self.maximo = _memoria_residente()
+        self._detener = threading.Event()
+        self._hilo = threading.Thread(target=self._muestrear, name="carga-memoria", daemon=True)
+
+    def _muestrear(self):
+        while not self._detener.wait(INTERVALO_MEMORIA):
+            self.maximo = max(self.maximo, _memoria_residente())
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._detener.set()
+        self._hilo.join()
+        self.maximo = max(self.maximo, _memoria_residente())
+
+
+class Sesion:
+    """
+    Una sesión de la interfaz: los flujos de las pestañas con los datos que
+    ingresaría un analista
+    """
+
+    def __init__(self, indice, configuracion, cuits):
+        self.indice = indice
+        self.configuracion = configuracion
+        self.cuits = cuits
+        self.rng = random.Random(indice)
+
+    def flujo_cuit(self):
+        """Pestaña 'Consulta por CUIT' con las opciones predeterminadas"""
+        cuit = self.rng.choice(self.cuits)
+        with senasa.plazo_consulta(1):
+            resultado = precalentado(cuit)
+            if resultado:
+                self._resultados(resultado.procesamiento)
+                return resultado.procesamiento
+            procesamiento = Procesamiento('cuit', incluir_cuit=False)
+            for _ in procesamiento.ejecutar([cuit]):
+                pass
+            self._resultados(procesamiento)
+            exportar_cuit(procesamiento, cuit)
+        return procesamiento
+
+    def flujo_lista_renspa(self):
+        """Pestaña 'Consulta por Lista de RENSPA' con RENSPA de CUITs al azar"""
+        total = self.configuracion['paginas'] * ITEMS_POR_PAGINA
+        renspa_list = [generar_renspa(self.rng.choice(self.cuits), self.rng.randrange(total))
+                       for _ in range(self.configuracion['renspa_por_consulta'])]
+        with senasa.plazo_consulta(len(renspa_list)):
+            procesamiento = Procesamiento('renspa')
+            for _ in procesamiento.ejecutar(renspa_list):
+                pass
+            self._resultados(procesamiento)
+            exportar(procesamiento, "renspa_lista", "RENSPA - Lista personalizada",
+                     "Polígonos de RENSPA de la lista personalizada")
+        return procesamiento
+
+    def flujo_multiples_cuits(self):
+        """Pestaña 'Consulta por Múltiples CUITs' con un color por CUIT"""
+        cuits = self.rng.sample(self.cuits, min(self.configuracion['cuits_por_consulta'], len(self.cuits)))
+        cuit_colors = {}
+
+        def registrar_listado(listado):
+            cuit_colors[listado.cuit] = '#{:02x}{:02x}{:02x}'.format(*(self.rng.randint(0, 200) for _ in range(3)))
+
+        with senasa.plazo_consulta(len(cuits)):
+            procesamiento = Procesamiento('cuit', al_listar=registrar_listado)
+            for _ in procesamiento.ejecutar(cuits):
+                pass
+            self._resultados(procesamiento, cuit_colors)
+            exportar(procesamiento, "renspa_multiple_cuits", "RENSPA - Múltiples CUITs",
+                     f"Polígonos de RENSPA para {len(cuits)} CUITs", cuit_colors=cuit_colors)
+        return procesamiento
+
+    @staticmethod
+    def _resultados(procesamiento, cuit_colors=None):
+        """Tabla, estadísticas y mapa, como los arma la vista de resultados"""
+        df_renspa = procesamiento.dataframe()
+        if not df_renspa.empty:
+            estadisticas_cacheadas(df_renspa, procesamiento.poligonos)
+        if procesamiento.poligonos:
+            mapa_html(procesamiento.poligonos, cuit_colors=cuit_colors)
+
+    def ejecutar(self, fin, latencias, errores, lock):
+        """Repite los flujos configurados, empezando por uno distinto en cada sesión, hasta `fin`"""
+        flujos = self.configuracion['flujos']
+        i = self.indice
+        while time.monotonic() < fin:
+            flujo = flujos[i % len(flujos)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                procesamiento = getattr(self, f"flujo_{flujo}")()
+                fallido = bool(procesamiento.estados['error'])
+            except Exception:
+                logging.getLogger(__name__).exception("Error en el flujo %s", flujo)
+                fallido = True
+            duracion = time.perf_counter() - inicio
+            with lock:
+                latencias[flujo].append(duracion)
+                errores[flujo] += fallido
+
+
+def _resumen_latencias(valores):
+    if not valores:
+        return {'flujos': 0}
+    resumen = {'flujos': len(valores), 'media_s': float(np.mean(valores)), 'max_s': float(np.max(valores))}
+    for percentil, valor in zip(PERCENTILES, np.percentile(valores, PERCENTILES)):
+        resumen[f'p{percentil}_s'] = float(valor)
+    return resumen
+
+
+def ejecutar_nivel(configuracion, sesiones):
+    """
+    Ejecuta `sesiones` sesiones concurrentes en este proceso
+
+    Returns:
+        Diccionario con el rendimiento, las latencias por flujo y total, los
+        flujos con errores, el uso de CPU y la memoria residente
+    """
+    # Los errores de la API se reportan con st.error; fuera de Streamlit solo generan ruido
+    logging.getLogger("streamlit").setLevel(logging.CRITICAL)
+    senasa.API_BASE_URL = configuracion['url']
+    senasa.TIEMPO_ESPERA = configuracion['pausa']
+    validacion.ARCHIVO_DESCONOCIDOS = os.path.join(tempfile.mkdtemp(prefix="carga_"), "desconocidos.json")
+
+    cuits = generar_cuits(configuracion['cuits'])
+    latencias, errores, lock = defaultdict(list), defaultdict(int), threading.Lock()
+    memoria_inicial = _memoria_residente()
+    cpu_inicial, inicio = os.times(), time.monotonic()
+    with _MuestreoMemoria() as memoria:
+        fin = inicio + configuracion['duracion']
+        hilos = [threading.Thread(target=Sesion(i, configuracion, cuits).ejecutar,
+                                  args=(fin, latencias, errores, lock), name=f"sesion-{i}")
+                 for i in range(sesiones)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+    duracion = time.monotonic() - inicio
+    cpu_final = os.times()
+    cpu = (cpu_final.user - cpu_inicial.user) + (cpu_final.system - cpu_inicial.system)
+
+    todas = [valor for valores in latencias.values() for valor in valores]
+    return {
+        'sesiones': sesiones,
+        'duracion_s': duracion,
+        'flujos_por_s': len(todas) / duracion,
+        'latencia': _resumen_latencias(todas),
+        'por_flujo': {flujo: {**_resumen_latencias(latencias[flujo]), 'con_errores': errores[flujo]}
+                      for flujo in configuracion['flujos']},
+        'con_errores': sum(errores.values()),
+        # Núcleos usados en promedio por el proceso de la aplicación
+        'cpu_nucleos': cpu / duracion,
+        'memoria_inicial_mb': memoria_inicial / 2 ** 20,
+        'memoria_max_mb': memoria.maximo / 2 ** 20,
+        # Pico de toda la vida del proceso según el sistema operativo (KiB en Linux)
+        'ru_maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def _ejecutar_nivel_en_proceso(configuracion, sesiones, cola):
+    cola.put(ejecutar_nivel(configuracion, sesiones))
+
+
+def medir(configuracion, niveles, servidor):
+    """Mide cada nivel de concurrencia en un proceso nuevo"""
+    contexto = multiprocessing.get_context("spawn")
+    resultados = []
+    for sesiones in niveles:
+        servidor.reiniciar_contadores()
+        cola = contexto.Queue()
+        proceso = contexto.Process(target=_ejecutar_nivel_en_proceso, args=(configuracion, sesiones, cola),
+                                   name=f"carga-{sesiones}")
+        proceso.start()
+        resultado = cola.get()
+        proceso.join()
+
+        peticiones = sum(servidor.contador_peticiones.values())
+        resultado.update({
+            'peticiones': dict(servidor.contador_peticiones),
+            'peticiones_por_s': peticiones / resultado['duracion_s'],
+            'respuestas_429': servidor.respuestas_429,
+        })
+        latencia = resultado['latencia']
+        print(f"sesiones={sesiones:<4} flujos/s={resultado['flujos_por_s']:.2f} "
+              f"p50={latencia.get('p50_s', 0):.2f}s p99={latencia.get('p99_s', 0):.2f}s "
+              f"errores={resultado['con_errores']} peticiones/s={resultado['peticiones_por_s']:.1f} "
+              f"429={resultado['respuestas_429']} cpu={resultado['cpu_nucleos']:.2f} "
+              f"memoria={resultado['memoria_max_mb']:.0f}MB", file=sys.stderr)
+        resultados.append(resultado)
+    return resultados
+
+
+def main(argv=None):
+    # Importado acá: los procesos de cada nivel importan este módulo y no necesitan la suite completa
+    from benchmarks.ejecutar import _commit_actual
+
+    parser = argparse.ArgumentParser(description="Prueba de carga con sesiones concurrentes")
+    parser.add_argument("--sesiones", default=",".join(str(s) for s in SESIONES_PREDETERMINADAS),
+                        help="Niveles de concurrencia separados por coma (default: 1,4,16,64)")
+    parser.add_argument("--duracion", type=float, default=60.0, help="Segundos de carga por nivel")
+    parser.add_argument("--flujos", default=",".join(FLUJOS),
+                        help="Flujos que repite cada sesión, separados por coma (default: los tres)")
+    parser.add_argument("--cuits", type=int, default=200, help="CUITs distintos que consultan las sesiones")
+    parser.add_argument("--cuits-por-consulta", type=int, default=5,
+                        help="CUITs de cada consulta de múltiples CUITs")
+    parser.add_argument("--renspa-por-consulta", type=int, default=10,
+                        help="RENSPA de cada consulta por lista de RENSPA")
+    parser.add_argument("--paginas", type=int, default=3, help="Páginas de 10 RENSPA por CUIT simulado")
+    parser.add_argument("--pausa", type=float, default=0.5,
+                        help="Pausa entre peticiones de cada sesión (TIEMPO_ESPERA, default: 0.5 como en producción)")
+    parser.add_argument("--latencia", type=float, default=0.05, help="Latencia simulada de SENASA (s)")
+    parser.add_argument("--vertices", type=int, default=20, help="Vértices por polígono simulado")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Tasa de errores HTTP 500 simulados")
+    parser.add_argument("--limite", type=float, help="Peticiones por segundo que admite SENASA simulado")
+    parser.add_argument("--salida", help="Archivo JSON de salida (por defecto stdout)")
+    args = parser.parse_args(argv)
+
+    flujos = [flujo for flujo in args.flujos.split(",") if flujo]
+    invalidos = set(flujos) - set(FLUJOS)
+    if invalidos:
+        parser.error(f"Flujos desconocidos: {', '.join(sorted(invalidos))}")
+    niveles = [int(s) for s in args.sesiones.split(",") if s]
+
+    with ServidorSenasaSimulado(latencia=args.latencia, paginas=args.paginas, vertices=args.vertices,
+                                tasa_error=args.tasa_error, limite=args.limite) as servidor:
+        configuracion = {
+            'url': servidor.url,
+            'duracion': args.duracion,
+            'flujos': flujos,
+            'cuits': args.cuits,
+            'cuits_por_consulta': args.cuits_por_consulta,
+            'renspa_por_consulta': args.renspa_por_consulta,
+            'paginas': args.paginas,
+            'pausa': args.pausa,
+        }
+        resultados = medir(configuracion, niveles, servidor)
+
+    informe = {
+        'fecha': datetime.now(timezone.utc).isoformat(),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'nucleos': os.cpu_count(),
+        'configuracion': vars(args),
+        'resultados': resultados,
+    }
+    salida = json.dumps(informe, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(salida)
+    else:
+        print(salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,578 @@
+"""
+Suite de benchmarks de la aplicación RENSPA
+
+Mide el procesamiento de punta a punta (CUIT y lista de RENSPA) contra el
+servidor SENASA simulado, los caminos internos (extraer_coordenadas, KML,
+GeoJSON y construcción del mapa) y el escalado de las etapas de geometría
+de 1 a N procesos, a distintas escalas. Los resultados se
+emiten en JSON para poder compararlos entre versiones.
+
+Uso:
+    python -m benchmarks.ejecutar --salida resultados.json
+    python -m benchmarks.ejecutar --escalas 10,1000 --solo micro
+    python -m benchmarks.ejecutar --solo geometria --procesos 1,2,4,8
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+import senasa
+import geometria
+import metricas
+import incremental
+import precalentamiento
+import rastreo
+import validacion
+from senasa import extraer_coordenadas
+from procesamiento import Procesamiento
+from ingesta import ingerir_archivo
+import raster
+from raster import analizar_campanas, estadisticas_zonales, guardar_raster_npy
+from estadisticas import calcular_estadisticas
+from esquema import dataframe_renspa
+from busqueda import COLUMNAS_BUSQUEDA, IndiceBusqueda
+from exportacion import generar_kml, generar_kmz, generar_geojson, escribir_paquete
+from mapa import cache_mapas, crear_mapa_mejorado, folium_disponible, mapa_html
+from benchmarks.mock_senasa import ServidorSenasaSimulado, ITEMS_POR_PAGINA, generar_cuits, generar_poligono
+
+ESCALAS_PREDETERMINADAS = [10, 1000, 50000]
+SESIONES_CONCURRENTES = 8
+PROCESOS_RASTREO = 2
+
+# Campañas de los benchmarks de estadísticas zonales
+CAMPANAS_RASTER = 5
+
+# Registro de benchmarks: nombre -> (grupo, función)
+BENCHMARKS = {}
+
+
+def benchmark(nombre, grupo):
+    """Registra una función de benchmark"""
+    def decorador(funcion):
+        BENCHMARKS[nombre] = (grupo, funcion)
+        return funcion
+    return decorador
+
+
+def medir(funcion, repeticiones):
+    """Ejecuta la función varias veces y devuelve los tiempos en segundos"""
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def generar_poligonos(cantidad, vertices=20, semilla=0):
+    """Genera polígonos sintéticos con la estructura que usan las pestañas"""
+    rng = random.Random(semilla)
+    poligonos = []
+    for i in range(cantidad):
+        poligono_str = generar_poligono(rng, vertices)
+        poligonos.append({
+            'renspa': f"01.001.0.{i % 100000:05d}/01",
+            'poligono': poligono_str,
+            'coords': extraer_coordenadas(poligono_str),
+            'superficie': round(rng.uniform(10, 1000), 2),
+            'titular': f"Titular {i % 37}",
+            'localidad': f"Localidad {i % 50}",
+            'cuit': f"30-{i % 500:08d}-1",
+        })
+    return poligonos
+
+
+def procesar_cuit(cuit, modo_incremental=False):
+    """Reproduce el flujo de la pestaña 'Consulta por CUIT' sin interfaz"""
+    procesamiento = Procesamiento('cuit', incremental=modo_incremental, incluir_cuit=False)
+    return [elemento.poligono for elemento in procesamiento.ejecutar([cuit]) if elemento.estado == 'ok']
+
+
+def procesar_lista_renspa(renspa_list):
+    """Reproduce el flujo de la pestaña 'Consulta por Lista de RENSPA' sin interfaz"""
+    procesamiento = Procesamiento('renspa')
+    return [elemento.poligono for elemento in procesamiento.ejecutar(renspa_list) if elemento.estado == 'ok']
+
+
+def en_frio(funcion):
+    """Envuelve un benchmark para que cada ejecución empiece con las cachés de consultas y listados vacías"""
+    def ejecutar_en_frio():
+        senasa.consultas_compartidas.limpiar()
+        senasa.listados_por_renspa.limpiar()
+        return funcion()
+    return ejecutar_en_frio
+
+
+@benchmark("e2e_cuit", "e2e")
+def bench_e2e_cuit(escala, servidor):
+    """Un CUIT con `escala` RENSPA (paginados de a 10)"""
+    servidor.paginas = max(1, escala // ITEMS_POR_PAGINA)
+    return en_frio(lambda: procesar_cuit("30-65425756-2"))
+
+
+@benchmark("e2e_cuit_concurrente", "e2e")
+def bench_e2e_cuit_concurrente(escala, servidor):
+    """8 sesiones consultan a la vez el mismo CUIT con `escala` RENSPA"""
+    servidor.paginas = max(1, escala // ITEMS_POR_PAGINA)
+
+    def sesiones_simultaneas():
+        with ThreadPoolExecutor(max_workers=SESIONES_CONCURRENTES) as pool:
+            list(pool.map(procesar_cuit, ["30-65425756-2"] * SESIONES_CONCURRENTES))
+    return en_frio(sesiones_simultaneas)
+
+
+@benchmark("e2e_cuit_precalentado", "e2e")
+def bench_e2e_cuit_precalentado(escala, servidor):
+    """Consulta de un CUIT de la lista de seguimiento ya precalentado, con sus archivos de descarga"""
+    servidor.paginas = max(1, escala // ITEMS_POR_PAGINA)
+    cuit = "30-65425756-2"
+    en_frio(lambda: precalentamiento.precalentar([cuit]))()
+
+    def consultar():
+        resultado = precalentamiento.precalentado(cuit)
+        return resultado.procesamiento.poligonos, resultado.archivos
+    return consultar
+
+
+@benchmark("e2e_cuit_incremental", "e2e")
+def bench_e2e_cuit_incremental(escala, servidor):
+    """Re-consulta incremental de un CUIT con 2% de RENSPA modificados"""
+    servidor.paginas = max(1, escala // ITEMS_POR_PAGINA)
+    incremental.DIRECTORIO_SNAPSHOTS = tempfile.mkdtemp(prefix="bench_snapshots_")
+    cuit = "30-65425756-2"
+
+    # Consulta inicial que deja el snapshot guardado
+    servidor.version, servidor.fraccion_modificados = 0, 0.0
+    en_frio(lambda: procesar_cuit(cuit, modo_incremental=True))()
+
+    def ejecutar_refresco():
+        servidor.version += 1
+        servidor.fraccion_modificados = 0.02
+        procesar_cuit(cuit, modo_incremental=True)
+
+    servidor.reiniciar_contadores()
+    return en_frio(ejecutar_refresco)
+
+
+@benchmark("e2e_lista_renspa", "e2e")
+def bench_e2e_lista_renspa(escala, servidor):
+    """Lista de `escala` RENSPA consultados uno por uno"""
+    renspa_list = [f"01001{i:08d}" for i in range(escala)]
+    return en_frio(lambda: procesar_lista_renspa(renspa_list))
+
+
+@benchmark("e2e_rastreo", "e2e")
+def bench_e2e_rastreo(escala, servidor):
+    """Rastreo por shards de escala/10 CUITs (10 RENSPA cada uno) con 2 procesos trabajadores"""
+    servidor.paginas = 1
+    cuits = generar_cuits(max(1, escala // ITEMS_POR_PAGINA))
+    # Mismo ritmo global que una sesión; sin pausa configurada, sin límite efectivo
+    limite = 1 / senasa.TIEMPO_ESPERA if senasa.TIEMPO_ESPERA else float("inf")
+
+    def rastrear():
+        directorio = tempfile.mkdtemp(prefix="bench_rastreo_")
+        rastreo.ejecutar(directorio, cuits, procesos=PROCESOS_RASTREO, tamano_shard=max(1, len(cuits) // 8),
+                         exportar=False, limite=limite, api_url=servidor.url)
+        shutil.rmtree(directorio, ignore_errors=True)
+    return rastrear
+
+
+@benchmark("extraer_coordenadas", "micro")
+def bench_extraer_coordenadas(escala, servidor):
+    poligonos = [p['poligono'] for p in generar_poligonos(escala)]
+    return lambda: [extraer_coordenadas(p) for p in poligonos]
+
+
+@benchmark("generar_kml", "micro")
+def bench_generar_kml(escala, servidor):
+    poligonos = generar_poligonos(escala)
+    return lambda: generar_kmz(generar_kml(poligonos, "Benchmark", "Benchmark"))
+
+
+@benchmark("generar_geojson", "micro")
+def bench_generar_geojson(escala, servidor):
+    poligonos = generar_poligonos(escala)
+    return lambda: generar_geojson(poligonos)
+
+
+@benchmark("ingesta_cuit", "micro")
+def bench_ingesta_cuit(escala, servidor):
+    """Carga de un TXT de `escala` CUITs con 1% de entradas inválidas"""
+    rng = random.Random(0)
+    lineas = [f"{rng.randint(20, 34)}-{rng.randint(0, 99999999):08d}-{rng.randint(0, 9)}" for _ in range(escala)]
+    # Alrededor del 90% tendrá dígito verificador incorrecto: se mide también el rechazo vectorizado
+    for i in range(0, escala, 100):
+        lineas[i] = "invalido"
+    contenido = "\n".join(lineas).encode("utf-8")
+    return lambda: ingerir_archivo(BytesIO(contenido), 'cuit', nombre="cuits.txt")
+
+
+def con_detalles(funcion, **detalles):
+    """Adjunta a un benchmark datos que se informan junto a sus tiempos (por ejemplo, tamaños)"""
+    funcion.detalles = detalles
+    return funcion
+
+
+@benchmark("geometria_json", "micro")
+def bench_geometria_json(escala, servidor):
+    """Lectura de polígonos guardados como listas JSON (formato anterior de snapshots)"""
+    datos = json.dumps([p['coords'] for p in generar_poligonos(escala)])
+    return con_detalles(lambda: geometria.empaquetar(json.loads(datos)), bytes=len(datos))
+
+
+def _bench_geometria_codificada(escala, compresion):
+    vertices, offsets = geometria.empaquetar([p['coords'] for p in generar_poligonos(escala)])
+    datos = geometria.codificar_geometrias(vertices, offsets, compresion)
+    return con_detalles(lambda: geometria.decodificar_geometrias(datos), bytes=len(datos))
+
+
+@benchmark("geometria_codificada", "micro")
+def bench_geometria_codificada(escala, servidor):
+    """Lectura de polígonos cuantizados, en diferencias y varint"""
+    return _bench_geometria_codificada(escala, 'varint')
+
+
+@benchmark("geometria_codificada_zlib", "micro")
+def bench_geometria_codificada_zlib(escala, servidor):
+    """Lectura de polígonos cuantizados, en diferencias, varint y zlib (formato de los snapshots)"""
+    return _bench_geometria_codificada(escala, 'zlib')
+
+
+@benchmark("estadisticas", "micro")
+def bench_estadisticas(escala, servidor):
+    """Agregados de `escala` RENSPA repartidos en escala/100 CUITs (sin caché)"""
+    rng = random.Random(0)
+    df = pd.DataFrame({
+        'renspa': [f"{rng.randint(1, 24):02d}.001.0.{i % 100000:05d}/{i % 100:02d}" for i in range(escala)],
+        'cuit': [f"30-{i % max(escala // 100, 1):08d}-1" for i in range(escala)],
+        'localidad': [f"Localidad {rng.randint(0, 500)}" for _ in range(escala)],
+        'superficie': [round(rng.uniform(10, 1000), 2) for _ in range(escala)],
+        'fecha_baja': [("2020-01-01" if rng.random() < 0.3 else None) for _ in range(escala)],
+    })
+    return lambda: calcular_estadisticas(df)
+
+
+def generar_registros(escala, semilla=0):
+    """Registros de RENSPA sintéticos como los de Procesamiento: ~30 por CUIT y 500 localidades"""
+    rng = random.Random(semilla)
+    cuits = generar_cuits(max(escala // 30, 1))
+    registros = []
+    for i in range(escala):
+        indice = rng.randrange(len(cuits))
+        registros.append({
+            'renspa': f"{rng.randint(1, 24):02d}.001.0.{i % 100000:05d}/{i % 100:02d}",
+            'titular': f"Titular {indice}",
+            'localidad': f"Localidad {rng.randint(0, 500)}",
+            'cuit': cuits[indice],
+            'superficie': round(rng.uniform(10, 1000), 2),
+            'fecha_baja': "2020-01-01" if rng.random() < 0.2 else None,
+        })
+    return registros
+
+
+def _operaciones_dataframe(df):
+    """Filtro de activos de una localidad y superficie por CUIT y localidad"""
+    activos = df[df['fecha_baja'].isna() & (df['localidad'] == "Localidad 7")]
+    return len(activos), df.groupby(['cuit', 'localidad'], observed=True, sort=False)['superficie'].sum()
+
+
+def _bench_dataframe(escala, construir):
+    df = construir(generar_registros(escala))
+    return con_detalles(lambda: _operaciones_dataframe(df), bytes=int(df.memory_usage(deep=True).sum()))
+
+
+@benchmark("dataframe_objeto", "micro")
+def bench_dataframe_objeto(escala, servidor):
+    """Filtro y groupby sobre el DataFrame con columnas object (construcción anterior)"""
+    return _bench_dataframe(escala, pd.DataFrame)
+
+
+@benchmark("dataframe_tipado", "micro")
+def bench_dataframe_tipado(escala, servidor):
+    """Filtro y groupby sobre el DataFrame con el esquema tipado de esquema.py"""
+    return _bench_dataframe(escala, dataframe_renspa)
+
+
+# Consultas de los benchmarks de búsqueda: selectivas, poco selectivas, por columna y sin resultados
+CONSULTAS_BUSQUEDA = ["titular 12", "localidad 45", "001.0.0001", "localidad:7 ti", "sin coincidencias"]
+
+
+@benchmark("busqueda_indice", "micro")
+def bench_busqueda_indice(escala, servidor):
+    """Construcción del índice de búsqueda de `escala` RENSPA"""
+    df = dataframe_renspa(generar_registros(escala))
+    return lambda: IndiceBusqueda(df)
+
+
+@benchmark("busqueda_consultas", "micro")
+def bench_busqueda_consultas(escala, servidor):
+    """Las consultas de CONSULTAS_BUSQUEDA con el índice (una vez construido)"""
+    indice = IndiceBusqueda(dataframe_renspa(generar_registros(escala)))
+    return con_detalles(lambda: [indice.buscar(consulta) for consulta in CONSULTAS_BUSQUEDA],
+                        consultas=len(CONSULTAS_BUSQUEDA))
+
+
+@benchmark("busqueda_lineal", "micro")
+def bench_busqueda_lineal(escala, servidor):
+    """Las consultas de CONSULTAS_BUSQUEDA recorriendo las columnas con str.contains en cada una"""
+    df = dataframe_renspa(generar_registros(escala))
+    columnas = [df[columna].astype(str) for columna in COLUMNAS_BUSQUEDA]
+
+    def buscar(consulta):
+        coincidencias = np.ones(len(df), dtype=bool)
+        for palabra in consulta.replace(":", " ").split():
+            en_filas = np.zeros(len(df), dtype=bool)
+            for columna in columnas:
+                en_filas |= columna.str.contains(palabra, case=False, regex=False).to_numpy()
+            coincidencias &= en_filas
+        return coincidencias
+
+    return con_detalles(lambda: [buscar(consulta) for consulta in CONSULTAS_BUSQUEDA],
+                        consultas=len(CONSULTAS_BUSQUEDA))
+
+
+def generar_raster_clases(directorio, nombre="clases.npy", semilla=0):
+    """Mapa de clases sintético de 5000x5000 píxeles (~100 m) que cubre los polígonos de generar_poligonos"""
+    rng = np.random.default_rng(semilla)
+    ruta = os.path.join(directorio, nombre)
+    guardar_raster_npy(ruta, rng.integers(1, 6, (5000, 5000), dtype=np.uint8),
+                       (-63.0, 0.001, 0.0, -32.0, 0.0, -0.001), nodata=0)
+    return ruta
+
+
+def sin_mascaras(funcion):
+    """Envuelve un benchmark para que cada ejecución rasterice los polígonos (sin máscaras en caché ni en disco)"""
+    def ejecutar_sin_mascaras():
+        raster.cache_mascaras.limpiar()
+        raster._grillas_cargadas.clear()
+        raster.DIRECTORIO_MASCARAS = tempfile.mkdtemp(prefix="bench_mascaras_")
+        return funcion()
+    return ejecutar_sin_mascaras
+
+
+@benchmark("zonales_raster", "micro")
+def bench_zonales_raster(escala, servidor):
+    """Clase mayoritaria de `escala` polígonos sobre un raster local con memoria mapeada"""
+    poligonos = generar_poligonos(escala)
+    ruta = generar_raster_clases(tempfile.mkdtemp(prefix="bench_raster_"))
+    return sin_mascaras(lambda: estadisticas_zonales(poligonos, ruta))
+
+
+def generar_campanas(cantidad=CAMPANAS_RASTER):
+    """Un mapa de clases por campaña, todos con la misma grilla"""
+    directorio = tempfile.mkdtemp(prefix="bench_campanas_")
+    return {f"{2019 + i}-{2020 + i}": generar_raster_clases(directorio, f"{2019 + i}-{2020 + i}.npy", semilla=i)
+            for i in range(cantidad)}
+
+
+@benchmark("zonales_campanas", "micro")
+def bench_zonales_campanas(escala, servidor):
+    """Clase mayoritaria de `escala` polígonos en 5 campañas, rasterizando los polígonos"""
+    poligonos = generar_poligonos(escala)
+    rasters = generar_campanas()
+    return sin_mascaras(lambda: analizar_campanas(poligonos, rasters))
+
+
+@benchmark("zonales_campanas_cacheado", "micro")
+def bench_zonales_campanas_cacheado(escala, servidor):
+    """Igual que zonales_campanas, con las máscaras de los polígonos ya en caché"""
+    poligonos = generar_poligonos(escala)
+    rasters = generar_campanas()
+    raster.DIRECTORIO_MASCARAS = tempfile.mkdtemp(prefix="bench_mascaras_")
+    analizar_campanas(poligonos, rasters)
+    return lambda: analizar_campanas(poligonos, rasters)
+
+
+@benchmark("geometria_parsear", "geometria")
+def bench_geometria_parsear(escala, servidor, procesos):
+    poligonos = [p['poligono'] for p in generar_poligonos(escala)]
+    return lambda: geometria.parsear_poligonos(poligonos, procesos=procesos)
+
+
+@benchmark("geometria_superficie", "geometria")
+def bench_geometria_superficie(escala, servidor, procesos):
+    vertices, offsets = geometria.empaquetar([p['coords'] for p in generar_poligonos(escala)])
+    return lambda: geometria.calcular_superficies(vertices, offsets, procesos=procesos)
+
+
+@benchmark("geometria_simplificar", "geometria")
+def bench_geometria_simplificar(escala, servidor, procesos):
+    vertices, offsets = geometria.empaquetar([p['coords'] for p in generar_poligonos(escala)])
+    return lambda: geometria.simplificar(vertices, offsets, tolerancia_m=5.0, procesos=procesos)
+
+
+@benchmark("geometria_geojson", "geometria")
+def bench_geometria_geojson(escala, servidor, procesos):
+    poligonos = generar_poligonos(escala)
+    return lambda: generar_geojson(poligonos, procesos=procesos)
+
+
+@benchmark("geometria_kml", "geometria")
+def bench_geometria_kml(escala, servidor, procesos):
+    poligonos = generar_poligonos(escala)
+    return lambda: generar_kml(poligonos, "Benchmark", "Benchmark", procesos=procesos)
+
+
+@benchmark("geometria_paquete", "geometria")
+def bench_geometria_paquete(escala, servidor, procesos):
+    """Paquete ZIP con KMZ, GeoJSON y CSV por CUIT (escala/40 CUITs)"""
+    poligonos = [{**pol, 'cuit': f"30-{i % max(1, escala // 40):08d}-1"} for i, pol in enumerate(generar_poligonos(escala))]
+    df_renspa = pd.DataFrame([{k: v for k, v in pol.items() if k != 'coords'} for pol in poligonos])
+    return lambda: escribir_paquete(BytesIO(), df_renspa, poligonos, 'cuit', incluir_cuit=True, procesos=procesos)
+
+
+@benchmark("crear_mapa", "micro")
+def bench_crear_mapa(escala, servidor):
+    if not folium_disponible:
+        return None
+    poligonos = generar_poligonos(escala)
+    # Incluye la serialización a HTML que realiza folium_static
+    return lambda: crear_mapa_mejorado(poligonos).get_root().render()
+
+
+@benchmark("mapa_html_cacheado", "micro")
+def bench_mapa_html_cacheado(escala, servidor):
+    if not folium_disponible:
+        return None
+    poligonos = generar_poligonos(escala)
+    cache_mapas.limpiar()
+    mapa_html(poligonos)
+    # Rerun con el mismo conjunto: solo se calcula la huella y se lee la caché
+    return lambda: mapa_html(poligonos)
+
+
+def _commit_actual():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _medir_resultado(nombre, grupo, escala, preparado, repeticiones, servidor, procesos=None):
+    # Las escalas grandes se miden una sola vez para acotar la duración
+    reps = repeticiones if escala <= 1000 else 1
+    tiempos = medir(preparado, reps)
+    resultado = {
+        'benchmark': nombre,
+        'grupo': grupo,
+        'escala': escala,
+        'repeticiones': reps,
+        'min_s': min(tiempos),
+        'mediana_s': statistics.median(tiempos),
+        'media_s': statistics.fmean(tiempos),
+        'max_s': max(tiempos),
+        'items_por_s': escala / statistics.median(tiempos) if statistics.median(tiempos) else None,
+    }
+    if procesos is not None:
+        resultado['procesos'] = procesos
+    resultado.update(getattr(preparado, 'detalles', {}))
+    if grupo == 'e2e':
+        resultado['peticiones_http_por_ejecucion'] = {
+            endpoint: cantidad / reps for endpoint, cantidad in servidor.contador_peticiones.items()
+        }
+    sufijo = f" procesos={procesos}" if procesos is not None else ""
+    if 'bytes' in resultado:
+        sufijo += f" bytes={resultado['bytes']}"
+    print(f"{nombre:<24} escala={escala:<7} mediana={resultado['mediana_s']:.4f}s{sufijo}", file=sys.stderr)
+    return resultado
+
+
+def ejecutar(escalas, grupos, nombres, repeticiones, servidor, lista_procesos=(1,)):
+    """Ejecuta los benchmarks seleccionados y devuelve la lista de resultados"""
+    resultados = []
+    for nombre, (grupo, funcion) in BENCHMARKS.items():
+        if grupos and grupo not in grupos:
+            continue
+        if nombres and nombre not in nombres:
+            continue
+        for escala in escalas:
+            if grupo == 'geometria':
+                # Escalado de 1 a N procesos sobre los mismos datos
+                for procesos in lista_procesos:
+                    preparado = funcion(escala, servidor, procesos)
+                    # Una ejecución previa arranca el pool para no medir su creación
+                    preparado()
+                    resultados.append(_medir_resultado(nombre, grupo, escala, preparado, repeticiones,
+                                                       servidor, procesos))
+                continue
+
+            servidor.reiniciar_contadores()
+            preparado = funcion(escala, servidor)
+            if preparado is None:
+                continue
+            resultados.append(_medir_resultado(nombre, grupo, escala, preparado, repeticiones, servidor))
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la aplicación RENSPA")
+    parser.add_argument("--escalas", default=",".join(str(e) for e in ESCALAS_PREDETERMINADAS),
+                        help="Escalas separadas por coma (default: 10,1000,50000)")
+    parser.add_argument("--solo", action="append", choices=["e2e", "micro", "geometria"],
+                        help="Ejecutar solo un grupo de benchmarks")
+    parser.add_argument("--benchmark", action="append", help="Ejecutar solo el benchmark indicado")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--procesos", default=f"1,{os.cpu_count() or 1}",
+                        help="Cantidades de procesos para los benchmarks de geometría (default: 1,<núcleos>)")
+    parser.add_argument("--latencia", type=float, default=0.0, help="Latencia simulada de SENASA (s)")
+    parser.add_argument("--vertices", type=int, default=20, help="Vértices por polígono simulado")
+    parser.add_argument("--tasa-error", type=float, default=0.0, help="Tasa de errores HTTP 500 simulados")
+    parser.add_argument("--tiempo-espera", type=float, default=0.0,
+                        help="Valor de TIEMPO_ESPERA durante los benchmarks")
+    parser.add_argument("--salida", help="Archivo JSON de salida (por defecto stdout)")
+    parser.add_argument("--metricas", help="Archivo donde escribir las métricas (formato Prometheus) al terminar")
+    args = parser.parse_args(argv)
+
+    # Los errores de la API se reportan con st.error; fuera de Streamlit solo generan ruido
+    logging.getLogger("streamlit").setLevel(logging.CRITICAL)
+
+    escalas = [int(e) for e in args.escalas.split(",") if e]
+
+    with ServidorSenasaSimulado(latencia=args.latencia, vertices=args.vertices,
+                                tasa_error=args.tasa_error) as servidor:
+        senasa.API_BASE_URL = servidor.url
+        senasa.TIEMPO_ESPERA = args.tiempo_espera
+        senasa.ESPERA_REINTENTO = args.tiempo_espera
+        validacion.ARCHIVO_DESCONOCIDOS = os.path.join(tempfile.mkdtemp(prefix="bench_"), "desconocidos.json")
+        # Los procesos del rastreo leen la configuración del entorno
+        os.environ["RENSPA_DESCONOCIDOS"] = validacion.ARCHIVO_DESCONOCIDOS
+        lista_procesos = sorted({int(p) for p in args.procesos.split(",") if p})
+        resultados = ejecutar(escalas, args.solo, args.benchmark, args.repeticiones, servidor, lista_procesos)
+
+    informe = {
+        'fecha': datetime.now(timezone.utc).isoformat(),
+        'commit': _commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'configuracion': vars(args),
+        'resultados': resultados,
+    }
+    if args.metricas:
+        metricas.escribir_archivo(args.metricas)
+
+    salida = json.dumps(informe, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(salida)
+    else:
+        print(salida)
+
+
+if __name__ == "__main__":
+    main()
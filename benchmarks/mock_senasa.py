@@ -0,0 +1,276 @@
+"""
+Servidor HTTP local que simula la API de RENSPA de SENASA
+
+Implementa los endpoints consultaPorCuit (paginado de a 10) y consultaPorNumero
+con latencia, profundidad de paginación, tamaño de polígono, tasa de error y
+límite de peticiones por segundo configurables. Se usa para benchmarks y
+pruebas sin tocar el servicio real.
+"""
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from validacion import cuit_valido
+
+ITEMS_POR_PAGINA = 10
+
+
+def _semilla(*partes):
+    """Deriva una semilla determinística a partir de las partes dadas"""
+    texto = "|".join(str(p) for p in partes)
+    return int(hashlib.md5(texto.encode('utf-8')).hexdigest()[:12], 16)
+
+
+def generar_poligono(rng, vertices, lat_base=-34.6, lon_base=-60.5):
+    """
+    Genera un polígono en el formato de texto de SENASA: (lat,lon),(lat,lon),...
+
+    Args:
+        rng: Instancia de random.Random
+        vertices: Cantidad de vértices del polígono
+    """
+    lat_c = lat_base + rng.uniform(-2, 2)
+    lon_c = lon_base + rng.uniform(-2, 2)
+    radio = rng.uniform(0.002, 0.02)
+    pares = []
+    for i in range(vertices):
+        angulo = 2 * math.pi * i / vertices
+        r = radio * rng.uniform(0.8, 1.2)
+        pares.append(f"({lat_c + r * math.sin(angulo):.10f},{lon_c + r * math.cos(angulo):.10f})")
+    return ",".join(pares)
+
+
+def generar_cuits(cantidad):
+    """Genera CUITs distintos con dígito verificador correcto"""
+    cuits, numero = [], 0
+    while len(cuits) < cantidad:
+        cuit = f"30-{numero:08d}-"
+        numero += 1
+        for digito in range(10):
+            if cuit_valido(f"{cuit}{digito}"):
+                cuits.append(f"{cuit}{digito}")
+                break
+    return cuits
+
+
+def generar_renspa(cuit, indice):
+    """RENSPA número `indice` del listado simulado de un CUIT"""
+    semilla = _semilla(cuit, indice)
+    # Provincia 01-24 y departamento distinto de 000, como en los RENSPA reales
+    provincia = 1 + semilla % 24
+    departamento = 1 + (semilla // 24) % 999
+    resto = f"{(semilla // 24000) % 10 ** 8:08d}"
+    return f"{provincia:02d}.{departamento:03d}.{resto[0]}.{resto[1:6]}/{resto[6:8]}"
+
+
+class ServidorSenasaSimulado:
+    """
+    Servidor simulado de SENASA, utilizable como context manager
+
+    Args:
+        latencia: Segundos de demora por respuesta
+        paginas: Cantidad de páginas de consultaPorCuit por CUIT
+        vertices: Cantidad de vértices por polígono
+        tasa_error: Probabilidad (0-1) de responder HTTP 500
+        fraccion_lentas: Probabilidad (0-1) de que una respuesta se demore latencia_lenta
+        latencia_lenta: Segundos de demora de las respuestas lentas (latencia de cola)
+        fraccion_con_poligono: Fracción de RENSPA cuyo listado ya incluye el polígono
+        fraccion_inactivos: Fracción de RENSPA con fecha_baja
+        limite: Peticiones por segundo admitidas; las que lo exceden reciben
+            un 429 con Retry-After (None para no limitar)
+        puerto: Puerto local (0 para elegir uno libre)
+    """
+
+    def __init__(self, latencia=0.0, paginas=3, vertices=20, tasa_error=0.0,
+                 fraccion_con_poligono=0.5, fraccion_inactivos=0.2, puerto=0,
+                 fraccion_lentas=0.0, latencia_lenta=5.0, limite=None):
+        self.latencia = latencia
+        self.fraccion_lentas = fraccion_lentas
+        self.latencia_lenta = latencia_lenta
+        self.paginas = paginas
+        self.vertices = vertices
+        self.tasa_error = tasa_error
+        self.fraccion_con_poligono = fraccion_con_poligono
+        self.fraccion_inactivos = fraccion_inactivos
+        self.limite = limite
+        self.puerto = puerto
+        # Versión de los datos: al incrementarla cambian los RENSPA marcados como modificados
+        self.version = 0
+        self.fraccion_modificados = 0.0
+        self.contador_peticiones = {'consultaPorCuit': 0, 'consultaPorNumero': 0}
+        self.respuestas_429 = 0
+        self._lock = threading.Lock()
+        # Ventana de un segundo del límite de peticiones: (inicio, peticiones)
+        self._ventana = (0.0, 0)
+        # Mapa RENSPA -> (cuit, índice) para responder consultaPorNumero
+        self._indices = {}
+        self._rng_errores = random.Random(0)
+        self._servidor = None
+        self._hilo = None
+
+    @property
+    def url(self):
+        """URL base a usar como API_BASE_URL"""
+        return f"http://127.0.0.1:{self._servidor.server_address[1]}"
+
+    def reiniciar_contadores(self):
+        with self._lock:
+            for clave in self.contador_peticiones:
+                self.contador_peticiones[clave] = 0
+            self.respuestas_429 = 0
+
+    def _limite_excedido(self):
+        """Cuenta la petición en la ventana del segundo actual (con el lock tomado)"""
+        if self.limite is None:
+            return False
+        ahora = time.monotonic()
+        inicio, peticiones = self._ventana
+        if ahora - inicio >= 1.0:
+            inicio, peticiones = ahora, 0
+        self._ventana = (inicio, peticiones + 1)
+        return peticiones >= self.limite
+
+    def _version_item(self, renspa):
+        """Versión efectiva del RENSPA según la fracción de modificados"""
+        if self.version and random.Random(_semilla(renspa, 'mod', self.version)).random() < self.fraccion_modificados:
+            return self.version
+        return 0
+
+    def _item(self, cuit, indice, incluir_poligono=None):
+        renspa = generar_renspa(cuit, indice)
+        version = self._version_item(renspa)
+        rng = random.Random(_semilla(renspa, version))
+        item = {
+            'renspa': renspa,
+            'titular': f"Titular {cuit}",
+            'localidad': f"Localidad {_semilla(renspa) % 50}",
+            'superficie': round(rng.uniform(10, 1000), 2),
+            'fecha_baja': "2020-01-01" if rng.random() < self.fraccion_inactivos else None,
+        }
+        if incluir_poligono is None:
+            incluir_poligono = rng.random() < self.fraccion_con_poligono
+        if incluir_poligono:
+            item['poligono'] = generar_poligono(rng, self.vertices)
+        return item
+
+    def _responder(self, handler):
+        parsed = urlparse(handler.path)
+        params = parse_qs(parsed.query)
+        endpoint = parsed.path.rstrip('/').rsplit('/', 1)[-1]
+
+        if endpoint not in self.contador_peticiones:
+            handler.send_error(404)
+            return
+
+        with self._lock:
+            self.contador_peticiones[endpoint] += 1
+            limitada = self._limite_excedido()
+            self.respuestas_429 += limitada
+            error = self._rng_errores.random() < self.tasa_error
+            lenta = self.fraccion_lentas and self._rng_errores.random() < self.fraccion_lentas
+
+        if limitada:
+            handler.send_response(429)
+            handler.send_header("Retry-After", "1")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        if self.latencia or lenta:
+            time.sleep(self.latencia_lenta if lenta else self.latencia)
+
+        if error:
+            handler.send_error(500, "Error simulado")
+            return
+
+        if endpoint == 'consultaPorCuit':
+            cuit = params.get('cuit', [''])[0]
+            offset = int(params.get('offset', ['0'])[0])
+            total = self.paginas * ITEMS_POR_PAGINA
+            indices = range(offset, min(offset + ITEMS_POR_PAGINA, total))
+            items = []
+            for i in indices:
+                item = self._item(cuit, i)
+                with self._lock:
+                    self._indices[item['renspa']] = (cuit, i)
+                items.append(item)
+            cuerpo = {'items': items, 'hasMore': offset + ITEMS_POR_PAGINA < total}
+        else:
+            numero = params.get('numero', [''])[0]
+            origen = self._indices.get(numero)
+            if origen is None:
+                # RENSPA desconocido: se genera uno sintético a partir del número
+                item = self._item(numero, 0, incluir_poligono=True)
+                item['renspa'] = numero
+            else:
+                item = self._item(*origen, incluir_poligono=True)
+            cuerpo = {'items': [item]}
+
+        datos = json.dumps(cuerpo).encode('utf-8')
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(datos)))
+        handler.end_headers()
+        handler.wfile.write(datos)
+
+    def iniciar(self):
+        servidor_simulado = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                servidor_simulado._responder(self)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(("127.0.0.1", self.puerto), _Handler)
+        self._servidor.daemon_threads = True
+        self._hilo = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._hilo.start()
+        return self
+
+    def detener(self):
+        if self._servidor:
+            self._servidor.shutdown()
+            self._servidor.server_close()
+            self._servidor = None
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.detener()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Servidor SENASA simulado")
+    parser.add_argument("--puerto", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.05)
+    parser.add_argument("--paginas", type=int, default=3)
+    parser.add_argument("--vertices", type=int, default=20)
+    parser.add_argument("--tasa-error", type=float, default=0.0)
+    parser.add_argument("--fraccion-lentas", type=float, default=0.0)
+    parser.add_argument("--latencia-lenta", type=float, default=5.0)
+    parser.add_argument("--limite", type=float, help="Peticiones por segundo admitidas")
+    args = parser.parse_args()
+
+    with ServidorSenasaSimulado(latencia=args.latencia, paginas=args.paginas, vertices=args.vertices,
+                                tasa_error=args.tasa_error, puerto=args.puerto,
+                                fraccion_lentas=args.fraccion_lentas,
+                                latencia_lenta=args.latencia_lenta, limite=args.limite) as servidor:
+        print(f"Servidor SENASA simulado en {servidor.url}")
+        print(f"Use: SENASA_API_URL={servidor.url} streamlit run app.py")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
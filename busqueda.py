@@ -0,0 +1,241 @@
+"""
+Búsqueda indexada sobre las tablas de RENSPA
+
+Filtrar miles de RENSPA con str.contains recorre todas las filas en cada
+consulta. Acá se arma, una vez por conjunto de datos, un índice sobre los
+valores distintos de titular, localidad, RENSPA y CUIT (las categóricas del
+esquema tipado ya los traen deduplicados):
+
+- los valores se normalizan (minúsculas, sin tildes ni signos de
+  puntuación), así "perez" encuentra "PÉREZ, JUAN" y "30-6542" o "306542"
+  encuentran el CUIT 30-65425756-2
+- un índice de trigramas resuelve las palabras de 3 o más caracteres, que se
+  buscan en cualquier parte del valor
+- un índice de prefijos resuelve las palabras de 1 o 2 caracteres, que se
+  buscan al comienzo de las palabras del valor
+
+Una consulta tiene una o más palabras y una fila coincide si coincide con
+todas. Cada palabra puede limitarse a una columna con "columna:palabra" (por
+ejemplo "localidad:pergamino").
+"""
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import metricas
+from cache import CacheLRU
+from estadisticas import huella_dataframe
+
+# Columnas indexadas, en el orden en que se buscan
+COLUMNAS_BUSQUEDA = ('titular', 'localidad', 'renspa', 'cuit')
+
+# Longitud mínima de una palabra para buscarla por trigramas (las más cortas se buscan como prefijo)
+LONGITUD_TRIGRAMA = 3
+# Si los candidatos de una palabra superan esta fracción de los valores de una columna, se
+# recorren los valores de la columna en lugar de intersecar publicaciones y verificar candidatos
+FRACCION_RECORRIDO = 0.25
+
+# Filas de la tabla filtrada y polígonos hasta los que el mapa muestra también los que no
+# coinciden (atenuados); con más polígonos, el mapa muestra solo los que coinciden
+MAX_FILAS_BUSQUEDA = 1000
+MAX_POLIGONOS_CONTEXTO = 2000
+
+_ESPACIO = ord(" ")
+
+# Índices ya construidos por huella de las columnas indexadas
+cache_indices = CacheLRU(max_entradas=8, max_bytes=512 * 1024 * 1024, tamano=lambda indice: indice.nbytes)
+metricas.registrar_cache("busqueda", cache_indices)
+
+_duracion_busqueda = metricas.histograma(
+    "busqueda_duracion_segundos", "Duración de la construcción del índice de búsqueda y de las consultas",
+    ("operacion",), buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+
+def normalizar(textos):
+    """
+    Normaliza un arreglo de Arrow de textos para la búsqueda: minúsculas, sin
+    tildes, solo letras, dígitos y un espacio entre palabras (queda en ASCII)
+    """
+    textos = pc.utf8_normalize(textos, "NFKD")
+    textos = pc.replace_substring_regex(textos, r"\p{Mn}", "")
+    textos = pc.utf8_lower(textos)
+    textos = pc.replace_substring_regex(textos, r"[^a-z0-9\s]", "")
+    textos = pc.replace_substring_regex(textos, r"\s+", " ")
+    return pc.utf8_trim_whitespace(textos)
+
+def _valores_distintos(serie):
+    """Códigos por fila (-1 para faltantes) y valores distintos de una columna, como texto"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos, valores = serie.cat.codes.to_numpy(), serie.cat.categories
+    else:
+        codigos, valores = serie.factorize()
+    return codigos, pa.array(pd.Index(valores).astype(str).to_numpy(dtype=object), type=pa.string())
+
+def _buffers(textos):
+    """Offsets (int64, desde 0) y bytes (uint8) de los valores de un arreglo de Arrow de textos"""
+    _, buffer_offsets, buffer_datos = textos.buffers()
+    offsets = np.frombuffer(buffer_offsets, dtype=np.int32)[textos.offset:textos.offset + len(textos) + 1]
+    offsets = offsets.astype(np.int64)
+    if buffer_datos is None:
+        return offsets - offsets[0], np.zeros(0, dtype=np.uint8)
+    datos = np.frombuffer(buffer_datos, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    return offsets - offsets[0], datos
+
+def _clave_prefijo(primero, segundo):
+    """Clave del índice de prefijos: primer byte y segundo byte + 1 (0 si la palabra tiene uno solo)"""
+    return (primero.astype(np.int32) << 9) | segundo.astype(np.int32)
+
+def _publicaciones(claves, valores):
+    """Claves distintas ordenadas, inicio de cada una y valores (ordenados y sin repetir dentro de cada clave)"""
+    pares = np.unique((claves.astype(np.int64) << 32) | valores)
+    claves = (pares >> 32).astype(np.int32)
+    distintas, inicios = np.unique(claves, return_index=True)
+    return distintas, np.append(inicios, len(pares)), (pares & 0xFFFFFFFF).astype(np.int32)
+
+class IndiceBusqueda:
+    """
+    Índice de trigramas y de prefijos sobre los valores distintos de las
+    columnas de búsqueda de un DataFrame de RENSPA
+
+    Los valores de todas las columnas se numeran juntos (cada columna ocupa
+    un rango de números) y cada fila guarda, por columna, el número de su
+    valor; una consulta resuelve primero los valores que coinciden y después
+    las filas que los tienen.
+    """
+
+    def __init__(self, df):
+        """
+        Args:
+            df: DataFrame de RENSPA (preferentemente con el esquema de esquema.py)
+        """
+        inicio = time.perf_counter()
+        self.filas = len(df)
+        self.columnas = [c for c in COLUMNAS_BUSQUEDA if c in df.columns]
+
+        # Valores distintos de cada columna, numerados en un único rango
+        self.rangos = {}
+        textos, codigos = [], {}
+        total = 0
+        for columna in self.columnas:
+            codigos_columna, valores = _valores_distintos(df[columna])
+            self.rangos[columna] = (total, total + len(valores))
+            codigos[columna] = codigos_columna.astype(np.int32) + total
+            textos.append(normalizar(valores))
+            total += len(valores)
+        self.valores = total
+        # Faltantes: un número extra que nunca coincide
+        for columna in self.columnas:
+            codigos[columna][codigos[columna] < self.rangos[columna][0]] = total
+        self.codigos = codigos
+        self.textos = pa.concat_arrays(textos) if textos else pa.array([], type=pa.string())
+
+        offsets, datos = _buffers(self.textos)
+        valor_por_byte = np.repeat(np.arange(total, dtype=np.int64), np.diff(offsets))
+        restantes = offsets[1:][valor_por_byte] - np.arange(len(datos))
+        # Dos espacios al final para mirar hasta dos bytes más adelante sin salirse del arreglo
+        es_espacio = np.append(datos == _ESPACIO, [True, True])
+        bytes_ = np.append(datos, [0, 0]).astype(np.int32)
+
+        # Trigramas: tres bytes consecutivos del mismo valor, sin espacios
+        validos = (restantes >= 3) & ~(es_espacio[:-2] | es_espacio[1:-1] | es_espacio[2:])
+        trigramas = (bytes_[:-2] << 16) | (bytes_[1:-1] << 8) | bytes_[2:]
+        self._trigramas, self._inicios_trigramas, self._valores_trigramas = _publicaciones(
+            trigramas[validos], valor_por_byte[validos])
+
+        # Prefijos: comienzo de cada palabra (primer byte del valor o byte que sigue a un espacio)
+        comienza = ~es_espacio[:-2]
+        comienza[1:] &= es_espacio[:-3] | (valor_por_byte[1:] != valor_por_byte[:-1])
+        segundo = np.where((restantes >= 2) & ~es_espacio[1:-1], bytes_[1:-1] + 1, 0)
+        self._prefijos, self._inicios_prefijos, self._valores_prefijos = _publicaciones(
+            _clave_prefijo(bytes_[:-2][comienza], segundo[comienza]), valor_por_byte[comienza])
+
+        self.nbytes = (self.textos.nbytes + sum(c.nbytes for c in self.codigos.values())
+                       + sum(a.nbytes for a in (self._trigramas, self._inicios_trigramas, self._valores_trigramas,
+                                                self._prefijos, self._inicios_prefijos, self._valores_prefijos)))
+        _duracion_busqueda.observar(time.perf_counter() - inicio, operacion="construir")
+
+    def _publicacion(self, claves, inicios, valores, clave):
+        posicion = np.searchsorted(claves, clave)
+        if posicion == len(claves) or claves[posicion] != clave:
+            return valores[:0]
+        return valores[inicios[posicion]:inicios[posicion + 1]]
+
+    def _valores_palabra(self, palabra, rango):
+        """Números de los valores (dentro del rango) que contienen la palabra normalizada"""
+        datos = np.frombuffer(palabra.encode("ascii"), dtype=np.uint8).astype(np.int32)
+        if len(datos) < LONGITUD_TRIGRAMA:
+            if len(datos) == 1:
+                # Todas las claves con ese primer byte
+                desde, hasta = np.searchsorted(self._prefijos, [datos[0] << 9, (datos[0] + 1) << 9])
+                candidatos = self._valores_prefijos[self._inicios_prefijos[desde]:self._inicios_prefijos[hasta]]
+            else:
+                candidatos = self._publicacion(self._prefijos, self._inicios_prefijos, self._valores_prefijos,
+                                               _clave_prefijo(datos[:1], datos[1:] + 1)[0])
+            return candidatos[(candidatos >= rango[0]) & (candidatos < rango[1])]
+
+        claves = np.unique((datos[:-2] << 16) | (datos[1:-1] << 8) | datos[2:])
+        publicaciones = sorted((self._publicacion(self._trigramas, self._inicios_trigramas,
+                                                  self._valores_trigramas, clave) for clave in claves), key=len)
+        # Intersección empezando por la publicación más corta (todas están ordenadas)
+        candidatos = publicaciones[0]
+        desde, hasta = np.searchsorted(candidatos, rango)
+        candidatos = candidatos[desde:hasta]
+        if len(datos) > LONGITUD_TRIGRAMA and len(candidatos) > (rango[1] - rango[0]) * FRACCION_RECORRIDO:
+            # Palabra poco selectiva: recorrer la columna cuesta menos que intersecar y verificar
+            coinciden = pc.match_substring(self.textos.slice(rango[0], rango[1] - rango[0]), palabra)
+            return np.flatnonzero(coinciden.to_numpy(zero_copy_only=False)).astype(np.int32) + rango[0]
+        for publicacion in publicaciones[1:]:
+            if not len(candidatos):
+                break
+            posiciones = np.minimum(np.searchsorted(publicacion, candidatos), len(publicacion) - 1)
+            candidatos = candidatos[publicacion[posiciones] == candidatos]
+        if len(datos) > LONGITUD_TRIGRAMA and len(candidatos):
+            # Tener todos los trigramas no garantiza tener la palabra: verificarla
+            candidatos = candidatos[pc.match_substring(self.textos.take(candidatos), palabra)
+                                    .to_numpy(zero_copy_only=False)]
+        return candidatos
+
+    def buscar(self, consulta):
+        """
+        Filas que coinciden con la consulta
+
+        Args:
+            consulta: Texto con una o más palabras ("columna:palabra" limita la
+                palabra a esa columna; con otra columna, se busca el término completo)
+
+        Returns:
+            Arreglo booleano con una posición por fila del DataFrame (todas
+            True si la consulta no tiene palabras)
+        """
+        inicio = time.perf_counter()
+        coincidencias = np.ones(self.filas, dtype=bool)
+        for termino in consulta.split():
+            columna, _, palabra = termino.partition(":")
+            if columna.lower() in self.rangos:
+                columnas = [columna.lower()]
+            else:
+                columnas, palabra = self.columnas, termino
+            for palabra in normalizar(pa.array([palabra])).to_pylist()[0].split():
+                en_filas = np.zeros(self.filas, dtype=bool)
+                for nombre in columnas:
+                    valores = self._valores_palabra(palabra, self.rangos[nombre])
+                    if not len(valores):
+                        continue
+                    en_valores = np.zeros(self.valores + 1, dtype=bool)
+                    en_valores[valores] = True
+                    en_filas |= np.take(en_valores, self.codigos[nombre])
+                coincidencias &= en_filas
+        _duracion_busqueda.observar(time.perf_counter() - inicio, operacion="consultar")
+        return coincidencias
+
+def indice_cacheado(df):
+    """Índice de búsqueda del DataFrame, reutilizado si el mismo conjunto de datos ya se indexó"""
+    clave = huella_dataframe(df, COLUMNAS_BUSQUEDA)
+    indice = cache_indices.obtener(clave)
+    if indice is None:
+        indice = IndiceBusqueda(df)
+        cache_indices.guardar(clave, indice)
+    return indice
@@ -0,0 +1,344 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+# Marcador de "sin valor" (None puede ser un valor cacheado válido)
+_FALTANTE = object()
+
+# Al pasarse del límite, CacheDisco descarta hasta quedar en esta fracción (para no recorrer el
+# directorio en cada escritura)
+FRACCION_RECORTE = 0.9
+
+class CacheLRU:
+    """
+    Caché en memoria, segura entre hilos, acotada por cantidad de entradas y
+    por tamaño total; al superar cualquiera de los límites descarta primero
+    las entradas usadas hace más tiempo. Opcionalmente las entradas vencen
+    después de un tiempo, general o propio de cada entrada.
+    """
+
+    def __init__(self, max_entradas=32, max_bytes=64 * 1024 * 1024, tamano=None, vigencia=None):
+        """
+        Args:
+            max_entradas: Cantidad máxima de entradas
+            max_bytes: Tamaño total máximo en bytes
+            tamano: Función que estima el tamaño de un valor (por defecto len
+                para str/bytes y sys.getsizeof para el resto)
+            vigencia: Segundos que dura cada entrada (None para no vencer)
+        """
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self.vigencia = vigencia
+        self._tamano = tamano or _tamano_predeterminado
+        self._entradas = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+
+    def obtener(self, clave, predeterminado=None, registrar=True):
+        """
+        Devuelve el valor de la clave y la marca como usada recientemente
+
+        Args:
+            registrar: Si la lectura se cuenta en aciertos/fallos
+        """
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and entrada[2] is not None and time.monotonic() > entrada[2]:
+                self._bytes -= self._entradas.pop(clave)[1]
+                entrada = None
+            if entrada is None:
+                self.fallos += registrar
+                return predeterminado
+            self._entradas.move_to_end(clave)
+            self.aciertos += registrar
+            return entrada[0]
+
+    def guardar(self, clave, valor, vigencia=None):
+        """
+        Guarda un valor; si no entra en el límite de tamaño no se guarda
+
+        Args:
+            vigencia: Segundos que dura esta entrada (por defecto, la vigencia de la caché)
+        """
+        tamano = self._tamano(valor)
+        if tamano > self.max_bytes:
+            return
+        vigencia = vigencia if vigencia is not None else self.vigencia
+        vence = time.monotonic() + vigencia if vigencia is not None else None
+        with self._lock:
+            if clave in self._entradas:
+                self._bytes -= self._entradas.pop(clave)[1]
+            self._entradas[clave] = (valor, tamano, vence)
+            self._bytes += tamano
+            while len(self._entradas) > self.max_entradas or self._bytes > self.max_bytes:
+                _, (_, tamano_descartado, _) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_descartado
+                self.descartes += 1
+
+    def limpiar(self):
+        with self._lock:
+            self._entradas.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        """Devuelve un diccionario con entradas, bytes, aciertos, fallos y descartes"""
+        with self._lock:
+            return {
+                'entradas': len(self._entradas),
+                'bytes': self._bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'descartes': self.descartes,
+            }
+
+    def __contains__(self, clave):
+        with self._lock:
+            return clave in self._entradas
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entradas)
+
+class CacheDisco:
+    """
+    Caché de bytes en disco, acotada por tamaño total; al superarlo descarta
+    primero los archivos usados hace más tiempo (cada lectura actualiza la
+    fecha de modificación del archivo). Varios procesos pueden compartir el
+    directorio: cada uno lleva su cuenta del tamaño y, al pasarse del límite,
+    la recalcula recorriendo el directorio antes de descartar.
+    """
+
+    def __init__(self, directorio, max_bytes=512 * 1024 * 1024):
+        """
+        Args:
+            directorio: Directorio de los archivos (se crea si no existe)
+            max_bytes: Tamaño total máximo en bytes
+        """
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.descartes = 0
+        os.makedirs(directorio, exist_ok=True)
+        self._entradas, self._bytes = self._recorrer(ordenar=False)[1:]
+
+    def _ruta(self, clave):
+        nombre = hashlib.sha1(repr(clave).encode('utf-8')).hexdigest()
+        return os.path.join(self.directorio, nombre[:2], nombre)
+
+    def _recorrer(self, ordenar=True):
+        """Devuelve (archivos (fecha, tamaño, ruta), cantidad, bytes), del más viejo al más nuevo"""
+        archivos = []
+        for raiz, _, nombres in os.walk(self.directorio):
+            for nombre in nombres:
+                if nombre.endswith(".tmp"):
+                    continue
+                ruta = os.path.join(raiz, nombre)
+                try:
+                    estado = os.stat(ruta)
+                except FileNotFoundError:
+                    continue
+                archivos.append((estado.st_mtime, estado.st_size, ruta))
+        if ordenar:
+            archivos.sort()
+        return archivos, len(archivos), sum(tamano for _, tamano, _ in archivos)
+
+    def obtener(self, clave, predeterminado=None, registrar=True):
+        """
+        Devuelve los bytes de la clave y la marca como usada recientemente
+
+        Args:
+            registrar: Si la lectura se cuenta en aciertos/fallos
+        """
+        ruta = self._ruta(clave)
+        try:
+            with open(ruta, "rb") as f:
+                valor = f.read()
+            os.utime(ruta)
+        except FileNotFoundError:
+            if registrar:
+                with self._lock:
+                    self.fallos += 1
+            return predeterminado
+        if registrar:
+            with self._lock:
+                self.aciertos += 1
+        return valor
+
+    def guardar(self, clave, valor, vigencia=None):
+        """
+        Guarda bytes (escritura atómica); si no entran en el límite de tamaño no se guardan
+
+        Args:
+            vigencia: Se acepta por compatibilidad con CacheLRU (las entradas en
+                disco no vencen; solo se descartan por tamaño)
+        """
+        if len(valor) > self.max_bytes:
+            return
+        ruta = self._ruta(clave)
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        try:
+            anterior = os.path.getsize(ruta)
+        except FileNotFoundError:
+            anterior = None
+        descriptor, temporal = tempfile.mkstemp(suffix=".tmp", dir=os.path.dirname(ruta))
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(valor)
+        os.replace(temporal, ruta)
+
+        with self._lock:
+            self._entradas += anterior is None
+            self._bytes += len(valor) - (anterior or 0)
+            if self._bytes > self.max_bytes:
+                self._recortar()
+
+    def _recortar(self):
+        """Descarta los archivos más viejos hasta quedar por debajo del límite (con el lock tomado)"""
+        archivos, self._entradas, self._bytes = self._recorrer()
+        for _, tamano, ruta in archivos:
+            if self._bytes <= self.max_bytes * FRACCION_RECORTE:
+                break
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            self._entradas -= 1
+            self._bytes -= tamano
+            self.descartes += 1
+
+    def limpiar(self):
+        with self._lock:
+            for _, _, ruta in self._recorrer(ordenar=False)[0]:
+                try:
+                    os.remove(ruta)
+                except FileNotFoundError:
+                    pass
+            self._entradas = 0
+            self._bytes = 0
+
+    def estadisticas(self):
+        """Devuelve un diccionario con entradas, bytes, aciertos, fallos y descartes"""
+        with self._lock:
+            return {
+                'entradas': self._entradas,
+                'bytes': self._bytes,
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'descartes': self.descartes,
+            }
+
+    def __contains__(self, clave):
+        return os.path.exists(self._ruta(clave))
+
+    def __len__(self):
+        with self._lock:
+            return self._entradas
+
+class _Vuelo:
+    """Llamada en curso de CacheCompartida, esperada por los demás interesados"""
+
+    def __init__(self):
+        self.terminado = threading.Event()
+        self.resultado = None
+        self.error = None
+
+class CacheCompartida:
+    """
+    Capa de consultas compartida por todos los hilos (y sesiones) del proceso,
+    con semántica single-flight: si varias llamadas piden la misma clave a la
+    vez, solo la primera ejecuta la consulta y las demás esperan y reciben su
+    resultado. Los resultados se guardan en una CacheLRU.
+    """
+
+    def __init__(self, cache):
+        """
+        Args:
+            cache: CacheLRU donde se guardan los resultados
+        """
+        self.cache = cache
+        self._en_vuelo = {}
+        self._lock = threading.Lock()
+        self.consultas = 0
+        self.coalescidas = 0
+
+    def obtener(self, clave, funcion, cachear=None, refrescar=False, vigencia=None):
+        """
+        Devuelve el resultado para la clave, de la caché, de una llamada en
+        curso o ejecutando funcion()
+
+        Args:
+            clave: Clave hasheable de la consulta
+            funcion: Función sin argumentos que realiza la consulta
+            cachear: Función (resultado) -> bool que indica si el resultado se
+                guarda en la caché (por ejemplo, no guardar errores). Los
+                resultados se comparten con las llamadas en espera siempre.
+            refrescar: Si se ignora el valor guardado y se vuelve a consultar
+                (las demás llamadas siguen usándolo mientras tanto)
+            vigencia: Segundos que dura el resultado guardado (por defecto, la
+                vigencia de la caché)
+
+        Returns:
+            El resultado de funcion(); si funcion() lanza una excepción, se
+            relanza en todas las llamadas que la esperaban
+        """
+        if not refrescar:
+            valor = self.cache.obtener(clave, _FALTANTE)
+            if valor is not _FALTANTE:
+                return valor
+
+        with self._lock:
+            vuelo = self._en_vuelo.get(clave)
+            lider = vuelo is None
+            if lider and not refrescar:
+                # Volver a mirar la caché: otra llamada pudo terminar mientras tanto
+                valor = self.cache.obtener(clave, _FALTANTE, registrar=False)
+                if valor is not _FALTANTE:
+                    return valor
+            if lider:
+                vuelo = self._en_vuelo[clave] = _Vuelo()
+                self.consultas += 1
+            else:
+                self.coalescidas += 1
+
+        if not lider:
+            vuelo.terminado.wait()
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.resultado
+
+        try:
+            vuelo.resultado = funcion()
+            if cachear is None or cachear(vuelo.resultado):
+                self.cache.guardar(clave, vuelo.resultado, vigencia)
+            return vuelo.resultado
+        except BaseException as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._en_vuelo[clave]
+            vuelo.terminado.set()
+
+    def limpiar(self):
+        self.cache.limpiar()
+
+    def estadisticas(self):
+        """Estadísticas de la caché más consultas ejecutadas, coalescidas y en curso"""
+        estadisticas = self.cache.estadisticas()
+        with self._lock:
+            en_vuelo = len(self._en_vuelo)
+        estadisticas.update({'consultas': self.consultas, 'coalescidas': self.coalescidas, 'en_vuelo': en_vuelo})
+        return estadisticas
+
+def _tamano_predeterminado(valor):
+    if isinstance(valor, (str, bytes, bytearray)):
+        return len(valor)
+    return sys.getsizeof(valor)
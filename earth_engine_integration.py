@@ -1,6 +1,23 @@
+import hashlib
+import json
+
 import streamlit as st
-import ee
-import geemap
+
+try:
+    import ee
+    import geemap
+    earth_engine_disponible = True
+except ImportError:
+    earth_engine_disponible = False
+
+from perfilado import perfilar_si_activo
+from raster import DIRECTORIO_RASTERS, analizar_campanas, descubrir_rasters
+from rotaciones import analizar_rotaciones, campos_de_poligonos, matriz_cultivos
+from teselas import id_capa, obtener_miniatura, precargar, registrar_capa, teselas_poligonos, url_teselas
+
+# Miniaturas por campo que se muestran debajo del mapa y su tamaño en píxeles
+MAX_MINIATURAS = 12
+TAMANO_MINIATURA = 256
 
 def inicializar_earth_engine():
     """Inicializa la API de Earth Engine si no está ya inicializada"""
@@ -11,37 +28,124 @@ def inicializar_earth_engine():
         st.error(f"Error al inicializar Earth Engine: {str(e)}")
         return False
 
-def crear_boton_analisis_cultivos(poligonos):
+def crear_boton_analisis_cultivos(poligonos, key=None):
     """
-    Crea un botón para analizar cultivos históricos usando Google Earth Engine
+    Crea un botón para analizar cultivos históricos con los rasters locales
+    o, si no hay, con Google Earth Engine
     
     Args:
         poligonos: Lista de diccionarios con información de polígonos
+        key: Clave del botón (necesaria si hay uno por pestaña)
+    """
+    if st.button("Analizar Cultivos Históricos", key=key):
+        with perfilar_si_activo("analisis_cultivos"):
+            _analizar_cultivos(poligonos)
+
+def _analizar_cultivos(poligonos):
+    """Análisis de cultivos de los polígonos con rasters locales o con Earth Engine"""
+    con_coords = [pol for pol in poligonos if 'coords' in pol]
+    
+    # Con un raster de clasificación por campaña en disco, el análisis se hace sin conexión
+    rasters = descubrir_rasters()
+    if rasters:
+        with st.spinner("Analizando cultivos con los rasters locales..."):
+            df_cultivos = analizar_campanas(con_coords, rasters)
+        st.subheader("Cultivo mayoritario por campaña")
+        st.dataframe(df_cultivos, hide_index=True)
+        mostrar_rotaciones(df_cultivos, con_coords)
+        return
+    
+    if not earth_engine_disponible:
+        st.warning("Para analizar cultivos, coloca un raster por campaña en "
+                   f"{DIRECTORIO_RASTERS} o instala Earth Engine con: pip install earthengine-api geemap")
+        return
+    
+    with st.spinner("Analizando cultivos con Google Earth Engine..."):
+        # Inicializar Earth Engine
+        if not inicializar_earth_engine():
+            st.error("No se pudo inicializar Google Earth Engine")
+            return
+        
+        # Una sola capa con todos los campos (Earth Engine usa [lon, lat], igual que coords)
+        campos = ee.FeatureCollection([
+            ee.Feature(ee.Geometry.Polygon([pol['coords']]), {'renspa': pol.get('renspa', '')})
+            for pol in con_coords
+        ])
+        vis_params = {'color': 'red'}
+        
+        # Las teselas se sirven desde la caché local; se precargan las que cubren los campos
+        capa = id_capa(campos, vis_params)
+        registrar_capa(capa, lambda: campos.getMapId(vis_params)['tile_fetcher'].url_format)
+        fallidas = precargar(capa, teselas_poligonos(con_coords))
+        if fallidas:
+            st.warning(f"No se pudieron precargar {fallidas} teselas; se descargarán al recorrer el mapa")
+        
+        # Crear un mapa de Earth Engine
+        m = geemap.Map()
+        m.add_tile_layer(url_teselas(capa), name="Campos", attribution="Google Earth Engine")
+        if con_coords:
+            lons = [coord[0] for pol in con_coords for coord in pol['coords']]
+            lats = [coord[1] for pol in con_coords for coord in pol['coords']]
+            m.fit_bounds([[min(lats), min(lons)], [max(lats), max(lons)]])
+        
+        # Mostrar el mapa
+        m.to_streamlit(height=600)
+    
+    mostrar_miniaturas(ee.Image().byte().paint(campos, 1, 2), {'palette': ['FF0000']}, con_coords)
+
+def mostrar_miniaturas(imagen, vis_params, poligonos):
     """
-    if st.button("Analizar Cultivos Históricos"):
-        with st.spinner("Analizando cultivos con Google Earth Engine..."):
-            # Inicializar Earth Engine
-            if not inicializar_earth_engine():
-                st.error("No se pudo inicializar Google Earth Engine")
-                return
-            
-            # Crear un mapa de Earth Engine
-            m = geemap.Map()
-            
-            # Procesar cada polígono
-            for i, pol in enumerate(poligonos):
-                if 'coords' in pol:
-                    # Convertir coordenadas de [lon, lat] a [lat, lon] para EE
-                    ee_coords = [[coord[1], coord[0]] for coord in pol['coords']]
-                    
-                    # Crear polígono para Earth Engine
-                    polygon = ee.Geometry.Polygon([ee_coords])
-                    
-                    # Añadir polígono al mapa
-                    m.add_layer(ee.Feature(polygon), {'color': 'red'}, f"Polígono {i+1}")
-            
-            # Mostrar el mapa
-            m.to_streamlit(height=600)
+    Muestra una miniatura de una imagen de Earth Engine recortada a cada campo
+
+    Las miniaturas se guardan en la caché de teselas por capa y huella del
+    campo, así que al volver a abrir el análisis no se piden de nuevo.
+
+    Args:
+        imagen: ee.Image a mostrar
+        vis_params: Parámetros de visualización de la imagen
+        poligonos: Campos (diccionarios con 'coords'); se muestran los primeros MAX_MINIATURAS
+    """
+    if not poligonos:
+        return
+    capa = id_capa(imagen, vis_params)
+    with st.expander("Miniaturas de los campos"):
+        columnas = st.columns(4)
+        for i, pol in enumerate(poligonos[:MAX_MINIATURAS]):
+            region = ee.Geometry.Polygon([pol['coords']])
+            clave = (capa, hashlib.sha1(json.dumps(pol['coords']).encode('utf-8')).hexdigest())
+            try:
+                datos = obtener_miniatura(clave, lambda: imagen.getThumbURL(
+                    {**vis_params, 'region': region, 'dimensions': TAMANO_MINIATURA}))
+            except Exception as e:
+                st.warning(f"No se pudo obtener la miniatura de {pol.get('renspa', f'campo {i + 1}')}: {str(e)}")
+                continue
+            columnas[i % len(columnas)].image(datos, caption=pol.get('renspa'))
+
+def mostrar_rotaciones(df_cultivos, poligonos):
+    """
+    Muestra el análisis de rotaciones a partir del cultivo mayoritario por campaña
+
+    Args:
+        df_cultivos: DataFrame de analizar_campanas (con 'clase' y 'nombre_clase')
+        poligonos: Polígonos analizados, para la superficie y el CUIT de cada campo
+    """
+    if df_cultivos.empty or 'clase' not in df_cultivos.columns:
+        return
+    nombres = df_cultivos.dropna(subset=['clase', 'nombre_clase']).drop_duplicates('clase')
+    clases = dict(zip(nombres['clase'].astype(int), nombres['nombre_clase']))
+    rotaciones = analizar_rotaciones(matriz_cultivos(df_cultivos), campos_de_poligonos(poligonos), clases)
+    por_campo = rotaciones['por_campo']
+
+    st.subheader("Rotaciones")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Campos analizados", f"{len(por_campo):,}")
+    col2.metric("Campos en monocultivo", f"{int(por_campo['monocultivo'].sum()):,}")
+    col3.metric("Cambios de cultivo por campo", f"{por_campo['cambios'].mean():.1f}")
+
+    pestanas = st.tabs(["Por campo", "Secuencias", "Transiciones", "Hectáreas por cultivo", "Por CUIT"])
+    for pestana, clave in zip(pestanas, ['por_campo', 'secuencias', 'transiciones', 'hectareas', 'por_cuit']):
+        with pestana:
+            st.dataframe(rotaciones[clave], hide_index=True)
 
 def mostrar_info_earth_engine_sidebar():
     """Muestra información sobre Earth Engine en la barra lateral"""
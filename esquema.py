@@ -0,0 +1,77 @@
+"""
+Esquema tipado del DataFrame de RENSPA
+
+Los registros de SENASA llegan como diccionarios y pd.DataFrame los deja
+como columnas object, con una cadena de Python por fila aunque el titular,
+la localidad o el CUIT se repitan en miles de filas. Acá cada columna
+conocida se construye directamente con un tipo compacto:
+
+- titular, localidad y cuit: categóricas (cada valor distinto se guarda una vez)
+- renspa y el resto de las columnas de texto: cadenas de Arrow en un único buffer
+- fecha_baja: datetime64 (NaT para los RENSPA activos), si viene en ISO 8601
+- superficie: float32
+
+Si una columna trae valores que el tipo no puede representar sin perder
+datos (por ejemplo, una fecha_baja que no se puede interpretar como fecha),
+esa columna se guarda como categórica o como object en lugar de descartarlos.
+"""
+import pandas as pd
+
+ESQUEMA_RENSPA = {
+    'renspa': 'texto',
+    'titular': 'categoria',
+    'localidad': 'categoria',
+    'cuit': 'categoria',
+    'fecha_baja': 'fecha',
+    'superficie': 'float32',
+}
+
+TIPO_TEXTO = pd.StringDtype("pyarrow")
+
+def _texto(valores):
+    """Cadenas de Arrow si todos los valores son texto (o faltantes); si no, None"""
+    if pd.api.types.infer_dtype(valores, skipna=True) not in ('string', 'empty'):
+        return None
+    return pd.array(valores, dtype=TIPO_TEXTO)
+
+def _convertir(nombre, valores):
+    """Columna tipada a partir de una lista o Serie de valores"""
+    tipo = ESQUEMA_RENSPA.get(nombre)
+    if tipo == 'categoria':
+        return pd.Categorical(valores)
+    if tipo == 'fecha':
+        serie = pd.Series(valores, dtype=object)
+        # Solo ISO 8601: una fecha dd/mm/aaaa no se puede confundir con mm/dd/aaaa
+        fechas = pd.to_datetime(serie, errors='coerce', format='ISO8601')
+        # Fechas ilegibles: conservar el texto (un RENSPA con fecha_baja no es activo)
+        if fechas.dtype == object or (fechas.isna() & serie.notna()).any():
+            return pd.Categorical(serie)
+        return fechas.array
+    if tipo == 'float32':
+        serie = pd.Series(valores, dtype=object)
+        numeros = pd.to_numeric(serie, errors='coerce')
+        if (numeros.isna() & serie.notna()).any():
+            return serie.to_numpy()
+        return numeros.astype('float32').to_numpy()
+    texto = _texto(valores)
+    if texto is not None:
+        return texto
+    return pd.Series(valores).array
+
+def dataframe_renspa(registros):
+    """
+    DataFrame tipado a partir de registros de RENSPA (diccionarios)
+
+    Las columnas siguen el orden en que aparecen en los registros; los
+    registros que no tienen una columna quedan con un faltante en ella.
+    """
+    if not registros:
+        return pd.DataFrame()
+    columnas = list(dict.fromkeys(clave for registro in registros for clave in registro))
+    return pd.DataFrame({nombre: _convertir(nombre, [registro.get(nombre) for registro in registros])
+                         for nombre in columnas})
+
+def tipar_renspa(df):
+    """Aplica el esquema a un DataFrame de RENSPA ya construido (por ejemplo, leído de un bloque Arrow)"""
+    return pd.DataFrame({nombre: _convertir(nombre, df[nombre].tolist()) for nombre in df.columns},
+                        index=df.index)
@@ -0,0 +1,192 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import metricas
+from cache import CacheLRU
+from geometria import calcular_superficies, empaquetar
+
+# Columnas del DataFrame de RENSPA que intervienen en las estadísticas
+COLUMNAS_ESTADISTICAS = ('renspa', 'cuit', 'localidad', 'superficie', 'fecha_baja')
+
+# Agregados calculados para cada grupo
+CONTEOS = ['renspa', 'activos', 'inactivos', 'con_poligono']
+AGREGADOS = ['renspa', 'activos', 'inactivos', 'superficie_declarada', 'superficie_declarada_activa',
+             'con_poligono', 'superficie_calculada']
+
+# Resultados ya calculados por huella del conjunto de datos
+cache_estadisticas = CacheLRU(
+    max_entradas=32,
+    max_bytes=256 * 1024 * 1024,
+    tamano=lambda resultado: sum(int(df.memory_usage(deep=True).sum())
+                                 for df in resultado.values() if isinstance(df, pd.DataFrame))
+)
+metricas.registrar_cache("estadisticas", cache_estadisticas)
+
+def huella_dataframe(df, columnas=COLUMNAS_ESTADISTICAS):
+    """Calcula la huella de las columnas indicadas de un DataFrame (por defecto, las de las estadísticas)"""
+    columnas = [c for c in columnas if c in df.columns]
+    huella = hashlib.sha1(",".join(columnas).encode('ascii'))
+    if columnas and len(df):
+        try:
+            hashes = pd.util.hash_pandas_object(df[columnas], index=False)
+        except TypeError:
+            # Valores no hasheables (listas, diccionarios): hashear su texto
+            hashes = pd.util.hash_pandas_object(df[columnas].astype("string"), index=False)
+        huella.update(hashes.to_numpy().tobytes())
+    return huella.hexdigest()
+
+def _superficies_calculadas(poligonos):
+    """Devuelve una Serie renspa -> hectáreas calculadas a partir de los polígonos"""
+    if not poligonos:
+        return pd.Series([], dtype="float64")
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+    hectareas = calcular_superficies(vertices, offsets)
+    serie = pd.Series(hectareas, index=[pol['renspa'] for pol in poligonos], dtype="float64")
+    return serie[~serie.index.duplicated()]
+
+def _columna(df, nombre, predeterminado):
+    if nombre in df.columns:
+        return df[nombre]
+    return pd.Series(predeterminado, index=df.index)
+
+def _categorica(serie, faltante):
+    """Serie categórica con los faltantes reemplazados (sin pasar por texto si ya es categórica)"""
+    if not isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.fillna(faltante).astype("category")
+    if serie.hasnans:
+        if faltante not in serie.cat.categories:
+            serie = serie.cat.add_categories([faltante])
+        serie = serie.fillna(faltante)
+    return serie
+
+def _agrupar(base, claves):
+    """Suma los agregados por claves a partir del agrupamiento más fino"""
+    return (base.groupby(claves, observed=True, sort=False)[AGREGADOS].sum()
+            .sort_values('superficie_declarada', ascending=False)
+            .reset_index())
+
+def _agrupar_detalle(df_renspa, superficies):
+    """Agrupa las filas por (cuit, provincia, localidad) con todos los agregados"""
+    renspa = _columna(df_renspa, 'renspa', "")
+    if not isinstance(renspa.dtype, pd.StringDtype):
+        renspa = renspa.astype("string")
+    activo = _columna(df_renspa, 'fecha_baja', None).isna().to_numpy()
+    # Las sumas en float64 aunque la columna sea float32
+    declarada = (pd.to_numeric(_columna(df_renspa, 'superficie', np.nan), errors='coerce')
+                 .astype("float64").fillna(0.0).to_numpy())
+    calculada = renspa.map(superficies).astype("float64").to_numpy()
+
+    detalle = pd.DataFrame({
+        'cuit': _categorica(_columna(df_renspa, 'cuit', "Sin CUIT"), "Sin CUIT"),
+        'provincia': renspa.str[0:2].fillna("--").astype("category"),
+        'localidad': _categorica(_columna(df_renspa, 'localidad', "Sin localidad"), "Sin localidad"),
+        'renspa': 1,
+        'activos': activo.astype(np.int64),
+        'inactivos': (~activo).astype(np.int64),
+        'superficie_declarada': declarada,
+        'superficie_declarada_activa': np.where(activo, declarada, 0.0),
+        'con_poligono': (~np.isnan(calculada)).astype(np.int64),
+        'superficie_calculada': np.nan_to_num(calculada),
+    })
+    base = detalle.groupby(['cuit', 'provincia', 'localidad'], observed=True, sort=False)[AGREGADOS].sum()
+    return base.reset_index()
+
+def _resultado(base):
+    """Resumen y desgloses a partir del agrupamiento por (cuit, provincia, localidad)"""
+    resumen = base[AGREGADOS].sum().to_dict()
+    resumen.update({clave: int(resumen[clave]) for clave in CONTEOS})
+    return {
+        'resumen': resumen,
+        'por_cuit': _agrupar(base, 'cuit'),
+        'por_localidad': _agrupar(base, ['provincia', 'localidad']),
+        'por_provincia': _agrupar(base, 'provincia'),
+    }
+
+def calcular_estadisticas(df_renspa, poligonos=None):
+    """
+    Calcula todos los agregados de un conjunto de RENSPA en una pasada agrupada
+
+    Los datos se agrupan una sola vez por (cuit, provincia, localidad); los
+    desgloses por CUIT, por localidad y por provincia y el resumen general se
+    obtienen sumando ese agrupamiento, que tiene muchas menos filas que el
+    original. La provincia es el código de jurisdicción del RENSPA (dos
+    primeros dígitos).
+
+    Args:
+        df_renspa: DataFrame con los datos de RENSPA
+        poligonos: Lista de diccionarios con los polígonos (opcional), para la
+            superficie calculada
+
+    Returns:
+        Diccionario con 'resumen' (diccionario de totales) y los DataFrames
+        'por_cuit', 'por_localidad' y 'por_provincia'
+    """
+    # Única pasada sobre todas las filas
+    return _resultado(_agrupar_detalle(df_renspa, _superficies_calculadas(poligonos or [])))
+
+def calcular_estadisticas_por_bloques(bloques_registros, bloques_poligonos=()):
+    """
+    Igual que calcular_estadisticas, pero leyendo los datos por bloques
+
+    Cada bloque de registros se agrupa por separado y los agrupamientos (de
+    pocas filas) se suman al final, así que en memoria solo hay un bloque a la
+    vez más una superficie calculada por RENSPA.
+
+    Args:
+        bloques_registros: Iterable de DataFrames de RENSPA
+        bloques_poligonos: Iterable de tuplas (atributos, vertices, offsets),
+            como las de AlmacenTemporal.iterar_buffers_poligonos
+
+    Returns:
+        Lo mismo que calcular_estadisticas
+    """
+    superficies = [pd.Series(calcular_superficies(vertices, offsets),
+                             index=[pol['renspa'] for pol in atributos], dtype="float64")
+                   for atributos, vertices, offsets in bloques_poligonos]
+    superficies = pd.concat(superficies) if superficies else pd.Series([], dtype="float64")
+    superficies = superficies[~superficies.index.duplicated()]
+
+    bases = [_agrupar_detalle(df, superficies) for df in bloques_registros]
+    if not bases:
+        return _resultado(_agrupar_detalle(pd.DataFrame(), superficies))
+    base = pd.concat(bases, ignore_index=True)
+    for clave in ('cuit', 'provincia', 'localidad'):
+        base[clave] = base[clave].astype("string").astype("category")
+    base = base.groupby(['cuit', 'provincia', 'localidad'], observed=True, sort=False)[AGREGADOS].sum()
+    return _resultado(base.reset_index())
+
+def huella_estadisticas(df_renspa, poligonos=None):
+    """
+    Clave de cache_estadisticas para un conjunto de datos
+
+    De los polígonos solo intervienen el RENSPA y las coordenadas, que se
+    hashean como buffers de NumPy. Con decenas de miles de polígonos la huella
+    cuesta casi lo mismo que la pasada agrupada, así que conviene calcularla
+    una vez al armar los resultados y pasarla a estadisticas_cacheadas.
+    """
+    huella = hashlib.sha1(huella_dataframe(df_renspa).encode('ascii'))
+    if poligonos:
+        huella.update("\n".join(str(pol['renspa']) for pol in poligonos).encode('utf-8'))
+        vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+        huella.update(vertices.tobytes())
+        huella.update(offsets.tobytes())
+    return huella.hexdigest()
+
+def estadisticas_cacheadas(df_renspa, poligonos=None, clave=None):
+    """
+    Igual que calcular_estadisticas, pero reutiliza el resultado si el mismo
+    conjunto de datos ya se calculó
+
+    Args:
+        clave: Huella de huella_estadisticas ya calculada para estos datos
+            (por defecto se calcula)
+    """
+    if clave is None:
+        clave = huella_estadisticas(df_renspa, poligonos)
+    resultado = cache_estadisticas.obtener(clave)
+    if resultado is None:
+        resultado = calcular_estadisticas(df_renspa, poligonos)
+        cache_estadisticas.guardar(clave, resultado)
+    return resultado
@@ -0,0 +1,445 @@
+import functools
+import hashlib
+import json
+import re
+import time
+import unicodedata
+import zipfile
+from datetime import datetime
+from io import BytesIO
+
+import metricas
+from geometria import empaquetar, mapear_por_bloques, mapear_tareas, procesos_a_usar
+
+_duracion_exportacion = metricas.histograma(
+    "exportacion_duracion_segundos", "Duración de la generación de archivos de exportación", ("formato",)
+)
+_tamano_exportacion = metricas.histograma(
+    "exportacion_bytes", "Tamaño de los archivos de exportación generados", ("formato",),
+    buckets=metricas.BUCKETS_BYTES
+)
+
+def _medir_exportacion(formato):
+    """Registra la duración y el tamaño del resultado de una función de exportación"""
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            inicio = time.perf_counter()
+            resultado = funcion(*args, **kwargs)
+            _duracion_exportacion.observar(time.perf_counter() - inicio, formato=formato)
+            # Para texto se cuenta en caracteres, que en KML/GeoJSON equivalen casi siempre a bytes
+            tamano = resultado.getbuffer().nbytes if isinstance(resultado, BytesIO) else len(resultado)
+            _tamano_exportacion.observar(tamano, formato=formato)
+            return resultado
+        return envoltura
+    return decorador
+
+# Estilo predeterminado para los polígonos en KML
+ESTILO_KML_PREDETERMINADO = """
+  <Style id="greenPoly">
+    <LineStyle>
+      <color>ff009900</color>
+      <width>3</width>
+    </LineStyle>
+    <PolyStyle>
+      <color>7f00ff00</color>
+    </PolyStyle>
+  </Style>
+"""
+
+def _estilo_kml_cuit(cuit, color):
+    """Genera el estilo KML para un CUIT a partir de su color hexadecimal"""
+    # Convertir color de hex a KML (aabbggrr)
+    color_hex = color.lstrip('#')
+    r = color_hex[0:2]
+    g = color_hex[2:4]
+    b = color_hex[4:6]
+    kml_color = f"7f{b}{g}{r}"  # 7f de transparencia
+
+    cuit_clean = cuit.replace('-', '_')
+    return f"""
+  <Style id="style_{cuit_clean}">
+    <LineStyle>
+      <color>ff{b}{g}{r}</color>
+      <width>3</width>
+    </LineStyle>
+    <PolyStyle>
+      <color>{kml_color}</color>
+    </PolyStyle>
+  </Style>
+"""
+
+PIE_KML = """
+</Document>
+</kml>
+"""
+
+def _encabezado_kml(nombre, descripcion, cuit_colors):
+    """Encabezado del documento KML con los estilos"""
+    partes = [f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+  <name>{nombre}</name>
+  <description>{descripcion}</description>
+"""]
+
+    # Añadir estilos para cada CUIT o un estilo único para todos
+    if cuit_colors:
+        for cuit, color in cuit_colors.items():
+            partes.append(_estilo_kml_cuit(cuit, color))
+    else:
+        partes.append(ESTILO_KML_PREDETERMINADO)
+    return "".join(partes)
+
+def _extras_kml(poligonos, cuit_colors, incluir_cuit):
+    """Datos y estilo de cada polígono para serializar sus Placemarks"""
+    extras = []
+    for pol in poligonos:
+        if cuit_colors and pol.get('cuit') in cuit_colors:
+            style_url = f"#style_{pol['cuit'].replace('-', '_')}"
+        else:
+            style_url = "#greenPoly"
+        datos = {clave: pol[clave] for clave in ('renspa', 'titular', 'localidad', 'superficie', 'cuit') if clave in pol}
+        extras.append((datos, style_url, incluir_cuit))
+    return extras
+
+def _placemark_kml(pol, style_url, incluir_cuit):
+    """Genera el Placemark KML de un polígono"""
+    linea_cuit = f"\n      <b>CUIT:</b> {pol['cuit']}<br/>" if incluir_cuit and 'cuit' in pol else ""
+
+    # Añadir coordenadas
+    coordenadas = "".join(f"{coord[0]},{coord[1]},0\n" for coord in pol['coords'])
+
+    return f"""
+  <Placemark>
+    <name>{pol['renspa']}</name>
+    <description><![CDATA[
+      <b>RENSPA:</b> {pol['renspa']}<br/>{linea_cuit}
+      <b>Titular:</b> {pol['titular']}<br/>
+      <b>Localidad:</b> {pol['localidad']}<br/>
+      <b>Superficie:</b> {pol['superficie']} ha
+    ]]></description>
+    <styleUrl>{style_url}</styleUrl>
+    <Polygon>
+      <extrude>1</extrude>
+      <altitudeMode>clampToGround</altitudeMode>
+      <outerBoundaryIs>
+        <LinearRing>
+          <coordinates>
+{coordenadas}
+          </coordinates>
+        </LinearRing>
+      </outerBoundaryIs>
+    </Polygon>
+  </Placemark>
+"""
+
+def _placemarks_kml_bloque(vertices, offsets, extras):
+    """Serializa un bloque de polígonos como Placemarks KML (ejecutable en un proceso del pool)"""
+    return [
+        _placemark_kml({**pol, 'coords': vertices[a:b].tolist()}, style_url, incluir_cuit)
+        for (pol, style_url, incluir_cuit), a, b in zip(extras, offsets[:-1], offsets[1:])
+    ]
+
+@_medir_exportacion("kml")
+def generar_kml(poligonos, nombre, descripcion, cuit_colors=None, incluir_cuit=False, procesos=None):
+    """
+    Genera el contenido KML para una lista de polígonos
+
+    Args:
+        poligonos: Lista de diccionarios con los datos de polígonos
+        nombre: Nombre del documento KML
+        descripcion: Descripción del documento KML
+        cuit_colors: Diccionario de colores por CUIT (opcional)
+        incluir_cuit: Si se incluye el CUIT en la descripción de cada polígono
+        procesos: Procesos para serializar en paralelo (None para decidir según la cantidad)
+
+    Returns:
+        String con el documento KML
+    """
+    partes = [_encabezado_kml(nombre, descripcion, cuit_colors)]
+
+    # Añadir cada polígono al KML
+    extras = _extras_kml(poligonos, cuit_colors, incluir_cuit)
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+    partes.extend(mapear_por_bloques(_placemarks_kml_bloque, vertices, offsets, extras, procesos=procesos))
+
+    # Cerrar documento KML
+    partes.append(PIE_KML)
+
+    return "".join(partes)
+
+def escribir_kml(bloques, ruta, nombre, descripcion, cuit_colors=None, incluir_cuit=False, procesos=None):
+    """
+    Escribe un KML en disco a partir de bloques de polígonos, sin tener el
+    documento completo en memoria (mismo contenido que generar_kml)
+
+    Args:
+        bloques: Iterable de tuplas (atributos, vertices, offsets), como las
+            de AlmacenTemporal.iterar_buffers_poligonos
+        ruta: Archivo de salida
+        nombre, descripcion, cuit_colors, incluir_cuit, procesos: Igual que en generar_kml
+    """
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(_encabezado_kml(nombre, descripcion, cuit_colors))
+        for atributos, vertices, offsets in bloques:
+            extras = _extras_kml(atributos, cuit_colors, incluir_cuit)
+            for placemark in mapear_por_bloques(_placemarks_kml_bloque, vertices, offsets, extras, procesos=procesos):
+                f.write(placemark)
+        f.write(PIE_KML)
+
+@_medir_exportacion("kmz")
+def generar_kmz(kml_content):
+    """
+    Crea un archivo KMZ (ZIP que contiene el KML) en memoria
+
+    Returns:
+        BytesIO posicionado al inicio, listo para descargar
+    """
+    kmz_buffer = BytesIO()
+    with zipfile.ZipFile(kmz_buffer, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        kmz.writestr("doc.kml", kml_content)
+
+    kmz_buffer.seek(0)
+    return kmz_buffer
+
+def escribir_kmz(ruta_kml, ruta_kmz):
+    """Comprime un KML ya escrito en disco como KMZ, leyéndolo por partes"""
+    with zipfile.ZipFile(ruta_kmz, 'w', zipfile.ZIP_DEFLATED) as kmz:
+        kmz.write(ruta_kml, "doc.kml")
+
+ENCABEZADO_GEOJSON = '{\n  "type": "FeatureCollection",\n  "features": [\n'
+PIE_GEOJSON = "\n  ]\n}"
+
+def _propiedades_geojson(pol):
+    propiedades = {
+        "renspa": pol['renspa'],
+        "titular": pol['titular'],
+        "localidad": pol['localidad'],
+        "superficie": pol['superficie']
+    }
+    if 'cuit' in pol:
+        propiedades["cuit"] = pol['cuit']
+    return propiedades
+
+def _features_geojson_bloque(vertices, offsets, propiedades):
+    """Serializa un bloque de Features GeoJSON (ejecutable en un proceso del pool)"""
+    textos = []
+    for props, a, b in zip(propiedades, offsets[:-1], offsets[1:]):
+        feature = {
+            "type": "Feature",
+            "properties": props,
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [vertices[a:b].tolist()]
+            }
+        }
+        # Indentación de un elemento de "features" dentro del FeatureCollection
+        textos.append("    " + json.dumps(feature, indent=2).replace("\n", "\n    "))
+    return textos
+
+@_medir_exportacion("geojson")
+def generar_geojson(poligonos, procesos=None):
+    """
+    Genera un GeoJSON (FeatureCollection) con los polígonos
+
+    Args:
+        poligonos: Lista de diccionarios con los datos de polígonos
+        procesos: Procesos para serializar en paralelo (None para decidir según la cantidad)
+
+    Returns:
+        String con el GeoJSON serializado
+    """
+    if not poligonos:
+        return json.dumps({"type": "FeatureCollection", "features": []}, indent=2)
+
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+    propiedades = [_propiedades_geojson(pol) for pol in poligonos]
+    features = mapear_por_bloques(_features_geojson_bloque, vertices, offsets, propiedades, procesos=procesos)
+
+    return ENCABEZADO_GEOJSON + ",\n".join(features) + PIE_GEOJSON
+
+def escribir_geojson(bloques, ruta, procesos=None):
+    """
+    Escribe un GeoJSON en disco a partir de bloques de polígonos, sin tener
+    el documento completo en memoria (mismo contenido que generar_geojson)
+
+    Args:
+        bloques: Iterable de tuplas (atributos, vertices, offsets)
+        ruta: Archivo de salida
+        procesos: Igual que en generar_geojson
+    """
+    hay_features = False
+    with open(ruta, "w", encoding="utf-8") as f:
+        for atributos, vertices, offsets in bloques:
+            propiedades = [_propiedades_geojson(pol) for pol in atributos]
+            for feature in mapear_por_bloques(_features_geojson_bloque, vertices, offsets, propiedades,
+                                              procesos=procesos):
+                f.write(",\n" if hay_features else ENCABEZADO_GEOJSON)
+                f.write(feature)
+                hay_features = True
+        f.write(PIE_GEOJSON if hay_features else json.dumps({"type": "FeatureCollection", "features": []}, indent=2))
+
+@_medir_exportacion("csv")
+def generar_csv(df_renspa):
+    """Genera el CSV con todos los datos de RENSPA"""
+    if df_renspa.empty:
+        return "No hay datos disponibles".encode('utf-8')
+    return df_renspa.to_csv(index=False).encode('utf-8')
+
+def escribir_csv(bloques, ruta, columnas):
+    """
+    Escribe un CSV en disco a partir de bloques de DataFrame
+
+    Args:
+        bloques: Iterable de DataFrames (por ejemplo, AlmacenTemporal.iterar_registros(columnas))
+        ruta: Archivo de salida
+        columnas: Columnas del CSV, en orden
+    """
+    with open(ruta, "w", encoding="utf-8", newline="") as f:
+        encabezado = True
+        for df in bloques:
+            df.reindex(columns=columnas).to_csv(f, index=False, header=encabezado)
+            encabezado = False
+        if encabezado:
+            f.write("No hay datos disponibles")
+
+# Particiones de los paquetes de exportación: nombre -> etiqueta para la interfaz
+PARTICIONES = {'cuit': 'CUIT', 'localidad': 'Localidad', 'provincia': 'Provincia'}
+
+# Carpeta y extensión de cada formato dentro del paquete
+CARPETAS_PAQUETE = {'kmz': 'kmz', 'geojson': 'geojson', 'csv': 'csv'}
+
+# Nivel de zlib para los GeoJSON y CSV del paquete: la compresión se hace en el proceso
+# principal mientras llegan las particiones, y el nivel 1 tarda menos de la mitad que
+# el predeterminado con archivos un 8 % más grandes
+NIVEL_COMPRESION_PAQUETE = 1
+
+def _claves_particion(valores_renspa, valores, particion):
+    """Clave de partición de cada fila: el valor de la columna o, para provincia, el código del RENSPA"""
+    if particion == 'provincia':
+        valores = [renspa[:2] if isinstance(renspa, str) else None for renspa in valores_renspa]
+    return [valor if isinstance(valor, str) and valor.strip() else None for valor in valores]
+
+def _nombre_particion(clave, usados):
+    """Nombre de archivo seguro y único para una partición"""
+    texto = unicodedata.normalize('NFKD', clave or "").encode('ascii', 'ignore').decode('ascii')
+    base = re.sub(r'[^A-Za-z0-9.-]+', '_', texto).strip('_.') or "sin_dato"
+    nombre, sufijo = base, 2
+    while nombre.lower() in usados:
+        nombre, sufijo = f"{base}_{sufijo}", sufijo + 1
+    usados.add(nombre.lower())
+    return nombre
+
+def _archivos_particion(titulo, registros, atributos, vertices, offsets, cuit_colors, incluir_cuit):
+    """
+    Genera los archivos de una partición (ejecutable en un proceso del pool)
+
+    Returns:
+        Tupla (archivos, superficie): archivos es una lista de (formato,
+        bytes, sha256) y superficie la suma de la superficie de los polígonos
+    """
+    archivos = []
+    if atributos:
+        extras = _extras_kml(atributos, cuit_colors, incluir_cuit)
+        kml = "".join([_encabezado_kml(titulo, f"Polígonos de {titulo}", cuit_colors),
+                       *_placemarks_kml_bloque(vertices, offsets, extras), PIE_KML])
+        kmz = BytesIO()
+        with zipfile.ZipFile(kmz, 'w', zipfile.ZIP_DEFLATED) as archivo_kmz:
+            archivo_kmz.writestr("doc.kml", kml)
+        archivos.append(('kmz', kmz.getvalue()))
+
+        features = _features_geojson_bloque(vertices, offsets, [_propiedades_geojson(pol) for pol in atributos])
+        archivos.append(('geojson', (ENCABEZADO_GEOJSON + ",\n".join(features) + PIE_GEOJSON).encode('utf-8')))
+    archivos.append(('csv', registros.to_csv(index=False).encode('utf-8')))
+    superficie = sum(float(pol.get('superficie') or 0) for pol in atributos)
+    return [(formato, datos, hashlib.sha256(datos).hexdigest()) for formato, datos in archivos], superficie
+
+def escribir_paquete(destino, df_renspa, poligonos, particion, titulo="RENSPA", cuit_colors=None,
+                     incluir_cuit=False, procesos=None):
+    """
+    Escribe un paquete ZIP con un KMZ, un GeoJSON y un CSV por partición
+    (CUIT, localidad o provincia) y un manifest.json
+
+    Los archivos de cada partición se generan en los procesos del pool y se
+    escriben en el ZIP a medida que llegan, en orden de partición: solo hay
+    en memoria los de las particiones en curso, no los de todo el paquete.
+    Las particiones sin polígonos solo tienen CSV.
+
+    Args:
+        destino: Ruta o archivo binario abierto donde escribir el ZIP
+        df_renspa: DataFrame con todos los RENSPA (para los CSV)
+        poligonos: Lista de diccionarios con los datos de polígonos
+        particion: 'cuit', 'localidad' o 'provincia'
+        titulo: Prefijo del nombre de los documentos KML
+        cuit_colors: Diccionario de colores por CUIT (opcional)
+        incluir_cuit: Si se incluye el CUIT en la descripción de cada polígono
+        procesos: Procesos para generar las particiones (None para decidir según la cantidad de polígonos)
+
+    Returns:
+        El manifiesto (diccionario) escrito en manifest.json
+    """
+    if particion not in PARTICIONES:
+        raise ValueError(f"Partición desconocida: {particion}")
+    inicio = time.perf_counter()
+
+    # Filas de cada partición, sin copiar todavía los datos
+    columna = df_renspa[particion] if particion in df_renspa.columns else [None] * len(df_renspa)
+    claves_registros = _claves_particion(df_renspa.get('renspa', [None] * len(df_renspa)), columna, particion)
+    filas = {}
+    for i, clave in enumerate(claves_registros):
+        filas.setdefault(clave, []).append(i)
+    indices_poligonos = {}
+    claves_poligonos = _claves_particion([pol.get('renspa') for pol in poligonos],
+                                         [pol.get(particion) for pol in poligonos], particion)
+    for i, clave in enumerate(claves_poligonos):
+        indices_poligonos.setdefault(clave, []).append(i)
+    claves = sorted(set(filas) | set(indices_poligonos), key=lambda clave: (clave is None, clave or ""))
+
+    usados = set()
+    nombres = [_nombre_particion(clave, usados) for clave in claves]
+
+    def tareas():
+        for clave in claves:
+            de_particion = [poligonos[i] for i in indices_poligonos.get(clave, [])]
+            vertices, offsets = empaquetar([pol['coords'] for pol in de_particion])
+            atributos = [{campo: pol[campo] for campo in ('renspa', 'titular', 'localidad', 'superficie', 'cuit')
+                          if campo in pol} for pol in de_particion]
+            colores = None
+            if cuit_colors:
+                cuits = {pol.get('cuit') for pol in atributos}
+                colores = {cuit: color for cuit, color in cuit_colors.items() if cuit in cuits}
+            yield (f"{titulo} - {clave or 'sin dato'}", df_renspa.iloc[filas.get(clave, [])],
+                   atributos, vertices, offsets, colores, incluir_cuit)
+
+    manifiesto = {
+        'particion': particion,
+        'generado': datetime.now().isoformat(timespec='seconds'),
+        'total_renspa': len(df_renspa),
+        'total_poligonos': len(poligonos),
+        'particiones': [],
+    }
+    procesos = procesos_a_usar(len(poligonos), procesos)
+    with zipfile.ZipFile(destino, 'w', zipfile.ZIP_DEFLATED, compresslevel=NIVEL_COMPRESION_PAQUETE) as paquete:
+        resultados = mapear_tareas(_archivos_particion, tareas(), procesos=procesos)
+        for clave, nombre, (archivos, superficie) in zip(claves, nombres, resultados):
+            entrada = {
+                'clave': clave,
+                'renspa': len(filas.get(clave, [])),
+                'poligonos': len(indices_poligonos.get(clave, [])),
+                'superficie': round(superficie, 2),
+                'archivos': [],
+            }
+            for formato, datos, sha256 in archivos:
+                ruta = f"{CARPETAS_PAQUETE[formato]}/{nombre}.{formato}"
+                # El KMZ ya está comprimido
+                paquete.writestr(ruta, datos,
+                                 compress_type=zipfile.ZIP_STORED if formato == 'kmz' else zipfile.ZIP_DEFLATED)
+                entrada['archivos'].append({'ruta': ruta, 'bytes': len(datos), 'sha256': sha256})
+            manifiesto['particiones'].append(entrada)
+        paquete.writestr("manifest.json", json.dumps(manifiesto, indent=2, ensure_ascii=False))
+        tamano = sum(info.compress_size for info in paquete.infolist())
+
+    _duracion_exportacion.observar(time.perf_counter() - inicio, formato="paquete")
+    _tamano_exportacion.observar(tamano, formato="paquete")
+    return manifiesto
@@ -0,0 +1,491 @@
+"""
+Etapas de geometría intensivas en CPU (parseo, superficie, simplificación y
+serialización) sobre buffers planos de vértices, ejecutables en un pool de
+procesos.
+
+Los polígonos se representan como un par (vertices, offsets): vertices es un
+array float64 de forma (N, 2) con [lon, lat] de todos los anillos
+concatenados y offsets un array int64 de largo n+1 tal que el polígono i ocupa
+vertices[offsets[i]:offsets[i+1]]. Para el pool, ambos arrays se copian una
+sola vez a memoria compartida y cada proceso trabaja sobre un rango de
+polígonos sin serializar listas anidadas.
+"""
+import atexit
+import math
+import os
+import re
+import struct
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+import metricas
+
+# Por debajo de esta cantidad de polígonos el costo de arrancar el pool supera la ganancia
+UMBRAL_PARALELO = 5000
+
+# Cantidad de bloques por proceso, para balancear la carga entre procesos
+BLOQUES_POR_PROCESO = 4
+
+RADIO_TIERRA = 6371008.8  # metros
+
+_PATRON_COORDENADAS = re.compile(r'\(([-\d\.]+),([-\d\.]+)\)')
+
+_poligonos_parseados = metricas.contador(
+    "poligonos_parseados_total", "Polígonos de SENASA parseados", ("resultado",)
+)
+
+_pool = None
+_procesos_pool = None
+
+def _obtener_pool(procesos):
+    """Devuelve el pool de procesos compartido, creándolo si hace falta"""
+    global _pool, _procesos_pool
+    if _pool is None or _procesos_pool != procesos:
+        if _pool is not None:
+            _pool.shutdown()
+        # spawn evita heredar los hilos del servidor de Streamlit en los procesos hijos
+        _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=get_context("spawn"))
+        _procesos_pool = procesos
+    return _pool
+
+@atexit.register
+def cerrar_pool():
+    """Cierra el pool de procesos compartido"""
+    global _pool, _procesos_pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+        _procesos_pool = None
+
+def procesos_a_usar(cantidad, procesos=None):
+    """
+    Determina cuántos procesos usar para `cantidad` polígonos
+
+    Args:
+        cantidad: Cantidad de polígonos a procesar
+        procesos: Cantidad pedida explícitamente (None para decidir según el umbral)
+    """
+    if procesos is not None:
+        return max(1, procesos)
+    if cantidad < UMBRAL_PARALELO:
+        return 1
+    return os.cpu_count() or 1
+
+def _rangos(cantidad, procesos):
+    """Divide [0, cantidad) en bloques contiguos"""
+    bloques = max(1, min(cantidad, procesos * BLOQUES_POR_PROCESO))
+    limites = np.linspace(0, cantidad, bloques + 1).astype(int)
+    return [(int(a), int(b)) for a, b in zip(limites[:-1], limites[1:]) if b > a]
+
+def empaquetar(lista_coords):
+    """
+    Convierte una lista de polígonos ([[lon, lat], ...]) en buffers planos
+
+    Returns:
+        Tupla (vertices, offsets)
+    """
+    largos = np.fromiter((len(c) for c in lista_coords), dtype=np.int64, count=len(lista_coords))
+    offsets = np.zeros(len(lista_coords) + 1, dtype=np.int64)
+    np.cumsum(largos, out=offsets[1:])
+    vertices = np.empty((offsets[-1], 2), dtype=np.float64)
+    for i, coords in enumerate(lista_coords):
+        if len(coords):
+            vertices[offsets[i]:offsets[i + 1]] = coords
+    return vertices, offsets
+
+def desempaquetar(vertices, offsets):
+    """Convierte buffers planos en una lista de polígonos [[lon, lat], ...]"""
+    return [vertices[a:b].tolist() for a, b in zip(offsets[:-1], offsets[1:])]
+
+# Núcleos que ejecuta cada proceso sobre un bloque de polígonos
+
+def _parsear_bloque(poligonos_str):
+    """Parsea un bloque de strings de SENASA; devuelve (vertices, offsets, validos)"""
+    partes = []
+    largos = []
+    validos = np.zeros(len(poligonos_str), dtype=bool)
+    for i, poligono_str in enumerate(poligonos_str):
+        if not poligono_str or not isinstance(poligono_str, str):
+            continue
+        pares = _PATRON_COORDENADAS.findall(poligono_str)
+        try:
+            latlon = np.array(pares, dtype=np.float64).reshape(-1, 2)
+        except ValueError:
+            # Pares mal formados: se descartan uno por uno como en extraer_coordenadas
+            latlon = np.array([p for p in pares if _es_par_valido(p)], dtype=np.float64).reshape(-1, 2)
+        if len(latlon) < 3:
+            continue
+        coords = latlon[:, ::-1]  # GeoJSON usa [lon, lat]
+        if not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack([coords, coords[:1]])  # Cerrar el polígono
+        partes.append(coords)
+        largos.append(len(coords))
+        validos[i] = True
+
+    offsets = np.zeros(len(largos) + 1, dtype=np.int64)
+    np.cumsum(largos, out=offsets[1:])
+    vertices = np.concatenate(partes) if partes else np.empty((0, 2), dtype=np.float64)
+    return vertices, offsets, validos
+
+def _es_par_valido(par):
+    try:
+        float(par[0])
+        float(par[1])
+        return True
+    except ValueError:
+        return False
+
+def _areas_bloque(vertices, offsets, extras=None):
+    """Superficie en hectáreas de cada polígono (proyección equirectangular local)"""
+    largos = np.diff(offsets)
+    if len(vertices) == 0:
+        return [0.0] * len(largos)
+    lon = np.radians(vertices[:, 0])
+    lat = np.radians(vertices[:, 1])
+    con_vertices = largos > 0
+    # reduceat necesita índices dentro del array aunque haya polígonos vacíos
+    inicios = np.minimum(offsets[:-1], len(vertices) - 1)
+
+    # Latitud media de cada polígono para escalar las longitudes
+    lat_media = np.add.reduceat(lat, inicios) / np.maximum(largos, 1)
+    escala = np.repeat(np.cos(lat_media), largos)
+    x = lon * escala * RADIO_TIERRA
+    y = lat * RADIO_TIERRA
+
+    # Fórmula del área de Gauss (shoelace) sobre cada anillo
+    siguiente = np.arange(1, len(x) + 1)
+    siguiente[(offsets[1:] - 1)[con_vertices]] = offsets[:-1][con_vertices]
+    productos = x * y[siguiente] - x[siguiente] * y
+    areas_m2 = np.abs(np.add.reduceat(productos, inicios)) / 2
+    areas_m2[~con_vertices] = 0
+    return (areas_m2 / 10000).tolist()
+
+def _douglas_peucker(puntos, tolerancia):
+    """
+    Simplificación de Douglas-Peucker iterativa sobre un anillo
+
+    Returns:
+        Máscara booleana de los puntos que se conservan
+    """
+    n = len(puntos)
+    conservar = np.ones(n, dtype=bool)
+    if n <= 4:
+        return conservar
+    conservar[:] = False
+    conservar[0] = conservar[-1] = True
+    pila = [(0, n - 1)]
+    while pila:
+        inicio, fin = pila.pop()
+        if fin <= inicio + 1:
+            continue
+        a = puntos[inicio]
+        b = puntos[fin]
+        tramo = puntos[inicio + 1:fin]
+        ab = b - a
+        largo = math.hypot(ab[0], ab[1])
+        if largo == 0:
+            distancias = np.hypot(tramo[:, 0] - a[0], tramo[:, 1] - a[1])
+        else:
+            distancias = np.abs(ab[0] * (tramo[:, 1] - a[1]) - ab[1] * (tramo[:, 0] - a[0])) / largo
+        indice = int(np.argmax(distancias))
+        if distancias[indice] > tolerancia:
+            medio = inicio + 1 + indice
+            conservar[medio] = True
+            pila.append((inicio, medio))
+            pila.append((medio, fin))
+    # Un anillo necesita al menos 4 puntos (3 distintos más el cierre)
+    if conservar.sum() < 4:
+        conservar[:] = True
+    return conservar
+
+def _simplificar_bloque(vertices, offsets, tolerancia_m):
+    """Simplifica cada polígono del bloque con tolerancia en metros"""
+    resultado = []
+    for a, b in zip(offsets[:-1], offsets[1:]):
+        anillo = vertices[a:b]
+        if len(anillo) == 0:
+            resultado.append(anillo)
+            continue
+        # Tolerancia en grados, según la latitud del polígono
+        lat_media = math.radians(float(anillo[:, 1].mean()))
+        grados_por_metro = 180 / (math.pi * RADIO_TIERRA)
+        escala = np.array([1 / max(math.cos(lat_media), 1e-6), 1.0])
+        resultado.append(anillo[_douglas_peucker(anillo / escala, tolerancia_m * grados_por_metro)])
+    return resultado
+
+def _tarea_memoria_compartida(funcion, nombre_vertices, nombre_offsets, forma_vertices,
+                              cantidad, rango, extras):
+    """Ejecuta `funcion` sobre un rango de polígonos leídos de memoria compartida"""
+    shm_vertices = shared_memory.SharedMemory(name=nombre_vertices)
+    shm_offsets = shared_memory.SharedMemory(name=nombre_offsets)
+    try:
+        vertices = np.ndarray(forma_vertices, dtype=np.float64, buffer=shm_vertices.buf)
+        offsets = np.ndarray((cantidad + 1,), dtype=np.int64, buffer=shm_offsets.buf)
+        a, b = rango
+        offsets_bloque = offsets[a:b + 1] - offsets[a]
+        vertices_bloque = np.array(vertices[offsets[a]:offsets[b]])
+        del vertices, offsets
+        return funcion(vertices_bloque, offsets_bloque, extras)
+    finally:
+        shm_vertices.close()
+        shm_offsets.close()
+
+def mapear_por_bloques(funcion, vertices, offsets, extras=None, procesos=None):
+    """
+    Aplica `funcion` a los polígonos por bloques, en paralelo si conviene
+
+    Args:
+        funcion: Función de nivel de módulo (vertices, offsets, extras) -> lista
+            con un resultado por polígono del bloque
+        vertices, offsets: Buffers planos de los polígonos
+        extras: Lista con un dato adicional por polígono (se reparte por bloque)
+            o valor único compartido por todos los bloques
+        procesos: Cantidad de procesos (None para decidir según UMBRAL_PARALELO)
+
+    Returns:
+        Lista con los resultados de todos los polígonos, en el orden original
+    """
+    cantidad = len(offsets) - 1
+    procesos = procesos_a_usar(cantidad, procesos)
+    por_poligono = isinstance(extras, list)
+
+    if procesos == 1 or cantidad == 0:
+        return list(funcion(vertices, offsets, extras))
+
+    shm_vertices = shared_memory.SharedMemory(create=True, size=max(vertices.nbytes, 1))
+    shm_offsets = shared_memory.SharedMemory(create=True, size=offsets.nbytes)
+    try:
+        np.ndarray(vertices.shape, dtype=np.float64, buffer=shm_vertices.buf)[:] = vertices
+        np.ndarray(offsets.shape, dtype=np.int64, buffer=shm_offsets.buf)[:] = offsets
+
+        pool = _obtener_pool(procesos)
+        futuros = [
+            pool.submit(_tarea_memoria_compartida, funcion, shm_vertices.name, shm_offsets.name,
+                        vertices.shape, cantidad, (a, b), extras[a:b] if por_poligono else extras)
+            for a, b in _rangos(cantidad, procesos)
+        ]
+        # Reensamblar en el orden original
+        resultados = []
+        for futuro in futuros:
+            resultados.extend(futuro.result())
+        return resultados
+    finally:
+        shm_vertices.close()
+        shm_vertices.unlink()
+        shm_offsets.close()
+        shm_offsets.unlink()
+
+def mapear_tareas(funcion, tareas, procesos=1, en_vuelo=None):
+    """
+    Aplica `funcion` a cada tarea en el pool compartido, entregando los
+    resultados en orden a medida que terminan
+
+    A diferencia de mapear_por_bloques, las tareas se envían de a poco: como
+    mucho hay `en_vuelo` pendientes, así que los resultados (por ejemplo,
+    archivos ya serializados) no se acumulan en memoria.
+
+    Args:
+        funcion: Función de nivel de módulo
+        tareas: Iterable de tuplas de argumentos (puede ser un generador)
+        procesos: Cantidad de procesos (1 para ejecutar en este proceso)
+        en_vuelo: Tareas pendientes como máximo (por defecto, dos por proceso)
+
+    Yields:
+        El resultado de cada tarea, en el orden de `tareas`
+    """
+    if procesos == 1:
+        for argumentos in tareas:
+            yield funcion(*argumentos)
+        return
+
+    pool = _obtener_pool(procesos)
+    en_vuelo = en_vuelo or 2 * procesos
+    pendientes = deque()
+    for argumentos in tareas:
+        pendientes.append(pool.submit(funcion, *argumentos))
+        if len(pendientes) >= en_vuelo:
+            yield pendientes.popleft().result()
+    while pendientes:
+        yield pendientes.popleft().result()
+
+def parsear_poligonos(poligonos_str, procesos=None):
+    """
+    Parsea strings de polígono de SENASA en buffers planos
+
+    Args:
+        poligonos_str: Lista de strings en el formato de SENASA
+        procesos: Cantidad de procesos (None para decidir según UMBRAL_PARALELO)
+
+    Returns:
+        Tupla (vertices, offsets, validos). validos es un array booleano con
+        un valor por string; los buffers contienen solo los polígonos válidos.
+    """
+    cantidad = len(poligonos_str)
+    procesos = procesos_a_usar(cantidad, procesos)
+    if procesos == 1 or cantidad == 0:
+        vertices, offsets, validos = _parsear_bloque(poligonos_str)
+    else:
+        pool = _obtener_pool(procesos)
+        partes = list(pool.map(_parsear_bloque, [poligonos_str[a:b] for a, b in _rangos(cantidad, procesos)]))
+
+        vertices = np.concatenate([p[0] for p in partes])
+        largos = np.concatenate([np.diff(p[1]) for p in partes])
+        offsets = np.zeros(len(largos) + 1, dtype=np.int64)
+        np.cumsum(largos, out=offsets[1:])
+        validos = np.concatenate([p[2] for p in partes])
+
+    cantidad_validos = int(validos.sum())
+    _poligonos_parseados.inc(cantidad_validos, resultado="ok")
+    _poligonos_parseados.inc(cantidad - cantidad_validos, resultado="invalido")
+    return vertices, offsets, validos
+
+def calcular_superficies(vertices, offsets, procesos=None):
+    """Superficie calculada (ha) de cada polígono"""
+    return np.array(mapear_por_bloques(_areas_bloque, vertices, offsets, procesos=procesos))
+
+def simplificar(vertices, offsets, tolerancia_m=1.0, procesos=None):
+    """
+    Simplifica los polígonos con Douglas-Peucker
+
+    Args:
+        tolerancia_m: Desvío máximo admitido, en metros
+
+    Returns:
+        Tupla (vertices, offsets) con los polígonos simplificados
+    """
+    anillos = mapear_por_bloques(_simplificar_bloque, vertices, offsets, tolerancia_m, procesos=procesos)
+    offsets_nuevos = np.zeros(len(anillos) + 1, dtype=np.int64)
+    np.cumsum([len(a) for a in anillos], out=offsets_nuevos[1:])
+    vertices_nuevos = np.concatenate(anillos) if anillos else np.empty((0, 2), dtype=np.float64)
+    return vertices_nuevos, offsets_nuevos
+
+# Codificación compacta para guardar polígonos en disco. Las coordenadas se
+# cuantizan a enteros de 1e-7 grados (alrededor de 1 cm; ±180° entra en int32)
+# y se guardan como diferencias con el vértice anterior del mismo anillo; el
+# primer vértice de cada anillo queda absoluto.
+ESCALA_CUANTIZACION = 10_000_000
+_MAGIA_GEOMETRIA = b"RGQ1"
+_ENCABEZADO_GEOMETRIA = struct.Struct("<4sBIII")  # magia, compresión, escala, polígonos, vértices
+COMPRESIONES = {None: 0, 'varint': 1, 'zlib': 2}
+
+def cuantizar_deltas(vertices, offsets, escala=ESCALA_CUANTIZACION):
+    """
+    Cuantiza los vértices y los codifica como diferencias dentro de cada anillo
+
+    Returns:
+        Array int32 de forma (N, 2)
+    """
+    cuantizados = np.rint(np.asarray(vertices, dtype=np.float64) * escala).astype(np.int64)
+    deltas = cuantizados.copy()
+    deltas[1:] -= cuantizados[:-1]
+    inicios = offsets[:-1][offsets[1:] > offsets[:-1]]
+    deltas[inicios] = cuantizados[inicios]
+    return deltas.astype(np.int32)
+
+def reconstruir_deltas(deltas, offsets, escala=ESCALA_CUANTIZACION):
+    """
+    Inversa de cuantizar_deltas: suma acumulada por anillo, sin recorrer los polígonos
+
+    Returns:
+        Array float64 de vértices de forma (N, 2)
+    """
+    acumulados = np.cumsum(np.asarray(deltas, dtype=np.int64).reshape(-1, 2), axis=0)
+    if not len(acumulados):
+        return np.empty((0, 2), dtype=np.float64)
+    # La suma corre a través de los anillos: restar lo acumulado antes del inicio de cada uno
+    inicios = np.asarray(offsets[:-1], dtype=np.int64)
+    previos = np.where((inicios > 0)[:, None], acumulados[np.maximum(inicios - 1, 0)], 0)
+    acumulados -= np.repeat(previos, np.diff(offsets), axis=0)
+    return acumulados / escala
+
+def _varint(valores):
+    """Codifica enteros sin signo (uint64) como varint LEB128, de forma vectorizada"""
+    largos = np.ones(len(valores), dtype=np.int64)
+    resto = valores >> np.uint64(7)
+    while resto.any():
+        largos += resto > 0
+        resto >>= np.uint64(7)
+    fines = np.cumsum(largos)
+    inicios = fines - largos
+    salida = np.empty(int(fines[-1]) if len(fines) else 0, dtype=np.uint8)
+    for k in range(int(largos.max()) if len(largos) else 0):
+        seleccion = largos > k
+        byte = (valores[seleccion] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        continua = (largos[seleccion] > k + 1).astype(np.uint64) << np.uint64(7)
+        salida[inicios[seleccion] + k] = byte | continua
+    return salida
+
+def _desvarint(datos):
+    """Decodifica una secuencia de varint LEB128 en un array uint64"""
+    bytes_ = np.frombuffer(datos, dtype=np.uint8)
+    if not len(bytes_):
+        return np.empty(0, dtype=np.uint64)
+    fines = np.flatnonzero(bytes_ < 0x80)
+    inicios = np.concatenate(([0], fines[:-1] + 1))
+    posiciones = np.arange(len(bytes_)) - np.repeat(inicios, fines - inicios + 1)
+    partes = (bytes_ & 0x7F).astype(np.uint64) << (7 * posiciones).astype(np.uint64)
+    return np.bitwise_or.reduceat(partes, inicios)
+
+def codificar_geometrias(vertices, offsets, compresion='varint'):
+    """
+    Codifica buffers (vertices, offsets) en bytes compactos
+
+    Los vértices se cuantizan con cuantizar_deltas; los largos de los anillos
+    y las diferencias se guardan en zigzag como varint ('varint'), además
+    comprimidos con zlib ('zlib') o como int32 sin empaquetar (None).
+
+    Returns:
+        bytes, para decodificar_geometrias
+    """
+    if compresion not in COMPRESIONES:
+        raise ValueError(f"Compresión desconocida: {compresion}")
+    offsets = np.asarray(offsets, dtype=np.int64)
+    deltas = cuantizar_deltas(vertices, offsets).astype(np.int64).ravel()
+    valores = np.concatenate((np.diff(offsets), (deltas << 1) ^ (deltas >> 63))).astype(np.uint64)
+    if compresion is None:
+        cuerpo = valores.astype("<u4").tobytes()
+    else:
+        cuerpo = _varint(valores).tobytes()
+        if compresion == 'zlib':
+            cuerpo = zlib.compress(cuerpo, 6)
+    encabezado = _ENCABEZADO_GEOMETRIA.pack(_MAGIA_GEOMETRIA, COMPRESIONES[compresion], ESCALA_CUANTIZACION,
+                                            len(offsets) - 1, int(offsets[-1]))
+    return encabezado + cuerpo
+
+def decodificar_geometrias(datos):
+    """
+    Decodifica bytes de codificar_geometrias directamente en buffers de NumPy
+
+    Returns:
+        Tupla (vertices, offsets)
+
+    Raises:
+        ValueError: Si los datos no son geometrías codificadas válidas
+    """
+    try:
+        magia, codigo, escala, cantidad, total_vertices = _ENCABEZADO_GEOMETRIA.unpack_from(datos)
+        cuerpo = memoryview(datos)[_ENCABEZADO_GEOMETRIA.size:]
+        if codigo == COMPRESIONES['zlib']:
+            cuerpo = zlib.decompress(cuerpo)
+    except (struct.error, zlib.error) as e:
+        raise ValueError(f"Geometrías codificadas inválidas: {e}") from e
+    if magia != _MAGIA_GEOMETRIA or codigo not in COMPRESIONES.values():
+        raise ValueError("Los datos no son geometrías codificadas")
+    if codigo == COMPRESIONES[None]:
+        valores = np.frombuffer(cuerpo, dtype="<u4").astype(np.uint64)
+    else:
+        valores = _desvarint(cuerpo)
+    if len(valores) != cantidad + 2 * total_vertices:
+        raise ValueError("Geometrías codificadas truncadas")
+
+    offsets = np.zeros(cantidad + 1, dtype=np.int64)
+    np.cumsum(valores[:cantidad].astype(np.int64), out=offsets[1:])
+    if offsets[-1] != total_vertices:
+        raise ValueError("Geometrías codificadas inconsistentes")
+    zigzag = valores[cantidad:]
+    deltas = (zigzag >> np.uint64(1)).astype(np.int64) ^ -(zigzag & np.uint64(1)).astype(np.int64)
+    return reconstruir_deltas(deltas, offsets, escala), offsets
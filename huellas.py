@@ -0,0 +1,32 @@
+import hashlib
+import json
+
+from geometria import empaquetar
+
+def hash_contenido(obj):
+    """
+    Calcula un hash estable del contenido de un objeto serializable a JSON
+
+    Las claves de los diccionarios se ordenan, de modo que dos objetos con el
+    mismo contenido producen el mismo hash sin importar el orden de inserción.
+    """
+    serializado = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(serializado.encode('utf-8')).hexdigest()
+
+def huella_poligonos(poligonos, **opciones):
+    """
+    Calcula la huella de un conjunto de polígonos y de las opciones con que se
+    lo representa (colores, tamaño, etc.)
+
+    Las coordenadas se hashean como buffers de NumPy, sin pasar por JSON, para
+    que la huella de decenas de miles de polígonos cueste poco frente a
+    volver a construir el mapa.
+    """
+    huella = hashlib.sha1()
+    atributos = [{clave: valor for clave, valor in pol.items() if clave != 'coords'} for pol in poligonos]
+    huella.update(hash_contenido(atributos).encode('ascii'))
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+    huella.update(vertices.tobytes())
+    huella.update(offsets.tobytes())
+    huella.update(hash_contenido(opciones).encode('ascii'))
+    return huella.hexdigest()
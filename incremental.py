@@ -0,0 +1,170 @@
+import base64
+import json
+import os
+import time
+
+from geometria import codificar_geometrias, decodificar_geometrias, empaquetar
+from huellas import hash_contenido
+
+# Directorio donde se guarda la última consulta de cada CUIT
+DIRECTORIO_SNAPSHOTS = os.environ.get("RENSPA_SNAPSHOTS_DIR", os.path.join(".renspa_cache", "snapshots"))
+# Los snapshots se leen una vez por consulta: conviene el tamaño mínimo
+COMPRESION_SNAPSHOTS = 'zlib'
+# Campos que el procesamiento agrega a los items del listado (según la pestaña) y que no
+# forman parte del contenido de SENASA
+CAMPOS_AGREGADOS = ('cuit',)
+
+def hash_item(item):
+    """Hash del contenido de un item del listado, sin los campos que agrega el procesamiento"""
+    return hash_contenido({clave: valor for clave, valor in item.items() if clave not in CAMPOS_AGREGADOS})
+
+def _ruta_snapshot(cuit):
+    return os.path.join(DIRECTORIO_SNAPSHOTS, f"{cuit.replace('-', '')}.json")
+
+def _codificar_poligonos(entradas):
+    """
+    Separa las coordenadas de los polígonos de un snapshot en un único bloque
+    codificado con geometria.codificar_geometrias (en base64)
+
+    Returns:
+        Tupla (entradas sin coordenadas, bloque)
+    """
+    con_poligono = [renspa for renspa, entrada in entradas.items() if entrada.get('poligono')]
+    vertices, offsets = empaquetar([entradas[renspa]['poligono']['coords'] for renspa in con_poligono])
+    indices = {renspa: i for i, renspa in enumerate(con_poligono)}
+    compactas = {}
+    for renspa, entrada in entradas.items():
+        if renspa in indices:
+            atributos = {k: v for k, v in entrada['poligono'].items() if k != 'coords'}
+            entrada = {**entrada, 'poligono': {**atributos, 'geometria': indices[renspa]}}
+        compactas[renspa] = entrada
+    bloque = base64.b64encode(codificar_geometrias(vertices, offsets, COMPRESION_SNAPSHOTS)).decode('ascii')
+    return compactas, bloque
+
+def _decodificar_poligonos(entradas, bloque):
+    """Inversa de _codificar_poligonos: vuelve a agregar 'coords' a cada polígono"""
+    vertices, offsets = decodificar_geometrias(base64.b64decode(bloque))
+    for entrada in entradas.values():
+        poligono = entrada.get('poligono')
+        if poligono and 'geometria' in poligono:
+            i = poligono.pop('geometria')
+            poligono['coords'] = vertices[offsets[i]:offsets[i + 1]].tolist()
+    return entradas
+
+def cargar_snapshot(cuit):
+    """
+    Carga el último snapshot guardado para un CUIT
+
+    Returns:
+        Diccionario renspa -> entrada del snapshot (vacío si no existe)
+    """
+    try:
+        with open(_ruta_snapshot(cuit), encoding="utf-8") as f:
+            datos = json.load(f)
+        entradas = datos.get('entradas', {})
+        # Los snapshots anteriores a la codificación compacta tienen las coordenadas en cada entrada
+        if 'geometrias' in datos:
+            entradas = _decodificar_poligonos(entradas, datos['geometrias'])
+        return entradas
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def guardar_snapshot(cuit, entradas):
+    """Guarda el snapshot de un CUIT de forma atómica, con los polígonos codificados"""
+    os.makedirs(DIRECTORIO_SNAPSHOTS, exist_ok=True)
+    ruta = _ruta_snapshot(cuit)
+    ruta_tmp = f"{ruta}.tmp"
+    entradas, geometrias = _codificar_poligonos(entradas)
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        json.dump({'cuit': cuit, 'fecha': time.time(), 'geometrias': geometrias, 'entradas': entradas}, f)
+    os.replace(ruta_tmp, ruta)
+
+def clasificar_cambios(listado, snapshot):
+    """
+    Compara un listado de consultaPorCuit contra el snapshot guardado
+
+    Un RENSPA es nuevo si no estaba en el snapshot y modificado si cambió su
+    fecha_baja o el hash de su contenido.
+
+    Args:
+        listado: Lista de RENSPA devuelta por obtener_renspa_por_cuit
+        snapshot: Diccionario devuelto por cargar_snapshot
+
+    Returns:
+        Diccionario con las listas de RENSPA 'nuevos', 'modificados',
+        'sin_cambios' y 'eliminados'
+    """
+    cambios = {'nuevos': [], 'modificados': [], 'sin_cambios': [], 'eliminados': []}
+    vistos = set()
+
+    for item in listado:
+        renspa = item['renspa']
+        vistos.add(renspa)
+        anterior = snapshot.get(renspa)
+        if anterior is None:
+            cambios['nuevos'].append(renspa)
+        elif anterior['fecha_baja'] != item.get('fecha_baja') or anterior['hash'] != hash_item(item):
+            cambios['modificados'].append(renspa)
+        else:
+            cambios['sin_cambios'].append(renspa)
+
+    cambios['eliminados'] = [renspa for renspa in snapshot if renspa not in vistos]
+    return cambios
+
+class SeguimientoIncremental:
+    """
+    Snapshot de un CUIT durante una consulta: indica qué RENSPA se pueden
+    reutilizar, recibe los resultados nuevos y guarda el snapshot actualizado
+    """
+
+    def __init__(self, cuit, todos_renspa):
+        """
+        Args:
+            cuit: CUIT normalizado
+            todos_renspa: Listado completo y actual de obtener_renspa_por_cuit
+        """
+        self.cuit = cuit
+        self.todos_renspa = todos_renspa
+        self.snapshot = cargar_snapshot(cuit)
+        self.cambios = clasificar_cambios(todos_renspa, self.snapshot)
+        self._sin_cambios = set(self.cambios['sin_cambios'])
+        self._resueltos = {}
+
+    def reutilizable(self, renspa):
+        """
+        Returns:
+            Tupla (poligono_data, estado) guardada si el RENSPA no cambió y se
+            había resuelto, o None si hay que volver a consultarlo
+        """
+        if renspa not in self._sin_cambios:
+            return None
+        anterior = self.snapshot[renspa]
+        if anterior.get('estado') in (None, 'error'):
+            return None
+        return anterior['poligono'], anterior['estado']
+
+    def registrar(self, renspa, poligono_data, estado):
+        """Registra el resultado de un RENSPA procesado en esta consulta"""
+        self._resueltos[renspa] = (poligono_data, estado)
+
+    def guardar(self):
+        """Guarda el snapshot; los RENSPA sin cambios no procesados conservan lo ya resuelto"""
+        if not self.todos_renspa:
+            return
+        entradas = {}
+        for item in self.todos_renspa:
+            renspa = item['renspa']
+            if renspa in self._resueltos:
+                poligono_data, estado = self._resueltos[renspa]
+            elif renspa in self._sin_cambios:
+                anterior = self.snapshot[renspa]
+                poligono_data, estado = anterior.get('poligono'), anterior.get('estado')
+            else:
+                poligono_data, estado = None, None
+            entradas[renspa] = {
+                'hash': hash_item(item),
+                'fecha_baja': item.get('fecha_baja'),
+                'estado': estado,
+                'poligono': poligono_data
+            }
+        guardar_snapshot(self.cuit, entradas)
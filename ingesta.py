@@ -0,0 +1,228 @@
+import csv
+import os
+from io import StringIO
+
+import pandas as pd
+
+from validacion import digito_verificador_valido, estructura_renspa_valida
+
+# Cantidad de filas leídas por bloque al procesar archivos grandes
+TAMANO_CHUNK = 50000
+
+# Patrones aceptados para cada tipo de identificador
+PATRON_CUIT = r'\d{11}'
+PATRON_RENSPA_FORMATEADO = r'\d{2}\.\d{3}\.\d\.\d{5}/\d{2}'
+PATRON_RENSPA_NUMERICO = r'\d{13}'
+
+def normalizar_cuits(serie):
+    """
+    Normaliza una serie de CUITs al formato XX-XXXXXXXX-X de forma vectorizada
+
+    Args:
+        serie: pd.Series de strings
+
+    Returns:
+        Tupla (normalizados, motivos): dos pd.Series con el mismo índice. Los
+        CUITs con formato o dígito verificador inválido quedan en NaN en
+        normalizados y con el motivo del rechazo en motivos (NaN para los
+        válidos).
+    """
+    limpio = serie.astype("string").str.strip().str.replace(r'[-\s.]', '', regex=True)
+    valido = limpio.str.fullmatch(PATRON_CUIT).fillna(False).astype(bool)
+
+    normalizados = (limpio.str[:2] + "-" + limpio.str[2:10] + "-" + limpio.str[10]).where(valido)
+    motivos = pd.Series(pd.NA, index=serie.index, dtype="string")
+    motivos[~valido] = "CUIT inválido: debe tener 11 dígitos"
+
+    # Verificar el dígito verificador antes de gastar una consulta a la API
+    digito_ok = pd.Series(False, index=serie.index)
+    digito_ok[valido] = digito_verificador_valido(normalizados[valido])
+    motivos[valido & ~digito_ok] = "CUIT inválido: dígito verificador incorrecto"
+    return normalizados.where(digito_ok), motivos
+
+def normalizar_renspas(serie):
+    """
+    Normaliza una serie de RENSPA al formato ##.###.#.#####/## de forma vectorizada
+
+    Args:
+        serie: pd.Series de strings
+
+    Returns:
+        Tupla (normalizados, motivos), con la misma convención que normalizar_cuits
+    """
+    limpio = serie.astype("string").str.strip()
+    formateado = limpio.str.fullmatch(PATRON_RENSPA_FORMATEADO).fillna(False).astype(bool)
+    numerico = limpio.str.fullmatch(PATRON_RENSPA_NUMERICO).fillna(False).astype(bool)
+
+    normalizados = limpio.where(formateado)
+    desde_numerico = (limpio.str[0:2] + "." + limpio.str[2:5] + "." + limpio.str[5:6] + "."
+                      + limpio.str[6:11] + "/" + limpio.str[11:13])
+    normalizados = normalizados.mask(numerico, desde_numerico)
+
+    motivos = pd.Series(pd.NA, index=serie.index, dtype="string")
+    valido = formateado | numerico
+    motivos[~valido] = "Formato de RENSPA inválido"
+
+    # Verificar los códigos de provincia y departamento
+    estructura_ok = pd.Series(False, index=serie.index)
+    estructura_ok[valido] = estructura_renspa_valida(normalizados[valido])
+    motivos[valido & ~estructura_ok] = "RENSPA inválido: código de provincia o departamento inexistente"
+    return normalizados.where(estructura_ok), motivos
+
+NORMALIZADORES = {
+    'cuit': normalizar_cuits,
+    'renspa': normalizar_renspas,
+}
+
+def _leer_excel_por_bloques(archivo, columna, tamano_chunk):
+    """Lee un XLSX fila a fila (modo solo lectura) y lo devuelve en bloques indexados por fila de la hoja"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para cargar archivos XLSX, instala openpyxl con: pip install openpyxl")
+
+    libro = load_workbook(archivo, read_only=True, data_only=True)
+    try:
+        filas = libro.active.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+
+        # Elegir la columna por nombre; si no hay encabezado reconocible, usar la primera
+        nombres = [str(c).strip().lower() if c is not None else "" for c in encabezado]
+        if columna in nombres:
+            indice = nombres.index(columna)
+            bloque = []
+            primera = 2
+        else:
+            indice = 0
+            bloque = [encabezado[0]]
+            primera = 1
+
+        for fila in filas:
+            bloque.append(fila[indice] if len(fila) > indice else None)
+            if len(bloque) >= tamano_chunk:
+                yield pd.Series(bloque, index=pd.RangeIndex(primera, primera + len(bloque)), dtype="object")
+                primera += len(bloque)
+                bloque = []
+        if bloque:
+            yield pd.Series(bloque, index=pd.RangeIndex(primera, primera + len(bloque)), dtype="object")
+    finally:
+        libro.close()
+
+def leer_por_bloques(archivo, nombre, columna, tamano_chunk=TAMANO_CHUNK):
+    """
+    Lee un archivo TXT, CSV o XLSX en bloques de valores crudos
+
+    Args:
+        archivo: Objeto tipo archivo (por ejemplo, el de st.file_uploader) o ruta
+        nombre: Nombre del archivo, usado para detectar el formato
+        columna: Columna preferida en CSV/XLSX ('cuit' o 'renspa')
+        tamano_chunk: Cantidad de filas por bloque
+
+    Yields:
+        pd.Series con los valores de cada bloque, indexada por el número de
+        línea (o fila de la hoja) en el archivo, contando el encabezado
+    """
+    extension = os.path.splitext(nombre)[1].lower()
+
+    if extension == ".xlsx":
+        yield from _leer_excel_por_bloques(archivo, columna, tamano_chunk)
+        return
+
+    if extension == ".csv":
+        # Detectar el encabezado leyendo solo la primera fila
+        encabezado = pd.read_csv(archivo, nrows=0, dtype=str, encoding="utf-8-sig")
+        if hasattr(archivo, "seek"):
+            archivo.seek(0)
+        nombres = [str(c).strip().lower() for c in encabezado.columns]
+        # Las líneas en blanco se conservan (vacías) para no correr la numeración
+        if columna in nombres:
+            lector = pd.read_csv(archivo, dtype=str, usecols=[encabezado.columns[nombres.index(columna)]],
+                                 skip_blank_lines=False, chunksize=tamano_chunk, encoding="utf-8-sig")
+            primera = 2
+        else:
+            lector = pd.read_csv(archivo, dtype=str, header=None, usecols=[0],
+                                 skip_blank_lines=False, chunksize=tamano_chunk, encoding="utf-8-sig")
+            primera = 1
+    else:
+        # TXT: un valor por línea, sin separadores ni comillas
+        lector = pd.read_csv(archivo, dtype=str, header=None, names=["valor"], sep="\x1f",
+                             quoting=csv.QUOTE_NONE, skip_blank_lines=False, chunksize=tamano_chunk,
+                             encoding="utf-8-sig")
+        primera = 1
+
+    with lector:
+        for bloque in lector:
+            valores = bloque.iloc[:, 0]
+            valores.index = pd.RangeIndex(primera, primera + len(valores))
+            primera += len(valores)
+            yield valores
+
+def _procesar_bloques(bloques, tipo):
+    """
+    Normaliza, valida y de-duplica una secuencia de bloques de valores crudos,
+    indexados por número de línea (el que se reporta en 'fila')
+    """
+    normalizar = NORMALIZADORES[tipo]
+    validos = []
+    rechazados = []
+
+    for bloque in bloques:
+        # Descartar filas vacías sin reportarlas como error
+        bloque = bloque[bloque.notna() & (bloque.astype("string").str.strip() != "")]
+        normalizados, motivos = normalizar(bloque)
+
+        validos.append(normalizados[motivos.isna()])
+        rechazo = motivos.notna()
+        if rechazo.any():
+            rechazados.append(pd.DataFrame({
+                'fila': bloque.index[rechazo],
+                'valor': bloque[rechazo].astype("string").values,
+                'motivo': motivos[rechazo].values
+            }))
+
+    todos = pd.concat(validos) if validos else pd.Series([], dtype="string")
+
+    # De-duplicar conservando la primera aparición
+    duplicado = todos.duplicated()
+    if duplicado.any():
+        rechazados.append(pd.DataFrame({
+            'fila': todos.index[duplicado],
+            'valor': todos[duplicado].values,
+            'motivo': "Duplicado"
+        }))
+
+    if rechazados:
+        df_rechazados = pd.concat(rechazados, ignore_index=True).sort_values('fila', ignore_index=True)
+    else:
+        df_rechazados = pd.DataFrame({'fila': [], 'valor': [], 'motivo': []})
+
+    return todos[~duplicado].tolist(), df_rechazados
+
+def ingerir_archivo(archivo, tipo, nombre=None, tamano_chunk=TAMANO_CHUNK):
+    """
+    Carga un archivo de CUITs o RENSPA en bloques y lo normaliza de forma vectorizada
+
+    Args:
+        archivo: Objeto tipo archivo (por ejemplo, el de st.file_uploader) o ruta
+        tipo: 'cuit' o 'renspa'
+        nombre: Nombre del archivo; por defecto se toma de archivo.name
+        tamano_chunk: Cantidad de filas por bloque
+
+    Returns:
+        Tupla (lista, df_rechazados): lista de identificadores normalizados y
+        sin duplicados, y un DataFrame con columnas fila, valor y motivo
+    """
+    if nombre is None:
+        nombre = getattr(archivo, "name", str(archivo))
+    return _procesar_bloques(leer_por_bloques(archivo, nombre, tipo, tamano_chunk), tipo)
+
+def ingerir_texto(texto, tipo):
+    """
+    Normaliza identificadores ingresados manualmente (uno por línea)
+
+    Returns:
+        Tupla (lista, df_rechazados), igual que ingerir_archivo
+    """
+    return ingerir_archivo(StringIO(texto), tipo, nombre="entrada.txt")
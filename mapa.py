@@ -0,0 +1,199 @@
+import os
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+import metricas
+from cache import CacheLRU
+from geometria import UMBRAL_PARALELO, desempaquetar, empaquetar, simplificar
+from huellas import huella_poligonos
+
+# Intentar importar folium
+try:
+    import folium
+    from folium.plugins import MeasureControl, MiniMap
+    folium_disponible = True
+except ImportError:
+    folium_disponible = False
+
+# Tolerancia (metros) para simplificar polígonos en mapas con muchas parcelas
+TOLERANCIA_SIMPLIFICACION_MAPA = 2.0
+# Color de los polígonos que no están entre los resaltados
+COLOR_ATENUADO = 'gray'
+
+# Mapas ya renderizados (HTML) por huella del conjunto de polígonos y opciones
+MAX_MB_CACHE_MAPAS = int(os.environ.get("RENSPA_CACHE_MAPAS_MB", "128"))
+cache_mapas = CacheLRU(max_entradas=16, max_bytes=MAX_MB_CACHE_MAPAS * 1024 * 1024)
+metricas.registrar_cache("mapas", cache_mapas)
+
+# Función para crear el mapa base (capas, controles y grupo de polígonos)
+def crear_mapa_base(center=None, poligonos=None):
+    """
+    Crea un mapa folium con las capas base y controles, sin polígonos
+
+    Args:
+        center: Coordenadas del centro del mapa (opcional)
+        poligonos: Lista de polígonos usada para centrar el mapa si no se indica center
+
+    Returns:
+        Tupla (mapa, grupo) con el mapa folium y el FeatureGroup donde añadir polígonos
+    """
+    # Determinar centro del mapa
+    if center:
+        # Usar centro proporcionado
+        center_lat, center_lon = center
+    elif poligonos:
+        # Usar el primer polígono como referencia
+        center_lat = poligonos[0]['coords'][0][1]  # Latitud está en la segunda posición
+        center_lon = poligonos[0]['coords'][0][0]  # Longitud está en la primera posición
+    else:
+        # Centro predeterminado (Buenos Aires)
+        center_lat = -34.603722
+        center_lon = -58.381592
+
+    # Crear mapa base
+    m = folium.Map(location=[center_lat, center_lon], zoom_start=10)
+
+    # Añadir diferentes capas base
+    folium.TileLayer('https://mt1.google.com/vt/lyrs=y&x={x}&y={y}&z={z}',
+                    name='Google Hybrid',
+                    attr='Google').add_to(m)
+    folium.TileLayer('https://mt1.google.com/vt/lyrs=s&x={x}&y={y}&z={z}',
+                    name='Google Satellite',
+                    attr='Google').add_to(m)
+    folium.TileLayer('OpenStreetMap', name='OpenStreetMap').add_to(m)
+
+    # Añadir herramienta de medición
+    MeasureControl(position='topright',
+                  primary_length_unit='kilometers',
+                  secondary_length_unit='miles',
+                  primary_area_unit='hectares').add_to(m)
+
+    # Añadir mini mapa para ubicación
+    MiniMap().add_to(m)
+
+    # Crear grupos de capas para mejor organización
+    fg_poligonos = folium.FeatureGroup(name="Polígonos RENSPA").add_to(m)
+
+    # Añadir control de capas (las capas se enumeran al renderizar el mapa)
+    folium.LayerControl(position='topright').add_to(m)
+
+    return m, fg_poligonos
+
+# Función para añadir polígonos a un mapa ya creado
+def agregar_poligonos_mapa(fg_poligonos, poligonos, cuit_colors=None, resaltados=None):
+    """
+    Añade polígonos al grupo de un mapa creado con crear_mapa_base
+
+    Args:
+        fg_poligonos: FeatureGroup devuelto por crear_mapa_base
+        poligonos: Lista de diccionarios con los datos de polígonos
+        cuit_colors: Diccionario de colores por CUIT (opcional)
+        resaltados: Conjunto de RENSPA a resaltar; los demás polígonos se
+            dibujan atenuados (opcional)
+    """
+    # Con muchas parcelas, simplificar los contornos (en paralelo) para aligerar el HTML
+    if len(poligonos) >= UMBRAL_PARALELO:
+        vertices, offsets = simplificar(*empaquetar([pol['coords'] for pol in poligonos]),
+                                        tolerancia_m=TOLERANCIA_SIMPLIFICACION_MAPA)
+        contornos = desempaquetar(vertices, offsets)
+    else:
+        contornos = [pol['coords'] for pol in poligonos]
+
+    # Añadir cada polígono al mapa
+    for pol, contorno in zip(poligonos, contornos):
+        # Determinar color según CUIT si está disponible
+        if cuit_colors and 'cuit' in pol and pol['cuit'] in cuit_colors:
+            color = cuit_colors[pol['cuit']]
+        else:
+            color = 'green'
+        atenuado = resaltados is not None and pol['renspa'] not in resaltados
+        if atenuado:
+            color = COLOR_ATENUADO
+
+        # Formatear popup con información
+        popup_text = f"""
+        <b>RENSPA:</b> {pol['renspa']}<br>
+        <b>Titular:</b> {pol.get('titular', 'No disponible')}<br>
+        <b>Localidad:</b> {pol.get('localidad', 'No disponible')}<br>
+        <b>Superficie:</b> {pol.get('superficie', 0)} ha
+        """
+        if 'cuit' in pol:
+            popup_text += f"<br><b>CUIT:</b> {pol['cuit']}"
+
+        # Añadir polígono al mapa
+        folium.Polygon(
+            locations=[[coord[1], coord[0]] for coord in contorno],  # Invertir coordenadas para folium
+            color=color,
+            weight=1 if atenuado else 2,
+            fill=True,
+            fill_color=color,
+            fill_opacity=0.1 if atenuado else 0.3,
+            tooltip=f"RENSPA: {pol['renspa']}",
+            popup=popup_text
+        ).add_to(fg_poligonos)
+
+# Función para crear mapa con múltiples mejoras
+def crear_mapa_mejorado(poligonos, center=None, cuit_colors=None, resaltados=None):
+    """
+    Crea un mapa folium mejorado con los polígonos proporcionados
+
+    Args:
+        poligonos: Lista de diccionarios con los datos de polígonos
+        center: Coordenadas del centro del mapa (opcional)
+        cuit_colors: Diccionario de colores por CUIT (opcional)
+        resaltados: Conjunto de RENSPA a resaltar (opcional)
+
+    Returns:
+        Objeto mapa de folium
+    """
+    if not folium_disponible:
+        st.warning("Para visualizar mapas, instala folium y streamlit-folium con: pip install folium streamlit-folium")
+        return None
+
+    m, fg_poligonos = crear_mapa_base(center, poligonos)
+    agregar_poligonos_mapa(fg_poligonos, poligonos, cuit_colors, resaltados)
+    return m
+
+def clave_mapa(poligonos, center=None, cuit_colors=None, resaltados=None):
+    """Clave de caché del mapa de un conjunto de polígonos con sus opciones de representación"""
+    opciones = {'resaltados': sorted(resaltados)} if resaltados is not None else {}
+    return huella_poligonos(poligonos, center=center, cuit_colors=cuit_colors,
+                            tolerancia=TOLERANCIA_SIMPLIFICACION_MAPA, **opciones)
+
+def renderizar_html(m):
+    """Serializa un mapa folium a HTML (igual que folium_static)"""
+    return folium.Figure().add_child(m).render()
+
+def mostrar_html_mapa(html, width=1000, height=600):
+    """Muestra un mapa ya renderizado a HTML"""
+    components.html(html, height=height + 10, width=width)
+
+def mapa_html(poligonos, center=None, cuit_colors=None, resaltados=None, clave=None):
+    """
+    Devuelve el HTML del mapa de los polígonos, reutilizando el de la caché si
+    ya se renderizó el mismo conjunto con las mismas opciones
+
+    Args:
+        clave: Clave de clave_mapa ya calculada para estos polígonos y
+            opciones (evita volver a hashear los polígonos)
+
+    Returns:
+        String con el HTML del mapa, o None si folium no está disponible
+    """
+    if clave is None:
+        clave = clave_mapa(poligonos, center, cuit_colors, resaltados)
+    html = cache_mapas.obtener(clave)
+    if html is None:
+        m = crear_mapa_mejorado(poligonos, center=center, cuit_colors=cuit_colors, resaltados=resaltados)
+        if m is None:
+            return None
+        html = renderizar_html(m)
+        cache_mapas.guardar(clave, html)
+    return html
+
+def mostrar_mapa(poligonos, center=None, cuit_colors=None, width=1000, height=600, resaltados=None, clave=None):
+    """Muestra el mapa de los polígonos usando la caché de mapas renderizados"""
+    html = mapa_html(poligonos, center=center, cuit_colors=cuit_colors, resaltados=resaltados, clave=clave)
+    if html is not None:
+        mostrar_html_mapa(html, width=width, height=height)
@@ -0,0 +1,259 @@
+"""
+Métricas de operación en formato de texto de Prometheus
+
+Contadores e histogramas con etiquetas, seguros entre hilos y compartidos
+por todas las sesiones del proceso. Se exponen en un endpoint HTTP local
+(RENSPA_METRICAS_PUERTO) y/o se escriben periódicamente en un archivo
+(RENSPA_METRICAS_ARCHIVO), por ejemplo para el textfile collector de
+node_exporter.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+PUERTO_METRICAS = os.environ.get("RENSPA_METRICAS_PUERTO")
+ARCHIVO_METRICAS = os.environ.get("RENSPA_METRICAS_ARCHIVO")
+INTERVALO_ARCHIVO = 15  # segundos entre escrituras del archivo
+
+# Límites de los histogramas (segundos y bytes)
+BUCKETS_SEGUNDOS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BUCKETS_BYTES = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9)
+
+def _formatear_etiquetas(nombres, valores, extra=None):
+    pares = [f'{nombre}="{_escapar(valor)}"' for nombre, valor in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _formatear_numero(valor):
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    tipo = "counter"
+
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, valor=1, **etiquetas):
+        clave = tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+        with self._lock:
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def valor(self, **etiquetas):
+        clave = tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+        with self._lock:
+            return self._valores.get(clave, 0)
+
+    def lineas(self):
+        with self._lock:
+            valores = sorted(self._valores.items())
+        return [f"{self.nombre}{_formatear_etiquetas(self.etiquetas, clave)} {_formatear_numero(valor)}"
+                for clave, valor in valores]
+
+class Histograma:
+    """Histograma acumulativo con etiquetas (buckets, suma y cantidad)"""
+
+    tipo = "histogram"
+
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, **etiquetas):
+        clave = tuple(str(etiquetas.get(nombre, "")) for nombre in self.etiquetas)
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(clave)
+            if serie is None:
+                serie = self._series[clave] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @contextmanager
+    def medir(self, **etiquetas):
+        """Observa la duración del bloque en segundos"""
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(time.perf_counter() - inicio, **etiquetas)
+
+    def lineas(self):
+        with self._lock:
+            series = sorted((clave, (list(conteos), suma, cantidad))
+                            for clave, (conteos, suma, cantidad) in self._series.items())
+        lineas = []
+        for clave, (conteos, suma, cantidad) in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float("inf"),), conteos):
+                acumulado += conteo
+                etiquetas = _formatear_etiquetas(self.etiquetas, clave, f'le="{_formatear_numero(limite)}"')
+                lineas.append(f"{self.nombre}_bucket{etiquetas} {acumulado}")
+            etiquetas = _formatear_etiquetas(self.etiquetas, clave)
+            lineas.append(f"{self.nombre}_sum{etiquetas} {_formatear_numero(suma)}")
+            lineas.append(f"{self.nombre}_count{etiquetas} {cantidad}")
+        return lineas
+
+# Registro de métricas del proceso
+_metricas = {}
+_recolectores = []
+_lock_registro = threading.Lock()
+
+def _registrar(clase, nombre, ayuda, etiquetas, **opciones):
+    with _lock_registro:
+        metrica = _metricas.get(nombre)
+        if metrica is None:
+            metrica = _metricas[nombre] = clase(nombre, ayuda, etiquetas, **opciones)
+        return metrica
+
+def contador(nombre, ayuda, etiquetas=()):
+    """Devuelve el contador registrado con ese nombre, creándolo si no existe"""
+    return _registrar(Contador, nombre, ayuda, etiquetas)
+
+def histograma(nombre, ayuda, etiquetas=(), buckets=BUCKETS_SEGUNDOS):
+    """Devuelve el histograma registrado con ese nombre, creándolo si no existe"""
+    return _registrar(Histograma, nombre, ayuda, etiquetas, buckets=buckets)
+
+def registrar_recolector(funcion):
+    """
+    Registra una función que, al exportar, devuelve métricas calculadas en el
+    momento (por ejemplo, el estado de una caché)
+
+    Args:
+        funcion: Función sin argumentos que devuelve una lista de tuplas
+            (nombre, tipo, ayuda, etiquetas, valor), con etiquetas un diccionario
+    """
+    with _lock_registro:
+        _recolectores.append(funcion)
+
+def registrar_cache(nombre, cache):
+    """
+    Exporta el estado de una caché (CacheLRU o CacheCompartida) con la etiqueta cache=nombre
+    """
+    def recolectar():
+        estadisticas = cache.estadisticas()
+        etiquetas = {'cache': nombre}
+        return [
+            ("cache_aciertos_total", "counter", "Lecturas de caché resueltas sin recalcular", etiquetas,
+             estadisticas['aciertos']),
+            ("cache_fallos_total", "counter", "Lecturas de caché sin valor vigente", etiquetas,
+             estadisticas['fallos']),
+            ("cache_descartes_total", "counter", "Entradas descartadas por límite de tamaño", etiquetas,
+             estadisticas['descartes']),
+            ("cache_entradas", "gauge", "Entradas en la caché", etiquetas, estadisticas['entradas']),
+            ("cache_bytes", "gauge", "Tamaño estimado de la caché", etiquetas, estadisticas['bytes']),
+        ]
+    registrar_recolector(recolectar)
+
+def texto_prometheus():
+    """Devuelve todas las métricas en el formato de texto de Prometheus (0.0.4)"""
+    with _lock_registro:
+        metricas = sorted(_metricas.values(), key=lambda m: m.nombre)
+        recolectores = list(_recolectores)
+
+    lineas = []
+    for metrica in metricas:
+        lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+        lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+        lineas.extend(metrica.lineas())
+
+    # Agrupar por nombre las muestras de los recolectores
+    muestras = {}
+    for recolector in recolectores:
+        try:
+            for nombre, tipo, ayuda, etiquetas, valor in recolector():
+                muestras.setdefault(nombre, (tipo, ayuda, []))[2].append((etiquetas, valor))
+        except Exception:
+            logger.exception("Error en un recolector de métricas")
+    for nombre, (tipo, ayuda, valores) in sorted(muestras.items()):
+        lineas.append(f"# HELP {nombre} {ayuda}")
+        lineas.append(f"# TYPE {nombre} {tipo}")
+        for etiquetas, valor in valores:
+            lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas.keys(), etiquetas.values())} "
+                          f"{_formatear_numero(valor)}")
+
+    return "\n".join(lineas) + "\n"
+
+def escribir_archivo(ruta):
+    """Escribe las métricas en un archivo de forma atómica"""
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    ruta_tmp = f"{ruta}.tmp"
+    with open(ruta_tmp, "w", encoding="utf-8") as f:
+        f.write(texto_prometheus())
+    os.replace(ruta_tmp, ruta)
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        cuerpo = texto_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_servidor(puerto, host="127.0.0.1"):
+    """Inicia el endpoint /metrics en un hilo de fondo y devuelve el servidor"""
+    servidor = ThreadingHTTPServer((host, int(puerto)), _ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name="metricas-http", daemon=True).start()
+    return servidor
+
+def _escribir_periodicamente(ruta, intervalo):
+    while True:
+        try:
+            escribir_archivo(ruta)
+        except OSError:
+            logger.exception("No se pudo escribir el archivo de métricas %s", ruta)
+        time.sleep(intervalo)
+
+_exportacion_iniciada = False
+
+def iniciar_exportacion(puerto=None, archivo=None):
+    """
+    Inicia, una sola vez por proceso, el endpoint y/o el archivo de métricas
+    configurados (por defecto, RENSPA_METRICAS_PUERTO y RENSPA_METRICAS_ARCHIVO)
+    """
+    global _exportacion_iniciada
+    with _lock_registro:
+        if _exportacion_iniciada:
+            return
+        _exportacion_iniciada = True
+
+    puerto = puerto or PUERTO_METRICAS
+    archivo = archivo or ARCHIVO_METRICAS
+    if puerto:
+        try:
+            iniciar_servidor(puerto)
+        except OSError as e:
+            logger.warning("No se pudo iniciar el endpoint de métricas en el puerto %s: %s", puerto, e)
+    if archivo:
+        threading.Thread(target=_escribir_periodicamente, args=(archivo, INTERVALO_ARCHIVO),
+                         name="metricas-archivo", daemon=True).start()
@@ -0,0 +1,276 @@
+"""
+Perfilado opcional de las consultas de la interfaz
+
+Con RENSPA_PERFILADO=1 (o el interruptor oculto de la barra lateral, que se
+muestra abriendo la aplicación con ?diagnostico en la URL) cada consulta se
+ejecuta bajo un perfilador por muestreo: un hilo toma la pila del hilo de la
+consulta cada RENSPA_PERFIL_INTERVALO_MS milisegundos, sin instrumentar cada
+llamada. Al terminar se guarda en RENSPA_PERFILES_DIR/<id de ejecución>/:
+
+- perfil.speedscope.json: para abrir en https://www.speedscope.app
+- perfil.folded: pilas colapsadas para flamegraph.pl o inferno
+- memoria.txt: pico de memoria de tracemalloc y las líneas que más memoria
+  tenían asignada en la instantánea tomada cerca del pico
+- resumen.json: duración, muestras, memoria residente máxima del proceso,
+  pico de tracemalloc y error, si lo hubo
+
+El muestreo agrega alrededor de un 1 % al tiempo de la consulta. tracemalloc,
+en cambio, intercepta cada asignación y puede hacer la consulta varias veces
+más lenta (unas 6 veces al generar KML y GeoJSON), lo que además deforma el
+perfil de tiempos: por eso se activa aparte, con RENSPA_PERFIL_MEMORIA=1 o la
+segunda casilla del interruptor. tracemalloc es global al proceso: si se
+perfilan dos sesiones a la vez, el pico de memoria incluye lo que asignaron
+ambas.
+"""
+import json
+import logging
+import os
+import resource
+import secrets
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit as st
+
+logger = logging.getLogger(__name__)
+
+PERFILADO_ACTIVO = os.environ.get("RENSPA_PERFILADO", "0") == "1"
+MEMORIA_ACTIVA = os.environ.get("RENSPA_PERFIL_MEMORIA", "0") == "1"
+DIRECTORIO_PERFILES = os.environ.get("RENSPA_PERFILES_DIR", os.path.join(".renspa_cache", "perfiles"))
+INTERVALO_MUESTREO = float(os.environ.get("RENSPA_PERFIL_INTERVALO_MS", "5")) / 1000  # segundos
+
+# Claves de los interruptores de la barra lateral en st.session_state
+CLAVE_PERFILADO = "perfilado"
+CLAVE_MEMORIA = "perfilado_memoria"
+
+# Instantánea de memoria: cuando el uso supera en esta fracción al de la última
+# instantánea, como mucho una vez por INTERVALO_INSTANTANEAS segundos
+CRECIMIENTO_INSTANTANEA = 0.1
+INTERVALO_INSTANTANEAS = 0.2
+LINEAS_MEMORIA = 25
+
+# Ejecuciones en curso que usan tracemalloc: se detiene al terminar la última
+_usos_tracemalloc = 0
+_lock_tracemalloc = threading.Lock()
+
+class _Muestreador(threading.Thread):
+    """Hilo que toma la pila de otro hilo a intervalos regulares"""
+
+    def __init__(self, id_hilo, intervalo, memoria):
+        super().__init__(name="perfilado-muestreo", daemon=True)
+        self.id_hilo = id_hilo
+        self.intervalo = intervalo
+        self.memoria = memoria
+        self.marcos = {}        # (función, archivo, línea) -> índice
+        self.pilas = {}         # tupla de índices de marcos (de la raíz a la hoja) -> índice
+        self.muestras = []      # (índice de pila, segundos)
+        self.instantanea = None
+        self._memoria_instantanea = 0
+        self._ultima_instantanea = 0.0
+        self._detener = threading.Event()
+
+    def _pila(self, marco):
+        indices = []
+        while marco is not None:
+            codigo = marco.f_code
+            clave = (codigo.co_name, codigo.co_filename, codigo.co_firstlineno)
+            indice = self.marcos.get(clave)
+            if indice is None:
+                indice = self.marcos[clave] = len(self.marcos)
+            indices.append(indice)
+            marco = marco.f_back
+        pila = tuple(reversed(indices))
+        indice = self.pilas.get(pila)
+        if indice is None:
+            indice = self.pilas[pila] = len(self.pilas)
+        return indice
+
+    def _revisar_memoria(self, ahora):
+        if not tracemalloc.is_tracing():
+            return
+        actual, _ = tracemalloc.get_traced_memory()
+        if (actual > self._memoria_instantanea * (1 + CRECIMIENTO_INSTANTANEA)
+                and ahora - self._ultima_instantanea >= INTERVALO_INSTANTANEAS):
+            self.instantanea = tracemalloc.take_snapshot()
+            self._memoria_instantanea = actual
+            self._ultima_instantanea = ahora
+
+    def run(self):
+        anterior = time.perf_counter()
+        while not self._detener.wait(self.intervalo):
+            ahora = time.perf_counter()
+            marco = sys._current_frames().get(self.id_hilo)
+            if marco is not None:
+                self.muestras.append((self._pila(marco), ahora - anterior))
+            del marco
+            anterior = ahora
+            if self.memoria:
+                self._revisar_memoria(ahora)
+
+    def detener(self):
+        self._detener.set()
+        self.join()
+
+class Ejecucion:
+    """Una ejecución perfilada y su directorio de resultados"""
+
+    def __init__(self, nombre, directorio=None):
+        self.nombre = nombre
+        self.id = f"{datetime.now():%Y%m%d-%H%M%S}-{nombre}-{secrets.token_hex(3)}"
+        self.directorio = os.path.join(directorio or DIRECTORIO_PERFILES, self.id)
+
+def _iniciar_tracemalloc():
+    global _usos_tracemalloc
+    with _lock_tracemalloc:
+        if _usos_tracemalloc == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _usos_tracemalloc += 1
+        tracemalloc.reset_peak()
+
+def _detener_tracemalloc():
+    """Devuelve el pico de memoria y detiene tracemalloc si no lo usa otra ejecución"""
+    global _usos_tracemalloc
+    with _lock_tracemalloc:
+        pico = tracemalloc.get_traced_memory()[1]
+        _usos_tracemalloc -= 1
+        if _usos_tracemalloc == 0:
+            tracemalloc.stop()
+        return pico
+
+def _speedscope(ejecucion, muestreador, duracion):
+    marcos = sorted(muestreador.marcos.items(), key=lambda par: par[1])
+    pilas = sorted(muestreador.pilas.items(), key=lambda par: par[1])
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": ejecucion.id,
+        "exporter": "renspa-perfilado",
+        "shared": {"frames": [{"name": nombre, "file": archivo, "line": linea}
+                              for (nombre, archivo, linea), _ in marcos]},
+        "profiles": [{
+            "type": "sampled",
+            "name": ejecucion.nombre,
+            "unit": "seconds",
+            "startValue": 0,
+            "endValue": duracion,
+            "samples": [list(pilas[indice][0]) for indice, _ in muestreador.muestras],
+            "weights": [segundos for _, segundos in muestreador.muestras],
+        }],
+    }
+
+def _pilas_colapsadas(muestreador):
+    """Líneas 'raíz;...;hoja milisegundos' del formato de flamegraph.pl"""
+    nombres = {indice: f"{nombre} ({os.path.basename(archivo)}:{linea})"
+               for (nombre, archivo, linea), indice in muestreador.marcos.items()}
+    pilas = {indice: pila for pila, indice in muestreador.pilas.items()}
+    tiempos = {}
+    for indice, segundos in muestreador.muestras:
+        tiempos[indice] = tiempos.get(indice, 0.0) + segundos
+    return "".join(f"{';'.join(nombres[marco] for marco in pilas[indice])} {max(1, round(segundos * 1000))}\n"
+                   for indice, segundos in sorted(tiempos.items()))
+
+def _informe_memoria(pico, instantanea):
+    lineas = [f"Pico de memoria asignada (tracemalloc): {pico / 1e6:.1f} MB\n"]
+    if instantanea is not None:
+        estadisticas = instantanea.statistics('lineno')
+        total = sum(estadistica.size for estadistica in estadisticas)
+        lineas.append(f"Instantánea cerca del pico: {total / 1e6:.1f} MB asignados\n\n")
+        for estadistica in estadisticas[:LINEAS_MEMORIA]:
+            lineas.append(f"{estadistica.size / 1e6:10.2f} MB {estadistica.count:9d} bloques  {estadistica.traceback}\n")
+    return "".join(lineas)
+
+def _rss_maximo():
+    """Memoria residente máxima del proceso en bytes (ru_maxrss está en KB en Linux)"""
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maximo if sys.platform == "darwin" else maximo * 1024
+
+def _guardar(ejecucion, muestreador, duracion, pico, error):
+    os.makedirs(ejecucion.directorio, exist_ok=True)
+    with open(os.path.join(ejecucion.directorio, "perfil.speedscope.json"), "w", encoding="utf-8") as f:
+        json.dump(_speedscope(ejecucion, muestreador, duracion), f)
+    with open(os.path.join(ejecucion.directorio, "perfil.folded"), "w", encoding="utf-8") as f:
+        f.write(_pilas_colapsadas(muestreador))
+    if pico is not None:
+        with open(os.path.join(ejecucion.directorio, "memoria.txt"), "w", encoding="utf-8") as f:
+            f.write(_informe_memoria(pico, muestreador.instantanea))
+    with open(os.path.join(ejecucion.directorio, "resumen.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            'id': ejecucion.id,
+            'nombre': ejecucion.nombre,
+            'duracion_s': round(duracion, 3),
+            'muestras': len(muestreador.muestras),
+            'intervalo_ms': muestreador.intervalo * 1000,
+            'rss_maximo_bytes': _rss_maximo(),
+            'pico_tracemalloc_bytes': pico,
+            'error': error,
+        }, f, indent=2, ensure_ascii=False)
+
+@contextmanager
+def perfilar(nombre, directorio=None, intervalo=None, memoria=False):
+    """
+    Perfila el bloque por muestreo y guarda los resultados en un directorio propio
+
+    Args:
+        nombre: Nombre de la ejecución (forma parte de su id)
+        directorio: Directorio base (por defecto RENSPA_PERFILES_DIR)
+        intervalo: Segundos entre muestras (por defecto RENSPA_PERFIL_INTERVALO_MS)
+        memoria: Si se registra el pico de memoria con tracemalloc (mucho más lento)
+
+    Yields:
+        La Ejecucion, con su id y directorio
+    """
+    ejecucion = Ejecucion(nombre, directorio)
+    if memoria:
+        _iniciar_tracemalloc()
+    muestreador = _Muestreador(threading.get_ident(), intervalo or INTERVALO_MUESTREO, memoria)
+    inicio = time.perf_counter()
+    muestreador.start()
+    error = None
+    try:
+        yield ejecucion
+    except BaseException as e:
+        error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        muestreador.detener()
+        duracion = time.perf_counter() - inicio
+        pico = _detener_tracemalloc() if memoria else None
+        try:
+            _guardar(ejecucion, muestreador, duracion, pico, error)
+            logger.info("Perfil de %s guardado en %s", nombre, ejecucion.directorio)
+        except OSError as e:
+            logger.warning("No se pudo guardar el perfil de %s: %s", nombre, e)
+
+def perfilado_activo():
+    """Si el perfilado está activado por variable de entorno o por el interruptor de la sesión"""
+    return PERFILADO_ACTIVO or bool(st.session_state.get(CLAVE_PERFILADO, False))
+
+def memoria_activa():
+    """Si el perfilado registra también la memoria con tracemalloc"""
+    return MEMORIA_ACTIVA or bool(st.session_state.get(CLAVE_MEMORIA, False))
+
+def mostrar_interruptor():
+    """
+    Muestra en la barra lateral los interruptores de perfilado si la
+    aplicación se abrió con ?diagnostico en la URL
+    """
+    if "diagnostico" not in st.experimental_get_query_params():
+        return
+    st.sidebar.checkbox("Perfilar las consultas", value=PERFILADO_ACTIVO, key=CLAVE_PERFILADO)
+    st.sidebar.checkbox("Registrar memoria con tracemalloc (más lento)", value=MEMORIA_ACTIVA, key=CLAVE_MEMORIA)
+
+@contextmanager
+def perfilar_si_activo(nombre):
+    """
+    Perfila el bloque solo si el perfilado está activo, e informa en la barra
+    lateral dónde se guardó el perfil
+    """
+    if not perfilado_activo():
+        yield None
+        return
+    with perfilar(nombre, memoria=memoria_activa()) as ejecucion:
+        yield ejecucion
+    st.sidebar.caption(f"Perfil de {nombre}: `{ejecucion.directorio}`")
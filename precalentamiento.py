@@ -0,0 +1,198 @@
+"""
+Precalentamiento programado de las cachés para una lista de CUITs en seguimiento
+
+Los CUITs que se consultan todos los días se listan en un archivo (TXT, CSV o
+XLSX, como los de la pestaña "Consulta por Múltiples CUITs") indicado en
+RENSPA_SEGUIMIENTO. Un hilo del proceso de Streamlit los procesa una vez por
+día a la hora RENSPA_PRECALENTAMIENTO_HORA (05:00 por defecto): vuelve a
+descargar el listado y los detalles de cada CUIT, al mismo ritmo que una
+sesión, y los deja en la caché compartida de senasa hasta después de la
+próxima ejecución. Además guarda el resultado de la consulta por CUIT tal
+como lo muestra la primera pestaña (polígonos ya parseados y archivos de
+descarga ya generados), así que esas consultas no hacen peticiones ni
+vuelven a procesar nada. El archivo se vuelve a leer en cada ejecución.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import metricas
+import senasa
+from cache import CacheLRU
+from ingesta import ingerir_archivo
+from procesamiento import Procesamiento, exportar
+
+logger = logging.getLogger(__name__)
+
+ARCHIVO_SEGUIMIENTO = os.environ.get("RENSPA_SEGUIMIENTO")
+HORA_PRECALENTAMIENTO = os.environ.get("RENSPA_PRECALENTAMIENTO_HORA", "05:00")
+# Si se precalienta también al iniciar el proceso (sin esperar a la hora programada)
+PRECALENTAR_AL_INICIAR = os.environ.get("RENSPA_PRECALENTAMIENTO_AL_INICIAR", "0") == "1"
+MAX_MB_PRECALENTADOS = int(os.environ.get("RENSPA_PRECALENTAMIENTO_MB", "256"))
+# Lo precalentado dura hasta la próxima ejecución más este margen, para que no
+# venza mientras esa ejecución todavía no llegó a refrescarlo
+MARGEN_VIGENCIA = 2 * 3600  # segundos
+
+class Precalentado:
+    """Resultado de la consulta por CUIT de la primera pestaña, preparado de antemano"""
+
+    def __init__(self, listado, procesamiento, archivos):
+        """
+        Args:
+            listado: Listado del CUIT
+            procesamiento: Procesamiento ya ejecutado (con solo_activos e incluir_cuit=False)
+            archivos: Archivos de descarga, como los devuelve exportar_cuit
+        """
+        self.listado = listado
+        self.procesamiento = procesamiento
+        # Bytes en lugar de BytesIO: los archivos se comparten entre sesiones
+        self.archivos = [(etiqueta, nombre, mime, datos.getvalue() if hasattr(datos, "getvalue") else datos)
+                         for etiqueta, nombre, mime, datos in archivos]
+        self.fecha = datetime.datetime.now()
+
+def _tamano_precalentado(precalentado):
+    # Los polígonos en memoria ocupan aproximadamente lo mismo que su GeoJSON
+    archivos = sum(len(datos) for _, _, _, datos in precalentado.archivos)
+    return 2 * archivos + len(repr(precalentado.procesamiento.registros))
+
+resultados_precalentados = CacheLRU(
+    max_entradas=10000,
+    max_bytes=MAX_MB_PRECALENTADOS * 1024 * 1024,
+    tamano=_tamano_precalentado,
+)
+
+_cuits_precalentados = metricas.contador(
+    "precalentamiento_cuits_total", "CUITs en seguimiento procesados por el precalentamiento", ("resultado",)
+)
+_duracion_precalentamiento = metricas.histograma(
+    "precalentamiento_duracion_segundos", "Duración de cada ejecución del precalentamiento",
+    buckets=(60.0, 300.0, 900.0, 1800.0, 3600.0, 7200.0, 14400.0)
+)
+metricas.registrar_cache("precalentados", resultados_precalentados)
+
+def exportar_cuit(procesamiento, cuit):
+    """Archivos de descarga de la consulta por CUIT de la primera pestaña"""
+    return exportar(
+        procesamiento,
+        f"renspa_{cuit.replace('-', '')}",
+        f"RENSPA - CUIT {cuit}",
+        f"Polígonos de RENSPA para el CUIT {cuit}"
+    )
+
+def precalentado(cuit):
+    """Resultado precalentado de un CUIT normalizado (solo RENSPA activos), o None"""
+    return resultados_precalentados.obtener((senasa.API_BASE_URL, cuit))
+
+def cargar_seguimiento(ruta=None):
+    """CUITs normalizados del archivo de seguimiento (por defecto, RENSPA_SEGUIMIENTO)"""
+    ruta = ruta or ARCHIVO_SEGUIMIENTO
+    cuits, rechazados = ingerir_archivo(ruta, 'cuit')
+    if not rechazados.empty:
+        logger.warning("Se descartaron %d entradas inválidas o duplicadas de %s", len(rechazados), ruta)
+    return cuits
+
+def segundos_hasta(hora, ahora=None):
+    """Segundos hasta la próxima vez que el reloj marque la hora indicada ("HH:MM")"""
+    horas, minutos = (int(parte) for parte in hora.split(":"))
+    ahora = ahora or datetime.datetime.now()
+    proxima = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    if proxima <= ahora:
+        proxima += datetime.timedelta(days=1)
+    return (proxima - ahora).total_seconds()
+
+def precalentar_cuit(cuit, vigencia):
+    """
+    Refresca el listado y los detalles de un CUIT y guarda su resultado precalentado
+
+    Returns:
+        True si se guardó el resultado; False si el listado (completo o
+        alguna de sus páginas) o algún detalle falló. En ese caso no se
+        guarda ni se refresca el resultado precalentado; los detalles
+        obtenidos quedan igual en la caché compartida.
+    """
+    listados = []
+    procesamiento = Procesamiento('cuit', incluir_cuit=False, hilos=1, al_listar=listados.append,
+                                  refrescar=True, vigencia=vigencia)
+    for _ in procesamiento.ejecutar([cuit]):
+        pass
+    if not listados or procesamiento.errores_listados or procesamiento.estados['error']:
+        return False
+    resultados_precalentados.guardar(
+        (senasa.API_BASE_URL, listados[0].cuit),
+        Precalentado(listados[0], procesamiento, exportar_cuit(procesamiento, listados[0].cuit)),
+        vigencia,
+    )
+    return True
+
+def precalentar(cuits, vigencia=None):
+    """
+    Precalienta una lista de CUITs, uno por vez y sin plazo
+
+    Args:
+        cuits: CUITs normalizados
+        vigencia: Segundos que dura lo precalentado (por defecto, hasta la
+            próxima ejecución programada más MARGEN_VIGENCIA)
+
+    Returns:
+        Counter con la cantidad de CUITs 'precalentados' y 'fallidos'
+    """
+    if vigencia is None:
+        vigencia = segundos_hasta(HORA_PRECALENTAMIENTO) + MARGEN_VIGENCIA
+    inicio = time.perf_counter()
+    resumen = Counter()
+    for cuit in cuits:
+        try:
+            precalentado_ok = precalentar_cuit(cuit, vigencia)
+        except Exception:
+            logger.exception("Error precalentando el CUIT %s", cuit)
+            precalentado_ok = False
+        resultado = 'precalentados' if precalentado_ok else 'fallidos'
+        resumen[resultado] += 1
+        _cuits_precalentados.inc(resultado=resultado)
+    duracion = time.perf_counter() - inicio
+    _duracion_precalentamiento.observar(duracion)
+    logger.info("Precalentamiento: %d CUITs precalentados y %d fallidos en %.0f s",
+                resumen['precalentados'], resumen['fallidos'], duracion)
+    return resumen
+
+def _precalentar_periodicamente(ruta, hora, al_iniciar):
+    if not al_iniciar:
+        time.sleep(segundos_hasta(hora))
+    while True:
+        try:
+            precalentar(cargar_seguimiento(ruta))
+        except Exception:
+            logger.exception("No se pudo precalentar la lista de seguimiento %s", ruta)
+        time.sleep(segundos_hasta(hora))
+
+_precalentamiento_iniciado = False
+_lock_inicio = threading.Lock()
+
+def iniciar_precalentamiento(ruta=None, hora=None, al_iniciar=None):
+    """
+    Inicia, una sola vez por proceso, el precalentamiento programado de la
+    lista de seguimiento configurada (por defecto, RENSPA_SEGUIMIENTO,
+    RENSPA_PRECALENTAMIENTO_HORA y RENSPA_PRECALENTAMIENTO_AL_INICIAR). Sin
+    lista de seguimiento no hace nada.
+    """
+    global _precalentamiento_iniciado
+    ruta = ruta or ARCHIVO_SEGUIMIENTO
+    hora = hora or HORA_PRECALENTAMIENTO
+    al_iniciar = PRECALENTAR_AL_INICIAR if al_iniciar is None else al_iniciar
+    if not ruta:
+        return
+    with _lock_inicio:
+        if _precalentamiento_iniciado:
+            return
+        _precalentamiento_iniciado = True
+
+    try:
+        segundos_hasta(hora)
+    except ValueError:
+        logger.warning("Hora de precalentamiento inválida: %s (formato HH:MM)", hora)
+        return
+    threading.Thread(target=_precalentar_periodicamente, args=(ruta, hora, al_iniciar),
+                     name="precalentamiento", daemon=True).start()
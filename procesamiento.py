@@ -0,0 +1,494 @@
+"""
+Procesamiento por etapas de las consultas de RENSPA
+
+Las tres pestañas, el rastreo por shards y los benchmarks recorren el mismo
+flujo, configurado con un Procesamiento:
+
+1. resolver_entradas: normaliza los CUIT o RENSPA y omite los que SENASA ya
+   informó como desconocidos
+2. obtener_listados: listado de consultaPorCuit de cada CUIT; para RENSPA
+   sueltos, el item de un listado descargado recientemente, si lo hay
+3. planificar_detalles: decide qué RENSPA necesitan consultaPorNumero. No lo
+   necesitan los que tienen un polígono legible en el listado ni los que la
+   actualización incremental puede reutilizar
+4. consultar_detalles: consultaPorNumero de los planificados
+5. parsear: polígono de la respuesta del detalle
+6. enriquecer: fila de la tabla, snapshot incremental y recolección de
+   registros y polígonos (en memoria o en un AlmacenTemporal)
+7. exportar: KMZ, GeoJSON y CSV de lo recolectado (función exportar)
+
+Cada etapa es un generador que consume el de la anterior, así que cada RENSPA
+llega a la interfaz apenas se resuelve. El tiempo propio de cada etapa se
+acumula en Procesamiento.tiempos y en la métrica procesamiento_etapa_segundos.
+Las dos etapas de consulta usan la caché compartida de senasa y pueden
+repartirse en RENSPA_HILOS_CONSULTA hilos (1 por defecto: cada hilo hace su
+propia pausa entre peticiones, así que más hilos suben el ritmo contra la API).
+
+Los polígonos se parsean en lote con geometria.parsear_poligonos, que a partir
+de UMBRAL_PARALELO polígonos reparte el trabajo en el pool de procesos: los de
+un listado, todos juntos al planificar su primer RENSPA, y los de los detalles,
+en los lotes que arma _en_lotes.
+"""
+import contextvars
+import os
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import metricas
+from esquema import dataframe_renspa
+from geometria import UMBRAL_PARALELO, desempaquetar, parsear_poligonos
+from exportacion import (
+    generar_kml,
+    generar_kmz,
+    generar_geojson,
+    generar_csv,
+    escribir_kml,
+    escribir_kmz,
+    escribir_geojson,
+    escribir_csv,
+)
+from incremental import SeguimientoIncremental
+from senasa import (
+    normalizar_cuit,
+    normalizar_renspa,
+    listar_renspa_por_cuit,
+    consultar_renspa_detalle,
+    item_de_listado,
+    poligono_de_listado,
+    poligono_de_detalle,
+    extender_plazo,
+    identificador_desconocido,
+    SIN_PARSEAR,
+)
+from validacion import guardar_desconocidos
+
+HILOS_CONSULTA = int(os.environ.get("RENSPA_HILOS_CONSULTA", "1"))
+# Un lote de detalles a parsear se cierra si pasó este tiempo desde el anterior
+ESPERA_LOTE_PARSEO = 0.05  # segundos
+
+ETAPAS = ('resolver_entradas', 'obtener_listados', 'planificar_detalles', 'consultar_detalles',
+          'parsear', 'enriquecer')
+
+_duracion_etapas = metricas.histograma(
+    "procesamiento_etapa_segundos", "Tiempo propio de cada etapa del procesamiento por ejecución",
+    ("tipo", "etapa")
+)
+_elementos_procesados = metricas.contador(
+    "procesamiento_renspa_total", "RENSPA procesados por estado del polígono", ("tipo", "estado")
+)
+
+def _mapear_en_hilos(funcion, elementos, hilos):
+    """
+    Aplica `funcion` a cada elemento en `hilos` hilos, entregando los
+    resultados en orden y con como mucho dos tareas pendientes por hilo
+
+    Los elementos se leen en el hilo llamador, así que las etapas anteriores
+    no se ejecutan en los hilos. Cada tarea corre con el contexto del llamador
+    (plazo del trabajo) y el de Streamlit, para que los errores se muestren.
+    """
+    if hilos <= 1:
+        for elemento in elementos:
+            yield funcion(elemento)
+        return
+
+    contexto_streamlit = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="procesamiento",
+                            initializer=lambda: add_script_run_ctx(threading.current_thread(),
+                                                                   contexto_streamlit)) as ejecutor:
+        pendientes = deque()
+        for elemento in elementos:
+            pendientes.append(ejecutor.submit(contextvars.copy_context().run, funcion, elemento))
+            if len(pendientes) >= 2 * hilos:
+                yield pendientes.popleft().result()
+        while pendientes:
+            yield pendientes.popleft().result()
+
+def _en_lotes(elementos, tamano, espera):
+    """
+    Agrupa los elementos en lotes de hasta `tamano`
+
+    Un lote se entrega al llenarse, con el último RENSPA a procesar de su
+    listado o cuando pasaron `espera` segundos desde el anterior, así que solo
+    se acumulan los elementos que llegan rápido (por ejemplo, de la caché) y la
+    vista progresiva no espera al listado siguiente.
+    """
+    lote, inicio = [], time.monotonic()
+    for elemento in elementos:
+        lote.append(elemento)
+        listado = elemento.listado
+        fin_listado = listado is not None and elemento.item is listado.a_procesar[-1]
+        if len(lote) >= tamano or fin_listado or time.monotonic() - inicio >= espera:
+            yield lote
+            lote, inicio = [], time.monotonic()
+    if lote:
+        yield lote
+
+def _parsear_lote(poligonos_str):
+    """Coordenadas de cada string de polígono (None si es ilegible), parseadas juntas"""
+    if not poligonos_str:
+        return []
+    vertices, offsets, validos = parsear_poligonos(poligonos_str)
+    anillos = iter(desempaquetar(vertices, offsets))
+    return [next(anillos) if valido else None for valido in validos]
+
+def _coordenadas_listado(listado):
+    """Parsea juntos los polígonos del listado a procesar la primera vez que se piden"""
+    if listado.coordenadas is None:
+        seguimiento = listado.seguimiento
+        items = [item for item in listado.a_procesar
+                 if isinstance(item.get('poligono'), str) and item['poligono']
+                 and not (seguimiento and seguimiento.reutilizable(item['renspa']))]
+        listado.coordenadas = dict(zip((item['renspa'] for item in items),
+                                       _parsear_lote([item['poligono'] for item in items])))
+    return listado.coordenadas
+
+class Listado:
+    """Listado de un CUIT durante el procesamiento"""
+
+    def __init__(self, cuit, items, a_procesar, seguimiento=None, error=None):
+        """
+        Args:
+            cuit: CUIT normalizado
+            items: Todos los RENSPA del listado
+            a_procesar: RENSPA del listado cuyos polígonos se buscan
+            seguimiento: SeguimientoIncremental del CUIT, en modo incremental
+            error: Mensaje de error si el listado no se pudo obtener completo
+                (items tiene lo obtenido hasta el error)
+        """
+        self.cuit = cuit
+        self.error = error
+        self.items = items
+        self.a_procesar = a_procesar
+        self.seguimiento = seguimiento
+        self.pendientes = len(a_procesar)
+        # renspa -> coordenadas del polígono del listado, parseadas en lote al planificar
+        self.coordenadas = None
+
+class Elemento:
+    """
+    Un RENSPA a lo largo de las etapas
+
+    estado es 'ok', 'fallido' (polígono ilegible), 'sin_poligono', 'error'
+    (no se pudo consultar el detalle) o, para RENSPA sueltos, 'sin_datos'
+    (SENASA no devolvió el RENSPA). fila es el registro de la tabla para los
+    RENSPA sueltos; los de un listado se registran con su listado.
+    """
+
+    __slots__ = ('renspa', 'item', 'cuit', 'listado', 'de_listado', 'consultar', 'detalle',
+                 'poligono', 'estado', 'fila')
+
+    def __init__(self, item, cuit=None, listado=None, de_listado=True):
+        self.renspa = item['renspa']
+        self.item = item
+        self.cuit = cuit
+        self.listado = listado
+        self.de_listado = de_listado
+        self.consultar = False
+        self.detalle = None
+        self.poligono = None
+        self.estado = None
+        self.fila = None
+
+class Procesamiento:
+    """
+    Configuración y estado de un procesamiento por etapas
+
+    ejecutar(entradas) devuelve un generador de Elementos resueltos. Mientras
+    avanza se recolectan los registros (el listado completo de cada CUIT o la
+    fila de cada RENSPA suelto) y los polígonos obtenidos, en memoria o en el
+    almacén indicado.
+    """
+
+    def __init__(self, tipo, solo_activos=True, buscar_poligonos=True, incremental=False, incluir_cuit=True,
+                 almacen=None, hilos=None, al_listar=None, refrescar=False, vigencia=None):
+        """
+        Args:
+            tipo: 'cuit' o 'renspa', el tipo de las entradas
+            solo_activos: Si solo se buscan los polígonos de los RENSPA activos (entradas 'cuit')
+            buscar_poligonos: Si se buscan los polígonos o solo los listados
+            incremental: Si se reutilizan los resultados sin cambios de la última consulta de cada CUIT
+            incluir_cuit: Si los registros de los listados llevan su CUIT
+            almacen: AlmacenTemporal donde recolectar (None para recolectar en memoria)
+            hilos: Hilos de las etapas de consulta (por defecto RENSPA_HILOS_CONSULTA)
+            al_listar: Función llamada con cada Listado apenas se obtiene, antes
+                de procesar sus RENSPA (entradas 'cuit')
+            refrescar: Si se vuelven a consultar los listados y detalles aunque
+                estén en la caché compartida
+            vigencia: Segundos que duran en la caché compartida las respuestas
+                consultadas (por defecto, RENSPA_CACHE_TTL)
+        """
+        if tipo not in ('cuit', 'renspa'):
+            raise ValueError(f"Tipo de entrada inválido: {tipo}")
+        self.tipo = tipo
+        self.solo_activos = solo_activos
+        self.buscar_poligonos = buscar_poligonos
+        self.incremental = incremental
+        self.incluir_cuit = incluir_cuit
+        self.almacen = almacen
+        self.hilos = hilos or HILOS_CONSULTA
+        self.al_listar = al_listar
+        self.refrescar = refrescar
+        self.vigencia = vigencia
+
+        self.invalidos = []
+        self.desconocidos = []
+        self.errores_listados = []
+        self.listados = 0
+        self.registros = []
+        self.poligonos = []
+        self.estados = Counter()
+        self.cambios = Counter()
+        self._inclusivos = dict.fromkeys(ETAPAS, 0.0)
+
+    @property
+    def total_registros(self):
+        return self.almacen.total_registros if self.almacen else len(self.registros)
+
+    @property
+    def total_poligonos(self):
+        return self.almacen.total_poligonos if self.almacen else len(self.poligonos)
+
+    @property
+    def tiempos(self):
+        """Segundos propios de cada etapa (sin contar los de las anteriores)"""
+        tiempos, anterior = {}, 0.0
+        for etapa in ETAPAS:
+            tiempos[etapa] = max(self._inclusivos[etapa] - anterior, 0.0)
+            anterior = self._inclusivos[etapa]
+        return tiempos
+
+    def dataframe(self):
+        """Registros recolectados en memoria como DataFrame tipado (esquema.ESQUEMA_RENSPA)"""
+        return dataframe_renspa(self.registros)
+
+    def ejecutar(self, entradas):
+        """
+        Encadena las etapas sobre las entradas
+
+        Args:
+            entradas: Iterable de CUITs o RENSPA (según el tipo), normalizados o no
+
+        Yields:
+            Cada Elemento resuelto, en el orden de las entradas
+        """
+        flujo = entradas
+        for etapa in ETAPAS:
+            flujo = self._medir(etapa, getattr(self, etapa)(flujo))
+        try:
+            yield from flujo
+        finally:
+            for etapa, segundos in self.tiempos.items():
+                _duracion_etapas.observar(segundos, tipo=self.tipo, etapa=etapa)
+            # Los desconocidos de este lote quedan disponibles para los demás procesos
+            guardar_desconocidos()
+
+    def _medir(self, etapa, generador):
+        # Tiempo de cada paso del generador, que incluye el de las etapas anteriores
+        while True:
+            inicio = time.perf_counter()
+            try:
+                elemento = next(generador)
+            except StopIteration:
+                return
+            finally:
+                self._inclusivos[etapa] += time.perf_counter() - inicio
+            yield elemento
+
+    def resolver_entradas(self, entradas):
+        """Normaliza las entradas; las inválidas quedan en invalidos y las desconocidas en desconocidos"""
+        normalizar = normalizar_cuit if self.tipo == 'cuit' else normalizar_renspa
+        vistas = set()
+        for entrada in entradas:
+            try:
+                identificador = normalizar(entrada)
+            except ValueError as e:
+                self.invalidos.append((entrada, str(e)))
+                continue
+            if identificador in vistas:
+                continue
+            vistas.add(identificador)
+            if identificador_desconocido(self.tipo, identificador):
+                self.desconocidos.append(identificador)
+                continue
+            yield identificador
+
+    def obtener_listados(self, identificadores):
+        """
+        Elementos de los RENSPA a procesar de cada listado (o de cada RENSPA
+        suelto); los CUITs cuyo listado falló quedan en errores_listados
+        """
+        if self.tipo == 'renspa':
+            for renspa in identificadores:
+                item = item_de_listado(renspa)
+                yield Elemento(item or {'renspa': renspa}, de_listado=item is not None)
+            return
+
+        def listar(cuit):
+            return cuit, *listar_renspa_por_cuit(cuit, refrescar=self.refrescar, vigencia=self.vigencia)
+
+        for cuit, items, error in _mapear_en_hilos(listar, identificadores, self.hilos):
+            extender_plazo(len(items))
+            self.listados += 1
+            if error:
+                self.errores_listados.append((cuit, error))
+            if self.incluir_cuit:
+                for item in items:
+                    item['cuit'] = cuit
+            if self.almacen:
+                self.almacen.agregar_registros(items)
+            else:
+                self.registros.extend(items)
+
+            a_procesar = []
+            if self.buscar_poligonos:
+                a_procesar = [item for item in items if item.get('fecha_baja') is None] if self.solo_activos else items
+            seguimiento = None
+            # Un listado incompleto no sirve para comparar con el snapshot (faltarían RENSPA)
+            if self.incremental and self.buscar_poligonos and not error:
+                seguimiento = SeguimientoIncremental(cuit, items)
+                for clave, renspas in seguimiento.cambios.items():
+                    self.cambios[clave] += len(renspas)
+            listado = Listado(cuit, items, a_procesar, seguimiento, error)
+            if self.al_listar:
+                self.al_listar(listado)
+            if seguimiento and not a_procesar:
+                seguimiento.guardar()
+
+            for item in a_procesar:
+                yield Elemento(item, cuit=cuit, listado=listado)
+
+    def planificar_detalles(self, elementos):
+        """Resuelve sin consultar los RENSPA reutilizables o con polígono en el listado"""
+        for elemento in elementos:
+            listado = elemento.listado
+            seguimiento = listado.seguimiento if listado else None
+            reutilizado = seguimiento.reutilizable(elemento.renspa) if seguimiento else None
+            if reutilizado:
+                elemento.poligono, elemento.estado = reutilizado
+            elif elemento.de_listado:
+                coordenadas = _coordenadas_listado(listado).get(elemento.renspa, SIN_PARSEAR) if listado \
+                    else SIN_PARSEAR
+                elemento.poligono = poligono_de_listado(elemento.item, elemento.cuit, coordenadas)
+                if elemento.poligono is not None:
+                    elemento.estado = 'ok'
+            elemento.consultar = elemento.estado is None
+            yield elemento
+
+    def consultar_detalles(self, elementos):
+        """Consulta el detalle de los RENSPA planificados"""
+        def consultar(elemento):
+            if elemento.consultar:
+                elemento.detalle = consultar_renspa_detalle(elemento.renspa, refrescar=self.refrescar,
+                                                            vigencia=self.vigencia)
+            return elemento
+        yield from _mapear_en_hilos(consultar, elementos, self.hilos)
+
+    def parsear(self, elementos):
+        """Obtiene el polígono de la respuesta del detalle, parseando en lotes"""
+        for lote in _en_lotes(elementos, UMBRAL_PARALELO, ESPERA_LOTE_PARSEO):
+            a_parsear = []
+            for elemento in lote:
+                if not elemento.consultar:
+                    continue
+                if not elemento.de_listado and elemento.detalle is not None:
+                    # RENSPA suelto: los datos del titular salen del propio detalle
+                    if not elemento.detalle.get('items'):
+                        elemento.estado = 'sin_datos'
+                        continue
+                    elemento.item = {**elemento.detalle['items'][0], 'renspa': elemento.renspa}
+                a_parsear.append(elemento)
+
+            # Solo se parsean los detalles con un string de polígono; el resto lo resuelve poligono_de_detalle
+            cadenas = {}
+            for i, elemento in enumerate(a_parsear):
+                items = elemento.detalle.get('items') if elemento.detalle else None
+                poligono_str = items[0].get('poligono') if items else None
+                if poligono_str and isinstance(poligono_str, str):
+                    cadenas[i] = poligono_str
+            parseados = dict(zip(cadenas, _parsear_lote(list(cadenas.values()))))
+
+            for i, elemento in enumerate(a_parsear):
+                elemento.poligono, elemento.estado = poligono_de_detalle(
+                    elemento.item, elemento.detalle, elemento.cuit, parseados.get(i, SIN_PARSEAR)
+                )
+            yield from lote
+
+    def enriquecer(self, elementos):
+        """Registra cada resultado: fila, polígono y snapshot incremental"""
+        for elemento in elementos:
+            self.estados[elemento.estado] += 1
+            _elementos_procesados.inc(tipo=self.tipo, estado=elemento.estado)
+
+            if elemento.listado is None and elemento.estado not in ('error', 'sin_datos'):
+                elemento.fila = {
+                    'renspa': elemento.renspa,
+                    'titular': elemento.item.get('titular', ''),
+                    'localidad': elemento.item.get('localidad', ''),
+                    'superficie': elemento.item.get('superficie', 0),
+                    'fecha_baja': elemento.item.get('fecha_baja', None)
+                }
+                if self.almacen:
+                    self.almacen.agregar_registros([elemento.fila])
+                else:
+                    self.registros.append(elemento.fila)
+
+            if elemento.estado == 'ok':
+                if self.almacen:
+                    self.almacen.agregar_poligonos([elemento.poligono])
+                else:
+                    self.poligonos.append(elemento.poligono)
+
+            listado = elemento.listado
+            if listado is not None and listado.seguimiento is not None:
+                listado.seguimiento.registrar(elemento.renspa, elemento.poligono, elemento.estado)
+                listado.pendientes -= 1
+                if listado.pendientes == 0:
+                    listado.seguimiento.guardar()
+            yield elemento
+
+def exportar(procesamiento, nombre_base, titulo, descripcion, cuit_colors=None):
+    """
+    Genera el KMZ y el GeoJSON (si hay polígonos) y el CSV de lo recolectado
+
+    En memoria los archivos se generan completos; con almacén se escriben
+    dentro de él leyendo sus bloques de a uno.
+
+    Args:
+        procesamiento: Procesamiento ya ejecutado
+        nombre_base: Nombre de los archivos, sin extensión
+        titulo: Nombre del documento KML
+        descripcion: Descripción del documento KML
+        cuit_colors: Diccionario de colores por CUIT (opcional)
+
+    Returns:
+        Lista de tuplas (etiqueta, nombre de archivo, tipo MIME, datos). Con
+        almacén, datos es None y el archivo está en almacen.ruta(nombre)
+    """
+    almacen = procesamiento.almacen
+    incluir_cuit = procesamiento.tipo == 'cuit' and procesamiento.incluir_cuit
+    archivos = []
+    if procesamiento.total_poligonos:
+        if almacen:
+            escribir_kml(almacen.iterar_buffers_poligonos(), almacen.ruta("doc.kml"), titulo, descripcion,
+                         cuit_colors=cuit_colors, incluir_cuit=incluir_cuit)
+            escribir_kmz(almacen.ruta("doc.kml"), almacen.ruta(f"{nombre_base}.kmz"))
+            escribir_geojson(almacen.iterar_buffers_poligonos(), almacen.ruta(f"{nombre_base}.geojson"))
+            kmz, geojson = None, None
+        else:
+            kmz = generar_kmz(generar_kml(procesamiento.poligonos, titulo, descripcion,
+                                          cuit_colors=cuit_colors, incluir_cuit=incluir_cuit))
+            geojson = generar_geojson(procesamiento.poligonos)
+        archivos.append(("Descargar KMZ", f"{nombre_base}.kmz", "application/vnd.google-earth.kmz", kmz))
+        archivos.append(("Descargar GeoJSON", f"{nombre_base}.geojson", "application/json", geojson))
+    if procesamiento.total_registros:
+        if almacen:
+            escribir_csv(almacen.iterar_registros(), almacen.ruta(f"{nombre_base}.csv"), almacen.columnas_registros())
+            csv = None
+        else:
+            csv = generar_csv(procesamiento.dataframe())
+        archivos.append(("Descargar CSV", f"{nombre_base}.csv", "text/csv", csv))
+    return archivos
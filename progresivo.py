@@ -0,0 +1,210 @@
+import time
+
+import pandas as pd
+import streamlit as st
+
+from mapa import (
+    agregar_poligonos_mapa,
+    cache_mapas,
+    clave_mapa,
+    crear_mapa_base,
+    folium_disponible,
+    mostrar_html_mapa,
+    renderizar_html,
+)
+
+# Filas acumuladas antes de añadirlas a la tabla
+TAMANO_LOTE_TABLA = 50
+# Segundos máximos sin actualizar la tabla aunque el lote no esté completo
+INTERVALO_TABLA = 1.0
+# Segundos mínimos entre dos actualizaciones del mapa
+INTERVALO_MAPA = 5.0
+# Filas y polígonos mostrados en el modo de memoria acotada (el resto solo se exporta)
+MAX_FILAS_ACOTADO = 1000
+MAX_POLIGONOS_ACOTADO = 5000
+# Columnas con listas de coordenadas, que no se muestran en la tabla
+_COLUMNAS_NO_TABULARES = ('coords',)
+
+def _tipos_estables(df):
+    """
+    Fija los tipos de las columnas para que todos los lotes tengan el mismo
+    esquema (add_rows rechaza lotes con tipos distintos a los de la tabla)
+    """
+    df = df.drop(columns=[c for c in df.columns if c in _COLUMNAS_NO_TABULARES], errors="ignore")
+    for columna in df.columns:
+        if pd.api.types.is_numeric_dtype(df[columna]) and not pd.api.types.is_bool_dtype(df[columna]):
+            df[columna] = df[columna].astype("float64")
+        else:
+            df[columna] = df[columna].astype("string")
+    return df
+
+class VistaProgresiva:
+    """
+    Contenedores de resultados que se completan a medida que avanza un lote
+
+    Reserva, en orden, los lugares de las métricas, la tabla, las estadísticas
+    y el mapa. La tabla crece por lotes con add_rows (solo se envían las filas
+    nuevas) y el mapa se vuelve a dibujar como mucho cada INTERVALO_MAPA
+    segundos, añadiendo al mapa existente solo los polígonos nuevos. El mapa
+    final queda en la caché de mapas renderizados (mapa.cache_mapas), con la
+    clave clave_mapa, para volver a mostrarlo en las ejecuciones siguientes.
+
+    Con max_filas/max_poligonos la vista guarda y muestra solo los primeros
+    resultados, para que su memoria no crezca con el tamaño del lote.
+    """
+
+    def __init__(self, titulo_tabla, mostrar_mapa=True, cuit_colors=None,
+                 tamano_lote=TAMANO_LOTE_TABLA, intervalo_tabla=INTERVALO_TABLA, intervalo_mapa=INTERVALO_MAPA,
+                 max_filas=None, max_poligonos=None):
+        """
+        Args:
+            titulo_tabla: Subtítulo de la tabla de resultados
+            mostrar_mapa: Si se reserva el lugar del mapa de polígonos
+            cuit_colors: Diccionario de colores por CUIT (opcional)
+            tamano_lote: Filas acumuladas antes de actualizar la tabla
+            intervalo_tabla: Segundos máximos entre actualizaciones de la tabla
+            intervalo_mapa: Segundos mínimos entre actualizaciones del mapa
+            max_filas: Filas máximas de la tabla (None para todas)
+            max_poligonos: Polígonos máximos del mapa (None para todos)
+        """
+        self.cuit_colors = cuit_colors
+        self.tamano_lote = tamano_lote
+        self.intervalo_tabla = intervalo_tabla
+        self.intervalo_mapa = intervalo_mapa
+        self.max_filas = max_filas
+        self.max_poligonos = max_poligonos
+        self.filas_omitidas = 0
+        self.poligonos_omitidos = 0
+
+        self.metricas = st.empty()
+        st.subheader(titulo_tabla)
+        self._contenedor_tabla = st.empty()
+        self.estadisticas = st.container()
+
+        self.mostrar_mapa = mostrar_mapa and folium_disponible
+        if self.mostrar_mapa:
+            self._contenedor_mapa = st.empty()
+        elif mostrar_mapa:
+            st.warning("Para visualizar mapas, instala folium y streamlit-folium con: pip install folium streamlit-folium")
+
+        self._tabla = None
+        self._columnas = None
+        self._filas = []
+        self._filas_pendientes = []
+        self._ultima_tabla = time.monotonic()
+
+        self._mapa = None
+        self._grupo = None
+        self._poligonos = []
+        self._html_mapa = None
+        self.clave_mapa = None
+        self._poligonos_pendientes = []
+        self._ultimo_mapa = 0.0
+        self._duracion_mapa = 0.0
+
+    def actualizar_metricas(self, valores, titulo=None):
+        """Muestra las métricas indicadas (etiqueta -> valor) en una fila de columnas"""
+        with self.metricas.container():
+            if titulo:
+                st.subheader(titulo)
+            columnas = st.columns(len(valores))
+            for columna, (etiqueta, valor) in zip(columnas, valores.items()):
+                with columna:
+                    st.metric(etiqueta, valor)
+
+    def agregar_filas(self, filas, inmediato=False):
+        """Acumula filas (diccionarios) y actualiza la tabla al completar un lote"""
+        filas, omitidas = self._dentro_del_limite(filas, self.max_filas,
+                                                  len(self._filas) + len(self._filas_pendientes))
+        self.filas_omitidas += len(omitidas)
+        self._filas_pendientes.extend(filas)
+        if (inmediato or len(self._filas_pendientes) >= self.tamano_lote
+                or time.monotonic() - self._ultima_tabla >= self.intervalo_tabla):
+            self._volcar_tabla()
+
+    def agregar_poligonos(self, poligonos):
+        """Acumula polígonos y actualiza el mapa si pasó el intervalo mínimo"""
+        if not self.mostrar_mapa:
+            return
+        poligonos, omitidos = self._dentro_del_limite(poligonos, self.max_poligonos, len(self._poligonos))
+        self.poligonos_omitidos += len(omitidos)
+        self._poligonos.extend(poligonos)
+        self._poligonos_pendientes.extend(poligonos)
+        # El intervalo crece con el tiempo de dibujo para que el mapa no domine el lote
+        intervalo = max(self.intervalo_mapa, 2 * self._duracion_mapa)
+        if self._poligonos_pendientes and time.monotonic() - self._ultimo_mapa >= intervalo:
+            self._volcar_mapa()
+
+    def mostrar_aviso_tabla(self, mensaje):
+        """Muestra un aviso en el lugar de la tabla (por ejemplo, si no hubo resultados)"""
+        self._contenedor_tabla.warning(mensaje)
+
+    def finalizar(self):
+        """Vuelca las filas y polígonos pendientes"""
+        self._volcar_tabla()
+        if self.filas_omitidas or self.poligonos_omitidos:
+            self.estadisticas.caption(
+                f"Se muestran los primeros {len(self._filas)} RENSPA y {len(self._poligonos)} polígonos; "
+                "los resultados completos están en las descargas."
+            )
+        if not self.mostrar_mapa or not self._poligonos:
+            return
+
+        # Si el mismo conjunto ya se renderizó (en esta u otra consulta), reutilizarlo
+        clave = self.clave_mapa = clave_mapa(self._poligonos, cuit_colors=self.cuit_colors)
+        html = cache_mapas.obtener(clave)
+        if html is not None:
+            self._poligonos_pendientes = []
+            self._mostrar_mapa(html)
+            return
+        if self._poligonos_pendientes or self._mapa is None:
+            self._volcar_mapa()
+        cache_mapas.guardar(clave, self._html_mapa)
+
+    @staticmethod
+    def _dentro_del_limite(elementos, limite, actuales):
+        """Separa los elementos que entran en el límite de los que se omiten"""
+        if limite is None:
+            return elementos, []
+        disponibles = max(limite - actuales, 0)
+        return elementos[:disponibles], elementos[disponibles:]
+
+    def _volcar_tabla(self):
+        self._ultima_tabla = time.monotonic()
+        if not self._filas_pendientes:
+            return
+        lote = _tipos_estables(pd.DataFrame(self._filas_pendientes))
+        # Continuar la numeración de las filas ya mostradas
+        lote.index += len(self._filas)
+        self._filas.extend(self._filas_pendientes)
+        self._filas_pendientes = []
+
+        if self._tabla is not None and list(lote.dtypes.items()) == self._columnas:
+            # Enviar al navegador solo las filas nuevas
+            self._tabla.add_rows(lote)
+            return
+
+        # Primer lote o esquema distinto: dibujar la tabla completa
+        tabla = _tipos_estables(pd.DataFrame(self._filas))
+        self._columnas = list(tabla.dtypes.items())
+        self._tabla = self._contenedor_tabla.dataframe(tabla)
+
+    def _volcar_mapa(self):
+        if not self._poligonos_pendientes:
+            return
+        inicio = time.monotonic()
+        if self._mapa is None:
+            self._mapa, self._grupo = crear_mapa_base(poligonos=self._poligonos_pendientes)
+        # Solo se construyen los polígonos nuevos; los anteriores ya están en el grupo
+        agregar_poligonos_mapa(self._grupo, self._poligonos_pendientes, self.cuit_colors)
+        self._poligonos_pendientes = []
+
+        self._html_mapa = renderizar_html(self._mapa)
+        self._mostrar_mapa(self._html_mapa)
+        self._ultimo_mapa = time.monotonic()
+        self._duracion_mapa = self._ultimo_mapa - inicio
+
+    def _mostrar_mapa(self, html):
+        with self._contenedor_mapa.container():
+            st.subheader("Visualización de polígonos")
+            mostrar_html_mapa(html, width=1000, height=600)
@@ -0,0 +1,476 @@
+"""
+Estadísticas zonales sin conexión sobre rasters locales
+
+Calcula, para cada polígono, estadísticas de los píxeles de un raster local:
+la clase mayoritaria de un mapa de clasificación de cultivos o la media de
+un índice continuo (NDVI, etc.). Los rasters pueden ser exportaciones de
+Earth Engine guardadas en disco o mapas de clasificación propios:
+
+- GeoTIFF, leídos por ventanas con rasterio (opcional)
+- .npy con un archivo .json al lado con la georreferencia (transform en el
+  orden de GDAL, nodata, crs y nombres de las clases), que se abren con
+  memoria mapeada: solo se leen del disco las páginas de las ventanas que
+  cubren los polígonos
+
+Los polígonos se rasterizan por filas: para cada fila de píxeles se calculan
+a la vez los cruces con todas las aristas y se obtienen los tramos
+[columna_inicio, columna_fin) cuyo centro cae dentro del polígono.
+
+Los tramos de cada polígono (su máscara, codificada por tramos) se guardan en
+caché por huella de la geometría y grilla del raster, en memoria y en disco.
+Como los rasters de distintas campañas suelen compartir la grilla, cada campo
+se rasteriza una sola vez y las estadísticas de todas las campañas se
+reducen a leer los píxeles por índice y agregarlos con np.bincount.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+try:
+    import rasterio
+    from rasterio.windows import Window
+    rasterio_disponible = True
+except ImportError:
+    rasterio_disponible = False
+
+import metricas
+from cache import CacheLRU
+from geometria import empaquetar
+
+# Directorio con un raster por campaña (por ejemplo, 2019-2020.tif o 2019-2020.npy)
+DIRECTORIO_RASTERS = os.environ.get("RENSPA_RASTERS_DIR", os.path.join(".renspa_cache", "rasters"))
+EXTENSIONES_RASTER = ('.npy', '.tif', '.tiff')
+_PATRON_CAMPANA = re.compile(r'(\d{4})[-_](\d{4})')
+
+# Máscaras rasterizadas guardadas en disco, un archivo por grilla
+DIRECTORIO_MASCARAS = os.environ.get("RENSPA_MASCARAS_DIR", os.path.join(".renspa_cache", "mascaras"))
+
+# Tramos por (huella de la geometría, grilla); cada tramo ocupa 12 bytes
+cache_mascaras = CacheLRU(
+    max_entradas=500_000,
+    max_bytes=256 * 1024 * 1024,
+    tamano=lambda tramos: tramos.nbytes
+)
+metricas.registrar_cache("mascaras", cache_mascaras)
+_grillas_cargadas = set()
+
+# Tamaño máximo de la tabla polígonos x clases que se cuenta con np.bincount
+MAX_CELDAS_CONTEO = 50_000_000
+
+def _ruta_georreferencia(ruta):
+    return os.path.splitext(ruta)[0] + ".json"
+
+def guardar_raster_npy(ruta, datos, transform, nodata=None, clases=None):
+    """
+    Guarda un raster en el formato .npy + .json
+
+    Args:
+        ruta: Archivo .npy de salida
+        datos: Array 2D (filas, columnas)
+        transform: (x0, dx, 0, y0, 0, dy) en el orden de GDAL, en grados
+        nodata: Valor sin datos (opcional)
+        clases: Diccionario código -> nombre de la clase (opcional)
+    """
+    np.save(ruta, np.ascontiguousarray(datos))
+    georreferencia = {
+        'transform': [float(v) for v in transform],
+        'nodata': nodata,
+        'crs': "EPSG:4326",
+        'clases': {str(codigo): nombre for codigo, nombre in (clases or {}).items()},
+    }
+    with open(_ruta_georreferencia(ruta), "w", encoding="utf-8") as f:
+        json.dump(georreferencia, f)
+
+class RasterLocal:
+    """
+    Raster de una banda en EPSG:4326, sin rotación, leído por ventanas
+    """
+
+    def __init__(self, ruta):
+        """
+        Args:
+            ruta: Archivo .npy (con su .json) o GeoTIFF
+        """
+        self.ruta = ruta
+        self._dataset = None
+        self.datos = None
+
+        if ruta.endswith('.npy'):
+            with open(_ruta_georreferencia(ruta), encoding="utf-8") as f:
+                georreferencia = json.load(f)
+            self.datos = np.load(ruta, mmap_mode='r')
+            if self.datos.ndim != 2:
+                raise ValueError(f"{ruta}: se esperaba un raster de una banda (2 dimensiones)")
+            self.transform = tuple(float(v) for v in georreferencia['transform'])
+            self.nodata = georreferencia.get('nodata')
+            self.crs = georreferencia.get('crs', "EPSG:4326")
+            self.clases = {int(codigo): nombre for codigo, nombre in georreferencia.get('clases', {}).items()}
+            self.alto, self.ancho = self.datos.shape
+        else:
+            if not rasterio_disponible:
+                raise ImportError("Para leer GeoTIFF instala rasterio con: pip install rasterio")
+            self._dataset = rasterio.open(ruta)
+            t = self._dataset.transform
+            self.transform = (t.c, t.a, t.b, t.f, t.d, t.e)
+            self.nodata = self._dataset.nodata
+            self.crs = self._dataset.crs.to_string() if self._dataset.crs else "EPSG:4326"
+            self.clases = {}
+            self.alto, self.ancho = self._dataset.height, self._dataset.width
+
+        if self.transform[2] or self.transform[4]:
+            raise ValueError(f"{ruta}: no se admiten rasters rotados")
+        if self.crs.upper() not in ("EPSG:4326", "OGC:CRS84"):
+            raise ValueError(f"{ruta}: el raster debe estar en EPSG:4326 (tiene {self.crs})")
+
+    def leer_ventana(self, fila0, fila1, col0, col1):
+        """Lee las filas [fila0, fila1) y columnas [col0, col1) del raster"""
+        if self.datos is not None:
+            return np.asarray(self.datos[fila0:fila1, col0:col1])
+        return self._dataset.read(1, window=Window(col0, fila0, col1 - col0, fila1 - fila0))
+
+    def a_pixeles(self, vertices):
+        """Convierte vértices [lon, lat] a coordenadas de píxel [columna, fila] (continuas)"""
+        x0, dx, _, y0, _, dy = self.transform
+        return np.column_stack(((vertices[:, 0] - x0) / dx, (vertices[:, 1] - y0) / dy))
+
+    def cerrar(self):
+        if self._dataset is not None:
+            self._dataset.close()
+        self.datos = None
+
+def rasterizar(pixeles, alto, ancho):
+    """
+    Rasteriza un anillo en coordenadas de píxel
+
+    Un píxel pertenece al polígono si su centro está dentro (regla par-impar).
+
+    Args:
+        pixeles: Array (N, 2) con [columna, fila] del anillo (cerrado o no)
+        alto, ancho: Tamaño de la grilla
+
+    Returns:
+        Array int32 (M, 3) de tramos [fila, columna_inicio, columna_fin)
+    """
+    if len(pixeles) < 3:
+        return np.empty((0, 3), dtype=np.int32)
+    fila0 = max(int(np.floor(pixeles[:, 1].min())), 0)
+    fila1 = min(int(np.ceil(pixeles[:, 1].max())), alto)
+    if fila1 <= fila0:
+        return np.empty((0, 3), dtype=np.int32)
+
+    # Aristas del anillo cerrado (si ya estaba cerrado, la arista extra es un punto y no cruza)
+    anillo = np.concatenate((pixeles, pixeles[:1]))
+    x1, y1 = anillo[:-1, 0], anillo[:-1, 1]
+    x2, y2 = anillo[1:, 0], anillo[1:, 1]
+    centros = np.arange(fila0, fila1, dtype=np.float64)[:, None] + 0.5
+
+    # Cruces de cada fila con cada arista (filas x aristas)
+    cruza = (y1 <= centros) != (y2 <= centros)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = x1 + (centros - y1) * (x2 - x1) / (y2 - y1)
+    x = np.where(cruza, x, np.inf)
+    x.sort(axis=1)
+
+    tramos = []
+    filas = np.arange(fila0, fila1)
+    for j in range(0, int(cruza.sum(axis=1).max()), 2):
+        entrada, salida = x[:, j], x[:, j + 1]
+        validos = np.isfinite(salida)
+        inicio = np.clip(np.ceil(entrada[validos] - 0.5), 0, ancho).astype(np.int32)
+        fin = np.clip(np.ceil(salida[validos] - 0.5), 0, ancho).astype(np.int32)
+        tramos.append(np.column_stack((filas[validos], inicio, fin)).astype(np.int32))
+    tramos = np.concatenate(tramos) if tramos else np.empty((0, 3), dtype=np.int32)
+    return tramos[tramos[:, 2] > tramos[:, 1]]
+
+def _valores_tramos(raster, tramos):
+    """Lee los valores de los píxeles de los tramos con una sola ventana"""
+    fila0, fila1 = tramos[:, 0].min(), tramos[:, 0].max() + 1
+    col0, col1 = tramos[:, 1].min(), tramos[:, 2].max()
+    ventana = raster.leer_ventana(fila0, fila1, col0, col1)
+
+    largos = tramos[:, 2] - tramos[:, 1]
+    comienzos = np.repeat(np.cumsum(largos) - largos, largos)
+    filas = np.repeat(tramos[:, 0] - fila0, largos)
+    columnas = np.arange(largos.sum()) - comienzos + np.repeat(tramos[:, 1] - col0, largos)
+    return ventana[filas, columnas]
+
+def clave_grilla(raster):
+    """Identifica la grilla de un raster (tamaño y georreferencia), no su contenido"""
+    grilla = repr((raster.alto, raster.ancho, tuple(raster.transform)))
+    return hashlib.sha1(grilla.encode('ascii')).hexdigest()[:16]
+
+def _ruta_mascaras(grilla):
+    return os.path.join(DIRECTORIO_MASCARAS, f"{grilla}.npz")
+
+def _cargar_mascaras(grilla):
+    """Lee de disco las máscaras de una grilla (una sola vez por proceso) y las pasa a la caché"""
+    if grilla in _grillas_cargadas:
+        return
+    _grillas_cargadas.add(grilla)
+    try:
+        with np.load(_ruta_mascaras(grilla)) as datos:
+            huellas, offsets, tramos = datos['huellas'], datos['offsets'], datos['tramos']
+    except (OSError, KeyError, ValueError):
+        return
+    for i, huella in enumerate(huellas):
+        cache_mascaras.guardar((huella.tobytes(), grilla), tramos[offsets[i]:offsets[i + 1]])
+
+def _guardar_mascaras(grilla, nuevas):
+    """
+    Agrega máscaras al archivo de una grilla (escritura atómica)
+
+    Args:
+        nuevas: Diccionario huella -> tramos
+    """
+    mascaras = {}
+    try:
+        with np.load(_ruta_mascaras(grilla)) as datos:
+            huellas, offsets, tramos = datos['huellas'], datos['offsets'], datos['tramos']
+        for i, huella in enumerate(huellas):
+            mascaras[huella.tobytes()] = tramos[offsets[i]:offsets[i + 1]]
+    except (OSError, KeyError, ValueError):
+        pass
+    mascaras.update(nuevas)
+
+    largos = [len(tramos) for tramos in mascaras.values()]
+    os.makedirs(DIRECTORIO_MASCARAS, exist_ok=True)
+    descriptor, temporal = tempfile.mkstemp(suffix=".npz", dir=DIRECTORIO_MASCARAS)
+    with os.fdopen(descriptor, "wb") as f:
+        np.savez(f,
+                 huellas=np.frombuffer(b''.join(mascaras), dtype=np.uint8).reshape(-1, 20),
+                 offsets=np.concatenate(([0], np.cumsum(largos))).astype(np.int64),
+                 tramos=np.concatenate([*mascaras.values(), np.empty((0, 3), dtype=np.int32)]))
+    os.replace(temporal, _ruta_mascaras(grilla))
+
+def mascaras_poligonos(poligonos, raster, persistir=True):
+    """
+    Tramos de cada polígono en la grilla de un raster
+
+    Las máscaras se buscan en la caché por huella de las coordenadas y grilla;
+    solo se rasterizan las que faltan.
+
+    Args:
+        poligonos: Lista de diccionarios con 'coords' ([lon, lat])
+        raster: RasterLocal
+        persistir: Si las máscaras nuevas se guardan también en disco
+
+    Returns:
+        Lista con un array de tramos [fila, columna_inicio, columna_fin) por polígono
+    """
+    grilla = clave_grilla(raster)
+    if persistir:
+        _cargar_mascaras(grilla)
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+
+    mascaras, nuevas, pendientes = [], {}, []
+    for i in range(len(poligonos)):
+        huella = hashlib.sha1(vertices[offsets[i]:offsets[i + 1]].tobytes()).digest()
+        tramos = cache_mascaras.obtener((huella, grilla))
+        if tramos is None:
+            tramos = nuevas.get(huella)
+        if tramos is None:
+            pendientes.append(i)
+            nuevas[huella] = None
+        mascaras.append((huella, tramos))
+
+    if pendientes:
+        # Convertir a píxeles solo los vértices de los polígonos que hay que rasterizar
+        for i in pendientes:
+            huella = mascaras[i][0]
+            if nuevas[huella] is None:
+                pixeles = raster.a_pixeles(vertices[offsets[i]:offsets[i + 1]])
+                nuevas[huella] = rasterizar(pixeles, raster.alto, raster.ancho)
+        for huella, tramos in nuevas.items():
+            cache_mascaras.guardar((huella, grilla), tramos)
+        if persistir:
+            _guardar_mascaras(grilla, nuevas)
+    return [tramos if tramos is not None else nuevas[huella] for huella, tramos in mascaras]
+
+def _indices_mascaras(mascaras, ancho):
+    """
+    Convierte las máscaras en índices planos de píxeles
+
+    Returns:
+        Tupla (indices, ids): índice de cada píxel en el raster aplanado y
+        posición del polígono al que pertenece (no decreciente)
+    """
+    tramos = np.concatenate([*mascaras, np.empty((0, 3), dtype=np.int32)]).astype(np.int64)
+    ids_tramo = np.repeat(np.arange(len(mascaras)), [len(t) for t in mascaras])
+    largos = tramos[:, 2] - tramos[:, 1]
+    comienzos = np.repeat(np.cumsum(largos) - largos, largos)
+    indices = np.repeat(tramos[:, 0] * ancho + tramos[:, 1], largos) + (np.arange(largos.sum()) - comienzos)
+    return indices, np.repeat(ids_tramo, largos)
+
+def _leer_pixeles(raster, mascaras, indices):
+    """Valores de los píxeles de todas las máscaras, en el orden de los índices"""
+    if raster.datos is not None:
+        # Raster en memoria mapeada: una sola lectura por índice
+        return raster.datos.reshape(-1)[indices]
+    valores = [_valores_tramos(raster, tramos) for tramos in mascaras if len(tramos)]
+    return np.concatenate(valores) if valores else np.empty(0)
+
+def _resumir(valores, nodata, tipo, clases):
+    if nodata is not None:
+        valores = valores[valores != nodata]
+    if tipo == 'categorico':
+        if not len(valores):
+            return {'pixeles': 0, 'clase': None, 'nombre_clase': None, 'fraccion': np.nan}
+        codigos, cuentas = np.unique(valores, return_counts=True)
+        mayor = int(np.argmax(cuentas))
+        clase = int(codigos[mayor])
+        return {'pixeles': int(len(valores)), 'clase': clase, 'nombre_clase': clases.get(clase),
+                'fraccion': cuentas[mayor] / len(valores)}
+    valores = valores[np.isfinite(valores)] if valores.dtype.kind == 'f' else valores
+    if not len(valores):
+        return {'pixeles': 0, 'media': np.nan, 'minimo': np.nan, 'maximo': np.nan, 'desvio': np.nan}
+    valores = valores.astype(np.float64)
+    return {'pixeles': int(len(valores)), 'media': valores.mean(), 'minimo': valores.min(),
+            'maximo': valores.max(), 'desvio': valores.std()}
+
+def _resumir_categorico(valores, ids, cantidad, clases):
+    """Clase mayoritaria de cada polígono contando (polígono, clase) con np.bincount"""
+    maximo = int(valores.max()) + 1 if len(valores) else 1
+    if valores.dtype.kind not in 'iub' or (len(valores) and valores.min() < 0) \
+            or cantidad * maximo > MAX_CELDAS_CONTEO:
+        # Códigos no enteros o demasiados: agrupar polígono por polígono
+        cortes = np.searchsorted(ids, np.arange(1, cantidad))
+        filas = [_resumir(v, None, 'categorico', clases) for v in np.split(valores, cortes)]
+        return {columna: [fila[columna] for fila in filas] for columna in filas[0]} if filas else {}
+
+    cuentas = np.bincount(ids * maximo + valores.astype(np.int64),
+                          minlength=cantidad * maximo).reshape(cantidad, maximo)
+    pixeles = cuentas.sum(axis=1)
+    clase = cuentas.argmax(axis=1)
+    con_datos = pixeles > 0
+    with np.errstate(invalid='ignore'):
+        fraccion = cuentas.max(axis=1) / pixeles
+    nombres = np.array([clases.get(codigo) for codigo in range(maximo)] + [None], dtype=object)
+    return {'pixeles': pixeles, 'clase': np.where(con_datos, clase, np.nan),
+            'nombre_clase': nombres[np.where(con_datos, clase, maximo)],
+            'fraccion': np.where(con_datos, fraccion, np.nan)}
+
+def _resumir_continuo(valores, ids, cantidad):
+    """Media, mínimo, máximo y desvío de cada polígono con np.bincount y reduceat"""
+    valores = valores.astype(np.float64)
+    validos = np.isfinite(valores)
+    valores, ids = valores[validos], ids[validos]
+
+    pixeles = np.bincount(ids, minlength=cantidad)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.bincount(ids, valores, minlength=cantidad) / pixeles
+        desvio = np.sqrt(np.bincount(ids, (valores - media[ids]) ** 2, minlength=cantidad) / pixeles)
+    minimo = np.full(cantidad, np.nan)
+    maximo = np.full(cantidad, np.nan)
+    con_datos = pixeles > 0
+    if con_datos.any():
+        comienzos = np.searchsorted(ids, np.flatnonzero(con_datos))
+        minimo[con_datos] = np.minimum.reduceat(valores, comienzos)
+        maximo[con_datos] = np.maximum.reduceat(valores, comienzos)
+    return {'pixeles': pixeles, 'media': media, 'minimo': minimo, 'maximo': maximo, 'desvio': desvio}
+
+def estadisticas_zonales(poligonos, raster, tipo='categorico', mascaras=None):
+    """
+    Calcula estadísticas de los píxeles de un raster dentro de cada polígono
+
+    Args:
+        poligonos: Lista de diccionarios con 'renspa' y 'coords' ([lon, lat])
+        raster: RasterLocal o ruta a un raster
+        tipo: 'categorico' (clase mayoritaria, su nombre y su fracción) o
+            'continuo' (media, mínimo, máximo y desvío)
+        mascaras: Tramos de cada polígono en la grilla del raster (por
+            defecto se obtienen con mascaras_poligonos)
+
+    Returns:
+        DataFrame con una fila por polígono: 'renspa', 'pixeles' y las
+        estadísticas del tipo indicado (NaN/None si el polígono no cubre
+        ningún píxel con datos)
+    """
+    if tipo not in ('categorico', 'continuo'):
+        raise ValueError(f"Tipo de estadística desconocido: {tipo}")
+    propio = not isinstance(raster, RasterLocal)
+    if propio:
+        raster = RasterLocal(raster)
+    try:
+        if mascaras is None:
+            mascaras = mascaras_poligonos(poligonos, raster)
+        return _zonales(poligonos, raster, tipo, mascaras, *_indices_mascaras(mascaras, raster.ancho))
+    finally:
+        if propio:
+            raster.cerrar()
+
+def _zonales(poligonos, raster, tipo, mascaras, indices, ids):
+    """Estadísticas zonales a partir de las máscaras ya convertidas en índices"""
+    valores = _leer_pixeles(raster, mascaras, indices)
+    if raster.nodata is not None:
+        con_datos = valores != raster.nodata
+        valores, ids = valores[con_datos], ids[con_datos]
+
+    columnas = list(_resumir(np.empty(0), None, tipo, raster.clases))
+    if tipo == 'categorico':
+        resumen = _resumir_categorico(valores, ids, len(poligonos), raster.clases)
+    else:
+        resumen = _resumir_continuo(valores, ids, len(poligonos))
+    return pd.DataFrame({'renspa': [pol['renspa'] for pol in poligonos], **resumen},
+                        columns=['renspa', *columnas])
+
+def descubrir_rasters(directorio=None):
+    """
+    Busca un raster por campaña en un directorio (nombres como 2019-2020.tif)
+
+    Returns:
+        Diccionario campaña ('2019-2020') -> ruta, ordenado por campaña. Los
+        GeoTIFF se omiten si rasterio no está instalado.
+    """
+    directorio = directorio or DIRECTORIO_RASTERS
+    extensiones = EXTENSIONES_RASTER if rasterio_disponible else ('.npy',)
+    rasters = {}
+    try:
+        nombres = sorted(os.listdir(directorio))
+    except FileNotFoundError:
+        return rasters
+    for nombre in nombres:
+        coincidencia = _PATRON_CAMPANA.search(nombre)
+        if coincidencia and nombre.lower().endswith(extensiones):
+            rasters.setdefault(f"{coincidencia.group(1)}-{coincidencia.group(2)}", os.path.join(directorio, nombre))
+    return dict(sorted(rasters.items()))
+
+def analizar_campanas(poligonos, rasters, tipo='categorico'):
+    """
+    Estadísticas zonales de los polígonos en cada campaña
+
+    Args:
+        poligonos: Lista de diccionarios con 'renspa' y 'coords'
+        rasters: Diccionario campaña -> ruta o RasterLocal (por ejemplo, de descubrir_rasters)
+        tipo: Igual que en estadisticas_zonales
+
+    Returns:
+        DataFrame en formato largo con la columna 'campana' y las de estadisticas_zonales
+    """
+    if tipo not in ('categorico', 'continuo'):
+        raise ValueError(f"Tipo de estadística desconocido: {tipo}")
+    resultados = []
+    pixeles_por_grilla = {}
+    for campana, raster in rasters.items():
+        propio = not isinstance(raster, RasterLocal)
+        if propio:
+            raster = RasterLocal(raster)
+        try:
+            # Las campañas con la misma grilla comparten las máscaras y sus índices
+            grilla = clave_grilla(raster)
+            if grilla not in pixeles_por_grilla:
+                mascaras = mascaras_poligonos(poligonos, raster)
+                pixeles_por_grilla[grilla] = (mascaras, *_indices_mascaras(mascaras, raster.ancho))
+            df = _zonales(poligonos, raster, tipo, *pixeles_por_grilla[grilla])
+        finally:
+            if propio:
+                raster.cerrar()
+        df.insert(1, 'campana', campana)
+        resultados.append(df)
+    if not resultados:
+        return pd.DataFrame(columns=['renspa', 'campana'])
+    return pd.concat(resultados, ignore_index=True)
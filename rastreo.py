@@ -0,0 +1,448 @@
+"""
+Rastreo por shards de inventarios grandes de CUITs
+
+La lista de CUITs se parte en shards que se registran en una cola SQLite
+(cola.sqlite dentro del directorio del rastreo). Los trabajadores, procesos
+de esta máquina o de otras que compartan el directorio, toman un shard con
+un lease que renuevan mientras avanzan; si un trabajador muere, el shard
+vuelve a estar disponible cuando vence su lease. Todas las peticiones a
+SENASA de todos los trabajadores pasan por un límite global de peticiones
+por segundo guardado en la misma base. La salida de cada shard es un
+AlmacenTemporal y al final se fusionan en un único conjunto de datos.
+
+Uso:
+    python -m rastreo ejecutar DIRECTORIO cuits.txt --procesos 4
+    python -m rastreo encolar DIRECTORIO cuits.txt --tamano-shard 50
+    python -m rastreo trabajar DIRECTORIO --procesos 4 --limite 2
+    python -m rastreo fusionar DIRECTORIO
+    python -m rastreo estado DIRECTORIO
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+
+import senasa
+from almacen import AlmacenTemporal
+from exportacion import escribir_csv, escribir_geojson
+from ingesta import ingerir_archivo
+from procesamiento import Procesamiento
+
+logger = logging.getLogger(__name__)
+
+TAMANO_SHARD = 50  # CUITs por shard
+DURACION_LEASE = 120.0  # segundos; el trabajador lo renueva cada tercio
+INTENTOS_MAXIMOS = 3  # veces que se toma un shard antes de marcarlo con error
+FORMATO_LOG = "%(asctime)s %(processName)s %(message)s"
+ESPERA_SIN_SHARDS = 1.0  # segundos entre consultas mientras otros terminan sus shards
+# Peticiones por segundo entre todos los trabajadores (el mismo ritmo que una sesión)
+LIMITE_PETICIONES = 1 / senasa.TIEMPO_ESPERA
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    id INTEGER PRIMARY KEY,
+    cuits TEXT NOT NULL,
+    cantidad INTEGER NOT NULL,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    trabajador TEXT,
+    vence REAL,
+    intentos INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE TABLE IF NOT EXISTS limite (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    proximo REAL NOT NULL
+);
+INSERT OR IGNORE INTO limite (id, proximo) VALUES (1, 0);
+"""
+
+class LeasePerdido(Exception):
+    """El lease del shard venció y otro trabajador pudo tomarlo"""
+
+class ConsultasFallidas(Exception):
+    """Algún listado o detalle del shard no se pudo consultar; el shard se vuelve a intentar"""
+
+class ColaRastreo:
+    """
+    Cola de shards de un rastreo, compartida por todos los trabajadores
+
+    Los estados de un shard son 'pendiente', 'tomado' (con lease vigente o
+    vencido), 'hecho' y 'error'. Los tiempos (leases y límite global) usan el
+    reloj del sistema, así que las máquinas que comparten la cola deben tener
+    los relojes sincronizados.
+    """
+
+    def __init__(self, directorio):
+        """
+        Args:
+            directorio: Directorio del rastreo (cola, salidas de los shards y resultado)
+        """
+        self.directorio = directorio
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, "cola.sqlite")
+        self._conexion = None
+
+    def _conectar(self):
+        # Una conexión por proceso; el modo de journal predeterminado funciona
+        # también sobre sistemas de archivos compartidos
+        if self._conexion is None:
+            self._conexion = sqlite3.connect(self.ruta, timeout=60, isolation_level=None)
+            self._conexion.executescript(_ESQUEMA)
+        return self._conexion
+
+    @contextmanager
+    def _transaccion(self):
+        conexion = self._conectar()
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            yield conexion
+            conexion.execute("COMMIT")
+        except BaseException:
+            conexion.execute("ROLLBACK")
+            raise
+
+    def ruta_shard(self, id_shard):
+        """Directorio con la salida (AlmacenTemporal) de un shard terminado"""
+        return os.path.join(self.directorio, "shards", f"shard-{id_shard:05d}")
+
+    def encolar(self, cuits, tamano_shard=TAMANO_SHARD):
+        """
+        Parte los CUITs en shards y los agrega a la cola; los CUITs que ya
+        estaban en la cola se omiten
+
+        Returns:
+            Cantidad de shards nuevos
+        """
+        with self._transaccion() as conexion:
+            encolados = set()
+            for (texto,) in conexion.execute("SELECT cuits FROM shards"):
+                encolados.update(json.loads(texto))
+            nuevos = [cuit for cuit in dict.fromkeys(cuits) if cuit not in encolados]
+            shards = [nuevos[i:i + tamano_shard] for i in range(0, len(nuevos), tamano_shard)]
+            conexion.executemany("INSERT INTO shards (cuits, cantidad) VALUES (?, ?)",
+                                 [(json.dumps(shard), len(shard)) for shard in shards])
+        return len(shards)
+
+    def tomar(self, trabajador, duracion=DURACION_LEASE):
+        """
+        Toma el próximo shard pendiente o con el lease vencido
+
+        Returns:
+            Tupla (id_shard, cuits), o None si no hay shards disponibles
+        """
+        with self._transaccion() as conexion:
+            while True:
+                fila = conexion.execute(
+                    "SELECT id, cuits, intentos FROM shards "
+                    "WHERE estado = 'pendiente' OR (estado = 'tomado' AND vence < ?) ORDER BY id LIMIT 1",
+                    (time.time(),)
+                ).fetchone()
+                if fila is None:
+                    return None
+                id_shard, cuits, intentos = fila
+                if intentos >= INTENTOS_MAXIMOS:
+                    conexion.execute("UPDATE shards SET estado = 'error', trabajador = NULL, "
+                                     "error = COALESCE(error, 'lease vencido') WHERE id = ?", (id_shard,))
+                    continue
+                conexion.execute("UPDATE shards SET estado = 'tomado', trabajador = ?, vence = ?, "
+                                 "intentos = intentos + 1 WHERE id = ?",
+                                 (trabajador, time.time() + duracion, id_shard))
+                return id_shard, json.loads(cuits)
+
+    def renovar(self, id_shard, trabajador, duracion=DURACION_LEASE):
+        """Extiende el lease; devuelve False si el shard ya no pertenece al trabajador"""
+        with self._transaccion() as conexion:
+            cursor = conexion.execute(
+                "UPDATE shards SET vence = ? WHERE id = ? AND trabajador = ? AND estado = 'tomado'",
+                (time.time() + duracion, id_shard, trabajador)
+            )
+        return cursor.rowcount == 1
+
+    def completar(self, id_shard, trabajador):
+        """Marca el shard como hecho; devuelve False si el trabajador perdió el lease"""
+        with self._transaccion() as conexion:
+            cursor = conexion.execute(
+                "UPDATE shards SET estado = 'hecho', vence = NULL, error = NULL "
+                "WHERE id = ? AND trabajador = ? AND estado = 'tomado'",
+                (id_shard, trabajador)
+            )
+        return cursor.rowcount == 1
+
+    def fallar(self, id_shard, trabajador, error):
+        """Devuelve el shard a la cola, o lo marca con error si agotó los intentos"""
+        with self._transaccion() as conexion:
+            conexion.execute(
+                "UPDATE shards SET estado = CASE WHEN intentos >= ? THEN 'error' ELSE 'pendiente' END, "
+                "trabajador = NULL, vence = NULL, error = ? "
+                "WHERE id = ? AND trabajador = ? AND estado = 'tomado'",
+                (INTENTOS_MAXIMOS, error, id_shard, trabajador)
+            )
+
+    def esperar_turno(self, limite):
+        """
+        Reserva el próximo turno del límite global de peticiones y espera hasta él
+
+        Args:
+            limite: Peticiones por segundo entre todos los trabajadores
+        """
+        with self._transaccion() as conexion:
+            ahora = time.time()
+            (proximo,) = conexion.execute("SELECT proximo FROM limite WHERE id = 1").fetchone()
+            turno = max(ahora, proximo)
+            conexion.execute("UPDATE limite SET proximo = ? WHERE id = 1", (turno + 1 / limite,))
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+    def estado(self):
+        """
+        Returns:
+            Diccionario estado -> {'shards': cantidad, 'cuits': cantidad}
+        """
+        filas = self._conectar().execute(
+            "SELECT estado, COUNT(*), SUM(cantidad) FROM shards GROUP BY estado"
+        ).fetchall()
+        return {estado: {'shards': shards, 'cuits': cuits} for estado, shards, cuits in filas}
+
+    def hay_pendientes(self):
+        """Indica si quedan shards pendientes o tomados (con lease vigente o no)"""
+        return self._conectar().execute(
+            "SELECT 1 FROM shards WHERE estado IN ('pendiente', 'tomado') LIMIT 1"
+        ).fetchone() is not None
+
+    def shards_hechos(self):
+        """Ids de los shards terminados, en orden"""
+        return [id_shard for (id_shard,) in
+                self._conectar().execute("SELECT id FROM shards WHERE estado = 'hecho' ORDER BY id")]
+
+def _procesar_shard(cola, id_shard, cuits, trabajador, solo_activos, duracion_lease):
+    """Consulta los CUITs de un shard y deja su salida en cola.ruta_shard(id_shard)"""
+    parcial = os.path.join(cola.directorio, "parciales", f"shard-{id_shard:05d}-{trabajador}")
+    shutil.rmtree(parcial, ignore_errors=True)
+    almacen = AlmacenTemporal(ruta=parcial)
+    ultima_renovacion = time.monotonic()
+
+    def renovar_lease():
+        nonlocal ultima_renovacion
+        if time.monotonic() - ultima_renovacion < duracion_lease / 3:
+            return
+        if not cola.renovar(id_shard, trabajador, duracion_lease):
+            raise LeasePerdido(f"Shard {id_shard}: el lease venció")
+        ultima_renovacion = time.monotonic()
+
+    try:
+        procesamiento = Procesamiento('cuit', solo_activos=solo_activos, almacen=almacen,
+                                      al_listar=lambda listado: renovar_lease())
+        for _ in procesamiento.ejecutar(cuits):
+            renovar_lease()
+        # No publicar un shard incompleto: los CUITs fallidos se perderían
+        if procesamiento.errores_listados or procesamiento.estados['error']:
+            raise ConsultasFallidas(
+                f"Shard {id_shard}: {len(procesamiento.errores_listados)} listados y "
+                f"{procesamiento.estados['error']} detalles con error"
+            )
+        almacen.cerrar()
+    except BaseException:
+        almacen.eliminar()
+        raise
+
+    # Publicar la salida antes de marcar el shard: si el trabajador muere entre
+    # ambos pasos, otro repite el shard y reemplaza la salida por una equivalente
+    destino = cola.ruta_shard(id_shard)
+    shutil.rmtree(destino, ignore_errors=True)
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    os.replace(parcial, destino)
+    if not cola.completar(id_shard, trabajador):
+        raise LeasePerdido(f"Shard {id_shard}: el lease venció antes de completarlo")
+    return almacen.total_registros, almacen.total_poligonos
+
+def trabajar(directorio, trabajador=None, limite=LIMITE_PETICIONES, solo_activos=True, api_url=None,
+             duracion_lease=DURACION_LEASE):
+    """
+    Toma y procesa shards hasta que no quede ninguno pendiente
+
+    Mientras otros trabajadores tengan shards tomados, espera: si alguno
+    muere, su shard se vuelve a tomar al vencer el lease.
+
+    Args:
+        directorio: Directorio del rastreo
+        trabajador: Identificador del trabajador (por defecto, host y pid)
+        limite: Peticiones por segundo entre todos los trabajadores (None o 0 sin límite)
+        solo_activos: Si solo se buscan los polígonos de los RENSPA activos
+        api_url: URL base de SENASA (por ejemplo, el servidor simulado)
+        duracion_lease: Segundos de cada lease
+
+    Returns:
+        Cantidad de shards procesados por este trabajador
+    """
+    cola = ColaRastreo(directorio)
+    trabajador = trabajador or f"{socket.gethostname()}-{os.getpid()}"
+    configuracion = (senasa.API_BASE_URL, senasa.TIEMPO_ESPERA, senasa.limitador)
+    if api_url:
+        senasa.API_BASE_URL = api_url
+    if limite:
+        # El límite global reemplaza la pausa fija entre peticiones de cada sesión
+        senasa.TIEMPO_ESPERA = 0
+        senasa.limitador = lambda: cola.esperar_turno(limite)
+
+    procesados = 0
+    try:
+        while True:
+            tarea = cola.tomar(trabajador, duracion_lease)
+            if tarea is None:
+                if not cola.hay_pendientes():
+                    return procesados
+                time.sleep(min(ESPERA_SIN_SHARDS, duracion_lease))
+                continue
+
+            id_shard, cuits = tarea
+            inicio = time.monotonic()
+            try:
+                registros, poligonos = _procesar_shard(cola, id_shard, cuits, trabajador, solo_activos,
+                                                       duracion_lease)
+            except LeasePerdido as e:
+                logger.warning("%s", e)
+                continue
+            except Exception as e:
+                logger.exception("Error en el shard %s", id_shard)
+                cola.fallar(id_shard, trabajador, str(e))
+                continue
+            procesados += 1
+            logger.info("Shard %s: %s CUITs, %s RENSPA, %s polígonos en %.1fs (%s)", id_shard, len(cuits),
+                        registros, poligonos, time.monotonic() - inicio, trabajador)
+    finally:
+        senasa.API_BASE_URL, senasa.TIEMPO_ESPERA, senasa.limitador = configuracion
+
+def _trabajar_en_proceso(directorio, nivel_log, opciones):
+    """Punto de entrada de un trabajador lanzado por lanzar_trabajadores"""
+    logging.basicConfig(level=nivel_log, format=FORMATO_LOG)
+    logging.getLogger("streamlit").setLevel(logging.CRITICAL)
+    trabajar(directorio, **opciones)
+
+def lanzar_trabajadores(directorio, procesos, **opciones):
+    """
+    Ejecuta `procesos` trabajadores en procesos separados y espera a que terminen
+
+    Args:
+        opciones: Argumentos de trabajar (limite, solo_activos, api_url, duracion_lease)
+    """
+    contexto = multiprocessing.get_context("spawn")
+    nivel_log = logging.getLogger().getEffectiveLevel()
+    trabajadores = [contexto.Process(target=_trabajar_en_proceso, args=(directorio, nivel_log, opciones),
+                                     name=f"rastreo-{i}") for i in range(procesos)]
+    for proceso in trabajadores:
+        proceso.start()
+    for proceso in trabajadores:
+        proceso.join()
+
+def fusionar(directorio, exportar=True):
+    """
+    Fusiona la salida de los shards terminados en DIRECTORIO/resultado
+
+    Los bloques de cada shard se copian sin leerlos, de modo que el resultado
+    es a su vez un almacén que se puede abrir con AlmacenTemporal(ruta=...).
+    Opcionalmente escribe también renspa.csv y poligonos.geojson leyendo el
+    resultado por bloques.
+
+    Returns:
+        AlmacenTemporal con el resultado
+    """
+    cola = ColaRastreo(directorio)
+    destino = os.path.join(directorio, "resultado")
+    shutil.rmtree(destino, ignore_errors=True)
+    resultado = AlmacenTemporal(ruta=destino)
+    for id_shard in cola.shards_hechos():
+        resultado.incorporar(AlmacenTemporal(ruta=cola.ruta_shard(id_shard)))
+
+    if exportar:
+        escribir_csv(resultado.iterar_registros(), resultado.ruta("renspa.csv"), resultado.columnas_registros())
+        escribir_geojson(resultado.iterar_buffers_poligonos(), resultado.ruta("poligonos.geojson"))
+    return resultado
+
+def ejecutar(directorio, cuits, procesos=1, tamano_shard=TAMANO_SHARD, exportar=True, **opciones):
+    """
+    Rastreo completo en esta máquina: encola, procesa con `procesos`
+    trabajadores y fusiona
+
+    Returns:
+        AlmacenTemporal con el resultado (ver fusionar)
+    """
+    ColaRastreo(directorio).encolar(cuits, tamano_shard)
+    if procesos > 1:
+        lanzar_trabajadores(directorio, procesos, **opciones)
+    else:
+        trabajar(directorio, **opciones)
+    return fusionar(directorio, exportar=exportar)
+
+def _leer_cuits(ruta):
+    with open(ruta, "rb") as archivo:
+        cuits, rechazados = ingerir_archivo(archivo, 'cuit', nombre=ruta)
+    if not rechazados.empty:
+        logger.warning("Se descartaron %s entradas inválidas o duplicadas", len(rechazados))
+    return cuits
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rastreo por shards de listas grandes de CUITs")
+    subcomandos = parser.add_subparsers(dest="comando", required=True)
+
+    def agregar_opciones_trabajo(sub):
+        sub.add_argument("--procesos", type=int, default=os.cpu_count() or 1, help="Trabajadores en esta máquina")
+        sub.add_argument("--limite", type=float, default=LIMITE_PETICIONES,
+                         help="Peticiones por segundo entre todos los trabajadores (0 sin límite)")
+        sub.add_argument("--todos", action="store_true", help="Buscar también los polígonos de RENSPA inactivos")
+        sub.add_argument("--api-url", help="URL base de SENASA (por ejemplo, el servidor simulado)")
+        sub.add_argument("--lease", type=float, default=DURACION_LEASE, help="Segundos de cada lease")
+
+    sub = subcomandos.add_parser("ejecutar", help="Encolar, procesar y fusionar en esta máquina")
+    sub.add_argument("directorio")
+    sub.add_argument("archivo", help="Archivo TXT, CSV o XLSX de CUITs")
+    sub.add_argument("--tamano-shard", type=int, default=TAMANO_SHARD)
+    agregar_opciones_trabajo(sub)
+
+    sub = subcomandos.add_parser("encolar", help="Agregar CUITs a la cola")
+    sub.add_argument("directorio")
+    sub.add_argument("archivo", help="Archivo TXT, CSV o XLSX de CUITs")
+    sub.add_argument("--tamano-shard", type=int, default=TAMANO_SHARD)
+
+    sub = subcomandos.add_parser("trabajar", help="Procesar shards de la cola")
+    sub.add_argument("directorio")
+    agregar_opciones_trabajo(sub)
+
+    sub = subcomandos.add_parser("fusionar", help="Fusionar la salida de los shards terminados")
+    sub.add_argument("directorio")
+
+    sub = subcomandos.add_parser("estado", help="Mostrar el avance de la cola")
+    sub.add_argument("directorio")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format=FORMATO_LOG)
+    # Los errores de la API se reportan con st.error; fuera de Streamlit solo generan ruido
+    logging.getLogger("streamlit").setLevel(logging.CRITICAL)
+
+    if args.comando in ("ejecutar", "trabajar"):
+        opciones = {'limite': args.limite, 'solo_activos': not args.todos, 'api_url': args.api_url,
+                    'duracion_lease': args.lease}
+    if args.comando == "ejecutar":
+        resultado = ejecutar(args.directorio, _leer_cuits(args.archivo), procesos=args.procesos,
+                             tamano_shard=args.tamano_shard, **opciones)
+        print(f"{resultado.total_registros} RENSPA y {resultado.total_poligonos} polígonos en {resultado.directorio}")
+    elif args.comando == "encolar":
+        shards = ColaRastreo(args.directorio).encolar(_leer_cuits(args.archivo), args.tamano_shard)
+        print(f"{shards} shards nuevos")
+    elif args.comando == "trabajar":
+        lanzar_trabajadores(args.directorio, args.procesos, **opciones)
+    elif args.comando == "fusionar":
+        resultado = fusionar(args.directorio)
+        print(f"{resultado.total_registros} RENSPA y {resultado.total_poligonos} polígonos en {resultado.directorio}")
+    else:
+        for estado, cantidades in sorted(ColaRastreo(args.directorio).estado().items()):
+            print(f"{estado:<10} {cantidades['shards']:>6} shards {cantidades['cuits']:>8} CUITs")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+"""
+Controles de latencia y de fallas para las consultas a SENASA
+
+- EstimadorLatencia: percentiles de las últimas latencias, para decidir
+  cuándo enviar una petición duplicada (cobertura) si la primera se demora
+- PresupuestoCobertura: limita las peticiones duplicadas a una fracción del
+  total, para no duplicar la carga justo cuando el servicio está lento
+- Interruptor: circuit breaker que se abre cuando la tasa de error de las
+  últimas peticiones supera un umbral; mientras está abierto las peticiones
+  esperan (la cola se pausa) o fallan enseguida si la espera no entra en el
+  plazo del trabajo, y al terminar el enfriamiento una sola petición de
+  prueba decide si se vuelve a cerrar
+- plazo_trabajo: plazo total de un trabajo (una consulta de la interfaz),
+  compartido por todas sus peticiones
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import requests
+
+class CircuitoAbierto(requests.RequestException):
+    """El interruptor está abierto y la espera no entra en el plazo del trabajo"""
+
+class PlazoAgotado(requests.RequestException):
+    """Se agotó el plazo del trabajo"""
+
+class EstimadorLatencia:
+    """Percentiles de una ventana de las últimas latencias observadas"""
+
+    def __init__(self, ventana=200, minimo_muestras=20):
+        """
+        Args:
+            ventana: Cantidad de latencias recientes que se conservan
+            minimo_muestras: Muestras necesarias para estimar un percentil
+        """
+        self.minimo_muestras = minimo_muestras
+        self._muestras = deque(maxlen=ventana)
+        self._lock = threading.Lock()
+
+    def registrar(self, segundos):
+        with self._lock:
+            self._muestras.append(segundos)
+
+    def percentil(self, p):
+        """Devuelve el percentil p (0-100) o None si todavía hay pocas muestras"""
+        with self._lock:
+            if len(self._muestras) < self.minimo_muestras:
+                return None
+            ordenadas = sorted(self._muestras)
+        return ordenadas[min(int(len(ordenadas) * p / 100), len(ordenadas) - 1)]
+
+class PresupuestoCobertura:
+    """Permite duplicar a lo sumo una fracción de las peticiones"""
+
+    def __init__(self, fraccion=0.1, minimo=5):
+        """
+        Args:
+            fraccion: Fracción máxima de peticiones duplicadas
+            minimo: Duplicadas permitidas aunque todavía haya pocas peticiones
+        """
+        self.fraccion = fraccion
+        self.minimo = minimo
+        self.peticiones = 0
+        self.coberturas = 0
+        self._lock = threading.Lock()
+
+    def registrar_peticion(self):
+        with self._lock:
+            self.peticiones += 1
+
+    def tomar(self):
+        """Devuelve True (y la descuenta) si queda presupuesto para una petición duplicada"""
+        with self._lock:
+            if self.coberturas >= self.minimo + self.fraccion * self.peticiones:
+                return False
+            self.coberturas += 1
+            return True
+
+class Interruptor:
+    """Circuit breaker por tasa de error, con estados cerrado, abierto y semiabierto"""
+
+    def __init__(self, ventana=50, minimo_muestras=20, umbral_error=0.5, enfriamiento=30.0):
+        """
+        Args:
+            ventana: Cantidad de resultados recientes que se evalúan
+            minimo_muestras: Resultados necesarios antes de poder abrirse
+            umbral_error: Fracción de errores (0-1) a partir de la cual se abre
+            enfriamiento: Segundos que permanece abierto antes de probar de nuevo
+        """
+        self.minimo_muestras = minimo_muestras
+        self.umbral_error = umbral_error
+        self.enfriamiento = enfriamiento
+        self.estado = 'cerrado'
+        self.aperturas = 0
+        self._resultados = deque(maxlen=ventana)
+        self._reapertura = 0.0
+        self._lock = threading.Lock()
+
+    def _abrir(self):
+        self.estado = 'abierto'
+        self._reapertura = time.monotonic() + self.enfriamiento
+        self._resultados.clear()
+        self.aperturas += 1
+
+    def permitir(self):
+        """
+        Decide si se puede enviar una petición
+
+        Returns:
+            Tupla (permitida, espera): si no está permitida, los segundos
+            sugeridos antes de volver a preguntar
+        """
+        with self._lock:
+            if self.estado == 'cerrado':
+                return True, 0.0
+            ahora = time.monotonic()
+            if self.estado == 'abierto' and ahora >= self._reapertura:
+                # Terminó el enfriamiento: dejar pasar una sola petición de prueba
+                self.estado = 'semiabierto'
+                return True, 0.0
+            if self.estado == 'abierto':
+                return False, self._reapertura - ahora
+            # Semiabierto con la prueba en curso
+            return False, min(1.0, self.enfriamiento)
+
+    def registrar(self, exito):
+        """Registra el resultado de una petición enviada"""
+        with self._lock:
+            if self.estado == 'semiabierto':
+                if exito:
+                    self.estado = 'cerrado'
+                else:
+                    self._abrir()
+                return
+            if self.estado != 'cerrado':
+                return
+            self._resultados.append(exito)
+            errores = len(self._resultados) - sum(self._resultados)
+            if len(self._resultados) >= self.minimo_muestras and errores >= self.umbral_error * len(self._resultados):
+                self._abrir()
+
+    def esperar(self, plazo=None):
+        """
+        Espera hasta poder enviar una petición
+
+        Args:
+            plazo: Plazo del trabajo (opcional); sin plazo se espera lo necesario
+
+        Raises:
+            CircuitoAbierto: Si la espera no entra en el plazo restante
+        """
+        while True:
+            permitida, espera = self.permitir()
+            if permitida:
+                return
+            if plazo is not None and espera >= plazo.restante():
+                raise CircuitoAbierto("SENASA no responde: se suspendieron las consultas hasta que se recupere")
+            time.sleep(espera)
+
+    def reiniciar(self):
+        with self._lock:
+            self.estado = 'cerrado'
+            self._resultados.clear()
+
+class Plazo:
+    """Plazo total de un trabajo"""
+
+    def __init__(self, segundos):
+        self.vence = time.monotonic() + segundos
+        self.avisos = set()
+
+    def restante(self):
+        return self.vence - time.monotonic()
+
+    def extender(self, segundos):
+        """Extiende el plazo (por ejemplo, al conocer la cantidad de consultas de un CUIT)"""
+        self.vence += segundos
+
+_plazo_actual = contextvars.ContextVar('plazo_trabajo', default=None)
+
+def plazo_actual():
+    """Plazo del trabajo en curso en este contexto, o None"""
+    return _plazo_actual.get()
+
+@contextmanager
+def plazo_trabajo(segundos):
+    """
+    Fija el plazo de las peticiones hechas dentro del bloque
+
+    Yields:
+        El Plazo, que se puede extender
+    """
+    plazo = Plazo(segundos)
+    token = _plazo_actual.set(plazo)
+    try:
+        yield plazo
+    finally:
+        _plazo_actual.reset(token)
@@ -0,0 +1,296 @@
+"""
+Análisis de rotaciones de cultivos
+
+Trabaja sobre una matriz de clases de cultivo con un campo (RENSPA) por fila
+y una campaña por columna, como la que se arma con la salida de
+raster.analizar_campanas. Las medidas se calculan con operaciones
+vectorizadas sobre la matriz completa: los únicos bucles de Python recorren
+las campañas (decenas) o las secuencias distintas, nunca los campos.
+"""
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+import metricas
+from cache import CacheLRU
+from geometria import calcular_superficies, empaquetar
+
+# Código de la matriz para las campañas sin clase (sin raster o sin píxeles con datos)
+SIN_DATO = -1
+
+# Años seguidos con el mismo cultivo a partir de los cuales un campo se considera en monocultivo
+UMBRAL_MONOCULTIVO = 3
+
+# Separador de las campañas en las secuencias de rotación
+SEPARADOR_SECUENCIA = " → "
+
+# Resultados ya calculados por huella de la matriz, los campos y las clases
+cache_rotaciones = CacheLRU(
+    max_entradas=16,
+    max_bytes=256 * 1024 * 1024,
+    tamano=lambda resultado: sum(int(df.memory_usage(deep=True).sum()) for df in resultado.values())
+)
+metricas.registrar_cache("rotaciones", cache_rotaciones)
+
+def matriz_cultivos(df_campanas, columna='clase'):
+    """
+    Arma la matriz campo x campaña a partir de estadísticas en formato largo
+
+    Args:
+        df_campanas: DataFrame con 'renspa', 'campana' y la columna de la clase
+            (por ejemplo, el de raster.analizar_campanas)
+        columna: Columna con el código de la clase
+
+    Returns:
+        DataFrame int32 con un RENSPA por fila y una campaña por columna
+        (ordenadas), con SIN_DATO donde no hay clase
+    """
+    campos = pd.Categorical(df_campanas['renspa'])
+    campanas = pd.Categorical(df_campanas['campana'], categories=sorted(df_campanas['campana'].unique()))
+    clases = pd.to_numeric(df_campanas[columna], errors='coerce').to_numpy(dtype=np.float64)
+    validos = ~np.isnan(clases)
+
+    matriz = np.full((len(campos.categories), len(campanas.categories)), SIN_DATO, dtype=np.int32)
+    matriz[campos.codes[validos], campanas.codes[validos]] = clases[validos].astype(np.int32)
+    return pd.DataFrame(matriz, index=pd.Index(campos.categories, name='renspa'),
+                        columns=list(campanas.categories))
+
+def campos_de_poligonos(poligonos):
+    """
+    Datos de cada campo para el análisis a partir de los polígonos
+
+    Returns:
+        DataFrame con 'renspa', 'cuit' y 'superficie' (hectáreas calculadas
+        a partir de las coordenadas)
+    """
+    if not poligonos:
+        return pd.DataFrame(columns=['renspa', 'cuit', 'superficie'])
+    vertices, offsets = empaquetar([pol['coords'] for pol in poligonos])
+    return pd.DataFrame({
+        'renspa': [pol['renspa'] for pol in poligonos],
+        'cuit': [pol.get('cuit') for pol in poligonos],
+        'superficie': calcular_superficies(vertices, offsets),
+    })
+
+def _huella(matriz, campos, clases):
+    huella = hashlib.sha1(repr((list(matriz.columns), sorted(clases.items()))).encode('utf-8'))
+    huella.update(pd.util.hash_pandas_object(matriz.index.to_series(), index=False).to_numpy().tobytes())
+    huella.update(np.ascontiguousarray(matriz.to_numpy()).tobytes())
+    if campos is not None:
+        columnas = [c for c in ('renspa', 'cuit', 'superficie') if c in campos.columns]
+        huella.update(",".join(columnas).encode('ascii'))
+        try:
+            hashes = pd.util.hash_pandas_object(campos[columnas], index=False)
+        except TypeError:
+            hashes = pd.util.hash_pandas_object(campos[columnas].astype("string"), index=False)
+        huella.update(hashes.to_numpy().tobytes())
+    return huella.hexdigest()
+
+def _nombres(codigos, clases):
+    """Nombre de cada código de clase (el código si no tiene nombre)"""
+    return np.array([clases.get(int(c), str(int(c))) if c != SIN_DATO else "Sin dato" for c in codigos],
+                    dtype=object)
+
+def _datos_campos(matriz, campos):
+    """CUIT y superficie de cada fila de la matriz"""
+    if campos is None or not len(campos):
+        return pd.Categorical(["Sin CUIT"] * len(matriz)), np.zeros(len(matriz), dtype=np.float64)
+    campos = campos.drop_duplicates('renspa').set_index('renspa').reindex(matriz.index)
+    cuit = campos['cuit'].fillna("Sin CUIT") if 'cuit' in campos.columns \
+        else pd.Series("Sin CUIT", index=matriz.index, dtype=object)
+    superficie = pd.to_numeric(campos['superficie'], errors='coerce').fillna(0.0).to_numpy(np.float64) \
+        if 'superficie' in campos.columns else np.zeros(len(matriz), dtype=np.float64)
+    return pd.Categorical(cuit.astype(str)), superficie
+
+def _rachas(valores):
+    """
+    Rachas de campañas seguidas con el mismo cultivo, recorriendo las campañas
+
+    Returns:
+        Tupla (racha_maxima, cultivo_racha, racha_actual) por campo
+    """
+    cantidad = len(valores)
+    racha = np.zeros(cantidad, dtype=np.int32)
+    maxima = np.zeros(cantidad, dtype=np.int32)
+    cultivo = np.full(cantidad, SIN_DATO, dtype=np.int32)
+    anterior = np.full(cantidad, SIN_DATO, dtype=np.int32)
+    for j in range(valores.shape[1]):
+        actual = valores[:, j]
+        con_dato = actual != SIN_DATO
+        racha = np.where(con_dato, np.where(actual == anterior, racha + 1, 1), 0)
+        mejora = racha > maxima
+        maxima = np.where(mejora, racha, maxima)
+        cultivo = np.where(mejora, actual, cultivo)
+        anterior = actual
+    return maxima, cultivo, racha
+
+def _textos_secuencias(unicas, nombres):
+    """Texto de cada secuencia distinta, concatenando columna por columna"""
+    if not unicas.shape[1]:
+        return np.full(len(unicas), "", dtype=object)
+    textos = nombres[unicas[:, 0]]
+    for j in range(1, unicas.shape[1]):
+        textos = textos + SEPARADOR_SECUENCIA + nombres[unicas[:, j]]
+    return textos
+
+def _por_campo(matriz, valores, cuit, superficie, secuencias, clases):
+    """Secuencia, cambios, cultivos distintos y rachas de cada campo"""
+    con_dato = valores != SIN_DATO
+    unicas, inversa, textos = secuencias
+    codigos = np.unique(unicas)
+    codigo_nombre = dict(zip(codigos.tolist(), _nombres(codigos, clases)))
+
+    # Cambios de cultivo entre campañas consecutivas con dato
+    pares = con_dato[:, 1:] & con_dato[:, :-1]
+    cambios = (pares & (valores[:, 1:] != valores[:, :-1])).sum(axis=1)
+
+    # Cultivos distintos: valores distintos en cada fila ordenada
+    ordenados = np.sort(valores, axis=1)
+    distintos = (ordenados[:, :1] != SIN_DATO).sum(axis=1) + \
+        ((ordenados[:, 1:] != ordenados[:, :-1]) & (ordenados[:, 1:] != SIN_DATO)).sum(axis=1)
+
+    maxima, cultivo_racha, actual = _rachas(valores)
+    ultimo = valores[:, -1] if valores.shape[1] else np.full(len(valores), SIN_DATO)
+    if pd.Index(textos).is_unique:
+        secuencia = pd.Categorical.from_codes(inversa, categories=textos)
+    else:
+        # Clases distintas con el mismo nombre
+        secuencia = textos[inversa]
+    return pd.DataFrame({
+        'renspa': matriz.index,
+        'cuit': cuit,
+        'superficie': superficie,
+        'secuencia': secuencia,
+        'campanas_con_dato': con_dato.sum(axis=1),
+        'cambios': cambios,
+        'cultivos_distintos': distintos,
+        'racha_maxima': maxima,
+        'cultivo_racha': _nombres_vector(cultivo_racha, codigo_nombre),
+        'racha_actual': actual,
+        'cultivo_actual': _nombres_vector(ultimo, codigo_nombre),
+        'monocultivo': maxima >= UMBRAL_MONOCULTIVO,
+    })
+
+def _nombres_vector(codigos, codigo_nombre):
+    """Mapea un array de códigos a nombres sin recorrerlo en Python"""
+    claves = np.array(sorted(codigo_nombre), dtype=np.int64)
+    nombres = np.array([codigo_nombre[c] for c in claves], dtype=object)
+    return nombres[np.searchsorted(claves, codigos)]
+
+def _secuencias(valores, superficie, clases):
+    """
+    Secuencias de rotación distintas
+
+    Returns:
+        Tupla (unicas, inversa, textos): las filas distintas de la matriz, la
+        posición de la secuencia de cada campo y el texto de cada una
+    """
+    if not len(valores):
+        return valores, np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+    unicas, inversa = np.unique(valores, axis=0, return_inverse=True)
+    codigos = np.unique(unicas)
+    # Tabla de nombres indexada por posición del código
+    posiciones = np.searchsorted(codigos, unicas)
+    return unicas, inversa.reshape(-1), _textos_secuencias(posiciones, _nombres(codigos, clases))
+
+def _resumen_secuencias(secuencias, superficie):
+    """Secuencias de rotación más frecuentes, con campos y hectáreas"""
+    unicas, inversa, textos = secuencias
+    return pd.DataFrame({
+        'secuencia': textos,
+        'campos': np.bincount(inversa, minlength=len(unicas)),
+        'hectareas': np.bincount(inversa, weights=superficie, minlength=len(unicas)),
+    }).sort_values(['campos', 'hectareas'], ascending=False, ignore_index=True)
+
+def _transiciones(valores, superficie, clases):
+    """Campos y hectáreas de cada par (cultivo anterior, cultivo siguiente) entre campañas consecutivas"""
+    anterior, siguiente = valores[:, :-1].ravel(), valores[:, 1:].ravel()
+    hectareas = np.repeat(superficie, max(valores.shape[1] - 1, 0))
+    validos = (anterior != SIN_DATO) & (siguiente != SIN_DATO)
+    anterior, siguiente, hectareas = anterior[validos], siguiente[validos], hectareas[validos]
+
+    codigos = np.unique(np.concatenate((anterior, siguiente)))
+    a, b = np.searchsorted(codigos, anterior), np.searchsorted(codigos, siguiente)
+    cantidad = len(codigos)
+    campos = np.bincount(a * cantidad + b, minlength=cantidad * cantidad)
+    suma = np.bincount(a * cantidad + b, weights=hectareas, minlength=cantidad * cantidad)
+    presentes = np.flatnonzero(campos)
+    nombres = _nombres(codigos, clases)
+    return pd.DataFrame({
+        'cultivo_anterior': nombres[presentes // cantidad] if cantidad else [],
+        'cultivo_siguiente': nombres[presentes % cantidad] if cantidad else [],
+        'campos': campos[presentes],
+        'hectareas': suma[presentes],
+    }).sort_values(['campos', 'hectareas'], ascending=False, ignore_index=True)
+
+def _largo(matriz, valores, cuit, superficie):
+    """Formato largo (cuit, campaña, cultivo, hectáreas) de las celdas con dato"""
+    campanas = len(matriz.columns)
+    con_dato = (valores != SIN_DATO).ravel()
+    return pd.DataFrame({
+        'cuit': pd.Categorical.from_codes(np.repeat(cuit.codes, campanas)[con_dato], categories=cuit.categories),
+        'campana': pd.Categorical.from_codes(np.tile(np.arange(campanas), len(matriz))[con_dato],
+                                             categories=list(matriz.columns)),
+        'clase': valores.ravel()[con_dato],
+        'hectareas': np.repeat(superficie, campanas)[con_dato],
+    })
+
+def analizar_rotaciones(matriz, campos=None, clases=None):
+    """
+    Calcula las medidas de rotación de todos los campos
+
+    Los resultados se guardan en caché por huella de la matriz, los campos y
+    los nombres de las clases.
+
+    Args:
+        matriz: DataFrame campo x campaña de matriz_cultivos
+        campos: DataFrame con 'renspa', 'cuit' y 'superficie' (hectáreas) de
+            cada campo (opcional; por ejemplo, de campos_de_poligonos)
+        clases: Diccionario código -> nombre de la clase (opcional)
+
+    Returns:
+        Diccionario de DataFrames:
+        - 'por_campo': secuencia, cambios de cultivo, cultivos distintos y
+          rachas de monocultivo de cada RENSPA
+        - 'secuencias': secuencias de rotación con sus campos y hectáreas
+        - 'transiciones': pares (cultivo anterior, cultivo siguiente)
+        - 'hectareas': hectáreas de cada cultivo por campaña
+        - 'por_cuit': hectáreas y participación de cada cultivo en la
+          superficie de cada CUIT por campaña
+    """
+    clases = clases or {}
+    huella = _huella(matriz, campos, clases)
+    resultado = cache_rotaciones.obtener(huella)
+    if resultado is not None:
+        return resultado
+
+    valores = matriz.to_numpy(dtype=np.int32)
+    cuit, superficie = _datos_campos(matriz, campos)
+    secuencias = _secuencias(valores, superficie, clases)
+    por_campo = _por_campo(matriz, valores, cuit, superficie, secuencias, clases)
+
+    largo = _largo(matriz, valores, cuit, superficie)
+    codigos, posiciones = np.unique(largo['clase'].to_numpy(), return_inverse=True)
+    nombres, por_codigo = np.unique(_nombres(codigos, clases).astype(str), return_inverse=True)
+    largo['cultivo'] = pd.Categorical.from_codes(por_codigo[posiciones] if len(codigos) else posiciones,
+                                                 categories=nombres)
+    hectareas = (largo.pivot_table(index='cultivo', columns='campana', values='hectareas', aggfunc='sum',
+                                   fill_value=0.0, observed=True)
+                 .reset_index())
+    por_cuit = (largo.groupby(['cuit', 'campana', 'cultivo'], observed=True, sort=True)['hectareas']
+                .agg(['size', 'sum']).rename(columns={'size': 'campos', 'sum': 'hectareas'})
+                .reset_index())
+    total = por_cuit.groupby(['cuit', 'campana'], observed=True)['hectareas'].transform('sum')
+    with np.errstate(invalid='ignore', divide='ignore'):
+        por_cuit['participacion'] = por_cuit['hectareas'] / total
+
+    resultado = {
+        'por_campo': por_campo,
+        'secuencias': _resumen_secuencias(secuencias, superficie),
+        'transiciones': _transiciones(valores, superficie, clases),
+        'hectareas': hectareas,
+        'por_cuit': por_cuit,
+    }
+    cache_rotaciones.guardar(huella, resultado)
+    return resultado
@@ -0,0 +1,640 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+import streamlit as st
+
+import metricas
+from cache import CacheCompartida, CacheLRU
+from resiliencia import (
+    CircuitoAbierto,
+    EstimadorLatencia,
+    Interruptor,
+    PlazoAgotado,
+    PresupuestoCobertura,
+    plazo_actual,
+    plazo_trabajo,
+)
+from validacion import cuit_valido, renspa_valido, es_desconocido, registrar_desconocido
+
+# Configuraciones globales
+# La URL base puede redirigirse (por ejemplo, al servidor simulado de benchmarks)
+API_BASE_URL = os.environ.get(
+    "SENASA_API_URL",
+    "https://aps.senasa.gob.ar/restapiprod/servicios/renspa"
+)
+TIEMPO_ESPERA = 0.5  # Pausa entre peticiones para no sobrecargar la API
+# Función llamada antes de cada petición (por ejemplo, el límite global de un rastreo)
+limitador = None
+
+# Respuestas de SENASA compartidas entre todas las sesiones del proceso: las
+# consultas simultáneas del mismo CUIT/RENSPA esperan una única petición
+VIGENCIA_CACHE_CONSULTAS = int(os.environ.get("RENSPA_CACHE_TTL", "600"))  # segundos
+MAX_MB_CACHE_CONSULTAS = int(os.environ.get("RENSPA_CACHE_CONSULTAS_MB", "256"))
+
+def _tamano_respuesta(valor):
+    """Estimación rápida del tamaño en memoria de una respuesta (items, error)"""
+    items = valor[0]
+    if isinstance(items, dict):
+        items = items.get('items', [])
+    return sum(len(repr(item)) for item in items or []) + 100
+
+consultas_compartidas = CacheCompartida(CacheLRU(
+    max_entradas=20000,
+    max_bytes=MAX_MB_CACHE_CONSULTAS * 1024 * 1024,
+    tamano=_tamano_respuesta,
+    vigencia=VIGENCIA_CACHE_CONSULTAS,
+))
+
+def _sin_error(respuesta):
+    return respuesta[1] is None
+
+# Items de los listados por CUIT descargados recientemente, por RENSPA: una consulta
+# por RENSPA usa el polígono del listado en lugar de pedir el detalle
+listados_por_renspa = CacheLRU(
+    max_entradas=200000,
+    max_bytes=MAX_MB_CACHE_CONSULTAS * 1024 * 1024 // 4,
+    tamano=lambda item: len(repr(item)),
+    vigencia=VIGENCIA_CACHE_CONSULTAS,
+)
+
+# Reintentos ante 429 (límite de consultas) y errores 5xx de SENASA
+REINTENTOS = 2
+ESPERA_REINTENTO = 1.0  # segundos; se duplica en cada reintento
+ESPERA_REINTENTO_MAXIMA = 30.0
+
+# Cobertura de la latencia de cola: si una petición tarda más que el percentil
+# PERCENTIL_COBERTURA de las últimas del mismo endpoint, se envía una duplicada y
+# se usa la primera respuesta (hasta FRACCION_COBERTURA de las peticiones). Solo
+# se cubren las peticiones para las que hay lugar en el pool de HILOS_COBERTURA
+# hilos; las demás van en el hilo llamador, sin límite de peticiones en curso
+COBERTURA_ACTIVA = os.environ.get("RENSPA_COBERTURA", "1") != "0"
+PERCENTIL_COBERTURA = 95
+RETRASO_COBERTURA_MINIMO = 0.05  # segundos
+FRACCION_COBERTURA = 0.1
+HILOS_COBERTURA = 32
+# Latencias recientes por endpoint con que se estima el percentil: una ventana
+# chica se contamina con unas pocas demoras y sube el retraso de cobertura
+VENTANA_LATENCIAS = 1000
+
+# Circuit breaker: se abre si fallan la mitad de las últimas 50 peticiones (con al
+# menos 20) y vuelve a probar después de ENFRIAMIENTO_CIRCUITO segundos
+ENFRIAMIENTO_CIRCUITO = float(os.environ.get("RENSPA_ENFRIAMIENTO_CIRCUITO", "30"))
+
+# Plazo de cada trabajo de la interfaz: una base más un margen por consulta
+PLAZO_BASE_TRABAJO = float(os.environ.get("RENSPA_PLAZO_BASE", "120"))  # segundos
+PLAZO_POR_CONSULTA = float(os.environ.get("RENSPA_PLAZO_POR_CONSULTA", "5"))  # segundos
+
+circuito = Interruptor(enfriamiento=ENFRIAMIENTO_CIRCUITO)
+_presupuesto_cobertura = PresupuestoCobertura(FRACCION_COBERTURA)
+_latencias = {}
+_lock_latencias = threading.Lock()
+_ejecutor_cobertura = ThreadPoolExecutor(max_workers=HILOS_COBERTURA, thread_name_prefix="senasa-cobertura")
+# Hilos del pool de cobertura reservados (en uso o por usarse): nada espera en su cola
+_reservados_cobertura = 0
+_lock_cobertura = threading.Lock()
+
+_duracion_http = metricas.histograma(
+    "senasa_http_duracion_segundos", "Latencia de las peticiones a SENASA", ("endpoint",)
+)
+_peticiones_http = metricas.contador(
+    "senasa_http_peticiones_total", "Peticiones a SENASA por código de respuesta", ("endpoint", "codigo")
+)
+_respuestas_429 = metricas.contador(
+    "senasa_http_429_total", "Respuestas 429 (límite de consultas) de SENASA", ("endpoint",)
+)
+_reintentos_http = metricas.contador(
+    "senasa_http_reintentos_total", "Peticiones a SENASA repetidas tras un 429 o un error 5xx", ("endpoint",)
+)
+_poligonos_parseados = metricas.contador(
+    "poligonos_parseados_total", "Polígonos de SENASA parseados", ("resultado",)
+)
+_coberturas = metricas.contador(
+    "senasa_coberturas_total",
+    "Peticiones duplicadas por demora de la primera, cuántas respondieron antes y cuántas no se cubrieron por falta de lugar",
+    ("endpoint", "resultado")
+)
+_rechazos_circuito = metricas.contador(
+    "senasa_circuito_rechazos_total", "Peticiones no enviadas por el circuit breaker abierto", ("endpoint",)
+)
+_plazos_agotados = metricas.contador(
+    "senasa_plazo_agotado_total", "Peticiones no enviadas por haberse agotado el plazo del trabajo", ("endpoint",)
+)
+
+def _metricas_consultas():
+    estadisticas = consultas_compartidas.estadisticas()
+    return [
+        ("senasa_consultas_coalescidas_total", "counter",
+         "Consultas que esperaron una petición idéntica en curso", {}, estadisticas['coalescidas']),
+        ("senasa_consultas_en_vuelo", "gauge", "Consultas a SENASA en curso", {}, estadisticas['en_vuelo']),
+        ("senasa_circuito_abierto", "gauge", "1 si el circuit breaker no está cerrado", {},
+         int(circuito.estado != 'cerrado')),
+        ("senasa_circuito_aperturas_total", "counter", "Veces que se abrió el circuit breaker", {},
+         circuito.aperturas),
+    ]
+
+metricas.registrar_cache("consultas", consultas_compartidas)
+metricas.registrar_cache("listados_por_renspa", listados_por_renspa)
+metricas.registrar_recolector(_metricas_consultas)
+
+def plazo_consulta(consultas=0):
+    """Plazo de un trabajo de la interfaz con la cantidad de consultas indicada (context manager)"""
+    return plazo_trabajo(PLAZO_BASE_TRABAJO + consultas * PLAZO_POR_CONSULTA)
+
+def extender_plazo(consultas):
+    """Extiende el plazo del trabajo en curso, si hay uno, por nuevas consultas"""
+    plazo = plazo_actual()
+    if plazo is not None:
+        plazo.extender(consultas * PLAZO_POR_CONSULTA)
+
+def _latencia(endpoint):
+    with _lock_latencias:
+        if endpoint not in _latencias:
+            _latencias[endpoint] = EstimadorLatencia(VENTANA_LATENCIAS)
+        return _latencias[endpoint]
+
+def _enviar(endpoint, url, timeout):
+    """Una petición, registrando su latencia y su resultado en el circuit breaker"""
+    inicio = time.monotonic()
+    try:
+        with _duracion_http.medir(endpoint=endpoint):
+            response = requests.get(url, timeout=timeout)
+    except requests.RequestException:
+        _peticiones_http.inc(endpoint=endpoint, codigo="error")
+        circuito.registrar(False)
+        raise
+    _peticiones_http.inc(endpoint=endpoint, codigo=response.status_code)
+    circuito.registrar(response.status_code < 500)
+    if response.status_code < 400:
+        _latencia(endpoint).registrar(time.monotonic() - inicio)
+    return response
+
+def _retraso_cobertura(endpoint, timeout):
+    """Segundos a esperar antes de duplicar una petición, o None para no duplicarla"""
+    if not COBERTURA_ACTIVA or circuito.estado != 'cerrado':
+        return None
+    percentil = _latencia(endpoint).percentil(PERCENTIL_COBERTURA)
+    if percentil is None:
+        return None
+    retraso = max(percentil, RETRASO_COBERTURA_MINIMO)
+    return retraso if retraso < timeout else None
+
+def _reservar_cobertura(hilos):
+    """Reserva hilos del pool de cobertura; False si no hay lugar"""
+    global _reservados_cobertura
+    with _lock_cobertura:
+        if _reservados_cobertura + hilos > HILOS_COBERTURA:
+            return False
+        _reservados_cobertura += hilos
+        return True
+
+def _liberar_cobertura():
+    global _reservados_cobertura
+    with _lock_cobertura:
+        _reservados_cobertura -= 1
+
+def _enviar_reservado(endpoint, url, timeout):
+    """_enviar en un hilo reservado del pool de cobertura, que libera al terminar"""
+    try:
+        return _enviar(endpoint, url, timeout)
+    finally:
+        _liberar_cobertura()
+
+def _peticion_cubierta(endpoint, url, timeout):
+    """
+    Envía una petición y, si no responde dentro del retraso de cobertura,
+    una duplicada; devuelve la primera respuesta obtenida
+
+    La petición va en el hilo llamador si no se puede cubrir: sin latencias
+    para estimar el retraso o sin lugar en el pool para ella y la duplicada.
+    Si se puede, se reservan los dos hilos antes de enviarla, así ninguna
+    espera en la cola del pool y el retraso solo cuenta el tiempo de la petición.
+    """
+    _presupuesto_cobertura.registrar_peticion()
+    retraso = _retraso_cobertura(endpoint, timeout)
+    if retraso is None:
+        return _enviar(endpoint, url, timeout)
+    if not _reservar_cobertura(2):
+        _coberturas.inc(endpoint=endpoint, resultado="sin_lugar")
+        return _enviar(endpoint, url, timeout)
+
+    primera = _ejecutor_cobertura.submit(_enviar_reservado, endpoint, url, timeout)
+    if wait([primera], timeout=retraso).done or not _presupuesto_cobertura.tomar():
+        # El hilo reservado para la duplicada no se usó
+        _liberar_cobertura()
+        return primera.result()
+
+    if limitador is not None:
+        try:
+            limitador()
+        except BaseException:
+            _liberar_cobertura()
+            raise
+    _coberturas.inc(endpoint=endpoint, resultado="enviada")
+    segunda = _ejecutor_cobertura.submit(_enviar_reservado, endpoint, url, timeout)
+    pendientes, error = {primera, segunda}, None
+    while pendientes:
+        hechas, pendientes = wait(pendientes, return_when=FIRST_COMPLETED)
+        for futura in hechas:
+            if futura.exception() is None:
+                if futura is segunda:
+                    _coberturas.inc(endpoint=endpoint, resultado="ganadora")
+                return futura.result()
+            error = futura.exception()
+    raise error
+
+def _get(endpoint, url, timeout):
+    """
+    GET a SENASA con métricas de latencia, reintentos ante 429 y errores 5xx,
+    cobertura de la latencia de cola, circuit breaker y el plazo del trabajo
+
+    Returns:
+        La respuesta de requests (lanza las excepciones de conexión y
+        raise_for_status de la última respuesta)
+
+    Raises:
+        PlazoAgotado: Si no queda plazo para la petición
+        CircuitoAbierto: Si el circuit breaker está abierto y esperarlo no entra en el plazo
+    """
+    espera = ESPERA_REINTENTO
+    plazo = plazo_actual()
+    for intento in range(REINTENTOS + 1):
+        recortado = False
+        if plazo is not None:
+            restante = plazo.restante()
+            if restante <= 0:
+                _plazos_agotados.inc(endpoint=endpoint)
+                raise PlazoAgotado("Se agotó el plazo de la consulta: los elementos restantes no se consultaron")
+            recortado = restante < timeout
+            timeout = min(timeout, restante)
+        try:
+            circuito.esperar(plazo)
+        except CircuitoAbierto:
+            _rechazos_circuito.inc(endpoint=endpoint)
+            raise
+        if limitador is not None:
+            limitador()
+        try:
+            response = _peticion_cubierta(endpoint, url, timeout)
+        except requests.Timeout as e:
+            if not recortado:
+                raise
+            # El timeout era el resto del plazo: la petición no falló, se terminó el tiempo
+            _plazos_agotados.inc(endpoint=endpoint)
+            raise PlazoAgotado("Se agotó el plazo de la consulta: los elementos restantes no se consultaron") from e
+
+        reintentable = response.status_code == 429 or response.status_code >= 500
+        if response.status_code == 429:
+            _respuestas_429.inc(endpoint=endpoint)
+        if not reintentable or intento == REINTENTOS:
+            response.raise_for_status()
+            return response
+
+        # Respetar Retry-After si SENASA lo informa
+        retry_after = response.headers.get("Retry-After", "")
+        pausa = float(retry_after) if retry_after.replace(".", "", 1).isdigit() else espera
+        if plazo is not None and min(pausa, ESPERA_REINTENTO_MAXIMA) >= plazo.restante():
+            response.raise_for_status()
+        _reintentos_http.inc(endpoint=endpoint)
+        time.sleep(min(pausa, ESPERA_REINTENTO_MAXIMA))
+        espera *= 2
+
+def _mostrar_error(mensaje):
+    """Muestra un error; dentro de un trabajo, cada mensaje distinto se muestra una sola vez"""
+    plazo = plazo_actual()
+    if plazo is not None:
+        if mensaje in plazo.avisos:
+            return
+        plazo.avisos.add(mensaje)
+    st.error(mensaje)
+
+def identificador_desconocido(tipo, identificador):
+    """Indica si la API configurada (API_BASE_URL) informó recientemente el identificador como desconocido"""
+    return es_desconocido(tipo, identificador, API_BASE_URL)
+
+# Función para normalizar CUIT
+def normalizar_cuit(cuit):
+    """Normaliza un CUIT a formato XX-XXXXXXXX-X"""
+    # Eliminar guiones si están presentes
+    cuit_limpio = cuit.replace("-", "")
+
+    # Validar longitud
+    if len(cuit_limpio) != 11 or not cuit_limpio.isdigit():
+        raise ValueError(f"CUIT inválido: {cuit}. Debe tener 11 dígitos.")
+
+    # Reformatear con guiones
+    cuit_normalizado = f"{cuit_limpio[:2]}-{cuit_limpio[2:10]}-{cuit_limpio[10]}"
+
+    # Validar dígito verificador
+    if not cuit_valido(cuit_normalizado):
+        raise ValueError(f"CUIT inválido: {cuit}. El dígito verificador no es correcto.")
+
+    return cuit_normalizado
+
+# Función para descargar el listado de RENSPA de un CUIT
+def _descargar_renspa_por_cuit(cuit, vigencia=None):
+    """
+    Descarga todas las páginas de consultaPorCuit
+
+    Args:
+        vigencia: Segundos que duran los items en listados_por_renspa (por defecto, la de la caché)
+
+    Returns:
+        Tupla (items, error). Si una página falla, items tiene lo obtenido
+        hasta ese momento y error el mensaje a mostrar.
+    """
+    # URL base para la consulta
+    url_base = f"{API_BASE_URL}/consultaPorCuit"
+
+    todos_renspa = []
+    offset = 0
+    limit = 10  # La API usa un límite de 10 por página
+    has_more = True
+    error = None
+
+    # Realizar consultas sucesivas hasta obtener todos los RENSPA
+    while has_more:
+        # Construir URL con offset para paginación
+        url = f"{url_base}?cuit={cuit}&offset={offset}"
+
+        try:
+            # Realizar la consulta a la API
+            response = _get("consultaPorCuit", url, timeout=15)
+            resultado = response.json()
+
+            # Verificar si hay resultados
+            if 'items' in resultado and resultado['items']:
+                # Agregar los RENSPA a la lista total
+                todos_renspa.extend(resultado['items'])
+                for item in resultado['items']:
+                    if item.get('renspa'):
+                        listados_por_renspa.guardar((API_BASE_URL, item['renspa']), {**item, 'cuit': cuit}, vigencia)
+
+                # Verificar si hay más páginas
+                has_more = resultado.get('hasMore', False)
+
+                # Actualizar offset para la siguiente página
+                offset += limit
+            else:
+                has_more = False
+
+                # Sin resultados desde la primera página: CUIT desconocido para SENASA
+                if offset == 0:
+                    registrar_desconocido('cuit', cuit, API_BASE_URL)
+
+        except (PlazoAgotado, CircuitoAbierto) as e:
+            # No se envió la petición: terminar sin pausa
+            return todos_renspa, str(e)
+        except Exception as e:
+            error = f"Error consultando la API: {str(e)}"
+            has_more = False
+
+        # Pausa breve para no sobrecargar la API
+        time.sleep(TIEMPO_ESPERA)
+
+    return todos_renspa, error
+
+# Función para obtener RENSPA por CUIT
+def listar_renspa_por_cuit(cuit, refrescar=False, vigencia=None):
+    """
+    Obtiene todos los RENSPA asociados a un CUIT, manejando la paginación.
+    Los CUIT que SENASA informó recientemente sin RENSPA no se vuelven a consultar,
+    y las consultas simultáneas del mismo CUIT desde otras sesiones comparten
+    una única descarga. Los listados incompletos no se guardan en la caché.
+
+    Args:
+        refrescar: Si se descarga de nuevo aunque el listado esté en la caché
+        vigencia: Segundos que dura el listado en la caché (por defecto, RENSPA_CACHE_TTL)
+
+    Returns:
+        Tupla (items, error). error es None si el listado está completo; si
+        no, es el mensaje mostrado e items tiene lo obtenido hasta el error.
+    """
+    if identificador_desconocido('cuit', cuit):
+        return [], None
+
+    try:
+        todos_renspa, error = consultas_compartidas.obtener(
+            ('cuit', API_BASE_URL, cuit), lambda: _descargar_renspa_por_cuit(cuit, vigencia), cachear=_sin_error,
+            refrescar=refrescar, vigencia=vigencia
+        )
+    except Exception as e:
+        todos_renspa, error = [], f"Error al obtener RENSPA: {str(e)}"
+    if error:
+        _mostrar_error(error)
+
+    # Copia por sesión: los llamadores modifican los items (por ejemplo, agregando el CUIT)
+    return [dict(item) for item in todos_renspa], error
+
+def obtener_renspa_por_cuit(cuit, refrescar=False, vigencia=None):
+    """
+    Igual que listar_renspa_por_cuit, pero devuelve solo los items (los
+    errores se muestran y el listado puede quedar incompleto)
+    """
+    return listar_renspa_por_cuit(cuit, refrescar=refrescar, vigencia=vigencia)[0]
+
+def item_de_listado(renspa):
+    """
+    Item de un listado por CUIT descargado recientemente que contiene el
+    RENSPA (con su 'cuit'), o None si no hay ninguno
+    """
+    item = listados_por_renspa.obtener((API_BASE_URL, renspa))
+    return dict(item) if item is not None else None
+
+# Función para normalizar RENSPA
+def normalizar_renspa(renspa):
+    """Normaliza un RENSPA al formato ##.###.#.#####/##"""
+    # Eliminar espacios
+    renspa_limpio = renspa.strip()
+
+    # Ya tiene el formato correcto con puntos y barra
+    if re.match(r'^\d{2}\.\d{3}\.\d\.\d{5}/\d{2}$', renspa_limpio):
+        renspa_normalizado = renspa_limpio
+
+    # Tiene el formato numérico sin puntos ni barra
+    # Formato esperado: XXYYYZWWWWWDD (XX.YYY.Z.WWWWW/DD)
+    elif re.match(r'^\d{13}$', renspa_limpio):
+        renspa_normalizado = f"{renspa_limpio[0:2]}.{renspa_limpio[2:5]}.{renspa_limpio[5:6]}.{renspa_limpio[6:11]}/{renspa_limpio[11:13]}"
+
+    else:
+        raise ValueError(f"Formato de RENSPA inválido: {renspa}")
+
+    # Validar códigos de provincia y departamento
+    if not renspa_valido(renspa_normalizado):
+        raise ValueError(f"RENSPA inválido: {renspa}. El código de provincia o departamento no existe.")
+
+    return renspa_normalizado
+
+# Función para descargar el detalle de un RENSPA
+def _descargar_renspa_detalle(renspa):
+    """
+    Consulta consultaPorNumero
+
+    Returns:
+        Tupla (data, error) con la respuesta de la API o el mensaje de error
+    """
+    consultado = True
+    try:
+        url = f"{API_BASE_URL}/consultaPorNumero?numero={renspa}"
+
+        response = _get("consultaPorNumero", url, timeout=10)
+        data = response.json()
+
+        if not data.get('items'):
+            registrar_desconocido('renspa', renspa, API_BASE_URL)
+        return data, None
+    except (PlazoAgotado, CircuitoAbierto) as e:
+        # No se envió la petición: mismo mensaje para todos los RENSPA del trabajo
+        consultado = False
+        return None, str(e)
+    except Exception as e:
+        return None, f"Error consultando {renspa}: {e}"
+    finally:
+        # Pausa breve para no sobrecargar la API (solo cuando se consulta)
+        if consultado:
+            time.sleep(TIEMPO_ESPERA)
+
+# Función para consultar detalles de un RENSPA
+def consultar_renspa_detalle(renspa, refrescar=False, vigencia=None):
+    """
+    Consulta los detalles de un RENSPA específico para obtener el polígono.
+    Los RENSPA que SENASA informó recientemente como inexistentes no se vuelven
+    a consultar, y las consultas simultáneas del mismo RENSPA desde otras
+    sesiones comparten una única petición.
+
+    Args:
+        refrescar: Si se consulta de nuevo aunque el detalle esté en la caché
+        vigencia: Segundos que dura el detalle en la caché (por defecto, RENSPA_CACHE_TTL)
+    """
+    if identificador_desconocido('renspa', renspa):
+        return {'items': []}
+
+    data, error = consultas_compartidas.obtener(
+        ('renspa', API_BASE_URL, renspa), lambda: _descargar_renspa_detalle(renspa), cachear=_sin_error,
+        refrescar=refrescar, vigencia=vigencia
+    )
+    if error:
+        _mostrar_error(error)
+        return None
+    return {**data, 'items': [dict(item) for item in data.get('items', [])]}
+
+# Función para extraer coordenadas de un polígono
+def extraer_coordenadas(poligono_str):
+    """
+    Extrae coordenadas de un string de polígono en el formato de SENASA
+    """
+    if not poligono_str or not isinstance(poligono_str, str):
+        return None
+
+    # Extraer pares de coordenadas
+    coord_pattern = r'\(([-\d\.]+),([-\d\.]+)\)'
+    coord_pairs = re.findall(coord_pattern, poligono_str)
+
+    if not coord_pairs:
+        _poligonos_parseados.inc(resultado="invalido")
+        return None
+
+    # Convertir a formato [lon, lat] para GeoJSON
+    coords_geojson = []
+    for lat_str, lon_str in coord_pairs:
+        try:
+            lat = float(lat_str)
+            lon = float(lon_str)
+            coords_geojson.append([lon, lat])  # GeoJSON usa [lon, lat]
+        except ValueError:
+            continue
+
+    # Verificar que hay al menos 3 puntos y que el polígono está cerrado
+    if len(coords_geojson) >= 3:
+        # Para polígonos válidos, asegurarse de que está cerrado
+        if coords_geojson[0] != coords_geojson[-1]:
+            coords_geojson.append(coords_geojson[0])  # Cerrar el polígono
+
+        _poligonos_parseados.inc(resultado="ok")
+        return coords_geojson
+
+    _poligonos_parseados.inc(resultado="invalido")
+    return None
+
+def _datos_poligono(item, coordenadas, superficie, cuit):
+    poligono_data = {
+        'renspa': item['renspa'],
+        'coords': coordenadas,
+        'superficie': superficie,
+        'titular': item.get('titular', ''),
+        'localidad': item.get('localidad', '')
+    }
+    if cuit:
+        poligono_data['cuit'] = cuit
+    return poligono_data
+
+# Marcador de "coordenadas sin parsear" (None indica un polígono ilegible)
+SIN_PARSEAR = object()
+
+def poligono_de_listado(item, cuit=None, coordenadas=SIN_PARSEAR):
+    """
+    Polígono del propio item del listado, si tiene uno legible
+
+    Args:
+        coordenadas: Coordenadas ya parseadas de item['poligono'] (por
+            ejemplo, en lote con geometria.parsear_poligonos)
+
+    Returns:
+        poligono_data (como en resolver_poligono) o None si hay que consultar el detalle
+    """
+    if 'poligono' in item and item['poligono']:
+        if coordenadas is SIN_PARSEAR:
+            coordenadas = extraer_coordenadas(item['poligono'])
+        if coordenadas:
+            return _datos_poligono(item, coordenadas, item.get('superficie', 0), cuit)
+    return None
+
+def poligono_de_detalle(item, resultado, cuit=None, coordenadas=SIN_PARSEAR):
+    """
+    Polígono de un RENSPA a partir de la respuesta de consultar_renspa_detalle
+
+    Args:
+        coordenadas: Coordenadas ya parseadas del polígono del detalle
+
+    Returns:
+        Tupla (poligono_data, estado), como en resolver_poligono
+    """
+    if resultado is None:
+        return None, 'error'
+
+    if resultado and 'items' in resultado and resultado['items'] and 'poligono' in resultado['items'][0]:
+        item_detalle = resultado['items'][0]
+        poligono_str = item_detalle.get('poligono')
+
+        if not poligono_str:
+            return None, 'sin_poligono'
+
+        if coordenadas is SIN_PARSEAR:
+            coordenadas = extraer_coordenadas(poligono_str)
+        if coordenadas:
+            return _datos_poligono(item, coordenadas, item_detalle.get('superficie', 0), cuit), 'ok'
+        return None, 'fallido'
+
+    return None, 'sin_poligono'
+
+# Función para obtener el polígono de un RENSPA del listado
+def resolver_poligono(item, cuit=None):
+    """
+    Obtiene el polígono de un RENSPA del listado de consultaPorCuit. Usa el
+    polígono del listado si es válido y, si no, consulta el detalle.
+
+    Args:
+        item: Diccionario del RENSPA tal como lo devuelve el listado
+        cuit: CUIT normalizado al que pertenece el RENSPA (opcional)
+
+    Returns:
+        Tupla (poligono_data, estado). poligono_data es None salvo que el
+        estado sea 'ok'; los otros estados son 'fallido' (polígono ilegible),
+        'sin_poligono' y 'error' (no se pudo consultar el detalle).
+    """
+    poligono_data = poligono_de_listado(item, cuit)
+    if poligono_data is not None:
+        return poligono_data, 'ok'
+    return poligono_de_detalle(item, consultar_renspa_detalle(item['renspa']), cuit)
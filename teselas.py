@@ -0,0 +1,327 @@
+"""
+Caché local de teselas y miniaturas de las capas de Earth Engine
+
+Las capas de Earth Engine se muestran a través de un proxy HTTP local: el
+mapa pide /teselas/<capa>/<z>/<x>/<y> al proxy, que devuelve la tesela desde
+una caché en disco acotada por tamaño (LRU) o la descarga de Earth Engine la
+primera vez. Las capas se identifican por la huella del objeto de Earth
+Engine y sus parámetros de visualización, no por el map id que devuelve
+getMapId (que cambia en cada sesión): así un análisis que se vuelve a abrir
+usa las teselas ya guardadas sin pedir un map id nuevo, que solo se pide si
+falta alguna tesela.
+
+Antes de mostrar el mapa se precargan las teselas que cubren los campos en
+los niveles de zoom en que se ven: el de la vista general que encuadra todos
+los campos y, para cada campo, el nivel en que ocupa la pantalla y el
+siguiente.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+import metricas
+from cache import CacheCompartida, CacheDisco
+from geometria import empaquetar
+
+logger = logging.getLogger(__name__)
+
+# Directorio y tamaño máximo de la caché de teselas y miniaturas
+DIRECTORIO_TESELAS = os.environ.get("RENSPA_TESELAS_DIR", os.path.join(".renspa_cache", "teselas"))
+MAX_MB_CACHE_TESELAS = int(os.environ.get("RENSPA_CACHE_TESELAS_MB", "512"))
+
+# Puerto del proxy (0 para uno libre) y URL con la que el navegador lo alcanza, si no es
+# http://127.0.0.1:<puerto> (por ejemplo, detrás de un proxy inverso)
+PUERTO_TESELAS = int(os.environ.get("RENSPA_TESELAS_PUERTO", "0"))
+URL_PUBLICA_TESELAS = os.environ.get("RENSPA_TESELAS_URL")
+
+# Precarga: tamaño de la vista del mapa en píxeles, zoom máximo, niveles por campo y límites
+ANCHO_MAPA_PX, ALTO_MAPA_PX = 1000, 600
+ZOOM_MAXIMO = 18
+NIVELES_POR_CAMPO = 2
+MAX_TESELAS_PRECARGA = 3000
+HILOS_PRECARGA = 8
+TIEMPO_ESPERA_TESELA = 20
+TAMANO_TESELA = 256
+
+# Los map id de Earth Engine vencen: la URL de teselas de una capa se vuelve a pedir pasado
+# este tiempo o cuando Earth Engine rechaza una tesela con un 4xx
+VIGENCIA_URL_CAPA = int(os.environ.get("RENSPA_TESELAS_VIGENCIA_URL", "3600"))
+
+_RUTA_TESELA = re.compile(r'^/teselas/([0-9a-f]+)/(\d+)/(\d+)/(\d+)(?:\.\w+)?$')
+
+cache_teselas = CacheCompartida(CacheDisco(DIRECTORIO_TESELAS, MAX_MB_CACHE_TESELAS * 1024 * 1024))
+metricas.registrar_cache("teselas", cache_teselas)
+
+_descargas = metricas.contador(
+    "teselas_descargas_total", "Teselas y miniaturas descargadas de Earth Engine", ("tipo",))
+
+class CapaNoDisponible(Exception):
+    """No se pudo obtener de Earth Engine la URL de teselas de una capa"""
+
+class _Capa:
+    """
+    URL de teselas de una capa, obtenida de Earth Engine solo cuando hace
+    falta y renovada al vencer (VIGENCIA_URL_CAPA)
+    """
+
+    def __init__(self, obtener_url):
+        self.obtener_url = obtener_url
+        self.url = None
+        self.vence = 0.0
+        self.lock = threading.Lock()
+
+    def formato(self):
+        with self.lock:
+            if self.url is None or time.monotonic() >= self.vence:
+                try:
+                    self.url = self.obtener_url()
+                except Exception as e:
+                    # Por ejemplo, ee.EEException de getMapId: este módulo no depende de ee
+                    raise CapaNoDisponible(str(e)) from e
+                self.vence = time.monotonic() + VIGENCIA_URL_CAPA
+            return self.url
+
+    def reemplazar(self, obtener_url):
+        """Cambia la función que obtiene la URL y descarta la URL guardada"""
+        with self.lock:
+            self.obtener_url = obtener_url
+            self.url = None
+
+    def invalidar(self, url):
+        """Descarta la URL guardada si sigue siendo `url` (otra llamada pudo renovarla ya)"""
+        with self.lock:
+            if self.url == url:
+                self.url = None
+
+_capas = {}
+_lock_capas = threading.Lock()
+_servidor = None
+
+def id_capa(objeto_ee, vis_params=None):
+    """
+    Identificador estable de una capa de Earth Engine
+
+    Args:
+        objeto_ee: Imagen, Feature o colección de Earth Engine
+        vis_params: Parámetros de visualización
+
+    Returns:
+        Huella hexadecimal del objeto serializado y los parámetros
+    """
+    huella = hashlib.sha1(objeto_ee.serialize().encode('utf-8'))
+    huella.update(json.dumps(vis_params or {}, sort_keys=True, default=str).encode('utf-8'))
+    return huella.hexdigest()[:20]
+
+def registrar_capa(capa, obtener_url):
+    """
+    Registra una capa para servirla por el proxy
+
+    Args:
+        capa: Identificador de id_capa
+        obtener_url: Función sin argumentos que devuelve el formato de URL de
+            las teselas con {z}, {x} e {y} (por ejemplo, el url_format del
+            tile_fetcher de getMapId); solo se llama si falta alguna tesela.
+            Si la capa ya estaba registrada, reemplaza a la anterior y
+            descarta la URL que esta había obtenido.
+    """
+    with _lock_capas:
+        if capa in _capas:
+            _capas[capa].reemplazar(obtener_url)
+        else:
+            _capas[capa] = _Capa(obtener_url)
+
+def _descargar(url, tipo):
+    respuesta = requests.get(url, timeout=TIEMPO_ESPERA_TESELA)
+    respuesta.raise_for_status()
+    _descargas.inc(tipo=tipo)
+    return respuesta.content
+
+def obtener_tesela(capa, z, x, y):
+    """
+    Devuelve los bytes de una tesela, de la caché o descargándola
+
+    Raises:
+        KeyError: Si la capa no está registrada y la tesela no está en caché
+        CapaNoDisponible: Si Earth Engine no devolvió la URL de la capa
+        requests.RequestException: Si falla la descarga
+    """
+    def descargar():
+        with _lock_capas:
+            registrada = _capas[capa]
+        formato = registrada.formato()
+        try:
+            return _descargar(formato.format(z=z, x=x, y=y), 'tesela')
+        except requests.HTTPError as e:
+            # Un 4xx suele indicar un map id vencido: pedir una URL nueva y reintentar una vez
+            if e.response is None or not 400 <= e.response.status_code < 500:
+                raise
+            registrada.invalidar(formato)
+            return _descargar(registrada.formato().format(z=z, x=x, y=y), 'tesela')
+    return cache_teselas.obtener(('tesela', capa, z, x, y), descargar)
+
+def obtener_miniatura(clave, obtener_url):
+    """
+    Devuelve los bytes de una miniatura, de la caché o descargándola
+
+    Args:
+        clave: Clave estable de la miniatura (por ejemplo, capa y huella del campo)
+        obtener_url: Función sin argumentos que devuelve la URL de la
+            miniatura (por ejemplo, getThumbURL); solo se llama si no está en caché
+    """
+    return cache_teselas.obtener(('miniatura', clave), lambda: _descargar(obtener_url(), 'miniatura'))
+
+def _mercator(lat):
+    """Ordenada Web Mercator (en radianes) de una latitud"""
+    return np.log(np.tan(np.radians(90.0 + np.clip(lat, -85.0511, 85.0511)) / 2.0))
+
+def _tesela_de(lon, lat, zoom):
+    """Columna y fila de la tesela (Web Mercator) que contiene un punto"""
+    n = 2 ** int(zoom)
+    x = np.floor((np.asarray(lon) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - _mercator(np.asarray(lat)) / math.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+def zoom_para(oeste, sur, este, norte, ancho_px, alto_px):
+    """Mayor nivel de zoom en que el rectángulo entra en una vista del tamaño indicado"""
+    ancho = np.maximum(np.asarray(este) - np.asarray(oeste), 1e-9) / 360.0
+    alto = np.maximum(_mercator(np.asarray(norte)) - _mercator(np.asarray(sur)), 1e-9) / (2 * math.pi)
+    zoom = np.floor(np.minimum(np.log2(ancho_px / TAMANO_TESELA / ancho), np.log2(alto_px / TAMANO_TESELA / alto)))
+    return np.clip(zoom, 0, ZOOM_MAXIMO).astype(np.int64)
+
+def teselas_rectangulo(oeste, sur, este, norte, zoom):
+    """Lista de (z, x, y) de las teselas que cubren un rectángulo"""
+    x0, y0 = _tesela_de(oeste, norte, zoom)
+    x1, y1 = _tesela_de(este, sur, zoom)
+    return [(int(zoom), x, y) for x in range(int(x0), int(x1) + 1) for y in range(int(y0), int(y1) + 1)]
+
+def teselas_poligonos(poligonos, niveles_por_campo=NIVELES_POR_CAMPO, maximo=MAX_TESELAS_PRECARGA):
+    """
+    Teselas a precargar para mostrar un conjunto de campos
+
+    Incluye las de la vista general que encuadra todos los campos y, para
+    cada campo, las de su rectángulo en el nivel en que ocupa la vista y los
+    siguientes. Se ordenan de menor a mayor zoom y se cortan en `maximo`.
+
+    Args:
+        poligonos: Lista de diccionarios con 'coords' ([lon, lat])
+
+    Returns:
+        Lista de (z, x, y) sin repetir
+    """
+    con_coords = [pol['coords'] for pol in poligonos if pol.get('coords')]
+    if not con_coords:
+        return []
+    vertices, offsets = empaquetar(con_coords)
+    comienzos = offsets[:-1]
+    oeste, este = np.minimum.reduceat(vertices[:, 0], comienzos), np.maximum.reduceat(vertices[:, 0], comienzos)
+    sur, norte = np.minimum.reduceat(vertices[:, 1], comienzos), np.maximum.reduceat(vertices[:, 1], comienzos)
+
+    general = int(zoom_para(oeste.min(), sur.min(), este.max(), norte.max(), ANCHO_MAPA_PX, ALTO_MAPA_PX))
+    teselas = set(teselas_rectangulo(oeste.min(), sur.min(), este.max(), norte.max(), general))
+    zooms = np.maximum(zoom_para(oeste, sur, este, norte, ANCHO_MAPA_PX, ALTO_MAPA_PX), general)
+    for nivel in range(niveles_por_campo):
+        z = np.minimum(zooms + nivel, ZOOM_MAXIMO)
+        for zoom in np.unique(z):
+            de_nivel = z == zoom
+            x0, y0 = _tesela_de(oeste[de_nivel], norte[de_nivel], zoom)
+            x1, y1 = _tesela_de(este[de_nivel], sur[de_nivel], zoom)
+            for a, b, c, d in zip(x0, x1, y0, y1):
+                teselas.update((int(zoom), x, y) for x in range(a, b + 1) for y in range(c, d + 1))
+    return sorted(teselas)[:maximo]
+
+def precargar(capa, teselas, hilos=HILOS_PRECARGA):
+    """
+    Descarga en paralelo las teselas que falten en la caché
+
+    Args:
+        capa: Identificador de una capa registrada
+        teselas: Lista de (z, x, y), por ejemplo de teselas_poligonos
+
+    Returns:
+        Cantidad de teselas que no se pudieron obtener
+    """
+    # Sin URL de la capa no se vuelve a pedir a Earth Engine por cada tesela
+    sin_capa = threading.Event()
+
+    def obtener(tesela):
+        if sin_capa.is_set():
+            return 1
+        try:
+            obtener_tesela(capa, *tesela)
+            return 0
+        except CapaNoDisponible as e:
+            if not sin_capa.is_set():
+                sin_capa.set()
+                logger.warning("No se pudo obtener la URL de teselas de la capa %s: %s", capa, e)
+            return 1
+        except (KeyError, requests.RequestException) as e:
+            logger.warning("No se pudo precargar la tesela %s de la capa %s: %s", tesela, capa, e)
+            return 1
+
+    with ThreadPoolExecutor(max_workers=hilos) as ejecutor:
+        return sum(ejecutor.map(obtener, teselas))
+
+def _tipo_contenido(datos):
+    if datos.startswith(b'\x89PNG'):
+        return "image/png"
+    if datos.startswith(b'\xff\xd8'):
+        return "image/jpeg"
+    return "application/octet-stream"
+
+class _ManejadorTeselas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        coincidencia = _RUTA_TESELA.match(self.path.split("?")[0])
+        if not coincidencia:
+            self.send_error(404)
+            return
+        capa, z, x, y = coincidencia.group(1), *(int(v) for v in coincidencia.groups()[1:])
+        try:
+            cuerpo = obtener_tesela(capa, z, x, y)
+        except KeyError:
+            self.send_error(404, "Capa desconocida")
+            return
+        except (CapaNoDisponible, requests.RequestException) as e:
+            self.send_error(502, str(e))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", _tipo_contenido(cuerpo))
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.send_header("Cache-Control", "max-age=86400")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+def iniciar_proxy(puerto=None, host="127.0.0.1"):
+    """
+    Inicia, una sola vez por proceso, el proxy de teselas en un hilo de fondo
+
+    Returns:
+        URL base con la que el navegador accede al proxy
+    """
+    global _servidor
+    with _lock_capas:
+        if _servidor is None:
+            _servidor = ThreadingHTTPServer((host, PUERTO_TESELAS if puerto is None else int(puerto)),
+                                            _ManejadorTeselas)
+            _servidor.daemon_threads = True
+            threading.Thread(target=_servidor.serve_forever, name="teselas-http", daemon=True).start()
+    if URL_PUBLICA_TESELAS:
+        return URL_PUBLICA_TESELAS.rstrip("/")
+    return f"http://{host}:{_servidor.server_address[1]}"
+
+def url_teselas(capa):
+    """Formato de URL ({z}/{x}/{y}) de las teselas de una capa a través del proxy"""
+    return f"{iniciar_proxy()}/teselas/{capa}/{{z}}/{{x}}/{{y}}"
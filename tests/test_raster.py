@@ -0,0 +1,135 @@
+"""
+Pruebas del motor de estadísticas zonales sin conexión (raster.py)
+
+Se ejecutan sin red ni rasterio: los rasters son .npy escritos en un
+directorio temporal.
+"""
+import numpy as np
+import pytest
+
+import raster
+from raster import RasterLocal, estadisticas_zonales, guardar_raster_npy, rasterizar
+
+ALTO, ANCHO = 40, 50
+
+POLIGONOS_PIXELES = {
+    'cuadrado': [[5.2, 5.7], [20.4, 5.7], [20.4, 18.3], [5.2, 18.3]],
+    'triangulo': [[1.0, 1.0], [45.3, 12.8], [10.6, 37.9]],
+    'concavo': [[3, 3], [30, 3], [30, 30], [16.5, 12.25], [3, 30]],
+    'estrella': [[25, 2], [30.5, 17], [47, 17], [33.5, 26], [39, 39.5],
+                 [25, 30.5], [11, 39.5], [16.5, 26], [3, 17], [19.5, 17]],
+    'cerrado': [[8.5, 8.5], [12.5, 8.5], [12.5, 12.5], [8.5, 12.5], [8.5, 8.5]],
+    'fuera_de_grilla': [[-10.3, -7.1], [60.2, -3.4], [55.8, 48.6], [-4.4, 44.9]],
+    # Pentagrama trazado de punta a punta: el centro queda fuera por la regla par-impar
+    'pentagrama': [[25, 2], [39, 39.5], [3, 17], [47, 17], [11, 39.5]],
+}
+
+def _dentro_par_impar(x, y, anillo):
+    """Punto en polígono por fuerza bruta: cuenta los cruces de un rayo horizontal"""
+    dentro = False
+    for (x1, y1), (x2, y2) in zip(anillo, anillo[1:] + anillo[:1]):
+        if (y1 <= y) != (y2 <= y) and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+            dentro = not dentro
+    return dentro
+
+def _mascara_tramos(tramos):
+    mascara = np.zeros((ALTO, ANCHO), dtype=bool)
+    for fila, inicio, fin in tramos:
+        assert not mascara[fila, inicio:fin].any(), "tramos superpuestos"
+        mascara[fila, inicio:fin] = True
+    return mascara
+
+@pytest.mark.parametrize("nombre", sorted(POLIGONOS_PIXELES))
+def test_rasterizar_coincide_con_par_impar(nombre):
+    anillo = POLIGONOS_PIXELES[nombre]
+    esperada = np.array([[_dentro_par_impar(col + 0.5, fila + 0.5, anillo) for col in range(ANCHO)]
+                         for fila in range(ALTO)])
+    tramos = rasterizar(np.array(anillo, dtype=np.float64), ALTO, ANCHO)
+    assert tramos.dtype == np.int32
+    np.testing.assert_array_equal(_mascara_tramos(tramos), esperada)
+
+def test_rasterizar_anillo_degenerado():
+    assert rasterizar(np.array([[1.0, 1.0], [5.0, 5.0]]), ALTO, ANCHO).shape == (0, 3)
+    assert rasterizar(np.array([[1.0, 50.0], [5.0, 50.0], [3.0, 60.0]]), ALTO, ANCHO).shape == (0, 3)
+
+@pytest.fixture
+def sin_cache_en_disco(tmp_path, monkeypatch):
+    """Máscaras en un directorio temporal y caché en memoria vacía"""
+    monkeypatch.setattr(raster, "DIRECTORIO_MASCARAS", str(tmp_path / "mascaras"))
+    raster.cache_mascaras.limpiar()
+    raster._grillas_cargadas.clear()
+    yield
+    raster.cache_mascaras.limpiar()
+    raster._grillas_cargadas.clear()
+
+def _a_coords(anillo, transform):
+    """Pasa un anillo de coordenadas de píxel a [lon, lat]"""
+    x0, dx, _, y0, _, dy = transform
+    return [[x0 + col * dx, y0 + fila * dy] for col, fila in anillo]
+
+def _a_pixeles(coords, transform):
+    """Vuelve de [lon, lat] a píxeles, con el mismo redondeo que verá el motor"""
+    x0, dx, _, y0, _, dy = transform
+    return [[(lon - x0) / dx, (lat - y0) / dy] for lon, lat in coords]
+
+def test_estadisticas_zonales_contra_fuerza_bruta(tmp_path, sin_cache_en_disco):
+    transform = (-61.0, 0.001, 0.0, -33.0, 0.0, -0.001)
+    rng = np.random.default_rng(0)
+    clases = rng.integers(1, 5, size=(ALTO, ANCHO)).astype(np.uint8)
+    clases[:4, :] = 255
+    ndvi = rng.random((ALTO, ANCHO)).astype(np.float32)
+    guardar_raster_npy(str(tmp_path / "clases.npy"), clases, transform, nodata=255,
+                       clases={1: "Soja", 2: "Maíz", 3: "Trigo", 4: "Girasol"})
+    guardar_raster_npy(str(tmp_path / "ndvi.npy"), ndvi, transform)
+
+    nombres = sorted(POLIGONOS_PIXELES)
+    poligonos = [{'renspa': nombre, 'coords': _a_coords(POLIGONOS_PIXELES[nombre], transform)}
+                 for nombre in nombres]
+    poligonos.append({'renspa': 'lejos', 'coords': [[-50.0, -20.0], [-49.9, -20.0], [-49.9, -19.9]]})
+
+    categorico = estadisticas_zonales(poligonos, str(tmp_path / "clases.npy"))
+    continuo = estadisticas_zonales(poligonos, str(tmp_path / "ndvi.npy"), tipo='continuo')
+    assert list(categorico['renspa']) == [pol['renspa'] for pol in poligonos]
+
+    for i, pol in enumerate(poligonos[:-1]):
+        # Los vértices sobre centros de píxel pueden caer de cualquier lado tras pasar a grados
+        anillo = _a_pixeles(pol['coords'], transform)
+        mascara = np.array([[_dentro_par_impar(col + 0.5, fila + 0.5, anillo) for col in range(ANCHO)]
+                            for fila in range(ALTO)])
+        valores = clases[mascara & (clases != 255)]
+        codigos, cuentas = np.unique(valores, return_counts=True)
+        assert categorico['pixeles'][i] == len(valores)
+        assert categorico['clase'][i] == codigos[np.argmax(cuentas)]
+        assert categorico['fraccion'][i] == pytest.approx(cuentas.max() / len(valores))
+
+        valores = ndvi[mascara].astype(np.float64)
+        assert continuo['pixeles'][i] == len(valores)
+        assert continuo['media'][i] == pytest.approx(valores.mean())
+        assert continuo['minimo'][i] == pytest.approx(valores.min())
+        assert continuo['maximo'][i] == pytest.approx(valores.max())
+        assert continuo['desvio'][i] == pytest.approx(valores.std())
+
+    # Un polígono fuera del raster no tiene píxeles
+    assert categorico['pixeles'].iloc[-1] == 0
+    assert categorico['nombre_clase'].iloc[-1] is None
+    assert np.isnan(continuo['media'].iloc[-1])
+
+def test_mascaras_en_cache_dan_el_mismo_resultado(tmp_path, sin_cache_en_disco):
+    transform = (-61.0, 0.001, 0.0, -33.0, 0.0, -0.001)
+    datos = np.arange(ALTO * ANCHO, dtype=np.int32).reshape(ALTO, ANCHO) % 7
+    guardar_raster_npy(str(tmp_path / "2019-2020.npy"), datos, transform)
+    poligonos = [{'renspa': nombre, 'coords': _a_coords(anillo, transform)}
+                 for nombre, anillo in POLIGONOS_PIXELES.items()]
+
+    ruta = str(tmp_path / "2019-2020.npy")
+
+    nuevas = estadisticas_zonales(poligonos, ruta)
+    en_memoria = estadisticas_zonales(poligonos, ruta)
+    # Con la caché en memoria vacía, las máscaras se leen del disco
+    raster.cache_mascaras.limpiar()
+    raster._grillas_cargadas.clear()
+    desde_disco = estadisticas_zonales(poligonos, ruta)
+    assert len(raster.cache_mascaras) == len(poligonos)
+
+    for resultado in (en_memoria, desde_disco):
+        assert resultado.equals(nuevas)
@@ -0,0 +1,214 @@
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+# Pesos del dígito verificador del CUIT (módulo 11)
+PESOS_CUIT = np.array([5, 4, 3, 2, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+
+# Códigos de jurisdicción válidos en el primer bloque del RENSPA (XX.YYY.Z.WWWWW/DD)
+CODIGOS_PROVINCIA_RENSPA = {f"{codigo:02d}" for codigo in range(1, 25)}
+
+# Identificadores sin datos en SENASA: no se vuelven a consultar durante este tiempo
+ARCHIVO_DESCONOCIDOS = os.environ.get(
+    "RENSPA_DESCONOCIDOS", os.path.join(".renspa_cache", "desconocidos.json")
+)
+VIGENCIA_DESCONOCIDOS = 7 * 24 * 3600  # segundos
+
+def _matriz_digitos(serie, largo):
+    """Convierte una serie de strings de dígitos de igual largo en una matriz (n, largo)"""
+    if len(serie) == 0:
+        return np.empty((0, largo), dtype=np.int64)
+    buffer = "".join(serie.tolist()).encode("ascii")
+    return (np.frombuffer(buffer, dtype=np.uint8).reshape(-1, largo) - ord("0")).astype(np.int64)
+
+def digito_verificador_valido(cuits):
+    """
+    Verifica el dígito verificador (módulo 11) de una serie de CUITs, de forma vectorizada
+
+    Args:
+        cuits: pd.Series de CUITs normalizados (XX-XXXXXXXX-X)
+
+    Returns:
+        Array booleano con True para los CUITs cuyo dígito verificador es correcto
+    """
+    digitos = _matriz_digitos(cuits.str.replace("-", "", regex=False), 11)
+    resto = (digitos[:, :10] @ PESOS_CUIT) % 11
+    esperado = np.where(resto == 0, 0, 11 - resto)
+    # Un resultado de 10 no es un dígito válido
+    return (esperado != 10) & (esperado == digitos[:, 10])
+
+def cuit_valido(cuit_normalizado):
+    """Verifica el dígito verificador de un único CUIT normalizado"""
+    return bool(digito_verificador_valido(pd.Series([cuit_normalizado]))[0])
+
+def estructura_renspa_valida(renspas):
+    """
+    Verifica los códigos de provincia y departamento de una serie de RENSPA
+
+    Args:
+        renspas: pd.Series de RENSPA normalizados (##.###.#.#####/##)
+
+    Returns:
+        Array booleano con True para los RENSPA con códigos existentes
+    """
+    # Con dtype "string" las comparaciones devuelven booleanos nullables; forzar bool
+    provincia_valida = renspas.str[0:2].isin(CODIGOS_PROVINCIA_RENSPA).to_numpy(dtype=bool, na_value=False)
+    departamento_valido = (renspas.str[3:6] != "000").to_numpy(dtype=bool, na_value=False)
+    return provincia_valida & departamento_valido
+
+def renspa_valido(renspa_normalizado):
+    """Verifica los códigos de provincia y departamento de un único RENSPA normalizado"""
+    return bool(estructura_renspa_valida(pd.Series([renspa_normalizado]))[0])
+
+# Caché negativa de identificadores que SENASA informó como desconocidos. El
+# archivo lo comparten los procesos de la aplicación y del rastreo. Las
+# entradas nuevas se acumulan en memoria y se escriben en lote: cada escritura
+# toma un lock, vuelve a leer el archivo y le agrega las suyas, en lugar de
+# reemplazarlas. Lo que escriben los demás procesos se relee cada
+# INTERVALO_DESCONOCIDOS segundos.
+LOTE_DESCONOCIDOS = 500
+INTERVALO_DESCONOCIDOS = 30  # segundos
+
+_desconocidos = None
+_pendientes = {}
+_leido = 0.0  # time.monotonic() de la última lectura del archivo
+_escrito = 0.0  # time.monotonic() de la última escritura
+_lock_desconocidos = threading.Lock()
+_lock_escritura = threading.Lock()
+
+def _clave_desconocido(tipo, identificador, api):
+    # Con la URL base: lo desconocido para el servidor simulado no vale para SENASA
+    return f"{api}|{tipo}:{identificador}"
+
+def _leer_desconocidos():
+    try:
+        with open(ARCHIVO_DESCONOCIDOS, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _combinar(*entradas):
+    """Une diccionarios clave -> fecha de registro, conservando la fecha más reciente"""
+    combinadas = {}
+    for diccionario in entradas:
+        for clave, registrado in diccionario.items():
+            if registrado > combinadas.get(clave, 0):
+                combinadas[clave] = registrado
+    return combinadas
+
+def _cargar_desconocidos():
+    """Carga las entradas la primera vez y vuelve a leer el archivo cuando pasó INTERVALO_DESCONOCIDOS"""
+    global _desconocidos, _leido
+    with _lock_desconocidos:
+        if _desconocidos is None:
+            _desconocidos, _leido = _leer_desconocidos(), time.monotonic()
+            return
+        if time.monotonic() - _leido < INTERVALO_DESCONOCIDOS:
+            return
+        _leido = time.monotonic()
+    # Releer fuera del lock: los demás hilos siguen consultando lo que ya está en memoria
+    leidos = _leer_desconocidos()
+    with _lock_desconocidos:
+        _desconocidos = _combinar(_desconocidos, leidos)
+
+@contextlib.contextmanager
+def _lock_archivo_desconocidos():
+    """Lock entre procesos del archivo de desconocidos (sin fcntl, solo el de este proceso)"""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{ARCHIVO_DESCONOCIDOS}.lock", "w") as archivo_lock:
+        fcntl.flock(archivo_lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo_lock, fcntl.LOCK_UN)
+
+def guardar_desconocidos():
+    """
+    Escribe en el archivo las entradas registradas desde la última escritura,
+    combinadas con las que guardaron los demás procesos
+
+    Se llama sola cada LOTE_DESCONOCIDOS registros o INTERVALO_DESCONOCIDOS
+    segundos, al terminar cada procesamiento y al salir del proceso.
+    """
+    global _desconocidos, _pendientes, _leido, _escrito
+    with _lock_escritura:
+        with _lock_desconocidos:
+            pendientes, _pendientes = _pendientes, {}
+            _escrito = time.monotonic()
+        if not pendientes:
+            return
+        try:
+            os.makedirs(os.path.dirname(ARCHIVO_DESCONOCIDOS) or ".", exist_ok=True)
+            with _lock_archivo_desconocidos():
+                # Descartar lo vencido para que el archivo no crezca sin límite
+                limite = time.time() - VIGENCIA_DESCONOCIDOS
+                combinados = {clave: registrado
+                              for clave, registrado in _combinar(_leer_desconocidos(), pendientes).items()
+                              if registrado >= limite}
+                ruta_tmp = f"{ARCHIVO_DESCONOCIDOS}.{os.getpid()}.tmp"
+                with open(ruta_tmp, "w", encoding="utf-8") as f:
+                    json.dump(combinados, f)
+                os.replace(ruta_tmp, ARCHIVO_DESCONOCIDOS)
+        except BaseException:
+            # Conservar las entradas para la próxima escritura
+            with _lock_desconocidos:
+                _pendientes = _combinar(pendientes, _pendientes)
+            raise
+        with _lock_desconocidos:
+            _desconocidos = _combinar(_desconocidos or {}, combinados)
+            _leido = time.monotonic()
+
+atexit.register(guardar_desconocidos)
+
+def registrar_desconocido(tipo, identificador, api):
+    """
+    Registra un CUIT o RENSPA para el que SENASA no devolvió datos
+
+    Args:
+        tipo: 'cuit' o 'renspa'
+        identificador: Identificador normalizado
+        api: URL base de la API que lo informó
+    """
+    _cargar_desconocidos()
+    clave = _clave_desconocido(tipo, identificador, api)
+    registrado = time.time()
+    with _lock_desconocidos:
+        _desconocidos[clave] = registrado
+        _pendientes[clave] = registrado
+        escribir = (len(_pendientes) >= LOTE_DESCONOCIDOS
+                    or time.monotonic() - _escrito >= INTERVALO_DESCONOCIDOS)
+    if escribir:
+        guardar_desconocidos()
+
+def es_desconocido(tipo, identificador, api):
+    """Indica si la API informó el identificador como desconocido dentro del período de vigencia"""
+    _cargar_desconocidos()
+    with _lock_desconocidos:
+        registrado = _desconocidos.get(_clave_desconocido(tipo, identificador, api))
+    return registrado is not None and time.time() - registrado < VIGENCIA_DESCONOCIDOS
+
+def separar_desconocidos(tipo, identificadores, api):
+    """
+    Separa una lista de identificadores en los que hay que consultar y los
+    que la API ya informó como desconocidos
+
+    Returns:
+        Tupla (a_consultar, desconocidos)
+    """
+    a_consultar, desconocidos = [], []
+    for identificador in identificadores:
+        (desconocidos if es_desconocido(tipo, identificador, api) else a_consultar).append(identificador)
+    return a_consultar, desconocidos